@@ -0,0 +1,124 @@
+"""Output cleaning after the read vs during it (``OutputCleaner``).
+
+Feeds ``--size`` bytes of pager-redraw output (every page ends in a
+``--More--`` marker that the next page overwrites with carriage returns, and
+each row is redrawn ``--redraws`` times behind bare ``\\r``) to a
+``ChannelReader`` in 32 KiB chunks, like a busy ``recv`` loop, then produces
+the cleaned command output:
+
+``after``   the reader keeps the raw text; ``clean_command_output`` runs over
+            the whole buffer once the read is over (the old path).
+``stream``  the reader is given an ``OutputCleaner``; each chunk's complete
+            lines are cleaned as they arrive and only ``finish()`` is left.
+
+``read_ms`` is the time spent in ``feed``, ``final_ms`` the time from the
+last byte to the cleaned output (what delays the next command), and
+``peak_MB`` the :mod:`tracemalloc` heap high-water mark.
+
+Run from the repository root::
+
+    python benchmarks/bench_clean_stream.py
+    python benchmarks/bench_clean_stream.py --sizes 4M,32M --redraws 8
+"""
+
+import argparse
+import importlib.util
+import time
+import tracemalloc
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+CHUNK = 32 * 1024
+
+
+def _load_bulk_show():
+    spec = importlib.util.spec_from_file_location(
+        "bulk_show", REPO_ROOT / "bulk-show.py"
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+bulk_show = _load_bulk_show()
+
+
+def make_output(size, redraws):
+    row = "  GigabitEthernet1  up  up  10.0.0.1/24  1500  0  0"
+    spinner = "".join(f"{'.' * (i + 1)}\r" for i in range(redraws))
+    page = (
+        f"{spinner}{row}\r\n" * 20
+        + " --More-- \r          \r"
+    )
+    return (page * max(1, size // len(page))).encode()
+
+
+def parse_size(token):
+    token = token.strip().upper()
+    scale = {"K": 1024, "M": 1024 * 1024}.get(token[-1:], 1)
+    if scale != 1:
+        token = token[:-1]
+    return int(float(token) * scale)
+
+
+def read(data, stream):
+    cleaner = bulk_show.OutputCleaner() if stream else None
+    reader = bulk_show.ChannelReader(cleaner=cleaner)
+    started = time.perf_counter()
+    for pos in range(0, len(data), CHUNK):
+        reader.feed(data[pos:pos + CHUNK])
+    last_byte = time.perf_counter()
+    output = reader.getvalue()
+    if not stream:
+        output = bulk_show.clean_command_output(output)
+    return output, last_byte - started, time.perf_counter() - last_byte
+
+
+def run(data, stream):
+    # Timed without tracemalloc, which slows every allocation down.
+    output, read_s, final_s = read(data, stream)
+    tracemalloc.start()
+    try:
+        read(data, stream)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return output, read_s, final_s, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes",
+        default="4M,16M",
+        help="Comma-separated output sizes (suffix K/M). Default: %(default)s",
+    )
+    parser.add_argument(
+        "--redraws",
+        type=int,
+        default=4,
+        help="Bare carriage-return redraws before each row. Default: %(default)s",
+    )
+    args = parser.parse_args()
+    print(
+        f"{'bytes':>10} {'variant':<7} {'read_ms':>8} {'final_ms':>9} "
+        f"{'total_ms':>9} {'peak_MB':>8}"
+    )
+    for token in args.sizes.split(","):
+        data = make_output(parse_size(token), args.redraws)
+        expected = None
+        for name, stream in (("after", False), ("stream", True)):
+            output, read_s, final_s, peak = run(data, stream)
+            if expected is None:
+                expected = output
+            elif output != expected:
+                raise SystemExit(f"{name}: output differs from clean_command_output")
+            print(
+                f"{len(data):>10} {name:<7} {read_s * 1000:>8.1f} "
+                f"{final_s * 1000:>9.1f} {(read_s + final_s) * 1000:>9.1f} "
+                f"{peak / 1e6:>8.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+"""End-to-end throughput of bulk-show.py against a simulated SD-WAN fleet.
+
+Starts ``tests/fake_sdwan_fleet.py`` (a paramiko SSH server answering as an
+IOS-XE edge or a viptela controller on every 127.x.y.z address), then runs
+``bulk-show.py`` as a subprocess once per ``--hosts`` size. Each run gets a
+hosts file of that many loopback addresses, ``--controllers`` of them
+controllers, and ``--commands`` commands per host. For each run it reports:
+
+``makespan_s``    wall time of the bulk-show process.
+``hosts_per_s``   hosts / makespan.
+``cpu_s``         user + system CPU seconds of the bulk-show process.
+``max_rss_MB``    its peak resident set size.
+``peak_threads``  the most threads it had at once (sampled from /proc).
+
+``--json PATH`` also writes the results, the fleet profile and the
+bulk-show arguments as a JSON baseline to track over time. Device behaviour
+(latency, output size, prompt delay, failure injection) is set with the
+options below. Extra bulk-show options go in ``--bulk-show-args``.
+
+Linux only (every 127.x.y.z address routes to ``lo``; /proc for threads).
+Runs of thousands of hosts need ``ulimit -n`` above ``--max-workers``
+times 4 or so. Run from the repository root::
+
+    python benchmarks/bench_fleet.py
+    python benchmarks/bench_fleet.py --hosts 10,100,1000,5000 --max-workers 128 \\
+        --bulk-show-args "--engine selectors" --json fleet-baseline.json
+"""
+
+import argparse
+import importlib.util
+import json
+import logging
+import os
+import platform
+import re
+import shlex
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+DONE_RE = re.compile(r"\[main\] done: success=(\d+), failed=(\d+)")
+
+
+def _load_fleet():
+    spec = importlib.util.spec_from_file_location(
+        "fake_sdwan_fleet", REPO_ROOT / "tests" / "fake_sdwan_fleet.py"
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+fleet = _load_fleet()
+
+
+def address(index):
+    """The loopback address of simulated host ``index`` (0-based)."""
+    return f"127.{1 + index // 62500}.{index // 250 % 250}.{index % 250 + 1}"
+
+
+def write_inputs(tmp, hosts, controllers, commands, password):
+    every = round(1 / controllers) if controllers else 0
+    hosts_file = Path(tmp) / f"hosts_{hosts}.txt"
+    with open(hosts_file, "w") as f:
+        for i in range(hosts):
+            kind = ",type=controller" if every and i % every == 0 else ""
+            f.write(f"{address(i)},admin,{password}{kind}\n")
+    commands_file = Path(tmp) / "commands.txt"
+    commands_file.write_text(
+        "".join(f"show sdwan command-{i}\n" for i in range(commands))
+    )
+    return hosts_file, commands_file
+
+
+def sample_threads(pid, peak, stop):
+    status = f"/proc/{pid}/status"
+    while not stop.is_set():
+        try:
+            with open(status) as f:
+                for line in f:
+                    if line.startswith("Threads:"):
+                        peak[0] = max(peak[0], int(line.split()[1]))
+                        break
+        except OSError:
+            return
+        stop.wait(0.05)
+
+
+def run_bulk_show(tmp, hosts, args, server):
+    hosts_file, commands_file = write_inputs(
+        tmp, hosts, args.controllers, args.commands, args.password
+    )
+    logs_dir = Path(tmp) / f"logs_{hosts}"
+    cmd = [
+        sys.executable, str(REPO_ROOT / "bulk-show.py"),
+        str(hosts_file), str(commands_file),
+        "--logs-dir", str(logs_dir),
+        "--port", str(server.edge_port),
+        "--controller-port", str(server.controller_port),
+        "--max-workers", str(args.max_workers),
+    ] + shlex.split(args.bulk_show_args)
+    # A scratch HOME so the user's known_hosts and keys play no part.
+    env = dict(os.environ, HOME=tmp)
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, env=env
+    )
+    peak, stop = [0], threading.Event()
+    sampler = threading.Thread(target=sample_threads, args=(proc.pid, peak, stop))
+    sampler.start()
+    done = None
+    for line in proc.stdout:
+        match = DONE_RE.search(line)
+        if match:
+            done = (int(match.group(1)), int(match.group(2)))
+    _, status, usage = os.wait4(proc.pid, 0)
+    makespan = time.perf_counter() - started
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    stop.set()
+    sampler.join()
+    if done is None:
+        raise SystemExit(f"bulk-show exited {proc.returncode} without a summary")
+    return {
+        "hosts": hosts,
+        "success": done[0],
+        "failed": done[1],
+        "makespan_s": round(makespan, 3),
+        "hosts_per_s": round(hosts / makespan, 2),
+        "cpu_s": round(usage.ru_utime + usage.ru_stime, 3),
+        "max_rss_MB": round(usage.ru_maxrss / 1024, 1),
+        "peak_threads": peak[0],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--hosts",
+        default="10,100,500",
+        help="Comma-separated fleet sizes, one run each. Default: %(default)s",
+    )
+    parser.add_argument(
+        "--controllers",
+        type=float,
+        default=0.05,
+        help="Fraction of the hosts that are controllers. Default: %(default)s",
+    )
+    parser.add_argument(
+        "--commands", type=int, default=3, help="Commands per host. Default: %(default)s"
+    )
+    parser.add_argument(
+        "--max-workers",
+        type=int,
+        default=32,
+        help="bulk-show --max-workers. Default: %(default)s",
+    )
+    parser.add_argument(
+        "--bulk-show-args",
+        default="",
+        help="Extra bulk-show options, e.g. \"--engine selectors --pipeline 4\".",
+    )
+    parser.add_argument(
+        "--fleet-processes",
+        type=int,
+        default=max(1, (os.cpu_count() or 2) // 2),
+        help="Processes serving the simulated devices. Default: %(default)s",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.02,
+        help="Seconds before each device response. Default: %(default)s",
+    )
+    parser.add_argument(
+        "--output-size",
+        type=int,
+        default=4096,
+        help="Output bytes per command. Default: %(default)s",
+    )
+    parser.add_argument(
+        "--prompt-delay",
+        type=float,
+        default=0.0,
+        help="Seconds between the last output line and the prompt. "
+        "Default: %(default)s",
+    )
+    parser.add_argument(
+        "--fail-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of misbehaving devices. Default: %(default)s",
+    )
+    parser.add_argument(
+        "--fail-modes",
+        default=",".join(fleet.FAIL_MODES),
+        help="Comma-separated failure modes to draw from. Default: %(default)s",
+    )
+    parser.add_argument("--json", metavar="PATH", help="Write the results here.")
+    args = parser.parse_args()
+    args.password = "admin"
+    # The injected failures make paramiko log every reset connection.
+    logging.getLogger("paramiko").setLevel(logging.CRITICAL)
+
+    profile = fleet.DeviceProfile(
+        password=args.password,
+        latency=args.latency,
+        output_size=args.output_size,
+        prompt_delay=args.prompt_delay,
+        fail_rate=args.fail_rate,
+        fail_modes=[m for m in args.fail_modes.split(",") if m],
+    )
+    server = fleet.FleetServer(profile, processes=args.fleet_processes)
+    results = []
+    print(
+        f"{'hosts':>6} {'ok':>6} {'failed':>6} {'makespan_s':>10} {'hosts/s':>8} "
+        f"{'cpu_s':>7} {'max_rss_MB':>10} {'threads':>7}"
+    )
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            for token in args.hosts.split(","):
+                r = run_bulk_show(tmp, int(token), args, server)
+                results.append(r)
+                print(
+                    f"{r['hosts']:>6} {r['success']:>6} {r['failed']:>6} "
+                    f"{r['makespan_s']:>10.2f} {r['hosts_per_s']:>8.1f} "
+                    f"{r['cpu_s']:>7.2f} {r['max_rss_MB']:>10.1f} "
+                    f"{r['peak_threads']:>7}"
+                )
+    finally:
+        server.close()
+    if args.json:
+        baseline = {
+            "recorded_at": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "bulk_show_args": [
+                "--max-workers", str(args.max_workers),
+            ] + shlex.split(args.bulk_show_args),
+            "commands": args.commands,
+            "controllers": args.controllers,
+            "fleet": {
+                "processes": args.fleet_processes,
+                "latency": args.latency,
+                "output_size": args.output_size,
+                "prompt_delay": args.prompt_delay,
+                "fail_rate": args.fail_rate,
+                "fail_modes": profile.fail_modes,
+            },
+            "results": results,
+        }
+        with open(args.json, "w") as f:
+            json.dump(baseline, f, indent=2)
+            f.write("\n")
+
+
+if __name__ == "__main__":
+    main()
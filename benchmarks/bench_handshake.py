@@ -0,0 +1,168 @@
+"""Per-host SSH handshake cost: paramiko defaults vs ``SSHConnector``.
+
+Starts a local paramiko SSH server that, like an SD-WAN device, accepts
+password authentication and rejects public keys, under a scratch ``HOME``
+whose ``~/.ssh`` holds a ``known_hosts`` of ``--known-hosts`` entries and a
+couple of private keys. Each host is then connected and closed ``--hosts``
+times:
+
+``defaults``    what bulk-show did before: a new ``SSHClient`` that re-parses
+                ``known_hosts`` and connects with paramiko's defaults, so the
+                ``~/.ssh`` keys are offered (and refused) before the password.
+``connector``   one ``SSHConnector`` for the run: known_hosts parsed once,
+                password authentication only.
+``+kex``        the connector with ``--kex`` / ``--ciphers`` preferences.
+
+Run from the repository root::
+
+    python benchmarks/bench_handshake.py
+    python benchmarks/bench_handshake.py --hosts 50 --known-hosts 5000
+"""
+
+import argparse
+import importlib.util
+import os
+import socket
+import statistics
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import paramiko
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+USERNAME = "admin"
+PASSWORD = "admin-pw"
+
+
+def _load_bulk_show():
+    spec = importlib.util.spec_from_file_location(
+        "bulk_show", REPO_ROOT / "bulk-show.py"
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+bulk_show = _load_bulk_show()
+
+
+class PasswordOnlyServer(paramiko.ServerInterface):
+    def get_allowed_auths(self, username):
+        return "publickey,password"
+
+    def check_auth_password(self, username, password):
+        if (username, password) == (USERNAME, PASSWORD):
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def check_auth_publickey(self, username, key):
+        return paramiko.AUTH_FAILED
+
+
+def serve(listener, host_key, stop):
+    while not stop.is_set():
+        try:
+            sock, _ = listener.accept()
+        except OSError:
+            return
+        transport = paramiko.Transport(sock)
+        transport.add_server_key(host_key)
+        try:
+            transport.start_server(server=PasswordOnlyServer())
+        except (paramiko.SSHException, EOFError, OSError):
+            transport.close()
+
+
+def make_home(home, host_key, port, entries):
+    ssh_dir = Path(home) / ".ssh"
+    ssh_dir.mkdir(mode=0o700)
+    filler = paramiko.RSAKey.generate(2048)
+    lines = [
+        f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256} "
+        f"{filler.get_name()} {filler.get_base64()}\n"
+        for i in range(entries)
+    ]
+    lines.append(f"[127.0.0.1]:{port} {host_key.get_name()} {host_key.get_base64()}\n")
+    (ssh_dir / "known_hosts").write_text("".join(lines))
+    paramiko.RSAKey.generate(2048).write_private_key_file(str(ssh_dir / "id_rsa"))
+    paramiko.ECDSAKey.generate().write_private_key_file(str(ssh_dir / "id_ecdsa"))
+
+
+def connect_defaults(port):
+    ssh = paramiko.SSHClient()
+    ssh.load_system_host_keys()
+    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    ssh.connect("127.0.0.1", port=port, username=USERNAME, password=PASSWORD, timeout=10)
+    ssh.close()
+
+
+def connect_with(connector, port):
+    ssh = connector.client(paramiko, True)
+    ssh.connect(
+        "127.0.0.1", port=port, username=USERNAME, password=PASSWORD,
+        **connector.connect_kwargs(paramiko, 10),
+    )
+    ssh.close()
+
+
+def measure(connect, hosts):
+    samples = []
+    for _ in range(hosts):
+        started = time.perf_counter()
+        connect()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--hosts", type=int, default=20, help="Connects per variant. Default: %(default)s"
+    )
+    parser.add_argument(
+        "--known-hosts",
+        type=int,
+        default=2000,
+        help="Entries in the scratch known_hosts. Default: %(default)s",
+    )
+    args = parser.parse_args()
+
+    host_key = paramiko.RSAKey.generate(2048)
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(16)
+    port = listener.getsockname()[1]
+    stop = threading.Event()
+    threading.Thread(target=serve, args=(listener, host_key, stop), daemon=True).start()
+
+    with tempfile.TemporaryDirectory() as home:
+        make_home(home, host_key, port, args.known_hosts)
+        os.environ["HOME"] = home
+        os.environ.pop("SSH_AUTH_SOCK", None)
+        variants = (
+            ("defaults", lambda: connect_defaults(port)),
+            ("connector", lambda c=bulk_show.SSHConnector(): connect_with(c, port)),
+            (
+                "+kex",
+                lambda c=bulk_show.SSHConnector(
+                    kex=["curve25519-sha256@libssh.org"],
+                    ciphers=["aes128-gcm@openssh.com", "aes128-ctr"],
+                ): connect_with(c, port),
+            ),
+        )
+        print(f"{'variant':<10} {'median_ms':>10} {'mean_ms':>8} {'total_s':>8}")
+        for name, connect in variants:
+            connect()  # warm-up: imports, first known_hosts parse
+            samples = measure(connect, args.hosts)
+            print(
+                f"{name:<10} {statistics.median(samples) * 1000:>10.1f} "
+                f"{statistics.mean(samples) * 1000:>8.1f} {sum(samples):>8.2f}"
+            )
+    stop.set()
+    listener.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,366 @@
+"""Micro-benchmarks of the hot text paths, with regression budgets.
+
+Times each case on fixed, generated fixtures and reports operations and
+input bytes per second:
+
+``strip_ansi``                  pager-heavy vSmart output.
+``collapse_carriage_returns``   the same output, pager markers removed.
+``clean_command_output``        the same output, and a 1 MB ``show run``.
+``read_channel``                the 1 MB ``show run`` and the prompt from a
+                                fake channel that always has data buffered.
+``extract_prompt``              a controller login banner ending in the
+                                ``\\x1b[?7h`` prompt.
+``parse_host_line``             a 10,000-host inventory, one op per line.
+``build_side_by_side``          a 20,000-line routing table against a copy
+                                with changed, added and removed routes.
+``mask_secrets``                the ``show run`` against the inventory's
+                                distinct passwords (``webapp.runner``).
+
+A case is run in batches of at least ``--min-time`` seconds; the best of
+``--rounds`` batches is reported. ``--json PATH`` writes the results with
+the Python version and platform. ``--baseline PATH`` compares against such
+a file and exits 1 when a case's ops/s dropped by more than
+``--tolerance`` (a fraction; cases missing from the baseline are skipped).
+Only compare runs from the same machine and Python.
+
+Run from the repository root::
+
+    python benchmarks/bench_micro.py --json micro-baseline.json
+    python benchmarks/bench_micro.py --baseline micro-baseline.json
+    python benchmarks/bench_micro.py --only clean,read_channel --tolerance 0.1
+"""
+
+import argparse
+import importlib.util
+import json
+import platform
+import socket
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+from webapp import runner, storage  # noqa: E402
+
+
+def _load_bulk_show():
+    spec = importlib.util.spec_from_file_location(
+        "bulk_show", REPO_ROOT / "bulk-show.py"
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+bulk_show = _load_bulk_show()
+
+MB = 1024 * 1024
+PROMPT = "\r\nRT01# "
+
+
+# -- Fixtures ----------------------------------------------------------------
+
+
+def show_run(size=MB):
+    """``show running-config`` of an IOS-XE edge, CRLF line ends."""
+    lines = ["Building configuration...", "", "Current configuration : 0 bytes", "!"]
+    total = 0
+    index = 0
+    while total < size:
+        block = [
+            f"interface GigabitEthernet0/0/{index}",
+            f" description to-branch-{index:05d} WAN 東京本社",
+            f" ip address 10.{index // 256 % 256}.{index % 256}.1 255.255.255.0",
+            " ip mtu 1500",
+            " negotiation auto",
+            " no mop enabled",
+            f" service-policy output QOS-SHAPE-{index % 8}",
+            "!",
+        ]
+        lines.extend(block)
+        total += sum(len(line) + 2 for line in block)
+        index += 1
+    lines.append("end")
+    return "\r\n".join(lines) + "\r\n"
+
+
+def vsmart_pager(size=MB):
+    """``show omp routes`` from a vSmart with the pager on.
+
+    Every page ends in a reverse-video ``--More--`` that the next page
+    erases with carriage returns, and every tenth row is redrawn behind a
+    bare ``\\r`` like a progress counter.
+    """
+    rows = []
+    index = 0
+    total = 0
+    while total < size:
+        for line in range(24):
+            row = (
+                f"1    {index % 64:<5} 10.{index // 256 % 256}.{index % 256}.0/24  "
+                f"1.1.{index % 250}.1  C,I,R  installed  192.168.{line}.{index % 250}"
+                f"  mpls  ipsec  -"
+            )
+            if index % 10 == 0:
+                row = f"{index}\r{row}"
+            rows.append(row + "\r\n")
+            index += 1
+        rows.append("\x1b[7m--More--\x1b[m\r        \r")
+        total = sum(len(row) for row in rows)
+    return "".join(rows)
+
+
+def routing_table(lines=20000):
+    """``show ip route`` with ``lines`` BGP / OSPF routes."""
+    out = []
+    for i in range(lines):
+        proto = "B " if i % 3 else "O "
+        out.append(
+            f"{proto}    10.{i // 256 % 256}.{i % 256}.0/24 [{20 if i % 3 else 110}/"
+            f"{i % 7}] via 192.168.{i % 16}.{1 + i % 250}, {i % 9}w{i % 7}d, "
+            f"GigabitEthernet0/0/{i % 4}"
+        )
+    return out
+
+
+def changed_routing_table(lines):
+    """``lines`` with every 50th route changed, every 200th gone, and new
+    routes every 300th line."""
+    out = []
+    for i, line in enumerate(lines):
+        if i % 200 == 0:
+            continue
+        if i % 50 == 0:
+            line = line.replace(", ", ", 00:00:01, ", 1)
+        out.append(line)
+        if i % 300 == 0:
+            out.append(f"S     172.16.{i // 256 % 256}.{i % 256}.0/24 [1/0] via Null0")
+    return out
+
+
+def inventory(hosts=10000):
+    """A hosts file in every supported form, with comments and blanks."""
+    lines = ["# generated inventory", ""]
+    for i in range(hosts):
+        ip = f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}"
+        password = f"Pw-{i % 20:02d}!region"
+        form = i % 6
+        if form == 0:
+            lines.append(f"{ip},admin")
+        elif form == 1:
+            lines.append(f"{ip},admin,{password}")
+        elif form == 2:
+            lines.append(f"{ip}, admin, {password}, type=controller")
+        elif form == 3:
+            lines.append(f"{ip},admin,{password},site=dc-{i % 40}")
+        elif form == 4:
+            lines.append(f"{ip},netops,type=vsmart")
+        else:
+            lines.append(f"  {ip} , netops , {password} , type=edge , site=br-{i % 500}")
+        if i % 1000 == 999:
+            lines.append(f"# region {i // 1000}")
+    return lines
+
+
+CONTROLLER_LOGIN = (
+    "viptela 20.12.4\r\n\r\nLast login: Fri Oct 16 09:12:44 2026 from 10.0.0.5\r\n"
+    + "Welcome to Viptela CLI\r\n" * 3
+    + "admin connected from 10.0.0.5 using ssh on vsmart-dc1-01\r\n"
+    + "\x1b[?7hvsmart-dc1-01# "
+)
+
+
+class ChunkChannel:
+    """Fake channel that replays ``payload``, honoring the requested size."""
+
+    def __init__(self, payload):
+        self._payload = memoryview(payload)
+        self._pos = 0
+
+    def settimeout(self, _timeout):
+        pass
+
+    def send(self, data):
+        return len(data)
+
+    def recv(self, size):
+        if self._pos >= len(self._payload):
+            raise socket.timeout()
+        end = self._pos + size
+        data = bytes(self._payload[self._pos:end])
+        self._pos = end
+        return data
+
+
+# -- Cases -------------------------------------------------------------------
+
+
+def build_cases():
+    """``(name, bytes per op, ops per call, callable)`` for every case."""
+    run = show_run()
+    pager = vsmart_pager()
+    unpaged = bulk_show.PAGER_MARKER_RE.sub("", pager)
+    hosts = inventory()
+    before = routing_table()
+    after = changed_routing_table(before)
+    secrets = sorted(
+        {entry[2] for entry in map(bulk_show.parse_host_line, hosts)
+         if entry and entry[2]},
+        key=len,
+        reverse=True,
+    )
+    payload = (run + PROMPT).encode()
+    prompt_re = bulk_show.build_command_prompt_re("RT01#")
+
+    def read_channel():
+        _, kind = bulk_show.read_channel(
+            ChunkChannel(payload), prompt_re=prompt_re, idle_timeout=5.0,
+            max_wait=3600.0, poll_interval=0.0,
+        )
+        if kind != bulk_show.MATCH_PROMPT:
+            raise SystemExit(f"read_channel: unexpected exit kind {kind!r}")
+
+    def parse_hosts():
+        for line in hosts:
+            bulk_show.parse_host_line(line)
+
+    def size(lines):
+        return sum(len(line) + 1 for line in lines)
+
+    return [
+        ("strip_ansi/vsmart_pager", len(pager), 1,
+         lambda: bulk_show.strip_ansi(pager)),
+        ("collapse_carriage_returns/vsmart_pager", len(unpaged), 1,
+         lambda: bulk_show._collapse_carriage_returns(unpaged)),
+        ("clean_command_output/vsmart_pager", len(pager), 1,
+         lambda: bulk_show.clean_command_output(pager)),
+        ("clean_command_output/show_run", len(run), 1,
+         lambda: bulk_show.clean_command_output(run)),
+        ("read_channel/show_run", len(payload), 1, read_channel),
+        ("extract_prompt/controller_login", len(CONTROLLER_LOGIN), 1,
+         lambda: bulk_show.extract_prompt(CONTROLLER_LOGIN)),
+        ("parse_host_line/inventory", size(hosts) / len(hosts), len(hosts),
+         parse_hosts),
+        ("build_side_by_side/routing_table", size(before) + size(after), 1,
+         lambda: storage.build_side_by_side(before, after)),
+        ("mask_secrets/show_run", len(run), 1,
+         lambda: runner._mask_secrets(run, secrets)),
+    ]
+
+
+def measure(func, ops_per_call, min_time, rounds):
+    """Best ops/s over ``rounds`` batches of at least ``min_time`` seconds."""
+    best = 0.0
+    for _ in range(rounds):
+        calls = 0
+        started = time.perf_counter()
+        while True:
+            func()
+            calls += 1
+            elapsed = time.perf_counter() - started
+            if elapsed >= min_time:
+                break
+        best = max(best, calls * ops_per_call / elapsed)
+    return best
+
+
+def compare(results, baseline, tolerance):
+    """Names of the cases more than ``tolerance`` slower than ``baseline``."""
+    previous = {r["name"]: r["ops_per_s"] for r in baseline["results"]}
+    regressed = []
+    for r in results:
+        before = previous.get(r["name"])
+        if before and r["ops_per_s"] < before * (1 - tolerance):
+            regressed.append(r["name"])
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--only",
+        default="",
+        help="Comma-separated substrings; run only the cases whose name "
+        "contains one of them.",
+    )
+    parser.add_argument(
+        "--rounds", type=int, default=5, help="Batches per case. Default: %(default)s"
+    )
+    parser.add_argument(
+        "--min-time",
+        type=float,
+        default=0.2,
+        help="Minimum seconds per batch. Default: %(default)s",
+    )
+    parser.add_argument("--json", metavar="PATH", help="Write the results here.")
+    parser.add_argument(
+        "--baseline", metavar="PATH", help="Fail on regressions against this file."
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="Allowed ops/s drop against --baseline, as a fraction. "
+        "Default: %(default)s",
+    )
+    args = parser.parse_args()
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("python") != platform.python_version():
+            print(
+                f"warning: baseline is from Python {baseline.get('python')}, "
+                f"this is {platform.python_version()}"
+            )
+    wanted = [token for token in args.only.split(",") if token]
+    previous = {}
+    if baseline:
+        previous = {r["name"]: r["ops_per_s"] for r in baseline["results"]}
+
+    print(f"{'case':<40} {'ops/s':>12} {'MB/s':>9} {'vs base':>8}")
+    results = []
+    for name, nbytes, ops_per_call, func in build_cases():
+        if wanted and not any(token in name for token in wanted):
+            continue
+        ops = measure(func, ops_per_call, args.min_time, args.rounds)
+        result = {
+            "name": name,
+            "ops_per_s": round(ops, 2),
+            "bytes_per_s": round(ops * nbytes),
+        }
+        results.append(result)
+        before = previous.get(name)
+        change = f"{(ops / before - 1) * 100:+.1f}%" if before else "-"
+        print(
+            f"{name:<40} {ops:>12.1f} {ops * nbytes / MB:>9.1f} {change:>8}"
+        )
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(
+                {
+                    "recorded_at": datetime.now().isoformat(timespec="seconds"),
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+            f.write("\n")
+    if baseline:
+        regressed = compare(results, baseline, args.tolerance)
+        if regressed:
+            print(
+                f"regressed by more than {args.tolerance:.0%}: "
+                + ", ".join(regressed)
+            )
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
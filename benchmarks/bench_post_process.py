@@ -0,0 +1,179 @@
+"""Socket-read latency of busy sessions, with and without --post-process-workers.
+
+``--workers`` threads each play one session of ``--commands`` commands. A
+command is ``--reads`` short waits for data (``--tick`` ms sleeps standing in
+for ``recv`` on a quiet socket), each followed by a slice of the command's
+pager-redraw output written into the session's ``OutputCapture`` the way
+the reads do it; then ``SessionOutput.command`` writes it as text, JSON and
+CSV to a scratch directory. Each wait records how late the thread woke up:
+the time it queued for the GIL behind other sessions' cleaning and
+encoding, which is what delays prompt detection at high worker counts.
+
+``inline``  the capture cleans as it reads and the encoders run in the
+            session thread (the default).
+``pool N``  a ``PostProcessor`` of N processes does that work.
+
+Every variant is run once per ``--sizes`` output size (bytes, ``K`` / ``M``
+suffixes allowed). Outputs above the capture's spill threshold (1 MiB) are
+rendered by the pool from the spill file, so large commands cost the
+session threads a block copy instead of the cleaning. Run from the
+repository root::
+
+    python benchmarks/bench_post_process.py
+    python benchmarks/bench_post_process.py --workers 128 --pools 2,4
+    python benchmarks/bench_post_process.py --workers 16 --sizes 4M,16M
+"""
+
+import argparse
+import importlib.util
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+def _load_bulk_show():
+    spec = importlib.util.spec_from_file_location(
+        "bulk_show", REPO_ROOT / "bulk-show.py"
+    )
+    module = importlib.util.module_from_spec(spec)
+    # Registered so that its functions pickle by reference.
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+bulk_show = _load_bulk_show()
+
+# A confd-style pager redraw: every page ends in a marker that the next page
+# overwrites with carriage returns.
+PAGE = (
+    "  interface GigabitEthernet1 is up, line protocol is up (connected)\r\n" * 20
+    + " --More-- \r          \r"
+)
+
+
+def play_session(index, tmp, args, size, post_processor, lateness):
+    body = PAGE * max(1, size // len(PAGE))
+    step = -(-len(body) // args.reads)
+    paths = bulk_show._build_output_paths(
+        tmp, f"10.0.{index // 256}.{index % 256}", "bench",
+        bulk_show.ALL_OUTPUT_FORMATS,
+    )
+    result = bulk_show._new_session_result(
+        f"10.0.{index // 256}.{index % 256}", "admin", 830, bulk_show.DEVICE_EDGE
+    )
+    output = bulk_show.SessionOutput(result, paths, post_processor)
+    output.begin()
+    tick = args.tick / 1000
+    samples = []
+    for seq in range(args.commands):
+        capture = output.capture()
+        for offset in range(0, len(body), step):
+            started = time.perf_counter()
+            time.sleep(tick)
+            samples.append(time.perf_counter() - started - tick)
+            capture.write(body[offset:offset + step])
+        capture.finish()
+        output.command({
+            "command": f"show interfaces {seq}",
+            "started_at": bulk_show.now_iso(),
+            "duration_s": args.reads * tick,
+            "exit_kind": bulk_show.MATCH_PROMPT,
+            "status": bulk_show.CMD_OK,
+            "output": capture,
+        })
+    result["status"] = bulk_show.SESSION_OK
+    output.end()
+    lateness.extend(samples)
+
+
+def parse_size(token):
+    """``"256K"`` -> 262144."""
+    token = token.strip().upper()
+    scale = {"K": 1024, "M": 1024 * 1024}.get(token[-1:], 1)
+    return int(token.rstrip("KM")) * scale
+
+
+def run(args, size, post_processor):
+    lateness = []
+    with tempfile.TemporaryDirectory() as tmp:
+        threads = [
+            threading.Thread(
+                target=play_session,
+                args=(i, tmp, args, size, post_processor, lateness),
+            )
+            for i in range(args.workers)
+        ]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+    lateness.sort()
+    return (
+        lateness[len(lateness) // 2],
+        lateness[int(len(lateness) * 0.99)],
+        elapsed,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--workers", type=int, default=64, help="Concurrent sessions. Default: %(default)s"
+    )
+    parser.add_argument(
+        "--commands", type=int, default=5, help="Commands per session. Default: %(default)s"
+    )
+    parser.add_argument(
+        "--reads",
+        type=int,
+        default=20,
+        help="Waits for data per command. Default: %(default)s",
+    )
+    parser.add_argument(
+        "--tick", type=float, default=5.0, help="Length of one wait in ms. Default: %(default)s"
+    )
+    parser.add_argument(
+        "--sizes",
+        default="256K,4M",
+        help="Comma-separated output sizes per command, one run each. "
+        "Default: %(default)s",
+    )
+    parser.add_argument(
+        "--pools",
+        default="2,4",
+        help="Comma-separated PostProcessor sizes to compare. Default: %(default)s",
+    )
+    args = parser.parse_args()
+    bulk_show.log_message = lambda _message: None
+    print(
+        f"{'size':>6} {'variant':<8} {'p50_late_ms':>12} {'p99_late_ms':>12} "
+        f"{'total_s':>8}"
+    )
+    variants = [("inline", 0)] + [
+        (f"pool {n}", int(n)) for n in args.pools.split(",") if n
+    ]
+    for token in args.sizes.split(","):
+        if not token:
+            continue
+        size = parse_size(token)
+        for name, workers in variants:
+            post_processor = bulk_show.PostProcessor(workers) if workers else None
+            try:
+                p50, p99, elapsed = run(args, size, post_processor)
+            finally:
+                if post_processor is not None:
+                    post_processor.close()
+            print(
+                f"{token.strip():>6} {name:<8} {p50 * 1000:>12.2f} "
+                f"{p99 * 1000:>12.2f} {elapsed:>8.2f}"
+            )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""Memory held per host as command output grows.
+
+Runs ``connect_and_execute`` against a fake controller whose every command
+returns ``size`` bytes of ``show tech-support``-style output, writing text,
+JSON and CSV files to a scratch directory. Two numbers are reported from
+:mod:`tracemalloc` (the Python heap, which is what grows per host; process
+RSS also includes allocator slack and is not returned to the OS):
+
+``retained_KB``  heap still referenced by the returned session_result. With
+                 streaming output writers this is a few KB of metadata
+                 regardless of output size; it is what each of 64 concurrent
+                 hosts keeps alive until the run finishes.
+``peak_MB``      the heap high-water mark during the session. It tracks the
+                 largest command up to the in-memory capture budget
+                 (CAPTURE_SPILL_CHARS); past it the output is spilled and
+                 written out in blocks.
+
+Run from the repository root::
+
+    python benchmarks/bench_session_memory.py
+    python benchmarks/bench_session_memory.py --sizes 1M,20M --commands 10
+"""
+
+import argparse
+import collections
+import importlib.util
+import socket
+import sys
+import tempfile
+import tracemalloc
+import types
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+def _load_bulk_show():
+    spec = importlib.util.spec_from_file_location(
+        "bulk_show", REPO_ROOT / "bulk-show.py"
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+bulk_show = _load_bulk_show()
+
+LINE = b"  interface GigabitEthernet1 is up, line protocol is up (connected)\r\n"
+PROMPT = b"\r\nvsmart# "
+CHUNK = 64 * 1024
+
+
+class OutputChannel:
+    """Fake controller shell answering every command with ``body``."""
+
+    def __init__(self, body):
+        self._body = memoryview(body)
+        self._queue = collections.deque([PROMPT])
+
+    def settimeout(self, _timeout):
+        pass
+
+    def send(self, data):
+        for line in data.replace("\x15", "").splitlines():
+            command = line.strip().encode()
+            if not command:
+                continue
+            self._queue.append(command + b"\r\n")
+            if command != b"paginate false":
+                for pos in range(0, len(self._body), CHUNK):
+                    self._queue.append(self._body[pos:pos + CHUNK])
+            self._queue.append(PROMPT)
+        return len(data)
+
+    def recv(self, _size):
+        if not self._queue:
+            raise socket.timeout()
+        return bytes(self._queue.popleft())
+
+    def close(self):
+        pass
+
+
+class FakeSSHClient:
+    def __init__(self, channel):
+        self._channel = channel
+
+    def load_system_host_keys(self):
+        pass
+
+    def set_missing_host_key_policy(self, _policy):
+        pass
+
+    def connect(self, *_args, **_kwargs):
+        pass
+
+    def invoke_shell(self):
+        return self._channel
+
+    def close(self):
+        pass
+
+
+def parse_size(token):
+    token = token.strip().upper()
+    scale = {"K": 1024, "M": 1024 * 1024}.get(token[-1:], 1)
+    if scale != 1:
+        token = token[:-1]
+    return int(float(token) * scale)
+
+
+def run_one(size, commands, tmp):
+    body = LINE * max(1, size // len(LINE))
+    sys.modules["paramiko"] = types.SimpleNamespace(
+        SSHClient=lambda: FakeSSHClient(OutputChannel(body)),
+        AutoAddPolicy=lambda: object(),
+        RejectPolicy=lambda: object(),
+        AuthenticationException=type("AuthenticationException", (Exception,), {}),
+        SSHException=type("SSHException", (Exception,), {}),
+    )
+    commands_file = Path(tmp) / "commands.txt"
+    commands_file.write_text(
+        "".join(f"show tech-support {i}\n" for i in range(commands))
+    )
+    output_paths = bulk_show._build_output_paths(
+        tmp, "10.0.0.1", str(size), bulk_show.ALL_OUTPUT_FORMATS
+    )
+    log_message = bulk_show.log_message
+    bulk_show.log_message = lambda _message: None
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = bulk_show.connect_and_execute(
+            "10.0.0.1", "admin", "pw", str(commands_file), output_paths,
+            device_type=bulk_show.DEVICE_CONTROLLER,
+        )
+        retained, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        bulk_show.log_message = log_message
+    if result["status"] != bulk_show.SESSION_OK:
+        raise SystemExit(f"session failed at size {size}: {result['error']}")
+    written = sum(Path(p).stat().st_size for p in output_paths.values())
+    return len(body), written, retained - before, peak - before
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes",
+        default="100K,1M,10M",
+        help="Comma-separated per-command output sizes (suffix K/M). "
+        "Default: %(default)s",
+    )
+    parser.add_argument(
+        "--commands",
+        type=int,
+        default=5,
+        help="Commands per session. Default: %(default)s",
+    )
+    args = parser.parse_args()
+    print(
+        f"{'cmd_bytes':>12} {'written_MB':>11} {'retained_KB':>12} {'peak_MB':>9}"
+    )
+    for token in args.sizes.split(","):
+        with tempfile.TemporaryDirectory() as tmp:
+            size, written, retained, peak = run_one(
+                parse_size(token), args.commands, tmp
+            )
+        print(
+            f"{size:>12} {written / 1e6:>11.1f} {retained / 1024:>12.1f} "
+            f"{peak / 1e6:>9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
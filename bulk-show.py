@@ -1,18 +1,38 @@
 import argparse
+import codecs
+import collections
 import sys
 import time
 import ipaddress
 import concurrent.futures
+import concurrent.futures.process
+import io
+import queue
+import selectors
+import signal
 import socket
+import socketserver
+import tempfile
 import threading
 import os
 import re
 import csv
+import errno
 import json
 import getpass
+import gzip
+import heapq
+import inspect
+import itertools
+import multiprocessing
+import multiprocessing.connection
+import random
 from datetime import datetime
 
 print_lock = threading.Lock()
+# Extra destinations for log lines, called with each message under print_lock
+# (the --serve daemon streams a run's log back to the client that sent it).
+log_listeners = []
 
 # Matches IOS-XE style prompts like "host_2111#", "host_2111(config)#",
 # or "host_2111>" at the end of the buffer. Trailing whitespace is allowed.
@@ -84,6 +104,106 @@ def clean_command_output(text):
     text = _collapse_carriage_returns(text)
     return text
 
+
+# The start of a pager marker that the next chunk may complete. Held back
+# only while it is at most PAGER_MARKER_HOLD_CHARS long.
+PAGER_MARKER_PARTIAL_RE = re.compile(
+    r"-(?:-\s*(?:M(?:o(?:r(?:e\s*-?)?)?)?)?)?\Z|\((?:E(?:N(?:D)?)?)?\Z"
+)
+PAGER_MARKER_HOLD_CHARS = 64
+
+# Longest unfinished line an OutputCleaner holds. Past it the line's
+# carriage-return redraws are resolved so far, and a line that is still
+# longer than half of this is released as it stands.
+CLEANER_LINE_CHARS = 64 * 1024
+
+
+class OutputCleaner:
+    """:func:`clean_command_output` applied chunk by chunk during the read.
+
+    :meth:`feed` returns the cleaned text that can no longer change; the
+    concatenation of every :meth:`feed` result and :meth:`finish` equals
+    ``clean_command_output`` of the concatenated input. Pager markers are
+    removed as soon as they are complete (a possible marker start at the end
+    of a chunk is held back), and complete lines are collapsed as they
+    arrive; only the unfinished last line is carried between chunks. A
+    ChannelReader given one keeps the cleaned text, so the output is not
+    cleaned again in a second full pass once the command completes.
+
+    What is held stays bounded (CLEANER_LINE_CHARS, PAGER_MARKER_HOLD_CHARS),
+    so output without newlines cannot pile up here. The result then differs
+    from ``clean_command_output`` only for a line that still shows more than
+    CLEANER_LINE_CHARS / 2 characters: it is released as it stands, and a
+    later carriage return on it no longer overwrites the released part.
+    """
+
+    def __init__(self):
+        self._held = ""  # raw text that may start a pager marker
+        self._line = []  # marker-free pieces of the unfinished last line
+        self._line_chars = 0
+
+    def feed(self, text):
+        """Add ``text`` (ANSI-stripped output); return what is now final."""
+        text = self._held + text
+        start = 0
+        pieces = []
+        for match in PAGER_MARKER_RE.finditer(text):
+            pieces.append(text[start:match.start()])
+            start = match.end()
+        partial = PAGER_MARKER_PARTIAL_RE.search(text, start)
+        end = len(text)
+        if partial and end - partial.start() <= PAGER_MARKER_HOLD_CHARS:
+            end = partial.start()
+        pieces.append(text[start:end])
+        self._held = text[end:]
+        return self._lines("".join(pieces))
+
+    def _lines(self, text):
+        cut = text.rfind("\n")
+        if cut < 0:
+            if not text:
+                return ""
+            self._line.append(text)
+            self._line_chars += len(text)
+            return self._bound()
+        self._line.append(text[:cut + 1])
+        complete = "".join(self._line)
+        self._line = [text[cut + 1:]]
+        self._line_chars = len(self._line[0])
+        # Carriage returns only act within a line, so a run of complete lines
+        # collapses exactly as it would inside the whole text.
+        return _collapse_carriage_returns(complete) + self._bound()
+
+    def _bound(self):
+        """Keep the unfinished line within CLEANER_LINE_CHARS; return what
+        had to be released."""
+        if self._line_chars <= CLEANER_LINE_CHARS:
+            return ""
+        line = "".join(self._line)
+        # Each carriage return redraws from column 0, so everything before
+        # the last one collapses to what it shows. A trailing one stays: it
+        # may be the start of a "\r\n".
+        cr = line.rfind("\r", 0, len(line) - 1)
+        if cr > 0:
+            line = _collapse_carriage_returns(line[:cr]) + line[cr:]
+        released = ""
+        if len(line) > CLEANER_LINE_CHARS // 2:
+            keep = 1 if line.endswith("\r") else 0
+            released = _collapse_carriage_returns(line[:len(line) - keep])
+            line = line[len(line) - keep:]
+        self._line = [line]
+        self._line_chars = len(line)
+        return released
+
+    def finish(self):
+        """Return the rest once the output is complete."""
+        rest = "".join(self._line) + PAGER_MARKER_RE.sub("", self._held)
+        self._held = ""
+        self._line = []
+        self._line_chars = 0
+        return _collapse_carriage_returns(rest)
+
+
 # Patterns indicating shell-level password authentication failure.
 # Matched case-insensitively against the buffer received after sending
 # a password to the device's "shell" sub-process.
@@ -114,6 +234,8 @@ MATCH_EXPECT = "expect"
 MATCH_IDLE = "idle"
 MATCH_MAX_WAIT = "max_wait"
 MATCH_EOF = "eof"
+# The read was cut short by a CancelToken (--deadline / --host-budget / signal).
+MATCH_DEADLINE = "deadline"
 
 # ---------------------------------------------------------------------------
 # Output formats and boundary markers (Issues 9 and 14)
@@ -131,10 +253,17 @@ SESSION_AUTH_SHELL = "auth_error_shell"
 SESSION_CONNECT_ERR = "connect_error"
 SESSION_SHELL_ERR = "shell_error"
 SESSION_OTHER_ERR = "error"
+# Cancelled mid-session, and never started, by a CancelToken.
+SESSION_DEADLINE = "deadline"
+SESSION_SKIPPED = "skipped"
+# Never attempted: its failure domain's circuit breaker was open.
+SESSION_CIRCUIT_OPEN = "circuit_open"
 
 # Per-command status codes (recorded in command_result["status"]).
 CMD_OK = "ok"
 CMD_TIMEOUT = "timeout"
+# Not sent because the session was cancelled first (exit_kind "deadline").
+CMD_SKIPPED = "skipped"
 
 # ---------------------------------------------------------------------------
 # Device types / connection profiles
@@ -185,7 +314,11 @@ def normalize_device_type(token):
 
 
 def parse_host_line(line):
-    """Parse one hosts-file line into ``(ip, username, password, device_type)``.
+    """Parse one hosts-file line into ``(ip, username, password, device_type, site)``.
+
+    ``site`` comes from a ``site=<name>`` token (allowed anywhere after the
+    IP, like ``type=``) and names the host's failure domain for
+    --circuit-breaker; it is None when the line has none.
 
     Returns ``None`` for blank lines and comment lines (first non-space char
     ``#``). Raises :class:`ValueError` with a human-readable reason for
@@ -218,9 +351,17 @@ def parse_host_line(line):
     # First pass: pull out any explicit ``type=<value>`` token(s). These are
     # unambiguous, so they win over a trailing bare keyword.
     device_type = None
+    site = None
     positional = []
     for field in parts:
-        if field.lower().startswith("type="):
+        if field.lower().startswith("site="):
+            value = field.split("=", 1)[1].strip()
+            if not value:
+                raise ValueError("empty site name")
+            if site is not None and site != value:
+                raise ValueError(f"conflicting sites {site!r} and {value!r}")
+            site = value
+        elif field.lower().startswith("type="):
             value = field.split("=", 1)[1]
             mapped = normalize_device_type(value)
             if mapped is None:
@@ -290,7 +431,7 @@ def parse_host_line(line):
     if not username:
         raise ValueError("missing username")
 
-    return router_ip, username, password, device_type
+    return router_ip, username, password, device_type, site
 
 
 def resolve_commands_file(device_type, base, controller_file, edge_file):
@@ -327,6 +468,8 @@ def now_iso():
 def log_message(message):
     with print_lock:
         print(message, flush=True)
+        for listener in log_listeners:
+            listener(message)
 
 
 def is_valid_ip(ip_address):
@@ -337,6 +480,425 @@ def is_valid_ip(ip_address):
         return False
 
 
+# Size (in characters of ANSI-stripped text) of the rolling tail window that
+# prompt / expect / pager detection looks at. Prompts and pager markers always
+# sit at the very end of the buffer, so a bounded window keeps each poll O(1)
+# regardless of how much output a command has already produced.
+READ_TAIL_CHARS = 1024
+
+# An escape sequence cut off at the end of a chunk: a bare ESC, or a CSI
+# introducer whose final byte has not arrived yet. ChannelReader holds such a
+# fragment back until the next chunk completes (or disproves) it.
+ANSI_PARTIAL_RE = re.compile(r"\x1b(?:\[[0-?]*[ -/]*)?\Z")
+
+
+# channel.recv sizes. Reads start at READ_RECV_MIN and double (up to
+# READ_RECV_MAX) while the channel keeps filling the whole request, so a bulk
+# transfer such as "show tech-support" takes far fewer recv calls, decodes and
+# tail checks per megabyte; a short read drops back to the minimum.
+READ_RECV_MIN = 4096
+READ_RECV_MAX = 256 * 1024
+
+# Per-command capture budget (characters of ANSI-stripped text). An
+# OutputCapture keeps the first CAPTURE_SPILL_CHARS in memory and spills the
+# rest to a temporary file. Past CAPTURE_MAX_CHARS only a rolling
+# CAPTURE_TAIL_CHARS tail is kept, and the output becomes head + truncation
+# marker + tail; the capture counts the UTF-8 size of what was dropped, which
+# the JSON / CSV outputs report as ``truncated_bytes``. The output files are
+# written from the capture in CAPTURE_SPILL_CHARS blocks, so a command costs
+# at most about CAPTURE_SPILL_CHARS + CAPTURE_TAIL_CHARS characters of memory
+# however much it printed. The matching window above sees every byte, so a
+# runaway command (``show logging`` on a chatty box, a pager that never
+# stops) still settles on its prompt.
+CAPTURE_SPILL_CHARS = 1024 * 1024
+CAPTURE_MAX_CHARS = 64 * 1024 * 1024
+CAPTURE_TAIL_CHARS = 64 * 1024
+CAPTURE_TRUNCATED_FMT = "\n!! output truncated: {} bytes omitted\n"
+
+
+class OutputCapture:
+    """The kept output of one command, bounded by the capture budget.
+
+    Every read of the command (the first one, any nudges) writes into the
+    same capture, so the budget (``spill_chars``, ``max_chars``,
+    ``keep_tail_chars``; see CAPTURE_MAX_CHARS) covers the whole command and
+    :attr:`truncated_bytes` counts everything dropped. With a ``cleaner`` (an
+    :class:`OutputCleaner`) the kept text is the cleaned output, and
+    :meth:`finish` adds what the cleaner still holds.
+
+    Read the result back with :meth:`chunks` (bounded blocks) or
+    :meth:`getvalue` (one string), and :meth:`close` it when done.
+    """
+
+    def __init__(self, spill_chars=CAPTURE_SPILL_CHARS, max_chars=CAPTURE_MAX_CHARS,
+                 keep_tail_chars=CAPTURE_TAIL_CHARS, cleaner=None):
+        self.cleaner = cleaner
+        self._spill_chars = spill_chars
+        self._max_chars = max_chars
+        self._keep_tail_chars = keep_tail_chars
+        # Head of the output: in _pieces, then in _spill once it outgrows
+        # spill_chars. _overflow is the rolling tail kept past max_chars.
+        self._pieces = []
+        self._pieces_chars = 0
+        self._spill = None
+        self._kept = 0
+        self._overflow = ""
+        self.truncated_bytes = 0
+
+    @property
+    def cleaned(self):
+        """Whether the kept text is already cleaned."""
+        return self.cleaner is not None
+
+    @property
+    def spilled(self):
+        return self._spill is not None
+
+    def write(self, text):
+        """Add ANSI-stripped output text."""
+        if self.cleaner is not None:
+            text = self.cleaner.feed(text)
+        self._keep(text)
+
+    def finish(self):
+        """Flush the cleaner; call once the command's reads are over."""
+        if self.cleaner is not None:
+            self._keep(self.cleaner.finish())
+        if self._spill is not None:
+            self._spill.flush()
+
+    def _keep(self, text):
+        room = self._max_chars - self._kept
+        if len(text) > room:
+            self._overflow += text[room:]
+            text = text[:room]
+            excess = len(self._overflow) - self._keep_tail_chars
+            if excess > 0:
+                self.truncated_bytes += len(self._overflow[:excess].encode("utf-8"))
+                self._overflow = self._overflow[excess:]
+        if not text:
+            return
+        self._kept += len(text)
+        if self._spill is not None:
+            self._spill.write(text)
+            return
+        self._pieces.append(text)
+        self._pieces_chars += len(text)
+        if self._pieces_chars > self._spill_chars:
+            self._spill = tempfile.NamedTemporaryFile(
+                "w+", encoding="utf-8", newline="", prefix="bulk-show-", suffix=".out"
+            )
+            self._spill.write("".join(self._pieces))
+            self._pieces = []
+
+    def trailer(self):
+        """The truncation marker and kept tail that follow the head."""
+        if not self.truncated_bytes:
+            return self._overflow
+        return CAPTURE_TRUNCATED_FMT.format(self.truncated_bytes) + self._overflow
+
+    def chunks(self, size=CAPTURE_SPILL_CHARS):
+        """Yield the kept output in blocks of at most about ``size`` characters."""
+        if self._spill is None:
+            yield from self._pieces
+        else:
+            self._spill.flush()
+            self._spill.seek(0)
+            while True:
+                block = self._spill.read(size)
+                if not block:
+                    break
+                yield block
+            self._spill.seek(0, os.SEEK_END)
+        trailer = self.trailer()
+        if trailer:
+            yield trailer
+
+    def getvalue(self):
+        """Return the kept output as one string."""
+        return "".join(self.chunks())
+
+    def spill_path(self):
+        """Flush the spill file and return its path (None if not spilled).
+
+        The file holds the head of the output; :meth:`trailer` follows it.
+        """
+        if self._spill is None:
+            return None
+        self._spill.flush()
+        return self._spill.name
+
+    def close(self):
+        """Delete the spill file, if any."""
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+
+
+class ChannelReader:
+    """Incremental, ANSI-stripped accumulator for one channel read.
+
+    ``read_channel`` used to re-join and re-strip the whole buffer on every
+    poll, which made a single large command (``show tech-support``) quadratic
+    in its output size. A ChannelReader instead decodes and strips each chunk
+    once as it arrives, writes it to an :class:`OutputCapture`, and
+    maintains a bounded ``tail`` window (``READ_TAIL_CHARS``) that prompt,
+    expect and pager matching inspect.
+
+    Chunks are raw bytes from ``channel.recv``. They go through an incremental
+    UTF-8 decoder, so a multibyte character (e.g. a Japanese hostname or
+    interface description) split across two chunks is decoded intact rather
+    than turned into replacement characters. Likewise an escape sequence split
+    across chunks is carried over and stripped once it is complete, so the
+    result is identical to ``strip_ansi`` over the whole decoded stream.
+
+    The text goes to ``capture`` when one is given (shared by every read of a
+    command), otherwise to a capture of the reader's own built from the
+    budget arguments and ``cleaner``. The matching window is never cleaned.
+    """
+
+    def __init__(self, tail_chars=READ_TAIL_CHARS, spill_chars=CAPTURE_SPILL_CHARS,
+                 max_chars=CAPTURE_MAX_CHARS, keep_tail_chars=CAPTURE_TAIL_CHARS,
+                 cleaner=None, capture=None):
+        self._tail_chars = tail_chars
+        if capture is None:
+            capture = OutputCapture(spill_chars, max_chars, keep_tail_chars, cleaner)
+        self.capture = capture
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._tail = ""
+        # Unterminated escape-sequence fragment from the end of the last chunk.
+        self._pending = ""
+        # Bytes received; grows on every chunk so the pager logic can tell
+        # whether the device has responded since the last keystroke.
+        self.received = 0
+
+    def feed(self, data):
+        """Append one raw chunk (bytes, bytearray or memoryview)."""
+        if not data:
+            return
+        self.received += len(data)
+        self._append(self._decoder.decode(data))
+
+    def _append(self, text):
+        if not text:
+            return
+        text = self._pending + text
+        self._pending = ""
+        partial = ANSI_PARTIAL_RE.search(text)
+        if partial:
+            self._pending = text[partial.start():]
+            text = text[:partial.start()]
+        text = strip_ansi(text)
+        if text:
+            self.capture.write(text)
+            self._tail = (self._tail + text)[-self._tail_chars:]
+
+    @property
+    def tail(self):
+        """Bounded, ANSI-stripped end of the buffer used for matching."""
+        return self._tail + self._pending
+
+    @property
+    def truncated_bytes(self):
+        return self.capture.truncated_bytes
+
+    def __bool__(self):
+        return self.received > 0
+
+    def close(self):
+        """Write what the decoder and escape stripping still hold to the
+        capture; call once the read is over.
+
+        An incomplete multibyte sequence is flushed as a replacement
+        character, and an unterminated escape sequence as it stands.
+        """
+        self._append(self._decoder.decode(b"", final=True))
+        if self._pending:
+            self.capture.write(self._pending)
+            self._pending = ""
+
+    def getvalue(self):
+        """Close the read and return the full ANSI-stripped buffer."""
+        self.close()
+        self.capture.finish()
+        return self.capture.getvalue()
+
+
+class ReadStats:
+    """Data-arrival timing shared by every read of one command.
+
+    Passed to :class:`ChannelRead` (via ``read_channel(..., stats=...)``) so
+    the latency model can learn how long a command's output may pause --
+    including the prompt-redraw delay after the last line -- and how long the
+    session spent waiting after the final byte arrived.
+    """
+
+    def __init__(self):
+        self.last_data = None
+        self.max_gap = 0.0
+
+    def data(self, now):
+        if self.last_data is not None:
+            self.max_gap = max(self.max_gap, now - self.last_data)
+        self.last_data = now
+
+
+class ChannelRead:
+    """State of one in-flight ``read_channel`` call.
+
+    The matching rules (expect, pager draining, prompt, idle, max_wait) live
+    here rather than inside a blocking loop so two drivers can share them:
+    :func:`read_channel` polls ``channel.recv`` with a short timeout, while the
+    selectors engine (:func:`run_selectors_engine`) feeds data as the
+    channel's file descriptor becomes readable and calls :meth:`check` on
+    idle/max_wait timers. Both therefore make identical decisions for the
+    same stream of chunks.
+
+    ``result`` is ``None`` while the read is in progress and becomes the
+    ``(buffer, match_kind)`` tuple once it completes. A read given a
+    ``capture`` (an :class:`OutputCapture`) writes the text there as it
+    arrives, and its result carries that capture in place of the buffer.
+    """
+
+    def __init__(
+        self,
+        channel,
+        prompt_re=DEFAULT_PROMPT_RE,
+        expect_re=None,
+        idle_timeout=1.0,
+        max_wait=60.0,
+        handle_pager=True,
+        max_pager_advances=10000,
+        now=None,
+        stats=None,
+        cancel=None,
+        capture=None,
+    ):
+        self.channel = channel
+        self.prompt_re = prompt_re
+        self.expect_re = expect_re
+        self.idle_timeout = idle_timeout
+        self.max_wait = max_wait
+        self.handle_pager = handle_pager
+        self.max_pager_advances = max_pager_advances
+        self.reader = ChannelReader(capture=capture)
+        self._shared_capture = capture is not None
+        self.start = time.monotonic() if now is None else now
+        self.last_data = self.start
+        self.pager_advances = 0
+        # Characters received at the last pager keystroke. Guards against
+        # sending a second keystroke for the same pager prompt before the
+        # device has responded with the next page.
+        self.len_at_last_pager = -1
+        self.recv_size = READ_RECV_MIN
+        self.stats = stats
+        self.cancel = cancel
+        self.result = None
+
+    def _finish(self, kind):
+        if self._shared_capture:
+            self.reader.close()
+            self.result = (self.reader.capture, kind)
+        else:
+            self.result = (self.reader.getvalue(), kind)
+        return self.result
+
+    def expired(self, now):
+        """Complete with MATCH_MAX_WAIT once the hard upper bound passes.
+
+        A set ``cancel`` token completes the read with MATCH_DEADLINE instead.
+        """
+        if self.cancel is not None and self.cancel.is_set(now):
+            self._finish(MATCH_DEADLINE)
+            return True
+        if now - self.start >= self.max_wait:
+            self._finish(MATCH_MAX_WAIT)
+            return True
+        return False
+
+    def feed(self, data, now):
+        """Record one ``channel.recv`` result; empty ``data`` means EOF."""
+        if not data:
+            self._finish(MATCH_EOF)
+            return
+        self.reader.feed(data)
+        self.last_data = now
+        if self.stats is not None:
+            self.stats.data(now)
+        # Adapt the next recv size: keep doubling while the channel fills the
+        # whole request, fall back to the minimum once it does not.
+        if len(data) >= self.recv_size:
+            self.recv_size = min(self.recv_size * 2, READ_RECV_MAX)
+        else:
+            self.recv_size = READ_RECV_MIN
+
+    def fail(self):
+        """Complete with MATCH_EOF after a socket-level error."""
+        return self._finish(MATCH_EOF)
+
+    def next_deadline(self):
+        """Monotonic time at which :meth:`check` must run even without data."""
+        deadline = self.start + self.max_wait
+        if self.reader:
+            deadline = min(deadline, self.last_data + self.idle_timeout)
+        if self.cancel is not None:
+            expires = self.cancel.expires()
+            if expires is not None:
+                deadline = min(deadline, expires)
+        return deadline
+
+    def check(self, now):
+        """Evaluate the tail; return the result if the read is complete."""
+        reader = self.reader
+        # Check matches whether we received data this poll or not, so that
+        # idle exits still get a final chance to confirm the tail. The reader
+        # strips ANSI escapes as data arrives so embedded sequences (e.g. the
+        # viptela "\x1b[?7h" emitted before the prompt) do not defeat the
+        # prompt/expect regexes.
+        tail = reader.tail
+        if self.expect_re is not None and self.expect_re.search(tail):
+            return self._finish(MATCH_EXPECT)
+
+        # Drain an interactive pager before considering prompt/idle exits.
+        # Only send one keystroke per distinct pager prompt (i.e. once the
+        # buffer has grown since the previous keystroke) so we advance page by
+        # page instead of spamming keys.
+        if self.handle_pager and reader.received != self.len_at_last_pager:
+            pager_key = None
+            if PAGER_MORE_RE.search(tail):
+                # "!" tells the confd/viptela pager to dump the remaining text
+                # without further pagination, so we settle straight on the CLI
+                # prompt instead of stopping again at "(END)" (which redraws
+                # itself and echoes stray quit keys into the next command).
+                pager_key = "!"
+            elif PAGER_END_RE.search(tail):
+                pager_key = "q"
+            if pager_key is not None:
+                if self.pager_advances >= self.max_pager_advances:
+                    return self._finish(MATCH_MAX_WAIT)
+                try:
+                    self.channel.send(pager_key)
+                except OSError:
+                    return self._finish(MATCH_EOF)
+                self.pager_advances += 1
+                self.len_at_last_pager = reader.received
+                self.last_data = now
+                return None
+
+        # Prompt detection runs on a tail with pager markers and carriage
+        # returns normalized away, so a prompt that the pager drew right after
+        # "(END)" or behind a bare "\r" (no newline) is still recognized.
+        prompt_tail = PAGER_MARKER_RE.sub("", tail).replace("\r", "\n")
+        if self.prompt_re is not None and self.prompt_re.search(prompt_tail):
+            return self._finish(MATCH_PROMPT)
+
+        # Idle exit: at least some data has been received and nothing new
+        # has arrived for idle_timeout seconds.
+        if reader and now - self.last_data >= self.idle_timeout:
+            return self._finish(MATCH_IDLE)
+        return None
+
+
 def read_channel(
     channel,
     prompt_re=DEFAULT_PROMPT_RE,
@@ -346,6 +908,9 @@ def read_channel(
     poll_interval=0.1,
     handle_pager=True,
     max_pager_advances=10000,
+    stats=None,
+    cancel=None,
+    capture=None,
 ):
     """
     Read from the SSH channel until prompt_re or expect_re matches the tail
@@ -369,84 +934,115 @@ def read_channel(
                       commands whose pager ignores "terminal length 0".
         max_pager_advances: safety cap on the number of pager keystrokes sent
                       during a single read (guards against a stuck pager).
+        stats: optional :class:`ReadStats` updated as data arrives.
+        cancel: optional :class:`CancelToken`, checked on every poll; once
+                it is set the read returns what it has with MATCH_DEADLINE.
+        capture: optional :class:`OutputCapture` that keeps the text as it
+                 arrives; it is then returned in place of the buffer.
 
     Returns:
         Tuple (buffer, match_kind). match_kind is one of:
-          MATCH_PROMPT, MATCH_EXPECT, MATCH_IDLE, MATCH_MAX_WAIT, MATCH_EOF.
+          MATCH_PROMPT, MATCH_EXPECT, MATCH_IDLE, MATCH_MAX_WAIT, MATCH_EOF,
+          MATCH_DEADLINE.
     """
     channel.settimeout(poll_interval)
-    chunks = []
-    start = time.monotonic()
-    last_data = start
-    pager_advances = 0
-    # Byte length of the buffer at the last pager keystroke. Guards against
-    # sending a second keystroke for the same pager prompt before the device
-    # has responded with the next page.
-    len_at_last_pager = -1
+    op = ChannelRead(
+        channel,
+        prompt_re=prompt_re,
+        expect_re=expect_re,
+        idle_timeout=idle_timeout,
+        max_wait=max_wait,
+        handle_pager=handle_pager,
+        max_pager_advances=max_pager_advances,
+        stats=stats,
+        cancel=cancel,
+        capture=capture,
+    )
     while True:
         now = time.monotonic()
-        if now - start >= max_wait:
-            return strip_ansi("".join(chunks)), MATCH_MAX_WAIT
+        if op.expired(now):
+            return op.result
         try:
-            data = channel.recv(4096)
-            if not data:
+            op.feed(channel.recv(op.recv_size), now)
+            if op.result is not None:
                 # EOF on the channel.
-                return strip_ansi("".join(chunks)), MATCH_EOF
-            chunks.append(data.decode(errors="replace"))
-            last_data = now
+                return op.result
         except socket.timeout:
             # No data this poll; loop and re-check patterns / idle.
             pass
         except OSError:
             # Other socket-level errors are treated as EOF for our purposes.
-            return strip_ansi("".join(chunks)), MATCH_EOF
+            return op.fail()
+        result = op.check(now)
+        if result is not None:
+            return result
 
-        # Check matches whether we received data this poll or not, so that
-        # idle exits still get a final chance to confirm the tail. Strip ANSI
-        # escapes first so embedded sequences (e.g. the viptela "\x1b[?7h"
-        # emitted before the prompt) do not defeat the prompt/expect regexes.
-        joined = "".join(chunks)
-        tail = strip_ansi(joined)[-1024:]
-        if expect_re is not None and expect_re.search(tail):
-            return strip_ansi(joined), MATCH_EXPECT
 
-        # Drain an interactive pager before considering prompt/idle exits.
-        # Only send one keystroke per distinct pager prompt (i.e. once the
-        # buffer has grown since the previous keystroke) so we advance page by
-        # page instead of spamming keys.
-        if handle_pager and len(joined) != len_at_last_pager:
-            pager_key = None
-            if PAGER_MORE_RE.search(tail):
-                # "!" tells the confd/viptela pager to dump the remaining text
-                # without further pagination, so we settle straight on the CLI
-                # prompt instead of stopping again at "(END)" (which redraws
-                # itself and echoes stray quit keys into the next command).
-                pager_key = "!"
-            elif PAGER_END_RE.search(tail):
-                pager_key = "q"
-            if pager_key is not None:
-                if pager_advances >= max_pager_advances:
-                    return strip_ansi(joined), MATCH_MAX_WAIT
-                try:
-                    channel.send(pager_key)
-                except OSError:
-                    return strip_ansi(joined), MATCH_EOF
-                pager_advances += 1
-                len_at_last_pager = len(joined)
-                last_data = now
-                continue
+def run_read_steps(channel, steps, cancel=None):
+    """Drive a read-steps generator with blocking :func:`read_channel` calls.
 
-        # Prompt detection runs on a tail with pager markers and carriage
-        # returns normalized away, so a prompt that the pager drew right after
-        # "(END)" or behind a bare "\r" (no newline) is still recognized.
-        prompt_tail = PAGER_MARKER_RE.sub("", tail).replace("\r", "\n")
-        if prompt_re is not None and prompt_re.search(prompt_tail):
-            return strip_ansi(joined), MATCH_PROMPT
+    Session logic is written as generators that ``yield`` a dict of
+    :class:`ChannelRead` keyword arguments whenever they need the channel's
+    next response and receive the ``(buffer, match_kind)`` result back. This
+    driver serves each request synchronously (the threaded engine); the
+    selectors engine serves the same requests from its event loop. Every read
+    watches ``cancel`` (a :class:`CancelToken`). Returns the generator's
+    return value.
+    """
+    result = None
+    while True:
+        try:
+            request = steps.send(result)
+        except StopIteration as stop:
+            return stop.value
+        result = read_channel(channel, cancel=cancel, **request)
 
-        # Idle exit: at least some data has been received and nothing new
-        # has arrived for idle_timeout seconds.
-        if chunks and now - last_data >= idle_timeout:
-            return strip_ansi(joined), MATCH_IDLE
+
+def read_until_prompt_steps(
+    channel,
+    prompt_re,
+    idle_timeout=1.0,
+    max_wait=120.0,
+    nudge_attempts=2,
+    nudge_wait=5.0,
+    stats=None,
+    capture=None,
+):
+    """Read-steps generator behind :func:`read_until_prompt`.
+
+    ``stats`` (a :class:`ReadStats`) is shared by the initial read and any
+    nudge reads, so it covers the command from first byte to final prompt.
+    So is ``capture`` (an :class:`OutputCapture`): the reads keep their text
+    in it, and it is finished and returned in place of the buffer.
+    """
+    buf, kind = yield dict(
+        prompt_re=prompt_re,
+        idle_timeout=idle_timeout,
+        max_wait=max_wait,
+        stats=stats,
+        capture=capture,
+    )
+    attempts = 0
+    while kind in (MATCH_IDLE, MATCH_MAX_WAIT) and attempts < nudge_attempts:
+        attempts += 1
+        try:
+            channel.send("\n")
+        except OSError:
+            break
+        extra, kind = yield dict(
+            prompt_re=prompt_re,
+            idle_timeout=idle_timeout,
+            max_wait=nudge_wait,
+            stats=stats,
+            capture=capture,
+        )
+        if capture is None:
+            buf += extra
+        if kind == MATCH_PROMPT:
+            break
+    if capture is not None:
+        capture.finish()
+    return buf, kind
 
 
 def read_until_prompt(
@@ -474,29 +1070,17 @@ def read_until_prompt(
     Returns ``(buffer, match_kind)`` where ``match_kind`` is the final result
     (``MATCH_PROMPT`` once the prompt is confirmed).
     """
-    buf, kind = read_channel(
+    return run_read_steps(
         channel,
-        prompt_re=prompt_re,
-        idle_timeout=idle_timeout,
-        max_wait=max_wait,
-    )
-    attempts = 0
-    while kind in (MATCH_IDLE, MATCH_MAX_WAIT) and attempts < nudge_attempts:
-        attempts += 1
-        try:
-            channel.send("\n")
-        except OSError:
-            break
-        extra, kind = read_channel(
+        read_until_prompt_steps(
             channel,
-            prompt_re=prompt_re,
+            prompt_re,
             idle_timeout=idle_timeout,
-            max_wait=nudge_wait,
-        )
-        buf += extra
-        if kind == MATCH_PROMPT:
-            break
-    return buf, kind
+            max_wait=max_wait,
+            nudge_attempts=nudge_attempts,
+            nudge_wait=nudge_wait,
+        ),
+    )
 
 
 def extract_prompt(buffer):
@@ -537,156 +1121,2449 @@ def build_command_prompt_re(base_prompt):
     )
 
 
-def _write_outputs(session_result, output_paths):
-    """
-    Materialize a session_result dict to disk in one or more formats.
-
-    Args:
-        session_result: dict produced by connect_and_execute. See the
-            docstring of connect_and_execute for the schema.
-        output_paths: dict mapping format name (one of OUTPUT_FORMAT_TEXT,
-            OUTPUT_FORMAT_JSON, OUTPUT_FORMAT_CSV) to destination file path.
-            Only the formats present in this dict are written.
-    """
-    if OUTPUT_FORMAT_TEXT in output_paths:
-        _write_text(session_result, output_paths[OUTPUT_FORMAT_TEXT])
-    if OUTPUT_FORMAT_JSON in output_paths:
-        _write_json(session_result, output_paths[OUTPUT_FORMAT_JSON])
-    if OUTPUT_FORMAT_CSV in output_paths:
-        _write_csv(session_result, output_paths[OUTPUT_FORMAT_CSV])
+# ---------------------------------------------------------------------------
+# Deadlines and cancellation (--deadline / --host-budget)
+# ---------------------------------------------------------------------------
+#
+# A run-wide CancelToken fires when --deadline passes or on SIGINT/SIGTERM;
+# each host gets a child token that additionally fires after --host-budget.
+# Every ChannelRead checks its token, so in-flight reads end within one poll
+# with MATCH_DEADLINE. The session then records the interrupted command (with
+# its partial output) and the commands it never sent, and closes its output
+# files; hosts not yet started are recorded as SESSION_SKIPPED.
 
+# How often waits that cannot watch a token directly re-check it.
+CANCEL_POLL_INTERVAL = 0.2
 
-def _write_text(session_result, path):
-    """Write a per-host text log as a continuous terminal transcript.
 
-    The whole host session is wrapped in session begin/end markers (the web
-    UI parses ``session end`` to roll up per-host status), but individual
-    commands are NOT wrapped: each command's captured output — including the
-    echoed command line and the trailing device prompt — is written back to
-    back so the file reads like one uninterrupted interactive session, exactly
-    as if the commands had been typed one after another at the prompt.
+class CancelToken:
+    """Cooperative cancellation for one run or one host.
 
-    A command that never settled on a prompt (e.g. an idle/timeout) still
-    gets a short ``!!`` note on its own line so failures are not hidden; the
-    richer per-command metadata remains available in the JSON/CSV outputs.
+    :meth:`is_set` turns true once :meth:`cancel` is called, the monotonic
+    ``deadline`` passes or ``parent`` (another CancelToken) is set;
+    :attr:`reason` then says why. Like :class:`threading.Event`, it can be
+    handed to anything that only needs ``is_set()``.
     """
-    with open(path, "w") as f:
-        f.write(
-            SESSION_BEGIN_FMT.format(
-                host=session_result["host"],
-                user=session_result["username"],
-                port=session_result["port"],
-                ts=session_result["started_at"],
-            )
-            + "\n"
-        )
-        # Surface a connect/auth-level error before any commands so that a
-        # text reader does not have to guess why the file is otherwise empty.
-        if session_result.get("error"):
-            f.write(f"!! {session_result['error']}\n")
-        # Concatenate command outputs verbatim. Because each command's capture
-        # ends on the device prompt and the next capture starts with that
-        # command's echo, the natural "prompt#next-command" flow is preserved.
-        pending_newline = False
-        for cmd in session_result["commands"]:
-            output = cmd["output"]
-            f.write(output)
-            pending_newline = bool(output) and not output.endswith("\n")
-            if cmd["status"] != CMD_OK:
-                # Ensure the note lands on its own line, then continue the
-                # transcript on a fresh line for the following command.
-                if pending_newline:
-                    f.write("\n")
-                f.write(
-                    f"!! command did not return a prompt: {cmd['command']} "
-                    f"(exit={cmd['exit_kind']}, {cmd['duration_s']:.2f}s)\n"
-                )
-                pending_newline = False
-        if pending_newline:
-            f.write("\n")
-        f.write(
-            SESSION_END_FMT.format(
-                host=session_result["host"],
-                status=session_result["status"],
-                ts=session_result["ended_at"],
-                dur=session_result["duration_s"],
-            )
-            + "\n"
+
+    def __init__(self, deadline=None, reason="deadline reached", parent=None):
+        self.deadline = deadline
+        self.parent = parent
+        self._deadline_reason = reason
+        self._reason = None
+
+    @classmethod
+    def for_host(cls, parent=None, budget=None):
+        """Per-host token: ``parent`` plus an optional ``budget`` in seconds.
+
+        Returns ``parent`` itself (possibly None) when there is no budget.
+        """
+        if budget is None:
+            return parent
+        return cls(
+            time.monotonic() + budget,
+            f"host budget {budget:g}s exceeded",
+            parent,
         )
 
+    def cancel(self, reason):
+        """Set the token now; the first reason given wins."""
+        if self._reason is None:
+            self._reason = reason
 
-def _write_json(session_result, path):
-    """Write the session_result as pretty-printed UTF-8 JSON."""
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(session_result, f, ensure_ascii=False, indent=2)
-        f.write("\n")
-
-
-def _write_csv(session_result, path):
-    """Write per-command rows as CSV. Multi-line outputs are quoted by csv."""
-    fieldnames = [
-        "seq",
-        "host",
-        "command",
-        "started_at",
-        "duration_s",
-        "exit_kind",
-        "status",
-        "output",
-    ]
-    with open(path, "w", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=fieldnames, quoting=csv.QUOTE_MINIMAL)
-        writer.writeheader()
-        # If no commands ran (e.g. early auth failure), emit a single error
-        # row so that aggregated CSVs still record the failed host.
-        if not session_result["commands"]:
-            writer.writerow(
-                {
-                    "seq": 0,
-                    "host": session_result["host"],
-                    "command": "",
-                    "started_at": session_result["started_at"],
-                    "duration_s": session_result["duration_s"],
-                    "exit_kind": session_result["status"],
-                    "status": session_result["status"],
-                    "output": session_result.get("error") or "",
-                }
-            )
-            return
-        for i, cmd in enumerate(session_result["commands"], 1):
-            writer.writerow(
-                {
-                    "seq": i,
-                    "host": session_result["host"],
-                    "command": cmd["command"],
-                    "started_at": cmd["started_at"],
-                    "duration_s": f"{cmd['duration_s']:.3f}",
-                    "exit_kind": cmd["exit_kind"],
-                    "status": cmd["status"],
-                    "output": cmd["output"],
-                }
-            )
+    def is_set(self, now=None):
+        if self._reason is not None:
+            return True
+        if self.deadline is not None:
+            if (time.monotonic() if now is None else now) >= self.deadline:
+                self._reason = self._deadline_reason
+                return True
+        if self.parent is not None and self.parent.is_set(now):
+            self._reason = self.parent.reason
+            return True
+        return False
 
+    @property
+    def reason(self):
+        return self._reason
 
-def connect_and_execute(
-    router_ip,
-    username,
-    password,
-    commands_file,
-    output_paths,
-    allow_unknown_hosts=True,
-    port=830,
-    retries=0,
-    retry_delay=5.0,
-    device_type=DEVICE_EDGE,
-):
+    def expires(self):
+        """Earliest monotonic deadline of this token and its parents, or None."""
+        expires = None
+        token = self
+        while token is not None:
+            if token.deadline is not None and (
+                expires is None or token.deadline < expires
+            ):
+                expires = token.deadline
+            token = token.parent
+        return expires
+
+    def remaining(self, now=None):
+        """Seconds until :meth:`expires` (inf without a deadline, >= 0)."""
+        expires = self.expires()
+        if expires is None:
+            return float("inf")
+        return max(0.0, expires - (time.monotonic() if now is None else now))
+
+    def wait(self, timeout):
+        """Sleep up to ``timeout`` seconds; return True if the token fired."""
+        end = time.monotonic() + timeout
+        while not self.is_set():
+            left = end - time.monotonic()
+            if left <= 0:
+                return False
+            time.sleep(min(left, CANCEL_POLL_INTERVAL))
+        return True
+
+
+def install_interrupt_handler(cancel):
+    """Make SIGINT / SIGTERM cancel ``cancel``; a second signal aborts.
+
+    The first signal (Ctrl-C, or the web UI stopping the run) cancels the
+    run cooperatively so every host still completes its output files; the
+    second raises KeyboardInterrupt with the default handlers restored.
     """
-    Connect to a single host, run the user's commands, and write per-host
-    output files in the requested formats.
 
-    Args:
-        router_ip, username, password: SSH credentials.
-        commands_file: path to a file with one command per line. Lines
+    def interrupt(signum, _frame):
+        if cancel.is_set():
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            raise KeyboardInterrupt
+        cancel.cancel(f"interrupted by {signal.Signals(signum).name}")
+
+    signal.signal(signal.SIGINT, interrupt)
+    signal.signal(signal.SIGTERM, interrupt)
+
+
+# ---------------------------------------------------------------------------
+# Latency profile (adaptive per-command timeouts)
+# ---------------------------------------------------------------------------
+#
+# Without a profile every command runs with the same fixed waits: go idle
+# after 1 s of silence, give up after 120 s, and nudge the prompt twice with a
+# 5 s window each. With --latency-profile, bulk-show records each completed
+# command's latency and its longest output pause (which includes the
+# prompt-redraw delay) per (device type, command), and on later runs derives
+# that command's waits from the observed p99 times a safety margin. Commands
+# that hang are then given up on after a realistic bound instead of the
+# worst-case constants, and slow-prompt commands wait for their prompt instead
+# of being nudged.
+DEFAULT_IDLE_TIMEOUT = 1.0
+DEFAULT_COMMAND_MAX_WAIT = 120.0
+DEFAULT_NUDGE_WAIT = 5.0
+
+# Samples needed before a command's waits are derived from the profile, and
+# the most recent samples kept per command.
+LATENCY_MIN_SAMPLES = 5
+LATENCY_MAX_SAMPLES = 200
+# Default multiplier applied to the observed p99 (--latency-margin).
+LATENCY_MARGIN = 1.5
+# Clamp ranges for the derived waits. The upper bounds never exceed the fixed
+# defaults, so a profile can only tighten a wait, never loosen it past them,
+# except for idle_timeout which may grow to cover a known slow prompt.
+ADAPTIVE_IDLE_BOUNDS = (0.5, 10.0)
+ADAPTIVE_MAX_WAIT_BOUNDS = (10.0, DEFAULT_COMMAND_MAX_WAIT)
+ADAPTIVE_NUDGE_BOUNDS = (1.0, DEFAULT_NUDGE_WAIT)
+# Run summaries kept in the profile for the timing report.
+LATENCY_PROFILE_RUNS = 20
+
+LATENCY_PROFILE_VERSION = 1
+
+
+def _percentile(values, pct):
+    """Nearest-rank percentile of a non-empty sequence."""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def _clamp(value, bounds):
+    low, high = bounds
+    return max(low, min(high, value))
+
+
+class LatencyProfile:
+    """On-disk per-(device type, command) latency history.
+
+    ``device_type`` is the closest thing to a device model bulk-show knows
+    before it logs in, so it keys the profile together with the command text.
+    Thread-safe: worker threads call :meth:`timeouts` and :meth:`observe`
+    concurrently; :meth:`save` writes the file atomically at the end of a run.
+    """
+
+    def __init__(self, path=None, margin=LATENCY_MARGIN):
+        self.path = path
+        self.margin = margin
+        self._lock = threading.Lock()
+        self._commands = {}
+        self._baseline = None
+        self._runs = []
+        self._run = {"commands": 0, "adaptive": 0, "wait_s": 0.0}
+
+    @classmethod
+    def load(cls, path, margin=LATENCY_MARGIN):
+        """Load ``path`` if it exists; a missing or unreadable file starts empty."""
+        profile = cls(path, margin)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return profile
+        except (OSError, ValueError) as ex:
+            log_message(f"[main] warning: ignoring latency profile {path}: {ex}")
+            return profile
+        if data.get("version") != LATENCY_PROFILE_VERSION:
+            log_message(
+                f"[main] warning: ignoring latency profile {path}: "
+                f"unsupported version {data.get('version')!r}"
+            )
+            return profile
+        profile._commands = data.get("commands", {})
+        profile._baseline = data.get("baseline")
+        profile._runs = data.get("runs", [])
+        return profile
+
+    def timeouts(self, device_type, command):
+        """Return the waits to use for ``command`` on a ``device_type`` host.
+
+        A dict with ``idle_timeout``, ``max_wait``, ``nudge_wait`` and
+        ``adaptive`` (False when the fixed defaults are used because the
+        command has fewer than LATENCY_MIN_SAMPLES observations).
+        """
+        with self._lock:
+            entry = self._commands.get(device_type, {}).get(command)
+            if not entry or len(entry["latency"]) < LATENCY_MIN_SAMPLES:
+                return dict(FIXED_COMMAND_TIMEOUTS)
+            latency_p99 = _percentile(entry["latency"], 99)
+            gap_p99 = _percentile(entry["gap"], 99)
+        idle = _clamp(gap_p99 * self.margin, ADAPTIVE_IDLE_BOUNDS)
+        return {
+            "idle_timeout": idle,
+            "max_wait": _clamp(
+                latency_p99 * self.margin + idle, ADAPTIVE_MAX_WAIT_BOUNDS
+            ),
+            "nudge_wait": _clamp(gap_p99 * self.margin, ADAPTIVE_NUDGE_BOUNDS),
+            "adaptive": True,
+        }
+
+    def observe(self, device_type, command, duration_s, max_gap, wait_s,
+                exit_kind, adaptive):
+        """Record one finished command.
+
+        Only commands that settled on their prompt become latency samples;
+        every command counts towards this run's waiting total (``wait_s`` is
+        the time spent after the final byte arrived, i.e. idle / nudge /
+        timeout waiting).
+        """
+        with self._lock:
+            self._run["commands"] += 1
+            self._run["adaptive"] += 1 if adaptive else 0
+            self._run["wait_s"] += wait_s
+            if exit_kind != MATCH_PROMPT:
+                return
+            entry = self._commands.setdefault(device_type, {}).setdefault(
+                command, {"latency": [], "gap": []}
+            )
+            entry["latency"].append(round(duration_s, 3))
+            entry["gap"].append(round(max_gap, 3))
+            del entry["latency"][:-LATENCY_MAX_SAMPLES]
+            del entry["gap"][:-LATENCY_MAX_SAMPLES]
+
+    def finish_run(self, makespan_s):
+        """Close out this run's totals and return the timing report line."""
+        with self._lock:
+            run = dict(self._run)
+            run["wait_s"] = round(run["wait_s"], 3)
+            run["makespan_s"] = round(makespan_s, 3)
+            run["finished_at"] = now_iso()
+            report = (
+                f"[main] timing: {run['commands']} command(s), "
+                f"{run['adaptive']} with adaptive timeouts; "
+                f"{run['wait_s']:.1f}s waiting on idle/nudge/timeout exits; "
+                f"makespan {makespan_s:.1f}s"
+            )
+            baseline = self._baseline
+            if baseline and baseline.get("commands"):
+                # Scale the fixed-timeout baseline to this run's command count
+                # so runs of different sizes compare fairly.
+                expected = baseline["wait_s"] / baseline["commands"] * run["commands"]
+                report += (
+                    f"; saved {expected - run['wait_s']:.1f}s vs fixed-timeout "
+                    f"baseline ({baseline['wait_s']:.1f}s over "
+                    f"{baseline['commands']} command(s))"
+                )
+            elif run["commands"] and not run["adaptive"]:
+                # The first run without adaptive timeouts becomes the
+                # reference the later, adaptive runs are measured against.
+                self._baseline = {k: run[k] for k in ("commands", "wait_s", "makespan_s")}
+            self._runs.append(run)
+            del self._runs[:-LATENCY_PROFILE_RUNS]
+        return report
+
+    def save(self):
+        """Write the profile to ``self.path`` atomically."""
+        with self._lock:
+            data = {
+                "version": LATENCY_PROFILE_VERSION,
+                "commands": self._commands,
+                "baseline": self._baseline,
+                "runs": self._runs,
+            }
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+
+FIXED_COMMAND_TIMEOUTS = {
+    "idle_timeout": DEFAULT_IDLE_TIMEOUT,
+    "max_wait": DEFAULT_COMMAND_MAX_WAIT,
+    "nudge_wait": DEFAULT_NUDGE_WAIT,
+    "adaptive": False,
+}
+
+
+# ---------------------------------------------------------------------------
+# Host scheduling (--host-history)
+# ---------------------------------------------------------------------------
+#
+# Hosts run in the order they are submitted, so a slow edge near the end of
+# the hosts file leaves one session running long after the rest finished.
+# With a history of per-host session durations the jobs are submitted
+# longest-expected-first (LPT list scheduling); hosts without history are
+# slotted in at the median estimate. The run summary compares the predicted
+# makespan of that order (and of hosts-file order) with the actual one.
+HOST_HISTORY_SAMPLES = 5
+HOST_HISTORY_VERSION = 1
+# Per-host JSON outputs from earlier runs seed hosts the history lacks.
+OUTPUT_JSON_NAME_RE = re.compile(r"^output_(?P<host>.+)_(?P<ts>\d{8}_\d{6})\.json$")
+
+
+def predict_makespan(durations, workers):
+    """Makespan of running ``durations`` in order on ``workers`` slots."""
+    slots = [0.0] * max(1, min(workers, len(durations)))
+    for duration in durations:
+        heapq.heappush(slots, heapq.heappop(slots) + duration)
+    return max(slots) if durations else 0.0
+
+
+class HostHistory:
+    """On-disk per-host session durations used to order submissions.
+
+    Keyed by host address; each host keeps its last HOST_HISTORY_SAMPLES
+    ``duration_s`` values and is estimated by their median. Thread-safe.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._hosts = {}
+
+    @classmethod
+    def load(cls, path):
+        """Load ``path`` if it exists; a missing or unreadable file starts empty."""
+        history = cls(path)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return history
+        except (OSError, ValueError) as ex:
+            log_message(f"[main] warning: ignoring host history {path}: {ex}")
+            return history
+        if data.get("version") != HOST_HISTORY_VERSION:
+            log_message(
+                f"[main] warning: ignoring host history {path}: "
+                f"unsupported version {data.get('version')!r}"
+            )
+            return history
+        history._hosts = data.get("hosts", {})
+        return history
+
+    def seed_from_outputs(self, logs_dir):
+        """Add hosts missing from the history from their newest JSON output.
+
+        Returns how many hosts were seeded.
+        """
+        try:
+            names = os.listdir(logs_dir)
+        except OSError:
+            return 0
+        newest = {}
+        for name in names:
+            m = OUTPUT_JSON_NAME_RE.match(name)
+            if not m or m.group("host") in self._hosts:
+                continue
+            if m.group("ts") > newest.get(m.group("host"), ("",))[0]:
+                newest[m.group("host")] = (m.group("ts"), name)
+        seeded = 0
+        for host, (_, name) in newest.items():
+            try:
+                with open(os.path.join(logs_dir, name), "r", encoding="utf-8") as f:
+                    duration = float(json.load(f)["duration_s"])
+            except (OSError, ValueError, KeyError, TypeError):
+                continue
+            with self._lock:
+                self._hosts[host] = [round(duration, 3)]
+            seeded += 1
+        return seeded
+
+    def estimate(self, host):
+        """Median recorded duration of ``host`` in seconds, or None."""
+        with self._lock:
+            durations = self._hosts.get(host)
+            return _percentile(durations, 50) if durations else None
+
+    def order(self, jobs, rtts=None):
+        """Return ``(jobs, estimates)`` sorted longest-expected-first.
+
+        ``estimates`` lines up with the returned jobs; hosts without history
+        get the median of the known estimates. ``rtts`` (host -> seconds,
+        from :func:`preflight`) breaks ties, slowest round trip first. With
+        no history at all the original order is kept and every estimate is
+        None.
+        """
+        known = [self.estimate(job["router_ip"]) for job in jobs]
+        found = [e for e in known if e is not None]
+        if not found:
+            return list(jobs), known
+        fill = _percentile(found, 50)
+        estimates = [fill if e is None else e for e in known]
+        rtts = rtts or {}
+        ranked = sorted(
+            range(len(jobs)),
+            key=lambda i: (estimates[i], rtts.get(jobs[i]["router_ip"]) or 0.0),
+            reverse=True,
+        )
+        return [jobs[i] for i in ranked], [estimates[i] for i in ranked]
+
+    def record(self, result):
+        """Add one finished host's ``duration_s``."""
+        with self._lock:
+            durations = self._hosts.setdefault(result["host"], [])
+            durations.append(round(result["duration_s"], 3))
+            del durations[:-HOST_HISTORY_SAMPLES]
+
+    def samples(self, hosts):
+        """Return ``{host: durations}`` for those of ``hosts`` with history."""
+        with self._lock:
+            return {
+                host: list(self._hosts[host]) for host in hosts if host in self._hosts
+            }
+
+    def update(self, samples):
+        """Replace the durations of the hosts in ``samples`` (see :meth:`samples`)."""
+        with self._lock:
+            self._hosts.update(samples)
+
+    def save(self):
+        """Write the history to ``self.path`` atomically."""
+        with self._lock:
+            data = {"version": HOST_HISTORY_VERSION, "hosts": self._hosts}
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+
+# ---------------------------------------------------------------------------
+# Per-host output files
+# ---------------------------------------------------------------------------
+#
+# Output is streamed: every file is created when the session starts and each
+# command is appended (and flushed) the moment it completes. The in-memory
+# session_result keeps only per-command metadata, so a host costs the same
+# memory whether it ran ``show clock`` or ``show tech-support``, and a crash
+# leaves every finished command on disk.
+CSV_FIELDNAMES = [
+    "seq",
+    "host",
+    "command",
+    "started_at",
+    "duration_s",
+    "exit_kind",
+    "status",
+    "truncated_bytes",
+    "output",
+]
+
+# session_result keys known when the session starts; the JSON writer emits
+# them ahead of the "commands" array and everything else after it.
+JSON_HEAD_KEYS = ("host", "username", "port", "device_type", "started_at")
+
+# Stands in for the output while a command's JSON / CSV frame is rendered;
+# the output itself is then written piece by piece in its place.
+_OUTPUT_SLOT = "\x1foutput\x1f"
+
+
+class _TextSink:
+    """Per-host text log written as a continuous terminal transcript.
+
+    The whole host session is wrapped in session begin/end markers (the web
+    UI parses ``session end`` to roll up per-host status), but individual
+    commands are NOT wrapped: each command's captured output — including the
+    echoed command line and the trailing device prompt — is written back to
+    back so the file reads like one uninterrupted interactive session, exactly
+    as if the commands had been typed one after another at the prompt.
+
+    A command that never settled on a prompt (e.g. an idle/timeout) still
+    gets a short ``!!`` note on its own line so failures are not hidden; the
+    richer per-command metadata remains available in the JSON/CSV outputs.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._pending_newline = False
+
+    def begin(self, session_result):
+        self._file = open(self.path, "w")
+        self._file.write(
+            SESSION_BEGIN_FMT.format(
+                host=session_result["host"],
+                user=session_result["username"],
+                port=session_result["port"],
+                ts=session_result["started_at"],
+            )
+            + "\n"
+        )
+
+    # Command outputs are concatenated verbatim. Because each command's
+    # capture ends on the device prompt and the next capture starts with that
+    # command's echo, the natural "prompt#next-command" flow is preserved.
+    @staticmethod
+    def head(cmd, seq, host):
+        return ""
+
+    @staticmethod
+    def escape(text):
+        return text
+
+    @staticmethod
+    def tail(cmd, seq, host, last):
+        note = None
+        if cmd["status"] == CMD_SKIPPED:
+            note = f"!! command not run: {cmd['command']} (exit={cmd['exit_kind']})\n"
+        elif cmd["status"] != CMD_OK:
+            note = (
+                f"!! command did not return a prompt: {cmd['command']} "
+                f"(exit={cmd['exit_kind']}, {cmd['duration_s']:.2f}s)\n"
+            )
+        if note is None:
+            return ""
+        # Ensure the note lands on its own line, then continue the
+        # transcript on a fresh line for the following command.
+        return ("\n" if last not in ("", "\n") else "") + note
+
+    def begin_command(self):
+        pass
+
+    def write(self, text):
+        if text:
+            self._file.write(text)
+            self._pending_newline = not text.endswith("\n")
+
+    def _newline(self):
+        if self._pending_newline:
+            self._file.write("\n")
+            self._pending_newline = False
+
+    def end(self, session_result):
+        self._newline()
+        # Surface a connect/auth-level (or mid-session) error right before the
+        # end marker so that a text reader does not have to guess why the
+        # file is empty or stops early.
+        if session_result.get("error"):
+            self._file.write(f"!! {session_result['error']}\n")
+        self._file.write(
+            SESSION_END_FMT.format(
+                host=session_result["host"],
+                status=session_result["status"],
+                ts=session_result["ended_at"],
+                dur=session_result["duration_s"],
+            )
+            + "\n"
+        )
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def flush(self):
+        self._file.flush()
+
+
+class _JsonSink:
+    """Pretty-printed UTF-8 JSON, with ``commands`` emitted element by element."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._count = 0
+
+    def begin(self, session_result):
+        self._file = open(self.path, "w", encoding="utf-8")
+        self._file.write("{\n")
+        for key in JSON_HEAD_KEYS:
+            self._write_member(key, session_result[key])
+        self._file.write('  "commands": [')
+
+    def _write_member(self, key, value, last=False):
+        encoded = json.dumps(value, ensure_ascii=False, indent=2).replace("\n", "\n  ")
+        self._file.write(f"  {json.dumps(key)}: {encoded}" + ("\n" if last else ",\n"))
+
+    @staticmethod
+    def _frame(cmd):
+        rendered = json.dumps(
+            dict(cmd, output=_OUTPUT_SLOT), ensure_ascii=False, indent=2
+        ).replace("\n", "\n    ")
+        head, _, tail = rendered.rpartition(json.dumps(_OUTPUT_SLOT)[1:-1])
+        return head, tail
+
+    @staticmethod
+    def head(cmd, seq, host):
+        return _JsonSink._frame(cmd)[0]
+
+    @staticmethod
+    def escape(text):
+        return json.dumps(text, ensure_ascii=False)[1:-1]
+
+    @staticmethod
+    def tail(cmd, seq, host, last):
+        return _JsonSink._frame(cmd)[1]
+
+    def begin_command(self):
+        self._file.write(("," if self._count else "") + "\n    ")
+        self._count += 1
+
+    def write(self, text):
+        self._file.write(text)
+
+    def end(self, session_result):
+        self._file.write("\n  ],\n" if self._count else "],\n")
+        tail = [
+            key
+            for key in session_result
+            if key not in JSON_HEAD_KEYS and key != "commands"
+        ]
+        for i, key in enumerate(tail):
+            self._write_member(key, session_result[key], last=i == len(tail) - 1)
+        self._file.write("}\n")
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def flush(self):
+        self._file.flush()
+
+
+class _CsvSink:
+    """Per-command rows as CSV. Multi-line outputs are quoted by csv."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._writer = None
+        self._count = 0
+
+    def begin(self, session_result):
+        self._file = open(self.path, "w", newline="", encoding="utf-8")
+        self._writer = csv.DictWriter(
+            self._file, fieldnames=CSV_FIELDNAMES, quoting=csv.QUOTE_MINIMAL
+        )
+        self._writer.writeheader()
+
+    @staticmethod
+    def _frame(cmd, seq, host):
+        # The output field is always quoted, as its text is not known yet.
+        row = io.StringIO()
+        csv.DictWriter(
+            row, fieldnames=CSV_FIELDNAMES, quoting=csv.QUOTE_MINIMAL
+        ).writerow(
+            {
+                "seq": seq,
+                "host": host,
+                "command": cmd["command"],
+                "started_at": cmd["started_at"],
+                "duration_s": f"{cmd['duration_s']:.3f}",
+                "exit_kind": cmd["exit_kind"],
+                "status": cmd["status"],
+                "truncated_bytes": cmd["truncated_bytes"],
+                "output": _OUTPUT_SLOT,
+            }
+        )
+        head, _, tail = row.getvalue().rpartition(_OUTPUT_SLOT)
+        return head + '"', '"' + tail
+
+    @staticmethod
+    def head(cmd, seq, host):
+        return _CsvSink._frame(cmd, seq, host)[0]
+
+    @staticmethod
+    def escape(text):
+        return text.replace('"', '""')
+
+    @staticmethod
+    def tail(cmd, seq, host, last):
+        return _CsvSink._frame(cmd, seq, host)[1]
+
+    def begin_command(self):
+        self._count += 1
+
+    def write(self, text):
+        self._file.write(text)
+
+    def end(self, session_result):
+        # If no commands ran (e.g. early auth failure), emit a single error
+        # row so that aggregated CSVs still record the failed host.
+        if self._count:
+            return
+        self._writer.writerow(
+            {
+                "seq": 0,
+                "host": session_result["host"],
+                "command": "",
+                "started_at": session_result["started_at"],
+                "duration_s": session_result["duration_s"],
+                "exit_kind": session_result["status"],
+                "status": session_result["status"],
+                "truncated_bytes": 0,
+                "output": session_result.get("error") or "",
+            }
+        )
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def flush(self):
+        self._file.flush()
+
+
+_OUTPUT_SINKS = (
+    (OUTPUT_FORMAT_TEXT, _TextSink),
+    (OUTPUT_FORMAT_JSON, _JsonSink),
+    (OUTPUT_FORMAT_CSV, _CsvSink),
+)
+
+
+def stream_command(cmd, formats, seq, host, chunks, clean, write):
+    """Render ``cmd`` for each of ``formats``, its output given as ``chunks``.
+
+    Calls ``write(format, text)`` with the rendered text piece by piece, in
+    order for each format; ``seq`` is the command's 1-based position in the
+    session of ``host``. ``clean`` runs the chunks through an
+    :class:`OutputCleaner` first. Memory use is bounded by the chunk size, so
+    a spilled capture is never held whole.
+    """
+    sinks = [(fmt, cls) for fmt, cls in _OUTPUT_SINKS if fmt in formats]
+    cleaner = OutputCleaner() if clean else None
+    for fmt, cls in sinks:
+        write(fmt, cls.head(cmd, seq, host))
+    last = ""
+
+    def emit(text):
+        nonlocal last
+        if text:
+            last = text[-1]
+            for fmt, cls in sinks:
+                write(fmt, cls.escape(text))
+
+    for chunk in chunks:
+        emit(cleaner.feed(chunk) if cleaner is not None else chunk)
+    if cleaner is not None:
+        emit(cleaner.finish())
+    for fmt, cls in sinks:
+        write(fmt, cls.tail(cmd, seq, host, last))
+
+
+def render_command(cmd, formats, seq, host, clean=True):
+    """Clean ``cmd["output"]`` and render ``cmd`` for each of ``formats``.
+
+    Returns ``{format: rendered}`` for the matching sink's ``write``; see
+    :func:`stream_command`. Pass ``clean=False`` for output an
+    :class:`OutputCleaner` already cleaned. Pure, so a
+    :class:`PostProcessor` can run it in another process.
+    """
+    output = cmd["output"]
+    if clean:
+        output = clean_command_output(output)
+    parts = {fmt: [] for fmt in formats}
+    stream_command(
+        cmd, formats, seq, host, [output], False,
+        lambda fmt, text: parts[fmt].append(text),
+    )
+    return {fmt: "".join(texts) for fmt, texts in parts.items()}
+
+
+def render_spilled(cmd, formats, seq, host, path, trailer, clean=True):
+    """Render ``cmd`` like :func:`render_command`, its output read from a file.
+
+    ``path`` is a spilled capture's file (see :meth:`OutputCapture.spill_path`)
+    and ``trailer`` its :meth:`OutputCapture.trailer`. The rendering goes to
+    one temporary file per format; returns ``{format: path}`` and the caller
+    copies and deletes them. Memory use and what crosses a
+    :class:`PostProcessor`'s pipe stay bounded whatever the output's size.
+    """
+
+    def chunks():
+        with open(path, encoding="utf-8", newline="") as f:
+            for block in iter(lambda: f.read(CAPTURE_SPILL_CHARS), ""):
+                yield block
+        if trailer:
+            yield trailer
+
+    files = {}
+    try:
+        for fmt in formats:
+            files[fmt] = tempfile.NamedTemporaryFile(
+                "w", encoding="utf-8", newline="", prefix="bulk-show-",
+                suffix=f".{fmt}", delete=False,
+            )
+        stream_command(
+            cmd, formats, seq, host, chunks(), clean,
+            lambda fmt, text: files[fmt].write(text),
+        )
+    except BaseException:
+        for f in files.values():
+            f.close()
+            os.unlink(f.name)
+        raise
+    for f in files.values():
+        f.close()
+    return {fmt: f.name for fmt, f in files.items()}
+
+
+# Pool initializer, run with exec() in each worker to make this script
+# importable as ``name``. A spawned or forkserver worker starts a fresh
+# interpreter in which a module loaded by path (``bulk_show``,
+# ``bulkshow._bulk_show``) does not exist, so the functions it is sent would
+# not unpickle; nor would an initializer defined here. ``__main__`` is taken
+# care of by multiprocessing itself.
+_WORKER_IMPORT = """\
+import importlib.util, sys
+if name != "__main__" and name not in sys.modules:
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+"""
+
+
+class PostProcessor:
+    """Process pool that runs :func:`render_command` off the I/O threads.
+
+    Cleaning (a regex pass plus a per-line loop for carriage returns) and
+    JSON / CSV encoding are CPU work that holds the GIL while the engine's
+    threads should be reading sockets. Shared by all sessions of a run
+    (--post-process-workers); a pool that breaks is replaced by inline
+    rendering, so output is never lost.
+
+    Workers come from a forkserver (or are spawned where there is none),
+    never forked from this process: by the time a pool exists the run, and
+    a --serve daemon even more so, has threads whose locks a fork would copy
+    mid-use.
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+        methods = multiprocessing.get_all_start_methods()
+        self._executor = concurrent.futures.ProcessPoolExecutor(
+            workers,
+            mp_context=multiprocessing.get_context(
+                "forkserver" if "forkserver" in methods else "spawn"
+            ),
+            initializer=exec,
+            initargs=(_WORKER_IMPORT, {"name": __name__, "path": os.path.abspath(__file__)}),
+        )
+        # Start a worker now rather than on a session's first command.
+        self._executor.submit(int).result()
+
+    def submit(self, fn, *args):
+        """Return a future of ``fn(*args)``, run inline if the pool is gone."""
+        try:
+            return self._executor.submit(fn, *args)
+        except (concurrent.futures.process.BrokenProcessPool, RuntimeError):
+            future = concurrent.futures.Future()
+            future.set_result(fn(*args))
+            return future
+
+    def close(self):
+        self._executor.shutdown()
+
+
+class SessionOutput:
+    """Streams one session_result to disk in one or more formats.
+
+    ``output_paths`` maps format name (one of OUTPUT_FORMAT_TEXT,
+    OUTPUT_FORMAT_JSON, OUTPUT_FORMAT_CSV) to destination file path; only
+    the formats present are written. Call :meth:`begin` once the session
+    starts, :meth:`command` for every finished command and :meth:`end` after
+    ``ended_at``/``duration_s``/``status`` are final. A format whose file
+    cannot be written is logged once and dropped; the others carry on.
+
+    With a ``post_processor`` (a :class:`PostProcessor`) each command is
+    cleaned and rendered in another process and written once its result is
+    back: in order, on a later :meth:`command`, and at the latest by
+    :meth:`end`. A spilled :class:`OutputCapture` is not sent whole: the
+    worker reads its spill file (:func:`render_spilled`) and the rendering
+    is copied in bounded blocks.
+
+    With a ``writer`` (``writer(fn, *args)`` runs ``fn(*args)`` later, in
+    submission order) :meth:`command` only records the metadata and leaves
+    the cleaning, rendering and file writes to it; the caller must run
+    :meth:`end` through the same writer.
+    """
+
+    def __init__(self, session_result, output_paths, post_processor=None,
+                 writer=None):
+        self.session_result = session_result
+        self._sinks = {
+            fmt: cls(output_paths[fmt]) for fmt, cls in _OUTPUT_SINKS if fmt in output_paths
+        }
+        self._post = post_processor
+        self._writer = writer
+        self._rendering = collections.deque()
+
+    def _call(self, fmt, method, *args):
+        sink = self._sinks[fmt]
+        try:
+            getattr(sink, method)(*args)
+        except OSError as ex:
+            log_message(
+                f"[{self.session_result['host']}] failed to write output: {ex}"
+            )
+            del self._sinks[fmt]
+            try:
+                sink.close()
+            except OSError:
+                pass
+
+    def _each(self, method, *args):
+        for fmt in list(self._sinks):
+            self._call(fmt, method, *args)
+
+    def begin(self):
+        self._each("begin", self.session_result)
+        self._each("flush")
+
+    def capture(self):
+        """Return a new :class:`OutputCapture` for one command's reads.
+
+        The output is cleaned as it is read, which leaves nothing to do once
+        the command completes. With a post_processor or a writer it is not:
+        cleaning stays off the session's thread and runs with the rendering.
+        """
+        inline = self._post is None and self._writer is None
+        return OutputCapture(cleaner=OutputCleaner() if inline else None)
+
+    def command(self, cmd):
+        """Record ``cmd``, a command_result with its ``output``.
+
+        ``output`` is the raw text, or the finished :class:`OutputCapture`
+        the reads kept it in (closed here once written). The output is
+        cleaned (see :func:`clean_command_output`; skipped for a capture that
+        already did it) and written out; only the metadata, plus the
+        ``truncated_bytes`` the capture dropped, is kept in
+        ``session_result["commands"]``.
+        """
+        output = cmd["output"]
+        capture = output if isinstance(output, OutputCapture) else None
+        cmd = dict(
+            cmd, truncated_bytes=capture.truncated_bytes if capture is not None else 0
+        )
+        commands = self.session_result["commands"]
+        commands.append({key: value for key, value in cmd.items() if key != "output"})
+        if self._writer is None:
+            self._record(cmd, capture, len(commands))
+        else:
+            self._writer(self._record, cmd, capture, len(commands))
+
+    def _record(self, cmd, capture, seq):
+        if not self._sinks:
+            if capture is not None:
+                capture.close()
+            return
+        if capture is not None and self._post is None:
+            # Written in bounded blocks, after whatever is still rendering.
+            self._drain(wait=True)
+            self._stream(cmd, capture, seq)
+            return
+        args = (cmd, tuple(self._sinks), seq, self.session_result["host"])
+        if capture is not None and capture.spilled:
+            cmd["output"] = None
+            spilled = args + (capture.spill_path(), capture.trailer(), not capture.cleaned)
+            self._rendering.append(
+                (self._post.submit(render_spilled, *spilled), args, capture)
+            )
+            self._drain(wait=False)
+            return
+        if capture is not None:
+            cmd["output"] = capture.getvalue()
+            args += (not capture.cleaned,)
+            capture.close()
+        if self._post is None:
+            self._write(render_command(*args))
+        else:
+            self._rendering.append(
+                (self._post.submit(render_command, *args), args, None)
+            )
+            self._drain(wait=False)
+
+    def _stream(self, cmd, capture, seq):
+        formats = tuple(self._sinks)
+        for fmt in formats:
+            self._call(fmt, "begin_command")
+        try:
+            stream_command(
+                cmd, formats, seq, self.session_result["host"], capture.chunks(),
+                not capture.cleaned, self._write_part,
+            )
+        finally:
+            capture.close()
+        self._each("flush")
+
+    def _write_part(self, fmt, text):
+        if fmt in self._sinks:
+            self._call(fmt, "write", text)
+
+    def _drain(self, wait):
+        while self._rendering and (wait or self._rendering[0][0].done()):
+            future, args, capture = self._rendering.popleft()
+            try:
+                rendered = future.result()
+            except concurrent.futures.process.BrokenProcessPool:
+                rendered = None
+            if capture is None:
+                self._write(rendered if rendered is not None else render_command(*args))
+            elif rendered is None:
+                self._stream(args[0], capture, args[2])
+            else:
+                capture.close()
+                self._copy(rendered)
+
+    def _copy(self, rendered):
+        """Write the files of :func:`render_spilled` in blocks, then delete them."""
+        try:
+            for fmt in list(self._sinks):
+                self._call(fmt, "begin_command")
+                with open(rendered[fmt], encoding="utf-8", newline="") as f:
+                    for block in iter(lambda: f.read(CAPTURE_SPILL_CHARS), ""):
+                        self._write_part(fmt, block)
+            self._each("flush")
+        finally:
+            for path in rendered.values():
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+
+    def _write(self, rendered):
+        for fmt in list(self._sinks):
+            self._call(fmt, "begin_command")
+            if fmt in self._sinks:
+                self._call(fmt, "write", rendered[fmt])
+        self._each("flush")
+
+    def end(self):
+        self._drain(wait=True)
+        self._each("end", self.session_result)
+        self._each("close")
+
+
+def _new_session_result(router_ip, username, port, device_type):
+    """Return a fresh session_result dict (see connect_and_execute)."""
+    started_wall = now_iso()
+    return {
+        "host": router_ip,
+        "username": username,
+        "port": port,
+        "device_type": device_type,
+        "started_at": started_wall,
+        "ended_at": started_wall,  # updated by _finish_session
+        "duration_s": 0.0,
+        "status": SESSION_OTHER_ERR,
+        "error": None,
+        "connect_s": None,  # successful SSH connect attempt; None if reused
+        "connect_attempts": 0,  # SSH connects tried, across engine retries
+        "commands": [],
+    }
+
+
+# ---------------------------------------------------------------------------
+# SSH connection factory
+# ---------------------------------------------------------------------------
+#
+# One SSHConnector per run builds every SSHClient. known_hosts is parsed once
+# (SSHClient.load_system_host_keys() re-reads and re-decodes the whole file
+# for every host), and connect() gets explicit settings instead of paramiko's
+# defaults: password authentication only (paramiko otherwise first offers
+# every agent key and ~/.ssh key, a round trip each, until the device
+# answers "too many authentication failures"), optional KEX / cipher
+# preference orders, and banner / auth timeouts.
+SSH_AUTH_PASSWORD = "password"
+SSH_AUTH_ANY = "any"  # paramiko's default order: agent, ~/.ssh keys, password
+ALL_SSH_AUTH = (SSH_AUTH_PASSWORD, SSH_AUTH_ANY)
+KNOWN_HOSTS_PATH = os.path.join("~", ".ssh", "known_hosts")
+SSH_CONNECT_TIMEOUT = 10
+
+
+def _prefer(available, preferred):
+    """``available`` reordered with the supported names of ``preferred`` first."""
+    first = [name for name in preferred if name in available]
+    return tuple(first + [name for name in available if name not in first])
+
+
+class _KnownHostsPolicy:
+    """paramiko missing-host-key policy backed by an :class:`SSHConnector`.
+
+    The clients load no host keys of their own, so paramiko consults this
+    policy for every server key: a host listed in known_hosts must present
+    the recorded key of that type, and an unknown one is accepted (and
+    remembered for the rest of the run) or rejected, as AutoAddPolicy /
+    RejectPolicy would.
+    """
+
+    def __init__(self, connector, allow_unknown_hosts):
+        self.connector = connector
+        self.allow_unknown_hosts = allow_unknown_hosts
+
+    def missing_host_key(self, client, hostname, key):
+        import paramiko
+
+        known = self.connector.host_keys(paramiko)
+        with self.connector.lock:
+            entry = known.lookup(hostname)
+            expected = entry.get(key.get_name()) if entry is not None else None
+            if expected is None and self.allow_unknown_hosts:
+                known.add(hostname, key.get_name(), key)
+                return
+        if expected is None:
+            raise paramiko.SSHException(
+                f"Server {hostname!r} not found in known_hosts"
+            )
+        if expected != key:
+            raise paramiko.BadHostKeyException(hostname, key, expected)
+
+
+class SSHConnector:
+    """Builds and connects the SSHClients of one run.
+
+    Args:
+        auth: :data:`SSH_AUTH_PASSWORD` (default) disables agent and
+            ``~/.ssh`` key attempts; :data:`SSH_AUTH_ANY` keeps paramiko's
+            default order.
+        kex, ciphers: optional algorithm names to prefer, in order; the
+            others paramiko supports stay available after them, and names
+            it does not support are ignored.
+        banner_timeout, auth_timeout: seconds for the SSH banner and for
+            authentication (None keeps paramiko's defaults).
+        known_hosts: host keys file, parsed once on first use.
+        record: optional directory; every shell's traffic is saved there as
+            a transcript (see :class:`TranscriptWriter`).
+    """
+
+    def __init__(self, auth=SSH_AUTH_PASSWORD, kex=None, ciphers=None,
+                 banner_timeout=None, auth_timeout=None,
+                 known_hosts=KNOWN_HOSTS_PATH, record=None):
+        self.auth = auth
+        self.kex = kex
+        self.ciphers = ciphers
+        self.banner_timeout = banner_timeout
+        self.auth_timeout = auth_timeout
+        self.known_hosts = known_hosts
+        self.record = record
+        self.lock = threading.Lock()
+        self._host_keys = None
+        self._factory_checked = False
+        self._factory_supported = False
+
+    def host_keys(self, paramiko):
+        """The parsed known_hosts (a ``paramiko.HostKeys``), loaded once."""
+        with self.lock:
+            if self._host_keys is None:
+                host_keys = paramiko.HostKeys()
+                try:
+                    host_keys.load(os.path.expanduser(self.known_hosts))
+                except OSError:
+                    pass
+                self._host_keys = host_keys
+            return self._host_keys
+
+    def client(self, paramiko, allow_unknown_hosts):
+        """A new SSHClient checking host keys against this connector's."""
+        ssh = paramiko.SSHClient()
+        ssh.set_missing_host_key_policy(
+            _KnownHostsPolicy(self, allow_unknown_hosts)
+        )
+        if self.record:
+            return _RecordingClient(ssh, self.record)
+        return ssh
+
+    def connect_kwargs(self, paramiko, timeout):
+        """Keyword arguments for ``SSHClient.connect``; no wait exceeds
+        ``timeout`` seconds.
+        """
+        kwargs = {"timeout": timeout}
+        if self.auth == SSH_AUTH_PASSWORD:
+            kwargs["look_for_keys"] = False
+            kwargs["allow_agent"] = False
+        if self.banner_timeout is not None:
+            kwargs["banner_timeout"] = min(self.banner_timeout, timeout)
+        if self.auth_timeout is not None:
+            kwargs["auth_timeout"] = min(self.auth_timeout, timeout)
+        if (self.kex or self.ciphers) and self._supports_factory(paramiko):
+            kwargs["transport_factory"] = self.transport
+        return kwargs
+
+    def transport(self, sock, **kwargs):
+        """``transport_factory`` applying the KEX / cipher preferences."""
+        import paramiko
+
+        transport = paramiko.Transport(sock, **kwargs)
+        options = transport.get_security_options()
+        if self.kex:
+            options.kex = _prefer(options.kex, self.kex)
+        if self.ciphers:
+            options.ciphers = _prefer(options.ciphers, self.ciphers)
+        return transport
+
+    def _supports_factory(self, paramiko):
+        # transport_factory arrived in paramiko 3.2; older releases (as on
+        # some vManage builds) run with their default algorithm order.
+        with self.lock:
+            if not self._factory_checked:
+                self._factory_checked = True
+                self._factory_supported = "transport_factory" in inspect.signature(
+                    paramiko.SSHClient.connect
+                ).parameters
+                if not self._factory_supported:
+                    log_message(
+                        "[main] warning: this paramiko cannot set algorithm "
+                        "preferences; --kex / --ciphers ignored"
+                    )
+            return self._factory_supported
+
+
+# Connect retries back off exponentially from --retry-delay, with jitter so a
+# cluster of hosts that failed together does not retry in lockstep.
+RETRY_BACKOFF = 2.0
+RETRY_JITTER = 0.25
+RETRY_MAX_DELAY = 300.0
+
+
+def retry_backoff(retry_delay, attempt):
+    """Seconds to wait before retry number ``attempt`` (1-based)."""
+    delay = min(retry_delay * RETRY_BACKOFF ** (attempt - 1), RETRY_MAX_DELAY)
+    return delay * random.uniform(1 - RETRY_JITTER, 1 + RETRY_JITTER)
+
+
+def _connect_with_retries(
+    paramiko, ssh, router_ip, port, username, password, retries, retry_delay,
+    session_result, cancel=None, connector=None,
+):
+    """Phase 1: SSH transport with optional retry on transient failures.
+
+    AuthenticationException is intentionally NOT retried. Returns True once
+    connected (and the successful attempt's duration as ``connect_s``); on
+    failure records the status/error in ``session_result`` and returns False.
+    A ``cancel`` token caps the connect timeout at its remaining time and
+    stops further attempts once set. Retries sleep here, holding the caller's
+    thread; the execution engines instead pass ``retries=0`` and re-queue
+    the host (see :class:`RetryQueue`). ``connector`` (an
+    :class:`SSHConnector`) supplies the connect settings.
+    """
+    if connector is None:
+        connector = SSHConnector()
+    attempt = 0
+    while True:
+        if cancel is not None and cancel.is_set():
+            _record_deadline(session_result, router_ip, cancel)
+            return False
+        attempt_started = time.monotonic()
+        session_result["connect_attempts"] += 1
+        timeout = SSH_CONNECT_TIMEOUT
+        if cancel is not None:
+            timeout = max(CANCEL_POLL_INTERVAL, min(timeout, cancel.remaining()))
+        try:
+            ssh.connect(
+                router_ip,
+                port=port,
+                username=username,
+                password=password,
+                **connector.connect_kwargs(paramiko, timeout),
+            )
+            break
+        except paramiko.AuthenticationException as ex:
+            session_result["status"] = SESSION_AUTH_SSH
+            session_result["error"] = f"auth error (ssh): {ex}"
+            log_message(f"[{router_ip}] {session_result['error']}")
+            return False
+        except (paramiko.SSHException, socket.timeout, OSError) as ex:
+            if attempt < retries:
+                attempt += 1
+                delay = retry_backoff(retry_delay, attempt)
+                log_message(
+                    f"[{router_ip}] connect attempt {attempt} failed: "
+                    f"{ex}; retrying in {delay:.1f}s "
+                    f"({attempt}/{retries})"
+                )
+                if cancel is None:
+                    time.sleep(delay)
+                else:
+                    cancel.wait(delay)
+                continue
+            session_result["status"] = SESSION_CONNECT_ERR
+            session_result["error"] = f"connect error: {ex}"
+            log_message(f"[{router_ip}] {session_result['error']}")
+            return False
+    session_result["connect_s"] = time.monotonic() - attempt_started
+    log_message(f"[{router_ip}] connected")
+    return True
+
+
+# ---------------------------------------------------------------------------
+# Session transcripts (--record / --replay)
+# ---------------------------------------------------------------------------
+#
+# --record DIR saves what every host's shell received (with arrival times)
+# and everything sent to it. --replay DIR plays those transcripts back in
+# place of the devices, at the recorded pace, faster, or as fast as the
+# commands go out, so the read path, pager handling and cleaning can be
+# benchmarked and debugged on real captures without a fleet. A
+# ReplayChannel works anywhere a paramiko Channel does (read_channel,
+# read_until_prompt), and a ReplayConnector runs whole sessions
+# (connect_and_execute, the threads and staged engines).
+TRANSCRIPT_NAME_FMT = "transcript_{}.ndjson.gz"
+TRANSCRIPT_VERSION = 1
+TRANSCRIPT_RECV = "r"
+TRANSCRIPT_SEND = "s"
+# Recorded in place of the login password when it is typed into the shell.
+TRANSCRIPT_PASSWORD = b"\x00password\x00"
+
+
+def transcript_path(directory, router_ip):
+    """Path of ``router_ip``'s transcript in ``directory``."""
+    return os.path.join(directory, TRANSCRIPT_NAME_FMT.format(router_ip))
+
+
+def _mask_password(data, secret):
+    if secret and data.rstrip(b"\r\n") == secret:
+        return TRANSCRIPT_PASSWORD + data[len(secret):]
+    return data
+
+
+class TranscriptWriter:
+    """Saves one shell session's traffic.
+
+    The file is gzip-compressed NDJSON: a header object (``version``,
+    ``host``, ``port``, ``username``, ``started_at``, ``connect_s``), then a
+    ``[t, kind, data]`` array per event, where ``t`` is seconds since the
+    shell opened, ``kind`` is TRANSCRIPT_RECV or TRANSCRIPT_SEND and
+    ``data`` holds the bytes on the wire as a latin-1 string (an empty recv
+    is the channel's EOF). A send of ``password`` is saved as
+    TRANSCRIPT_PASSWORD.
+    """
+
+    def __init__(self, path, header, password=None):
+        self._file = gzip.open(path, "wt", encoding="utf-8", compresslevel=6)
+        self._file.write(json.dumps(dict(header, version=TRANSCRIPT_VERSION)) + "\n")
+        self._secret = password.encode() if password else None
+        self._start = time.monotonic()
+
+    def event(self, kind, data):
+        if isinstance(data, str):
+            data = data.encode()
+        if kind == TRANSCRIPT_SEND:
+            data = _mask_password(data, self._secret)
+        t = round(time.monotonic() - self._start, 4)
+        self._file.write(json.dumps([t, kind, data.decode("latin-1")]) + "\n")
+
+    def close(self):
+        self._file.close()
+
+
+class Transcript:
+    """A session saved by :class:`TranscriptWriter`.
+
+    ``header`` is the header object and ``events`` a list of
+    ``(t, kind, data)`` tuples with ``data`` as bytes.
+    """
+
+    def __init__(self, header, events):
+        self.header = header
+        self.events = events
+
+    @classmethod
+    def load(cls, path):
+        """Read ``path``; raises OSError, or ValueError if it is not a
+        transcript. A file cut short by a killed run loads up to the cut.
+        """
+        header = None
+        events = []
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            try:
+                for line in f:
+                    if header is None:
+                        header = json.loads(line)
+                        continue
+                    t, kind, data = json.loads(line)
+                    events.append((t, kind, data.encode("latin-1")))
+            except EOFError:
+                pass
+        if not isinstance(header, dict) or header.get("version") != TRANSCRIPT_VERSION:
+            raise ValueError(f"not a version {TRANSCRIPT_VERSION} transcript")
+        return cls(header, events)
+
+
+class RecordingChannel:
+    """Channel wrapper copying every recv and send to a
+    :class:`TranscriptWriter`; anything else goes to the channel.
+    """
+
+    def __init__(self, channel, writer):
+        self._channel = channel
+        self._writer = writer
+
+    def __getattr__(self, name):
+        return getattr(self._channel, name)
+
+    def recv(self, size):
+        data = self._channel.recv(size)
+        self._writer.event(TRANSCRIPT_RECV, data)
+        return data
+
+    def send(self, data):
+        sent = self._channel.send(data)
+        self._writer.event(TRANSCRIPT_SEND, data)
+        return sent
+
+
+class _RecordingClient:
+    """SSHClient wrapper from an :class:`SSHConnector` with ``record`` set."""
+
+    def __init__(self, ssh, directory):
+        self._ssh = ssh
+        self._directory = directory
+        self._header = None
+        self._password = None
+        self._writer = None
+
+    def __getattr__(self, name):
+        return getattr(self._ssh, name)
+
+    def connect(self, hostname, port=22, username=None, password=None, **kwargs):
+        started = time.monotonic()
+        self._ssh.connect(
+            hostname, port=port, username=username, password=password, **kwargs
+        )
+        self._header = {
+            "host": hostname,
+            "port": port,
+            "username": username,
+            "started_at": now_iso(),
+            "connect_s": round(time.monotonic() - started, 4),
+        }
+        self._password = password
+
+    def invoke_shell(self, *args, **kwargs):
+        shell = self._ssh.invoke_shell(*args, **kwargs)
+        host = self._header["host"]
+        try:
+            self._writer = TranscriptWriter(
+                transcript_path(self._directory, host), self._header, self._password
+            )
+        except OSError as ex:
+            log_message(f"[{host}] warning: not recording the session: {ex}")
+            return shell
+        return RecordingChannel(shell, self._writer)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        self._ssh.close()
+
+
+class ReplayChannel:
+    """paramiko Channel stand-in that plays a :class:`Transcript` back.
+
+    Received data comes back in the recorded chunks, with the recorded gaps
+    divided by ``speed`` (0: no gaps at all). Output recorded after a send
+    is held until the caller makes that send, and is then timed from it, so
+    a device's response never overtakes the command that caused it. A send
+    that does not match the next recorded one (``password`` standing in for
+    TRANSCRIPT_PASSWORD) is logged once, sets :attr:`diverged` and is
+    otherwise ignored. Once the transcript is exhausted every recv times
+    out, unless it ended in EOF.
+    """
+
+    def __init__(self, transcript, speed=1.0, password=None, name=None):
+        self._events = transcript.events
+        self._speed = speed
+        self._secret = password.encode() if password else None
+        self._name = name or transcript.header.get("host", "replay")
+        self._timeout = None
+        self._pos = 0
+        # Events before this index are released: recvs due at once, sends made.
+        self._released = 0
+        # (recorded t, monotonic time) that later events are timed from.
+        self._anchor = (0.0, time.monotonic())
+        self._rest = b""
+        self.diverged = False
+        self.eof_received = False
+        self.closed = False
+
+    def settimeout(self, timeout):
+        self._timeout = timeout
+
+    def _due(self, t):
+        recorded, replayed = self._anchor
+        if not self._speed:
+            return replayed
+        return replayed + (t - recorded) / self._speed
+
+    def _next_chunk(self):
+        events = self._events
+        limit = None if self._timeout is None else time.monotonic() + self._timeout
+        while True:
+            while self._pos < self._released and events[self._pos][1] == TRANSCRIPT_SEND:
+                self._pos += 1
+            now = time.monotonic()
+            due = None  # waiting for the caller's next send, or at the end
+            if self._pos < len(events) and events[self._pos][1] == TRANSCRIPT_RECV:
+                t, _, data = events[self._pos]
+                due = now if self._pos < self._released else self._due(t)
+                if due <= now:
+                    self._pos += 1
+                    return data
+            if limit is None and due is None:
+                raise socket.timeout()
+            if limit is not None and (due is None or due > limit):
+                time.sleep(max(0.0, limit - now))
+                raise socket.timeout()
+            time.sleep(due - now)
+
+    def recv(self, size):
+        if self.eof_received:
+            return b""
+        if not self._rest:
+            self._rest = self._next_chunk()
+            if not self._rest:
+                self.eof_received = True
+                return b""
+        data, self._rest = self._rest[:size], self._rest[size:]
+        return data
+
+    def send(self, data):
+        raw = data.encode() if isinstance(data, str) else bytes(data)
+        masked = _mask_password(raw, self._secret)
+        events = self._events
+        index = next(
+            (i for i in range(self._released, len(events))
+             if events[i][1] == TRANSCRIPT_SEND),
+            None,
+        )
+        if index is not None and events[index][2] == masked:
+            self._released = index + 1
+            self._anchor = (events[index][0], time.monotonic())
+        elif not self.diverged:
+            self.diverged = True
+            expected = events[index][2] if index is not None else None
+            log_message(
+                f"[{self._name}] replay diverged: sent {masked!r}, "
+                f"transcript has {expected!r}"
+            )
+        return len(raw)
+
+    def close(self):
+        self.closed = True
+
+
+class _ReplayClient:
+    """SSHClient stand-in from a :class:`ReplayConnector`."""
+
+    def __init__(self, connector):
+        self._connector = connector
+        self._shell_args = None
+
+    def connect(self, hostname, password=None, timeout=None, **_kwargs):
+        path = transcript_path(self._connector.directory, hostname)
+        try:
+            transcript = Transcript.load(path)
+        except ValueError as ex:
+            raise OSError(f"{path}: {ex}") from ex
+        if self._connector.speed:
+            delay = (transcript.header.get("connect_s") or 0.0) / self._connector.speed
+            time.sleep(delay if timeout is None else min(delay, timeout))
+        self._shell_args = (transcript, self._connector.speed, password, hostname)
+
+    def invoke_shell(self):
+        return ReplayChannel(*self._shell_args)
+
+    def close(self):
+        pass
+
+
+class ReplayConnector(SSHConnector):
+    """:class:`SSHConnector` whose clients replay the transcripts in
+    ``directory`` (--replay) instead of connecting.
+
+    Each host "connects" in its recorded ``connect_s`` and gets a
+    :class:`ReplayChannel` at ``speed`` as its shell; a host without a
+    transcript fails to connect. The shells have no file descriptor, so
+    :data:`ENGINE_SELECTORS` cannot drive them.
+    """
+
+    def __init__(self, directory, speed=1.0):
+        super().__init__()
+        self.directory = directory
+        self.speed = speed
+
+    def client(self, paramiko, allow_unknown_hosts):
+        return _ReplayClient(self)
+
+
+class SettledShell:
+    """What the login phases learned about a shell ready for commands."""
+
+    def __init__(self, captured_prompt):
+        self.captured_prompt = captured_prompt
+        self.cmd_prompt_re = build_command_prompt_re(captured_prompt)
+
+
+def login_steps(shell, router_ip, password, device_type, session_result):
+    """Read-steps generator for Phases 2-4 of a host session.
+
+    Settles the interactive shell on a usable prompt and disables pagination.
+    Returns a :class:`SettledShell`, or ``None`` after recording an auth or
+    shell error in ``session_result``.
+    """
+    # Accumulated buffer during shell entry; useful for diagnostics and for
+    # extracting the device prompt. NEVER overwritten -- always appended.
+    auth_banner = []
+
+    # Phase 2: Settle the interactive shell on a usable command prompt.
+    # Edges and controllers differ here, so branch on the connection profile.
+    if device_type == DEVICE_CONTROLLER:
+        # Controllers (vBond / vSmart) reached through vManage land us
+        # directly in the viptela CLI on the SSH transport: there is no
+        # "shell" sub-process and the password was already supplied during
+        # the SSH handshake (asked only once). Just wait for the CLI
+        # prompt to appear.
+        buf, kind = yield dict(
+            prompt_re=DEFAULT_PROMPT_RE,
+            expect_re=CONTROLLER_REAUTH_RE,
+            idle_timeout=1.0,
+            max_wait=10.0,
+        )
+        auth_banner.append(buf)
+        if kind == MATCH_EXPECT:
+            # The controller unexpectedly asked for a password again (or
+            # reported an auth failure). The controller profile assumes a
+            # single password was already supplied during the SSH
+            # handshake, so we deliberately do NOT resend it here: doing so
+            # could leak the password into command output and would mask the
+            # real problem. Fail clearly instead.
+            if AUTH_FAILURE_RE.search(buf):
+                session_result["error"] = (
+                    "auth error (shell): controller rejected the password"
+                )
+            else:
+                session_result["error"] = (
+                    "auth error (shell): controller re-prompted for a "
+                    "password (single-password profile does not resend); "
+                    "aborting"
+                )
+            session_result["status"] = SESSION_AUTH_SHELL
+            log_message(f"[{router_ip}] {session_result['error']}")
+            return None
+        if kind != MATCH_PROMPT:
+            # A long login banner may push the prompt past the window;
+            # warn but continue and rely on per-command max_wait.
+            log_message(
+                f"[{router_ip}] warning: no CLI prompt after login "
+                f"({kind}); proceeding anyway"
+            )
+        # Pagination is disabled in the viptela CLI (vBond / vSmart / vEdge)
+        # with 'paginate false', sent automatically for every controller.
+        pager_off_command = "paginate false"
+    else:
+        # Edge profile: enter the device "shell" sub-process. Wait for
+        # either a re-auth password prompt or the device's command prompt
+        # -- whichever comes first.
+        shell.send("shell\n")
+        log_message(f"[{router_ip}] entered shell")
+
+        buf, kind = yield dict(
+            prompt_re=DEFAULT_PROMPT_RE,
+            expect_re=PASSWORD_PROMPT_RE,
+            idle_timeout=1.0,
+            max_wait=10.0,
+        )
+        auth_banner.append(buf)
+
+        if kind == MATCH_EXPECT:
+            # Re-authentication requested by the device.
+            shell.send(f"{password}\n")
+            buf, kind = yield dict(
+                prompt_re=DEFAULT_PROMPT_RE,
+                expect_re=AUTH_FAILURE_RE,
+                idle_timeout=1.0,
+                max_wait=10.0,
+            )
+            auth_banner.append(buf)
+            if kind == MATCH_EXPECT:
+                session_result["status"] = SESSION_AUTH_SHELL
+                session_result["error"] = (
+                    "auth error (shell): device rejected the password"
+                )
+                log_message(f"[{router_ip}] {session_result['error']}")
+                return None
+            if kind != MATCH_PROMPT:
+                session_result["status"] = SESSION_SHELL_ERR
+                session_result["error"] = (
+                    f"shell did not return a prompt after password "
+                    f"(got {kind}); aborting"
+                )
+                log_message(f"[{router_ip}] {session_result['error']}")
+                return None
+        elif kind != MATCH_PROMPT:
+            # Neither a prompt nor a password request appeared in the
+            # initial window. Some platforms emit a long banner first;
+            # we log a warning but continue and rely on the per-command
+            # max_wait to recover.
+            log_message(
+                f"[{router_ip}] warning: shell entry returned no prompt "
+                f"({kind}); proceeding anyway"
+            )
+        # Pagination is disabled on the IOS-XE edge with 'terminal length 0'
+        # (sent automatically for every edge-profile host).
+        pager_off_command = "terminal length 0"
+
+    # Phase 3: Capture the device's prompt for accurate completion
+    # detection. Fall back to the default regex if extraction fails.
+    settled = SettledShell(extract_prompt("".join(auth_banner)))
+    if settled.captured_prompt:
+        log_message(f"[{router_ip}] prompt: {settled.captured_prompt}")
+    else:
+        log_message(
+            f"[{router_ip}] prompt: <not captured, using default regex>"
+        )
+
+    # Phase 4: Disable pagination. Wait for the captured prompt to ensure the
+    # shell is settled before user commands start.
+    shell.send(f"{pager_off_command}\n")
+    _, page_kind = yield from read_until_prompt_steps(
+        shell,
+        prompt_re=settled.cmd_prompt_re,
+        idle_timeout=1.0,
+        max_wait=5.0,
+    )
+    if page_kind != MATCH_PROMPT:
+        log_message(
+            f"[{router_ip}] warning: '{pager_off_command}' did not "
+            f"return a prompt ({page_kind}); first command output may "
+            "include residual data"
+        )
+    return settled
+
+
+def session_steps(shell, router_ip, password, commands_file, device_type,
+                  session_result, latency_profile=None, pipeline=None,
+                  output=None, settled=None, cancel=None):
+    """Read-steps generator for Phases 2-5 of a host session.
+
+    Settles the interactive shell on a usable prompt, disables pagination and
+    runs the user's commands, recording everything into ``session_result``.
+    Every wait on the device is a ``yield`` (see :func:`run_read_steps`), so
+    the same logic runs unchanged under the threaded and selectors engines.
+    Socket-level errors propagate to the driver. ``latency_profile`` (a
+    :class:`LatencyProfile`) supplies per-command waits and learns from each
+    completed command; ``pipeline`` (a :class:`CommandPipeline`) enables
+    sending commands in batches. Finished commands go to ``output`` (a
+    :class:`SessionOutput`); without one their output text is discarded and
+    only the metadata is recorded. Passing ``settled`` (a shell reused from
+    a :class:`SessionPool`) skips Phases 2-4. Once ``cancel`` (the
+    :class:`CancelToken` the driver's reads watch) is set, the commands not
+    yet sent are recorded as CMD_SKIPPED and the session as SESSION_DEADLINE.
+
+    Returns the :class:`SettledShell` the commands ran on, or ``None`` if the
+    login phases failed or the session was cancelled.
+    """
+    if output is None:
+        output = SessionOutput(session_result, {})
+    if settled is None:
+        settled = yield from login_steps(
+            shell, router_ip, password, device_type, session_result
+        )
+        if cancel is not None and cancel.is_set():
+            _record_deadline(session_result, router_ip, cancel)
+            return None
+        if settled is None:
+            return None
+
+    # Phase 5: Run the user's commands. Each command captures its own
+    # metadata (start time, duration, exit kind) so that downstream
+    # writers can render boundaries (Issue 9) and structured outputs
+    # (Issue 14). A missing/empty commands_file (e.g. a device type with
+    # no split list) leaves the session connected but command-free.
+    if not commands_file:
+        log_message(
+            f"[{router_ip}] no commands file for device type "
+            f"{device_type}; connected but running no commands"
+        )
+        session_result["status"] = SESSION_OK
+        return settled
+    commands = load_commands(commands_file)
+    index = 0
+    while index < len(commands):
+        if cancel is not None and cancel.is_set():
+            for command in commands[index:]:
+                output.command(
+                    {
+                        "command": command,
+                        "started_at": now_iso(),
+                        "duration_s": 0.0,
+                        "exit_kind": MATCH_DEADLINE,
+                        "status": CMD_SKIPPED,
+                        "output": "",
+                    }
+                )
+            _record_deadline(session_result, router_ip, cancel)
+            return None
+        batch = [commands[index]]
+        # Pipelining needs the captured prompt to split the combined stream
+        # reliably, so the default prompt regex always runs stop-and-wait.
+        if pipeline is not None and settled.captured_prompt:
+            batch = pipeline.next_batch(device_type, commands, index)
+        if len(batch) == 1:
+            yield from command_steps(
+                shell, router_ip, batch[0], settled.cmd_prompt_re, device_type,
+                output, latency_profile,
+            )
+            index += 1
+        else:
+            index += yield from pipelined_batch_steps(
+                shell, router_ip, batch, settled.captured_prompt,
+                settled.cmd_prompt_re, device_type, output, pipeline,
+                latency_profile,
+            )
+
+    recorded = session_result["commands"]
+    if recorded and recorded[-1]["exit_kind"] == MATCH_DEADLINE:
+        # Cancelled during the last command: nothing is left to skip.
+        _record_deadline(session_result, router_ip, cancel)
+        return None
+    session_result["status"] = SESSION_OK
+    return settled
+
+
+def _record_deadline(session_result, router_ip, cancel):
+    """Record that ``cancel`` stopped the session before it finished."""
+    session_result["status"] = SESSION_DEADLINE
+    session_result["error"] = f"cancelled: {cancel.reason}"
+    log_message(f"[{router_ip}] {session_result['error']}")
+
+
+def load_commands(commands_file):
+    """Return the commands in ``commands_file``, skipping blanks and comments."""
+    commands = []
+    with open(commands_file, "r") as file:
+        for line in file:
+            command = line.strip()
+            if command and not command.startswith("#"):
+                commands.append(command)
+    return commands
+
+
+def _log_command_result(router_ip, command, cmd_status, cmd_kind):
+    if cmd_status == CMD_OK:
+        log_message(f"[{router_ip}] done: {command}")
+    else:
+        log_message(
+            f"[{router_ip}] command timeout ({cmd_kind}): "
+            f"{command}"
+        )
+
+
+def command_steps(shell, router_ip, command, cmd_prompt_re, device_type,
+                  output, latency_profile=None):
+    """Read-steps generator running one command stop-and-wait."""
+    log_message(f"[{router_ip}] running: {command}")
+    cmd_started_wall = now_iso()
+    cmd_started_mono = time.monotonic()
+    # Prefix Ctrl-U (line kill) so any keystroke the previous
+    # command's pager left echoed on the input line (e.g. "!" or
+    # "q") is cleared before this command is typed; otherwise it
+    # would prepend to and corrupt the command.
+    shell.send(f"\x15{command}\n")
+    # Prompt detection short-circuits short commands; max_wait
+    # is the safety upper bound for long commands like
+    # 'show tech-support'. read_until_prompt nudges the device
+    # with a newline if the prompt is slow to redraw, so a late
+    # prompt is confirmed instead of being misreported as idle.
+    # A latency profile replaces the fixed waits with ones learned
+    # for this command.
+    if latency_profile is not None:
+        limits = latency_profile.timeouts(device_type, command)
+    else:
+        limits = FIXED_COMMAND_TIMEOUTS
+    stats = ReadStats()
+    command_output, cmd_kind = yield from read_until_prompt_steps(
+        shell,
+        prompt_re=cmd_prompt_re,
+        idle_timeout=limits["idle_timeout"],
+        max_wait=limits["max_wait"],
+        nudge_wait=limits["nudge_wait"],
+        stats=stats,
+        capture=output.capture(),
+    )
+    cmd_finished_mono = time.monotonic()
+    cmd_status = CMD_OK if cmd_kind == MATCH_PROMPT else CMD_TIMEOUT
+    cmd_duration = cmd_finished_mono - cmd_started_mono
+    output.command(
+        {
+            "command": command,
+            "started_at": cmd_started_wall,
+            "duration_s": cmd_duration,
+            "exit_kind": cmd_kind,
+            "status": cmd_status,
+            "output": command_output,
+        }
+    )
+    if latency_profile is not None:
+        last_data = stats.last_data or cmd_started_mono
+        latency_profile.observe(
+            device_type,
+            command,
+            cmd_duration,
+            stats.max_gap,
+            cmd_finished_mono - last_data,
+            cmd_kind,
+            limits["adaptive"],
+        )
+    _log_command_result(router_ip, command, cmd_status, cmd_kind)
+
+
+# ---------------------------------------------------------------------------
+# Command pipelining (--pipeline N)
+# ---------------------------------------------------------------------------
+#
+# Stop-and-wait pays one round trip per command. With --pipeline N, up to N
+# commands are typed back to back and the combined output is split into
+# per-command results at each occurrence of the captured prompt that is
+# followed by the next command's echo (or sits at the end of the stream).
+# A pager or a timeout inside a batch makes the typed-ahead input unreliable
+# (a pager consumes it as keystrokes), so the batch stops there: the shell is
+# settled, the offending command is re-run stop-and-wait and remembered so
+# every later host runs it stop-and-wait too.
+
+
+class CommandPipeline:
+    """Batch size plus the commands that must run stop-and-wait.
+
+    Shared by all hosts of a run; thread-safe.
+    """
+
+    def __init__(self, depth):
+        self.depth = depth
+        self._serial = set()
+        self._lock = threading.Lock()
+
+    def needs_serial(self, device_type, command):
+        with self._lock:
+            return (device_type, command) in self._serial
+
+    def mark_serial(self, device_type, command):
+        with self._lock:
+            self._serial.add((device_type, command))
+
+    def next_batch(self, device_type, commands, index):
+        """Return the commands to send together starting at ``index``.
+
+        A command known to need stop-and-wait is returned on its own, and a
+        batch stops right before the next such command.
+        """
+        if self.needs_serial(device_type, commands[index]):
+            return [commands[index]]
+        batch = []
+        for command in commands[index:index + self.depth]:
+            if self.needs_serial(device_type, command):
+                break
+            batch.append(command)
+        return batch
+
+
+def build_prompt_boundary_re(base_prompt):
+    """Regex matching the captured prompt anywhere at the start of a line.
+
+    Unlike :func:`build_command_prompt_re` it is not anchored to the end of
+    the buffer, so it finds the prompts *between* pipelined commands.
+    """
+    head = base_prompt.rstrip("#>").rstrip()
+    return re.compile(
+        r"(?:(?<=[\r\n])|^)" + re.escape(head) + r"(?:\([^)]+\))?[#>][^\S\r\n]*"
+    )
+
+
+def find_pipelined_command_end(buffer, pos, boundary_re, next_command, settled=True):
+    """Return where the command output starting at ``pos`` ends, or None.
+
+    A prompt counts as the end of the current command only if what follows
+    it is the echo of ``next_command`` (possibly still partial) or nothing at
+    all yet; a prompt-like line inside the output is skipped. For the last
+    command of a batch (``next_command`` is None) the prompt must end the
+    buffer, and the segment extends to the end of the buffer.
+
+    Pass ``settled=False`` while more data may still arrive: only a prompt
+    followed by the complete echo counts then, and the last command never
+    ends, since a chunk can stop right after a prompt-like output line.
+    """
+    for match in boundary_re.finditer(buffer, pos):
+        rest = buffer[match.end():]
+        if next_command is None:
+            if not settled:
+                return None
+            if not rest.strip():
+                return len(buffer)
+            continue
+        echoed = rest.lstrip("\x15")
+        if echoed.startswith(next_command) or settled and (
+            not echoed.strip() or next_command.startswith(echoed)
+        ):
+            return match.end()
+    return None
+
+
+# Unassigned text a BatchSplitter keeps for boundary matching before it
+# hands the older, complete lines to the in-flight command's capture.
+PIPELINE_WINDOW_CHARS = 64 * 1024
+
+
+class BatchSplitter:
+    """Splits the combined output of a pipelined batch as it is read.
+
+    Passed to the batch's reads as their ``capture``: each write is
+    searched for the boundaries of :func:`find_pipelined_command_end` and
+    the text goes to the in-flight command's :class:`OutputCapture` (from
+    ``output.capture()``), so every command gets the capture budget of a
+    stop-and-wait one. Only a window of unassigned text (about
+    ``window_chars``) is held for matching.
+
+    :attr:`done` lists ``(capture, finished_mono, stats)`` for each
+    command completed so far, ``stats`` being its :class:`ReadStats`.
+    :attr:`pager` is set, and splitting stops, once a pager marker shows up.
+    """
+
+    def __init__(self, batch, boundary_re, output, window_chars=PIPELINE_WINDOW_CHARS):
+        self._batch = batch
+        self._boundary_re = boundary_re
+        self._output = output
+        self._window_chars = window_chars
+        # Unassigned text starts at _pos. Once trimmed, _buf[_pos - 1] is the
+        # character before it, kept so the boundary regex's line-start
+        # lookbehind sees the real stream.
+        self._buf = ""
+        self._pos = 0
+        self.capture = output.capture()
+        self.stats = ReadStats()
+        self.done = []
+        self.pager = False
+
+    def write(self, text):
+        if not text or self.pager or len(self.done) == len(self._batch):
+            return
+        now = time.monotonic()
+        self.stats.data(now)
+        self._buf += text
+        if not self._split(now, settled=False):
+            return
+        tail = self._buf[self._pos:]
+        if len(tail) > self._window_chars:
+            # Keep the last line: a prompt still arriving starts there.
+            cut = max(tail.rfind("\n"), tail.rfind("\r")) + 1
+            if not cut:
+                cut = len(tail) - self._window_chars // 2
+            if not self._assign(self._pos + cut):
+                return
+        if self._pos > 1:
+            self._buf = self._buf[self._pos - 1:]
+            self._pos = 1
+
+    def settle(self):
+        """Split what is left once a read is over; see
+        :func:`find_pipelined_command_end`."""
+        if not self.pager:
+            self._split(time.monotonic(), settled=True)
+
+    def _split(self, now, settled):
+        while len(self.done) < len(self._batch):
+            index = len(self.done) + 1
+            next_command = self._batch[index] if index < len(self._batch) else None
+            end = find_pipelined_command_end(
+                self._buf, self._pos, self._boundary_re, next_command, settled
+            )
+            if end is None:
+                break
+            if not self._assign(end):
+                return False
+            self.capture.finish()
+            self.done.append((self.capture, now, self.stats))
+            self.capture = self._output.capture()
+            self.stats = ReadStats()
+            if end < len(self._buf):
+                self.stats.data(now)
+        return True
+
+    def _assign(self, end):
+        """Move the text up to ``end`` to the in-flight capture."""
+        text = self._buf[self._pos:end]
+        if PAGER_MARKER_RE.search(text):
+            self.pager = True
+            return False
+        self.capture.write(text)
+        self._pos = end
+        return True
+
+    def unassigned(self):
+        """The text not yet handed to a capture."""
+        return self._buf[self._pos:]
+
+    def flush(self):
+        """Hand all remaining text to the in-flight capture and return it."""
+        self.capture.write(self.unassigned())
+        self._pos = len(self._buf)
+        self.capture.finish()
+        return self.capture
+
+
+def pipelined_batch_steps(shell, router_ip, batch, captured_prompt,
+                          cmd_prompt_re, device_type, output, pipeline,
+                          latency_profile=None):
+    """Read-steps generator sending ``batch`` back to back.
+
+    Appends one command_result per command that completed cleanly inside the
+    pipeline and returns how many did. The remaining commands are left for
+    the caller; the one that hit a pager or timeout is marked stop-and-wait.
+    The device may already have run some of them from the typed-ahead
+    input: that output is discarded, so they run twice. A cancelled read
+    also records the command in flight (counted in the return value) with
+    its partial output.
+
+    Each read waits as long as the commands still outstanding would
+    stop-and-wait in total (their idle limit the longest of theirs), with
+    the limits from ``latency_profile`` when there is one; every recorded
+    command is observed in it.
+    """
+    boundary_re = build_prompt_boundary_re(captured_prompt)
+    for command in batch:
+        log_message(f"[{router_ip}] running: {command}")
+    if latency_profile is not None:
+        limits = [latency_profile.timeouts(device_type, command) for command in batch]
+    else:
+        limits = [FIXED_COMMAND_TIMEOUTS] * len(batch)
+    seg_started_wall = now_iso()
+    seg_started_mono = time.monotonic()
+    shell.send("".join(f"\x15{command}\n" for command in batch))
+
+    def record(index, kind, capture, finished_mono, stats):
+        nonlocal seg_started_wall, seg_started_mono
+        command = batch[index]
+        status = CMD_OK if kind == MATCH_PROMPT else CMD_TIMEOUT
+        duration = finished_mono - seg_started_mono
+        output.command(
+            {
+                "command": command,
+                "started_at": seg_started_wall,
+                "duration_s": duration,
+                "exit_kind": kind,
+                "status": status,
+                "output": capture,
+            }
+        )
+        if latency_profile is not None:
+            latency_profile.observe(
+                device_type,
+                command,
+                duration,
+                stats.max_gap,
+                finished_mono - (stats.last_data or seg_started_mono),
+                kind,
+                limits[index]["adaptive"],
+            )
+        _log_command_result(router_ip, command, status, kind)
+        seg_started_wall = now_iso()
+        seg_started_mono = finished_mono
+
+    splitter = BatchSplitter(batch, boundary_re, output)
+    completed = 0
+    failure = None
+    while True:
+        pending = limits[completed:]
+        _, kind = yield dict(
+            prompt_re=cmd_prompt_re,
+            idle_timeout=max(limit["idle_timeout"] for limit in pending),
+            max_wait=sum(limit["max_wait"] for limit in pending),
+            capture=splitter,
+        )
+        splitter.settle()
+        for index in range(completed, len(splitter.done)):
+            record(index, MATCH_PROMPT, *splitter.done[index])
+        completed = len(splitter.done)
+        if completed == len(batch):
+            return completed
+        if splitter.pager or PAGER_MARKER_RE.search(splitter.unassigned()):
+            failure = "pager"
+        elif kind != MATCH_PROMPT:
+            failure = kind
+        if failure is not None:
+            break
+
+    if failure == MATCH_DEADLINE:
+        # Cancelled: keep the partial output of the command in flight and
+        # let session_steps record the rest as skipped. The command itself
+        # is not at fault, so it is not marked stop-and-wait.
+        record(
+            completed, MATCH_DEADLINE, splitter.flush(), time.monotonic(), splitter.stats
+        )
+        return completed + 1
+    splitter.capture.close()
+
+    failed_command = batch[completed]
+    pipeline.mark_serial(device_type, failed_command)
+    log_message(
+        f"[{router_ip}] pipeline: {failure} at '{failed_command}'; "
+        f"re-running it and the rest of the batch stop-and-wait"
+    )
+    # Let the device work off whatever typed-ahead input it still has, given
+    # as long as the outstanding commands would get, then discard the output
+    # so the stop-and-wait re-run starts clean. The extra line guarantees
+    # some output (a fresh prompt) for the idle exit to key off once the
+    # queue is drained.
+    pending = limits[completed:]
+    shell.send("\x15\n")
+    yield dict(
+        prompt_re=None,
+        idle_timeout=max(limit["idle_timeout"] for limit in pending),
+        max_wait=sum(limit["max_wait"] for limit in pending),
+    )
+    return completed
+
+
+# ---------------------------------------------------------------------------
+# Warm session pool (--serve)
+# ---------------------------------------------------------------------------
+#
+# A run that finishes cleanly can hand its logged-in, prompt-settled shell to
+# a SessionPool instead of closing it. The next run for the same (host, port,
+# user, device type) checks it out, confirms the prompt still answers and
+# goes straight to Phase 5, skipping the TCP/SSH handshake, the edge "shell"
+# entry, the password re-prompt, prompt capture and the pager-off command.
+# Only the --serve daemon keeps a pool; a one-shot run has nobody to hand
+# sessions to.
+POOL_MAX_SIZE = 256
+# Idle shells older than this are closed. Longer than the usual 15-minute
+# collection interval so a scheduled fleet stays warm between runs.
+POOL_IDLE_TTL = 1800.0
+# How long a checked-out shell has to redraw its prompt before it is
+# considered dead and replaced by a fresh login.
+POOL_HEALTH_WAIT = 3.0
+# SSH keepalive interval for pooled transports, so idle NAT/firewall state
+# along the path is not dropped between runs.
+POOL_KEEPALIVE = 30
+
+
+class PooledShell:
+    """A logged-in shell parked in a :class:`SessionPool`."""
+
+    def __init__(self, ssh, shell, settled):
+        self.ssh = ssh
+        self.shell = shell
+        self.settled = settled
+        self.last_used = time.monotonic()
+
+    def alive(self):
+        """Cheap liveness test that does not touch the device."""
+        if getattr(self.shell, "closed", False) or getattr(
+            self.shell, "eof_received", False
+        ):
+            return False
+        transport = self.ssh.get_transport()
+        return transport is not None and transport.is_active()
+
+    def close(self):
+        try:
+            self.ssh.close()
+        except Exception:
+            pass
+
+
+def pool_health_steps(settled):
+    """Read-steps generator: True if the parked shell redraws its prompt."""
+    _, kind = yield dict(
+        prompt_re=settled.cmd_prompt_re,
+        idle_timeout=POOL_HEALTH_WAIT,
+        max_wait=POOL_HEALTH_WAIT,
+    )
+    return kind == MATCH_PROMPT
+
+
+class SessionPool:
+    """Bounded LRU pool of settled shells keyed by (host, port, user, type).
+
+    Thread-safe. A shell is owned by exactly one session while checked out;
+    :meth:`checkin` parks it again (evicting the least recently used shell
+    beyond ``max_size``) and :meth:`evict_idle` closes shells unused for
+    ``idle_ttl`` seconds.
+    """
+
+    def __init__(self, max_size=POOL_MAX_SIZE, idle_ttl=POOL_IDLE_TTL):
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self._shells = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        with self._lock:
+            return len(self._shells)
+
+    @staticmethod
+    def key(router_ip, port, username, device_type):
+        return (router_ip, port, username, device_type)
+
+    def checkout(self, key):
+        """Return a healthy :class:`PooledShell` for ``key`` or ``None``.
+
+        Blocks for up to :data:`POOL_HEALTH_WAIT` while the device redraws its
+        prompt, so call it from a worker/helper thread. Stale shells are
+        closed and count as a miss.
+        """
+        with self._lock:
+            pooled = self._shells.pop(key, None)
+        if pooled is not None and (
+            time.monotonic() - pooled.last_used > self.idle_ttl
+            or not pooled.alive()
+        ):
+            pooled.close()
+            pooled = None
+        if pooled is not None:
+            try:
+                # Ctrl-U clears any half-typed input, the newline asks for a
+                # fresh prompt.
+                pooled.shell.send("\x15\n")
+                healthy = run_read_steps(
+                    pooled.shell, pool_health_steps(pooled.settled)
+                )
+            except Exception:
+                # socket/OS errors or paramiko.SSHException (paramiko is not
+                # imported at module level): either way the shell is gone.
+                healthy = False
+            if not healthy:
+                pooled.close()
+                pooled = None
+        with self._lock:
+            if pooled is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return pooled
+
+    def checkin(self, key, pooled):
+        """Park ``pooled`` under ``key``; closes whatever it displaces."""
+        pooled.last_used = time.monotonic()
+        transport = pooled.ssh.get_transport()
+        if transport is not None:
+            transport.set_keepalive(POOL_KEEPALIVE)
+        evicted = []
+        with self._lock:
+            previous = self._shells.pop(key, None)
+            if previous is not None:
+                evicted.append(previous)
+            self._shells[key] = pooled
+            while len(self._shells) > self.max_size:
+                evicted.append(self._shells.popitem(last=False)[1])
+        for old in evicted:
+            old.close()
+
+    def evict_idle(self, now=None):
+        """Close shells idle for longer than ``idle_ttl``; return how many."""
+        now = time.monotonic() if now is None else now
+        evicted = []
+        with self._lock:
+            for key, pooled in list(self._shells.items()):
+                if now - pooled.last_used > self.idle_ttl:
+                    evicted.append(self._shells.pop(key))
+        for old in evicted:
+            old.close()
+        return len(evicted)
+
+    def close(self):
+        """Close every parked shell."""
+        with self._lock:
+            shells = list(self._shells.values())
+            self._shells.clear()
+        for pooled in shells:
+            pooled.close()
+
+
+def _record_session_error(session_result, router_ip, ex):
+    """Record an unexpected SSH/socket error that aborted the session."""
+    session_result["status"] = SESSION_OTHER_ERR
+    session_result["error"] = str(ex)
+    log_message(f"[{router_ip}] error: {ex}")
+
+
+def _finish_session(ssh, session_result, started_mono, output, park=None):
+    """Close the SSH client, stamp the end time and complete output files.
+
+    ``park`` (a zero-argument callable handing the shell to a
+    :class:`SessionPool`) replaces the close when the session succeeded.
+    """
+    if park is not None and session_result["status"] == SESSION_OK:
+        park()
+    else:
+        try:
+            ssh.close()
+        except Exception:
+            pass
+    session_result["ended_at"] = now_iso()
+    session_result["duration_s"] = time.monotonic() - started_mono
+    output.end()
+
+
+def connect_and_execute(
+    router_ip,
+    username,
+    password,
+    commands_file,
+    output_paths,
+    allow_unknown_hosts=True,
+    port=830,
+    retries=0,
+    retry_delay=5.0,
+    device_type=DEVICE_EDGE,
+    latency_profile=None,
+    pipeline=None,
+    session_pool=None,
+    cancel=None,
+    host_budget=None,
+    connector=None,
+    post_processor=None,
+):
+    """
+    Connect to a single host, run the user's commands, and write per-host
+    output files in the requested formats.
+
+    Args:
+        router_ip, username, password: SSH credentials.
+        commands_file: path to a file with one command per line. Lines
             starting with '#' and blank lines are skipped. May be ``None``
             (or empty), in which case the host is connected but no commands
             are run -- useful when split controller/edge command lists leave
@@ -702,352 +3579,2307 @@ def connect_and_execute(
         retries: number of additional SSH connect attempts after the first
             one fails on a transient network/SSH error (Issue 12). Auth
             failures are NEVER retried because they will not fix themselves.
-        retry_delay: seconds to sleep between connect attempts.
+        retry_delay: seconds before the first retry; each later retry
+            doubles it, with jitter (see :func:`retry_backoff`).
         device_type: connection profile, one of DEVICE_EDGE (default) or
             DEVICE_CONTROLLER. Edges enter the device "shell" sub-process
             (and may re-prompt for the password a second time); controllers
             (vBond/vSmart reached through vManage) land directly in the
             viptela CLI with a single password and no "shell" step.
+        latency_profile: optional :class:`LatencyProfile` providing learned
+            per-command waits (and recording this session's timings).
+        pipeline: optional :class:`CommandPipeline`; when given, commands are
+            sent in batches instead of strictly one round trip each.
+        session_pool: optional :class:`SessionPool`. A warm shell for this
+            host is reused when one is parked (skipping Phases 1-4), and the
+            shell is parked again instead of closed when the session succeeds.
+        cancel: optional run-wide :class:`CancelToken`. Once it is set the
+            session stops at its next poll, records the interrupted and
+            unsent commands and ends with status SESSION_DEADLINE.
+        host_budget: optional seconds this host may run in total; exceeding
+            it cancels this host alone, in the same way.
+        connector: optional :class:`SSHConnector` shared by the run (known
+            hosts parsed once, auth method, algorithm preferences). Default:
+            password authentication with paramiko's algorithms.
+        post_processor: optional :class:`PostProcessor` shared by the run;
+            command output is then cleaned and rendered in its processes.
+
+    Returns:
+        session_result: dict with the schema:
+            {
+              "host": str, "username": str, "port": int,
+              "device_type": str,
+              "started_at": iso, "ended_at": iso, "duration_s": float,
+              "status": one of SESSION_*,
+              "error": str | None,
+              "connect_s": float | None (successful connect attempt;
+                  None when not connected or a pooled shell was reused),
+              "connect_attempts": int (SSH connects tried; 0 for a pooled
+                  shell),
+              "commands": [
+                  {"command": str, "started_at": iso,
+                   "duration_s": float, "exit_kind": str,
+                   "status": one of CMD_*},
+                  ...
+              ],
+            }
+        Command output is streamed to the files in ``output_paths`` as each
+        command completes and is NOT kept in session_result (the JSON file
+        carries it as an extra "output" field per command).
+    """
+    # Imported lazily so that the pure-parser helpers in this module remain
+    # importable (and unit-testable) on systems without paramiko installed.
+    import paramiko
+
+    started_mono = time.monotonic()
+    cancel = CancelToken.for_host(cancel, host_budget)
+    if connector is None:
+        connector = SSHConnector()
+    session_result = _new_session_result(router_ip, username, port, device_type)
+    output = SessionOutput(session_result, output_paths, post_processor)
+    output.begin()
+    pool_key = SessionPool.key(router_ip, port, username, device_type)
+    pooled = session_pool.checkout(pool_key) if session_pool is not None else None
+    if pooled is not None:
+        log_message(f"[{router_ip}] reusing pooled session")
+        ssh, shell, settled = pooled.ssh, pooled.shell, pooled.settled
+    else:
+        ssh = connector.client(paramiko, allow_unknown_hosts)
+        shell = settled = None
+    park = None
+    try:
+        if shell is None:
+            if not _connect_with_retries(
+                paramiko, ssh, router_ip, port, username, password, retries,
+                retry_delay, session_result, cancel, connector,
+            ):
+                return session_result
+            shell = ssh.invoke_shell()
+        settled = run_read_steps(
+            shell,
+            session_steps(
+                shell, router_ip, password, commands_file, device_type,
+                session_result, latency_profile, pipeline, output, settled,
+                cancel,
+            ),
+            cancel,
+        )
+        if session_pool is not None and settled is not None:
+            park = lambda: session_pool.checkin(
+                pool_key, PooledShell(ssh, shell, settled)
+            )
+    except (paramiko.SSHException, socket.timeout, OSError) as ex:
+        _record_session_error(session_result, router_ip, ex)
+    finally:
+        _finish_session(ssh, session_result, started_mono, output, park)
+    return session_result
+
+# ---------------------------------------------------------------------------
+# Adaptive concurrency (--max-workers auto)
+# ---------------------------------------------------------------------------
+#
+# AIMD, as in TCP congestion control: every healthy host that completes lets
+# one more session run at once; a congestion signal halves the limit. The
+# signals are a connect / shell / socket error, a command that never returned
+# its prompt, connect latency well above the run's own baseline and,
+# optionally, this machine's (vManage's) load average. After a decrease the
+# hosts that were already running under the old limit cannot trigger another
+# one, so a single burst of timeouts backs off once rather than to the floor.
+MAX_WORKERS_AUTO = "auto"
+AIMD_INITIAL = 8  # the fixed default, so auto never starts slower
+AIMD_MAX = 128
+AIMD_BACKOFF = 0.5
+# Connect latency: the median of the first few connects is the baseline; the
+# median of the most recent ones above baseline x factor (and above the
+# floor, so a LAN-fast baseline does not make jitter look like congestion)
+# is a congestion signal.
+AIMD_LATENCY_SAMPLES = 5
+AIMD_LATENCY_FACTOR = 3.0
+AIMD_LATENCY_FLOOR = 2.0
+# Statuses that point at an overloaded path rather than a bad credential.
+AIMD_CONGESTION_STATUSES = (SESSION_CONNECT_ERR, SESSION_SHELL_ERR, SESSION_OTHER_ERR)
+
+
+class ConcurrencyController:
+    """AIMD limit on concurrent sessions, fed with completed session_results.
+
+    Engines read :attr:`limit` before starting each host and pass every
+    finished session_result to :meth:`record`. ``max_load`` enables the
+    1-minute load average as an extra congestion signal (Unix only).
+    Changes are logged as ``[main] concurrency: OLD -> NEW (reason)``.
+    """
+
+    def __init__(self, initial=AIMD_INITIAL, maximum=AIMD_MAX, minimum=1,
+                 max_load=None):
+        self.minimum = minimum
+        self.maximum = max(minimum, maximum)
+        self.limit = max(self.minimum, min(initial, self.maximum))
+        self.max_load = max_load
+        self._baseline = []
+        self._recent = collections.deque(maxlen=AIMD_LATENCY_SAMPLES)
+        # Completions still owed to hosts started before the last decrease.
+        self._cooldown = 0
+        self._lock = threading.Lock()
+
+    def _congestion(self, result):
+        """Return the reason ``result`` signals congestion, or None."""
+        if result["status"] in AIMD_CONGESTION_STATUSES:
+            return f"{result['status']} on {result['host']}"
+        for cmd in result["commands"]:
+            # A cancelled command says nothing about the path's health.
+            if cmd["status"] != CMD_OK and cmd.get("exit_kind") != MATCH_DEADLINE:
+                return f"command timeout on {result['host']}"
+        connect_s = result.get("connect_s")
+        if connect_s is not None:
+            if len(self._baseline) < AIMD_LATENCY_SAMPLES:
+                self._baseline.append(connect_s)
+            else:
+                self._recent.append(connect_s)
+                recent = _percentile(list(self._recent), 50)
+                threshold = max(
+                    _percentile(self._baseline, 50) * AIMD_LATENCY_FACTOR,
+                    AIMD_LATENCY_FLOOR,
+                )
+                if len(self._recent) == AIMD_LATENCY_SAMPLES and recent > threshold:
+                    return f"connect latency {recent:.1f}s > {threshold:.1f}s"
+        if self.max_load is not None:
+            load = os.getloadavg()[0]
+            if load > self.max_load:
+                return f"load average {load:.2f} > {self.max_load:g}"
+        return None
+
+    def record(self, result):
+        """Adjust the limit for one finished host."""
+        with self._lock:
+            old = self.limit
+            reason = self._congestion(result)
+            if self._cooldown:
+                self._cooldown -= 1
+                if reason is not None:
+                    return
+            if reason is not None:
+                self.limit = max(self.minimum, int(old * AIMD_BACKOFF))
+                # The other hosts in flight started under the old limit.
+                self._cooldown = old - 1
+                self._recent.clear()
+            elif result["status"] == SESSION_OK:
+                self.limit = min(self.maximum, old + 1)
+                reason = "healthy"
+            if self.limit != old:
+                log_message(f"[main] concurrency: {old} -> {self.limit} ({reason})")
+
+
+def _current_limit(max_workers):
+    """Concurrency limit right now: an int, or a controller's live value."""
+    if isinstance(max_workers, ConcurrencyController):
+        return max_workers.limit
+    return max_workers
+
+
+def _record_completion(max_workers, result):
+    if isinstance(max_workers, ConcurrencyController) and result:
+        max_workers.record(result)
+
+
+# ---------------------------------------------------------------------------
+# Failure-domain circuit breaker (--circuit-breaker)
+# ---------------------------------------------------------------------------
+#
+# When a site's uplink drops, every host behind it fails its connect in turn,
+# 10 s each plus retries. Hosts are grouped into failure domains: the
+# hosts-file ``site=`` token, else the host's IPv4 /24 (--failure-domain-
+# prefix). After --circuit-breaker consecutive hosts of a domain failed to
+# connect (each counted once, after its retries) the domain's breaker opens
+# and the next host of the domain goes ahead alone as a half-open probe
+# while the others wait. If the probe connects the breaker
+# closes and they run; if it fails they, and any later host of the domain,
+# get SESSION_CIRCUIT_OPEN without a connect attempt.
+FAILURE_DOMAIN_PREFIX = 24
+BREAKER_CLOSED = "closed"
+BREAKER_OPEN = "open"            # tripped; the next host is the probe
+BREAKER_HALF_OPEN = "half_open"  # probe in flight, the rest held
+BREAKER_FAILED = "failed"        # probe failed; fail the rest fast
+
+
+def failure_domains(parsed_hosts, prefix=FAILURE_DOMAIN_PREFIX):
+    """Map each host of ``parsed_hosts`` to its failure domain name.
+
+    The domain is ``site=<name>`` for hosts with a site (see
+    :func:`parse_host_line`), else the IPv4 network of ``prefix`` bits the
+    address belongs to.
+    """
+    domains = {}
+    for host in parsed_hosts:
+        if host[4]:
+            domains[host[0]] = f"site={host[4]}"
+        else:
+            domains[host[0]] = str(
+                ipaddress.IPv4Network(f"{host[0]}/{prefix}", strict=False)
+            )
+    return domains
+
+
+class CircuitBreaker:
+    """Per-failure-domain circuit breakers for one run.
+
+    ``domains`` maps host -> failure domain (see :func:`failure_domains`);
+    ``threshold`` is the number of consecutive hosts failing to connect that
+    opens a domain's breaker. The engines pass every ``(job, previous)``
+    entry through :meth:`admit` before starting it and every final
+    session_result to :meth:`record`: a failure the :class:`RetryQueue`
+    takes for another attempt is not one, so a host counts once, and a host
+    that counted has no attempts left to become the probe. Results of hosts
+    failed without an attempt collect in ``failed`` for the engine to yield.
+    The default instance (no domains) admits everything.
+    """
+
+    def __init__(self, domains=None, threshold=0):
+        self.domains = domains or {}
+        self.threshold = threshold
+        self.failed = collections.deque()
+        self.opened = 0
+        self._state = {}
+        self._failures = collections.Counter()
+        self._probe = {}
+        self._held = collections.defaultdict(list)
+
+    def admit(self, entry):
+        """Return True to start ``entry`` now, False if held or failed."""
+        job, _ = entry
+        domain = self.domains.get(job["router_ip"])
+        state = self._state.get(domain, BREAKER_CLOSED)
+        if state == BREAKER_CLOSED:
+            return True
+        if state == BREAKER_OPEN:
+            self._state[domain] = BREAKER_HALF_OPEN
+            self._probe[domain] = job["router_ip"]
+            log_message(f"[main] circuit {domain}: probing with {job['router_ip']}")
+            return True
+        if state == BREAKER_HALF_OPEN:
+            if self._probe[domain] == job["router_ip"]:
+                # The probe's own connect retry.
+                return True
+            self._held[domain].append(entry)
+        else:
+            self._fail(domain, entry)
+        return False
+
+    def record(self, job, result):
+        """Feed one host's final result (after its connect retries).
+
+        Returns the held entries to start again (the domain's breaker closed,
+        or its probe ended without an answer).
+        """
+        domain = self.domains.get(job["router_ip"])
+        if domain is None or not result:
+            return []
+        state = self._state.get(domain, BREAKER_CLOSED)
+        is_probe = self._probe.get(domain) == job["router_ip"]
+        if result["status"] == SESSION_CONNECT_ERR:
+            if state == BREAKER_CLOSED:
+                self._failures[domain] += 1
+                if self._failures[domain] >= self.threshold:
+                    self._state[domain] = BREAKER_OPEN
+                    self.opened += 1
+                    log_message(
+                        f"[main] circuit {domain}: open after "
+                        f"{self._failures[domain]} consecutive connect failure(s)"
+                    )
+            elif state == BREAKER_HALF_OPEN and is_probe:
+                self._state[domain] = BREAKER_FAILED
+                held = self._held.pop(domain, [])
+                log_message(
+                    f"[main] circuit {domain}: probe {job['router_ip']} failed; "
+                    f"failing {len(held)} waiting host(s) without connecting"
+                )
+                for entry in held:
+                    self._fail(domain, entry)
+            return []
+        if result["connect_s"] is None and result["status"] in (
+            SESSION_DEADLINE, SESSION_SKIPPED,
+        ):
+            # Stopped before connecting: no evidence either way.
+            if state != BREAKER_HALF_OPEN or not is_probe:
+                return []
+            self._state[domain] = BREAKER_OPEN
+            self._probe.pop(domain)
+            return self._held.pop(domain, [])
+        self._failures[domain] = 0
+        if state == BREAKER_CLOSED:
+            return []
+        self._state[domain] = BREAKER_CLOSED
+        self._probe.pop(domain, None)
+        held = self._held.pop(domain, [])
+        log_message(
+            f"[main] circuit {domain}: closed, {job['router_ip']} connected; "
+            f"resuming {len(held)} host(s)"
+        )
+        return held
+
+    def drain(self):
+        """Remove and return every held entry, e.g. when the run is cancelled."""
+        entries = [entry for held in self._held.values() for entry in held]
+        self._held.clear()
+        return entries
+
+    def take_failed(self):
+        """Remove and return the results failed fast since the last call."""
+        failed = list(self.failed)
+        self.failed.clear()
+        return failed
+
+    def _fail(self, domain, entry):
+        job, previous = entry
+        if previous is None:
+            previous = _unstarted_result(
+                job, SESSION_CIRCUIT_OPEN,
+                f"circuit open: failure domain {domain} is unreachable",
+            )
+        self.failed.append(previous)
+
+
+# ---------------------------------------------------------------------------
+# Per-device-type and per-site worker limits
+# ---------------------------------------------------------------------------
+#
+# --max-workers bounds the whole run. --controller-workers / --edge-workers
+# cap the hosts of one device type in flight, so a few vSmarts are neither
+# queued behind thousands of edges nor hit by dozens of sessions at once,
+# and --per-site-workers caps each failure domain (site= token, else the
+# --failure-domain-prefix network) to spare thin WAN links. The engines skip
+# over hosts whose pool is full and start the next eligible one, so free
+# global slots are never left idle while any host could run.
+
+
+class WorkerPools:
+    """Caps on hosts in flight per device type and per site.
+
+    ``per_type`` maps a device type to its limit (types not in it are only
+    bound by the global limit); ``per_site`` limits every site of ``sites``
+    (host -> site, see :func:`failure_domains`). Not thread-safe: the
+    engines call it from their scheduling loop only.
+    """
+
+    def __init__(self, per_type=None, per_site=None, sites=None):
+        self.per_type = {t: n for t, n in (per_type or {}).items() if n}
+        self.per_site = per_site
+        self.sites = sites or {}
+        self._running = collections.Counter()
+
+    def _slots(self, job):
+        device_type = job.get("device_type", DEVICE_EDGE)
+        if device_type in self.per_type:
+            yield ("type", device_type), self.per_type[device_type]
+        site = self.sites.get(job["router_ip"])
+        if self.per_site and site is not None:
+            yield ("site", site), self.per_site
+
+    def allows(self, job):
+        """Return True if ``job`` may start without exceeding a limit."""
+        return all(self._running[key] < limit for key, limit in self._slots(job))
+
+    def acquire(self, job):
+        for key, _ in self._slots(job):
+            self._running[key] += 1
+
+    def release(self, job):
+        for key, _ in self._slots(job):
+            self._running[key] -= 1
+
+
+def _start_entries(pending, free, pools, breaker):
+    """Remove and return up to ``free`` pending entries that may start now.
+
+    Entries held back by a full pool keep their place at the front of
+    ``pending``; entries the ``breaker`` holds or fails are consumed.
+    """
+    started = []
+    blocked = []
+    while pending and len(started) < free:
+        entry = pending.popleft()
+        if not pools.allows(entry[0]):
+            blocked.append(entry)
+        elif breaker.admit(entry):
+            pools.acquire(entry[0])
+            started.append(entry)
+    pending.extendleft(reversed(blocked))
+    return started
+
+
+# ---------------------------------------------------------------------------
+# Execution engines
+# ---------------------------------------------------------------------------
+#
+# threads    (default) one ThreadPoolExecutor worker per in-flight host; each
+#            worker runs connect_and_execute end to end and polls its channel
+#            with a short recv timeout.
+#
+# selectors  one event loop drives every host's session_steps generator,
+#            waiting on channel.fileno() readiness instead of polling. The
+#            blocking SSH handshake runs on a small helper pool, and the
+#            output files (cleaning, rendering, writing) and closing the
+#            session on a second one, so --max-workers can be raised to
+#            hundreds or thousands of concurrent sessions without one Python
+#            worker thread each. paramiko still runs one transport thread
+#            per connection; those block on the socket rather than waking up
+#            10x a second.
+#
+# staged     a two-stage pipeline: --connect-workers threads connect, log in
+#            and settle each host's shell into a small ready queue, and
+#            --max-workers threads run the command lists, so handshakes
+#            (1-3 s through vManage) overlap other hosts' commands.
+ENGINE_THREADS = "threads"
+ENGINE_SELECTORS = "selectors"
+ENGINE_STAGED = "staged"
+ALL_ENGINES = (ENGINE_THREADS, ENGINE_SELECTORS, ENGINE_STAGED)
+
+# Upper bound on the helper threads the selectors engine uses for SSH
+# handshakes and pooled-shell health checks.
+SELECTORS_CONNECT_WORKERS = 32
+
+# Threads the selectors engine cleans, renders and writes output files on.
+# Kept apart from the handshake pool so that a host's files, and with them
+# its completion, never wait behind other hosts' slow connects.
+SELECTORS_WRITE_WORKERS = 4
+
+# Longest the selectors event loop sleeps without re-checking timers.
+SELECTORS_MAX_SLEEP = 1.0
+
+# staged engine defaults: connect-stage threads, and settled sessions allowed
+# to wait for an execute slot.
+STAGED_CONNECT_WORKERS = 4
+STAGED_READY_SESSIONS = 2
+
+
+def _skip_job(job, reason):
+    """Record a job the run never started, output files included."""
+    return _unstarted_result(job, SESSION_SKIPPED, f"skipped: {reason}")
+
+
+def _unstarted_result(job, status, error):
+    """Final session_result (and output files) for a job never connected."""
+    session_result = _new_session_result(
+        job["router_ip"],
+        job["username"],
+        job.get("port", 830),
+        job.get("device_type", DEVICE_EDGE),
+    )
+    session_result["status"] = status
+    session_result["error"] = error
+    log_message(f"[{job['router_ip']}] {session_result['error']}")
+    output = SessionOutput(session_result, job["output_paths"])
+    output.begin()
+    output.end()
+    return session_result
+
+
+class RetryQueue:
+    """Hosts waiting out a connect-retry backoff, soonest first.
+
+    The engines connect with ``retries=0`` and offer every result here: a
+    transient connect failure with retries left is held for
+    :func:`retry_backoff` seconds instead of sleeping in a worker, so the
+    slot goes straight to the next ready host. Entries are ``(job,
+    previous)`` pairs, ``previous`` being the failed attempt's
+    session_result (``None`` for a first attempt).
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._seq = itertools.count()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def offer(self, job, result):
+        """Queue ``job`` again after the failed ``result``, if it may retry.
+
+        Returns False (the result is final) otherwise.
+        """
+        attempts = result["connect_attempts"]
+        retries = job.get("retries", 0)
+        if result["status"] != SESSION_CONNECT_ERR or attempts > retries:
+            return False
+        delay = retry_backoff(job.get("retry_delay", 5.0), attempts)
+        log_message(
+            f"[{job['router_ip']}] retrying connect in {delay:.1f}s "
+            f"({attempts}/{retries})"
+        )
+        heapq.heappush(
+            self._heap, (time.monotonic() + delay, next(self._seq), job, result)
+        )
+        return True
+
+    def ready(self, now):
+        """Remove and return the entries whose backoff has passed."""
+        entries = []
+        while self._heap and self._heap[0][0] <= now:
+            _, _, job, previous = heapq.heappop(self._heap)
+            entries.append((job, previous))
+        return entries
+
+    def wait_time(self, now):
+        """Seconds until the next entry is ready, or None when empty."""
+        if not self._heap:
+            return None
+        return max(0.0, self._heap[0][0] - now)
+
+    def drain(self):
+        """Remove every entry, e.g. when the run is cancelled."""
+        entries = [(job, previous) for _, _, job, previous in sorted(self._heap)]
+        self._heap.clear()
+        return entries
+
+
+def _give_up(entry, reason):
+    """Final result for a pending ``(job, previous)`` entry of a cancelled run."""
+    job, previous = entry
+    return previous if previous is not None else _skip_job(job, reason)
+
+
+def _attempt_job(job, previous):
+    """One ``connect_and_execute`` attempt; retries are the engine's job."""
+    result = connect_and_execute(**dict(job, retries=0))
+    if previous is not None:
+        result["connect_attempts"] += previous["connect_attempts"]
+    return result
+
+
+class _OpenedShell:
+    """A job's live shell, as handed from :func:`_open_shell` to a driver."""
+
+    def __init__(self, ssh, shell, settled, output, started_mono, cancel):
+        self.ssh = ssh
+        self.shell = shell
+        self.settled = settled
+        self.output = output
+        self.started_mono = started_mono
+        self.cancel = cancel
+
+
+def _open_shell(paramiko, job, previous, login=False, writer=None):
+    """Phase 1 of one connect attempt for ``job``, for the engines that drive
+    sessions themselves.
+
+    Checks a warm shell out of the job's pool, or connects once and invokes
+    a shell; with ``login`` the login phases run too, so the shell comes
+    back settled on its prompt. ``writer`` goes to the
+    :class:`SessionOutput`. Returns an :class:`_OpenedShell`, or the
+    finished session_result (output files completed) when the host could
+    not be opened.
+    """
+    started_mono = time.monotonic()
+    cancel = CancelToken.for_host(job.get("cancel"), job.get("host_budget"))
+    session_result = _new_session_result(
+        job["router_ip"],
+        job["username"],
+        job.get("port", 830),
+        job.get("device_type", DEVICE_EDGE),
+    )
+    if previous is not None:
+        session_result["connect_attempts"] = previous["connect_attempts"]
+    output = SessionOutput(
+        session_result, job["output_paths"], job.get("post_processor"), writer
+    )
+    output.begin()
+    pool = job.get("session_pool")
+    if pool is not None:
+        pooled = pool.checkout(SessionPool.key(
+            job["router_ip"],
+            job.get("port", 830),
+            job["username"],
+            job.get("device_type", DEVICE_EDGE),
+        ))
+        if pooled is not None:
+            log_message(f"[{job['router_ip']}] reusing pooled session")
+            return _OpenedShell(
+                pooled.ssh, pooled.shell, pooled.settled, output, started_mono,
+                cancel,
+            )
+    connector = job.get("connector") or SSHConnector()
+    ssh = connector.client(paramiko, job.get("allow_unknown_hosts", True))
+    try:
+        if _connect_with_retries(
+            paramiko, ssh, job["router_ip"], job.get("port", 830),
+            job["username"], job["password"], 0,
+            job.get("retry_delay", 5.0), session_result,
+            cancel, connector,
+        ):
+            shell = ssh.invoke_shell()
+            settled = None
+            if login:
+                settled = run_read_steps(
+                    shell,
+                    login_steps(
+                        shell, job["router_ip"], job["password"],
+                        job.get("device_type", DEVICE_EDGE), session_result,
+                    ),
+                    cancel,
+                )
+                if cancel is not None and cancel.is_set():
+                    _record_deadline(session_result, job["router_ip"], cancel)
+                    settled = None
+            if settled is not None or not login:
+                return _OpenedShell(
+                    ssh, shell, settled, output, started_mono, cancel
+                )
+    except (paramiko.SSHException, socket.timeout, OSError) as ex:
+        _record_session_error(session_result, job["router_ip"], ex)
+    _finish_session(ssh, session_result, started_mono, output)
+    return session_result
+
+
+def _run_opened(job, opened):
+    """Run ``job``'s commands on the settled shell ``opened``; returns its
+    session_result once the session is closed (or parked).
+    """
+    import paramiko
+
+    session_result = opened.output.session_result
+    park = None
+    try:
+        settled = run_read_steps(
+            opened.shell,
+            session_steps(
+                opened.shell,
+                job["router_ip"],
+                job["password"],
+                job["commands_file"],
+                job.get("device_type", DEVICE_EDGE),
+                session_result,
+                job.get("latency_profile"),
+                job.get("pipeline"),
+                opened.output,
+                opened.settled,
+                opened.cancel,
+            ),
+            opened.cancel,
+        )
+        pool = job.get("session_pool")
+        if pool is not None and settled is not None:
+            key = SessionPool.key(
+                job["router_ip"],
+                job.get("port", 830),
+                job["username"],
+                job.get("device_type", DEVICE_EDGE),
+            )
+            pooled = PooledShell(opened.ssh, opened.shell, settled)
+            park = lambda: pool.checkin(key, pooled)
+    except (paramiko.SSHException, socket.timeout, OSError) as ex:
+        _record_session_error(session_result, job["router_ip"], ex)
+    finally:
+        _finish_session(
+            opened.ssh, session_result, opened.started_mono, opened.output, park
+        )
+    return session_result
+
+
+def run_threaded_engine(jobs, max_workers, cancel=None, breaker=None,
+                        pools=None):
+    """Run ``connect_and_execute(**job)`` for every job on a thread pool.
+
+    Yields each session_result as its host completes. ``max_workers`` is an
+    int or a :class:`ConcurrencyController` whose limit is re-read whenever
+    a host completes. Failed connects wait in a :class:`RetryQueue` without
+    holding a worker, ``breaker`` (a :class:`CircuitBreaker`) holds or fails
+    the hosts of unreachable failure domains and ``pools`` (a
+    :class:`WorkerPools`) caps hosts per device type and site. Once
+    ``cancel`` (the run's :class:`CancelToken`) is set, jobs not yet started
+    are yielded as SESSION_SKIPPED results and hosts waiting to retry with
+    their last failure.
+    """
+    if isinstance(max_workers, ConcurrencyController):
+        pool_size = max_workers.maximum
+    else:
+        pool_size = max_workers
+    if breaker is None:
+        breaker = CircuitBreaker()
+    if pools is None:
+        pools = WorkerPools()
+    pending = collections.deque((job, None) for job in jobs)
+    retry_queue = RetryQueue()
+    running = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=pool_size) as executor:
+        while pending or running or retry_queue:
+            if cancel is not None and cancel.is_set():
+                pending.extend(retry_queue.drain())
+                pending.extend(breaker.drain())
+                while pending:
+                    yield _give_up(pending.popleft(), cancel.reason)
+                if not running:
+                    break
+            # Hosts whose backoff has passed go ahead of untried ones.
+            pending.extendleft(reversed(retry_queue.ready(time.monotonic())))
+            free = _current_limit(max_workers) - len(running)
+            for entry in _start_entries(pending, free, pools, breaker):
+                running[executor.submit(_attempt_job, *entry)] = entry[0]
+            yield from breaker.take_failed()
+            timeout = None if cancel is None else CANCEL_POLL_INTERVAL
+            backoff = retry_queue.wait_time(time.monotonic())
+            if backoff is not None:
+                timeout = backoff if timeout is None else min(timeout, backoff)
+            if not running:
+                # Only hosts in backoff are left.
+                if cancel is None:
+                    time.sleep(timeout)
+                else:
+                    cancel.wait(timeout)
+                continue
+            done, _ = concurrent.futures.wait(
+                running, timeout=timeout,
+                return_when=concurrent.futures.FIRST_COMPLETED,
+            )
+            for future in done:
+                job = running.pop(future)
+                result = future.result()
+                pools.release(job)
+                _record_completion(max_workers, result)
+                if not retry_queue.offer(job, result):
+                    pending.extendleft(reversed(breaker.record(job, result)))
+                    yield result
+            yield from breaker.take_failed()
+
+
+class _OrderedWriter:
+    """Runs the submitted calls one at a time, in order, on ``executor``.
+
+    A :class:`SessionOutput` writer for the selectors engine: one per
+    session, so its files are written in order off the event loop while
+    the write pool is shared by every session. A call that raises is
+    logged against ``router_ip`` and the calls after it still run, so the
+    session's final ``finish`` always does.
+    """
+
+    def __init__(self, executor, router_ip):
+        self._executor = executor
+        self._router_ip = router_ip
+        self._lock = threading.Lock()
+        self._calls = collections.deque()
+        self._running = False
+
+    def submit(self, fn, *args):
+        with self._lock:
+            self._calls.append((fn, args))
+            if self._running:
+                return
+            self._running = True
+        self._executor.submit(self._run)
+
+    def _run(self):
+        self._lock.acquire()
+        try:
+            while self._calls:
+                fn, args = self._calls.popleft()
+                self._lock.release()
+                try:
+                    fn(*args)
+                except Exception as ex:
+                    log_message(f"[{self._router_ip}] error writing output: {ex!r}")
+                finally:
+                    self._lock.acquire()
+        finally:
+            self._running = False
+            self._lock.release()
+
+
+class _SelectorSession:
+    """One host driven by :func:`run_selectors_engine`."""
+
+    def __init__(self, job, ssh, shell, output, started_mono, settled=None,
+                 cancel=None, writer=None):
+        self.job = job
+        self.writer = writer
+        self.ssh = ssh
+        self.shell = shell
+        self.output = output
+        self.session_result = output.session_result
+        self.started_mono = started_mono
+        self.settled = None
+        self.cancel = cancel
+        self.steps = session_steps(
+            shell,
+            job["router_ip"],
+            job["password"],
+            job["commands_file"],
+            job.get("device_type", DEVICE_EDGE),
+            self.session_result,
+            job.get("latency_profile"),
+            job.get("pipeline"),
+            output,
+            settled,
+            self.cancel,
+        )
+        self.op = None
+
+    def park(self):
+        """Return a callable parking this shell in the job's pool, or None."""
+        pool = self.job.get("session_pool")
+        if pool is None or self.settled is None:
+            return None
+        key = SessionPool.key(
+            self.job["router_ip"],
+            self.job.get("port", 830),
+            self.job["username"],
+            self.job.get("device_type", DEVICE_EDGE),
+        )
+        pooled = PooledShell(self.ssh, self.shell, self.settled)
+        return lambda: pool.checkin(key, pooled)
+
+
+def run_selectors_engine(jobs, max_workers, cancel=None, breaker=None,
+                         pools=None):
+    """Run every job from a single selectors-based event loop.
+
+    Accepts the same job dicts as :func:`run_threaded_engine` (keyword
+    arguments of :func:`connect_and_execute`) and yields each session_result
+    as its host completes. At most ``max_workers`` sessions (an int or a
+    :class:`ConcurrencyController`'s live limit) are connecting or open at
+    once. The per-host logic is the same :func:`session_steps` generator
+    the threaded engine runs, so the output files are identical; the loop
+    only reads, handshakes run on a helper pool, and each session's
+    cleaning, rendering and file writes run in order on a separate write
+    pool (see :class:`_OrderedWriter`). Connect retries, ``breaker`` and
+    ``pools`` work as in the threaded engine, and jobs still pending once
+    ``cancel`` is set are yielded as skipped.
+    """
+    import paramiko
+
+    session_errors = (paramiko.SSHException, socket.timeout, OSError)
+    selector = selectors.DefaultSelector()
+    # Helper threads post ("ready", session) / ("done", (job, session_result))
+    # here and poke the wake-up socket so the loop notices immediately.
+    inbox = queue.Queue()
+    wake_r, wake_w = socket.socketpair()
+    wake_r.setblocking(False)
+    wake_w.setblocking(False)
+    selector.register(wake_r, selectors.EVENT_READ, None)
+    helpers = concurrent.futures.ThreadPoolExecutor(
+        max_workers=max(
+            1,
+            min(
+                max_workers.maximum
+                if isinstance(max_workers, ConcurrencyController)
+                else max_workers,
+                SELECTORS_CONNECT_WORKERS,
+            ),
+        )
+    )
+    writers = concurrent.futures.ThreadPoolExecutor(
+        max_workers=SELECTORS_WRITE_WORKERS
+    )
+
+    def post(item):
+        inbox.put(item)
+        try:
+            wake_w.send(b"\0")
+        except (BlockingIOError, OSError):
+            # The wake-up buffer is full, so the loop is about to wake anyway.
+            pass
+
+    def finish(job, ssh, output, started_mono, park=None):
+        _finish_session(ssh, output.session_result, started_mono, output, park)
+        post(("done", (job, output.session_result)))
+
+    def open_session(job, previous):
+        # Phase 1 (plus invoke_shell) blocks inside paramiko, so it runs here
+        # on a helper thread and hands the live shell back to the loop.
+        writer = _OrderedWriter(writers, job["router_ip"])
+        opened = _open_shell(paramiko, job, previous, writer=writer.submit)
+        if isinstance(opened, dict):
+            post(("done", (job, opened)))
+            return
+        post((
+            "ready",
+            _SelectorSession(
+                job, opened.ssh, opened.shell, opened.output,
+                opened.started_mono, opened.settled, opened.cancel, writer,
+            ),
+        ))
+
+    live = set()
+
+    def close_session(session):
+        live.discard(session)
+        try:
+            selector.unregister(session.shell)
+        except (KeyError, ValueError):
+            pass
+        # After the session's queued writes, so its files end last.
+        session.writer.submit(
+            finish, session.job, session.ssh, session.output,
+            session.started_mono, session.park(),
+        )
+
+    def advance(session, result):
+        """Feed ``result`` to the session and start its next read."""
+        try:
+            request = session.steps.send(result)
+        except StopIteration as stop:
+            session.settled = stop.value
+            close_session(session)
+            return
+        except session_errors as ex:
+            _record_session_error(session.session_result, session.job["router_ip"], ex)
+            close_session(session)
+            return
+        session.op = ChannelRead(session.shell, cancel=session.cancel, **request)
+
+    def service(session, now):
+        """Drain whatever the channel has buffered into the current read."""
+        shell = session.shell
+        op = session.op
+        while op.result is None and not op.expired(now):
+            if shell.recv_ready():
+                try:
+                    data = shell.recv(op.recv_size)
+                except OSError:
+                    op.fail()
+                    break
+            elif shell.eof_received or shell.closed:
+                data = b""
+            else:
+                break
+            op.feed(data, now)
+            if op.result is None:
+                op.check(now)
+        if op.result is not None:
+            advance(session, op.result)
+
+    if breaker is None:
+        breaker = CircuitBreaker()
+    if pools is None:
+        pools = WorkerPools()
+    pending = collections.deque((job, None) for job in jobs)
+    retry_queue = RetryQueue()
+    in_flight = 0
+    try:
+        while pending or in_flight or retry_queue:
+            if cancel is not None and cancel.is_set():
+                pending.extend(retry_queue.drain())
+                pending.extend(breaker.drain())
+                while pending:
+                    yield _give_up(pending.popleft(), cancel.reason)
+                if not in_flight:
+                    break
+            pending.extendleft(reversed(retry_queue.ready(time.monotonic())))
+            free = _current_limit(max_workers) - in_flight
+            for entry in _start_entries(pending, free, pools, breaker):
+                helpers.submit(open_session, *entry)
+                in_flight += 1
+            yield from breaker.take_failed()
+
+            now = time.monotonic()
+            timeout = SELECTORS_MAX_SLEEP
+            backoff = retry_queue.wait_time(now)
+            if backoff is not None:
+                timeout = min(timeout, backoff)
+            for session in live:
+                timeout = min(timeout, session.op.next_deadline() - now)
+            for key, _ in selector.select(max(0.0, timeout)):
+                if key.data is None:
+                    try:
+                        while wake_r.recv(4096):
+                            pass
+                    except (BlockingIOError, OSError):
+                        pass
+                elif key.data in live:
+                    service(key.data, time.monotonic())
+
+            while True:
+                try:
+                    kind, item = inbox.get_nowait()
+                except queue.Empty:
+                    break
+                if kind == "ready":
+                    live.add(item)
+                    selector.register(item.shell, selectors.EVENT_READ, item)
+                    advance(item, None)
+                else:
+                    job, result = item
+                    in_flight -= 1
+                    pools.release(job)
+                    _record_completion(max_workers, result)
+                    if not retry_queue.offer(job, result):
+                        pending.extendleft(reversed(breaker.record(job, result)))
+                        yield result
+            yield from breaker.take_failed()
+
+            # Timers: idle / max_wait / cancel exits for reads with no new data.
+            now = time.monotonic()
+            for session in list(live):
+                op = session.op
+                if op.expired(now) or (
+                    now >= op.next_deadline() and op.check(now) is not None
+                ):
+                    advance(session, op.result)
+    finally:
+        helpers.shutdown(wait=True)
+        writers.shutdown(wait=True)
+        selector.close()
+        wake_r.close()
+        wake_w.close()
+
+
+def run_staged_engine(jobs, max_workers, cancel=None, breaker=None,
+                      pools=None, connect_workers=STAGED_CONNECT_WORKERS,
+                      ready_sessions=STAGED_READY_SESSIONS):
+    """Run every job as a two-stage pipeline: connect, then execute.
+
+    ``connect_workers`` threads connect, authenticate and settle each host's
+    shell (:func:`_open_shell`); settled sessions wait in a ready queue for
+    one of ``max_workers`` execute threads (an int or a
+    :class:`ConcurrencyController`'s live limit) to run their commands
+    (:func:`_run_opened`). A connect only starts while the sessions
+    connecting or ready fit in ``ready_sessions`` plus the free execute
+    slots, so at most ``max_workers + ready_sessions`` sessions are open at
+    once. Yields each session_result as its host completes; retries,
+    ``breaker``, ``pools`` and ``cancel`` work as in
+    :func:`run_threaded_engine`. Per-stage timings, the ready-queue depth
+    and how long execute slots sat idle waiting for a session are logged at
+    the end, to size the two stages.
+    """
+    import paramiko
+
+    if isinstance(max_workers, ConcurrencyController):
+        pool_size = max_workers.maximum
+    else:
+        pool_size = max_workers
+    if breaker is None:
+        breaker = CircuitBreaker()
+    if pools is None:
+        pools = WorkerPools()
+    pending = collections.deque((job, None) for job in jobs)
+    retry_queue = RetryQueue()
+    connecting = {}
+    ready = collections.deque()
+    executing = {}
+    timings = collections.defaultdict(list)
+    starved = 0.0
+    connectors = concurrent.futures.ThreadPoolExecutor(max_workers=connect_workers)
+    executors = concurrent.futures.ThreadPoolExecutor(max_workers=pool_size)
+    try:
+        while pending or retry_queue or connecting or ready or executing:
+            if cancel is not None and cancel.is_set():
+                pending.extend(retry_queue.drain())
+                pending.extend(breaker.drain())
+                while pending:
+                    yield _give_up(pending.popleft(), cancel.reason)
+                if not (connecting or ready or executing):
+                    break
+            now = time.monotonic()
+            pending.extendleft(reversed(retry_queue.ready(now)))
+            limit = _current_limit(max_workers)
+            # Execute stage: settled sessions take the free execute slots.
+            while ready and len(executing) < limit:
+                job, opened, ready_mono = ready.popleft()
+                timings["ready_wait"].append(now - ready_mono)
+                executing[executors.submit(_run_opened, job, opened)] = (job, now)
+            # Connect stage: only as far ahead as the execute stage can use.
+            free = min(
+                connect_workers - len(connecting),
+                ready_sessions + limit - len(executing) - len(ready) - len(connecting),
+            )
+            for entry in _start_entries(pending, free, pools, breaker):
+                future = connectors.submit(_open_shell, paramiko, *entry, login=True)
+                connecting[future] = (entry[0], now)
+            yield from breaker.take_failed()
+
+            timeout = None if cancel is None else CANCEL_POLL_INTERVAL
+            backoff = retry_queue.wait_time(time.monotonic())
+            if backoff is not None:
+                timeout = backoff if timeout is None else min(timeout, backoff)
+            if not connecting and not executing:
+                # Only hosts in backoff are left.
+                if cancel is None:
+                    time.sleep(timeout)
+                else:
+                    cancel.wait(timeout)
+                continue
+            waited = time.monotonic()
+            done, _ = concurrent.futures.wait(
+                set(connecting) | set(executing), timeout=timeout,
+                return_when=concurrent.futures.FIRST_COMPLETED,
+            )
+            now = time.monotonic()
+            if not ready and (pending or connecting):
+                # Execute slots left idle for want of a settled session.
+                starved += (now - waited) * max(0, limit - len(executing))
+            finished = []
+            for future in done:
+                if future in connecting:
+                    job, started = connecting.pop(future)
+                    opened = future.result()
+                    if isinstance(opened, dict):
+                        finished.append((job, opened))
+                        continue
+                    timings["connect"].append(now - started)
+                    ready.append((job, opened, now))
+                    timings["ready_depth"].append(len(ready))
+                else:
+                    job, started = executing.pop(future)
+                    timings["execute"].append(now - started)
+                    finished.append((job, future.result()))
+            for job, result in finished:
+                pools.release(job)
+                _record_completion(max_workers, result)
+                if not retry_queue.offer(job, result):
+                    pending.extendleft(reversed(breaker.record(job, result)))
+                    yield result
+            yield from breaker.take_failed()
+    finally:
+        connectors.shutdown(wait=True)
+        executors.shutdown(wait=True)
+    if timings["connect"]:
+        log_message(_stage_report(timings, starved, ready_sessions))
+
+
+def _stage_report(timings, starved, ready_sessions):
+    """One log line sizing the staged engine's connect and execute stages."""
+
+    def spread(values):
+        if not values:
+            return "n/a"
+        return (
+            f"median {_percentile(values, 50):.2f}s, "
+            f"p90 {_percentile(values, 90):.2f}s"
+        )
+
+    depths = timings["ready_depth"]
+    return (
+        f"[main] stages: connect {len(timings['connect'])} session(s) "
+        f"{spread(timings['connect'])}; ready queue depth max "
+        f"{max(depths)}/{ready_sessions}, mean {sum(depths) / len(depths):.1f}, "
+        f"wait {spread(timings['ready_wait'])}; execute "
+        f"{spread(timings['execute'])}; execute slots idle for want of a "
+        f"session {starved:.1f} slot-s"
+    )
+
+
+# ---------------------------------------------------------------------------
+# TCP preflight (--preflight)
+# ---------------------------------------------------------------------------
+#
+# An unreachable host costs a full ssh.connect timeout (10 s) per attempt, in
+# a worker slot. With --preflight every (host, port) gets a non-blocking TCP
+# connect at once from one selector; hosts that refuse or do not answer
+# within --preflight-timeout get an immediate connect_error result (and
+# output files) and never reach the engine. The measured connect RTTs are
+# saved to <logs-dir>/preflight.json and break scheduling ties under
+# --host-history.
+PREFLIGHT_TIMEOUT = 2.0
+# Sockets open at once; stays well under the usual 1024 file limit.
+PREFLIGHT_MAX_INFLIGHT = 512
+PREFLIGHT_NAME = "preflight.json"
+_CONNECT_IN_PROGRESS = (
+    errno.EINPROGRESS,
+    errno.EWOULDBLOCK,
+    getattr(errno, "WSAEWOULDBLOCK", errno.EWOULDBLOCK),
+)
+
+
+def preflight(targets, timeout=PREFLIGHT_TIMEOUT):
+    """Probe TCP reachability of every ``(host, port)`` in ``targets``.
+
+    Returns ``{(host, port): (rtt_s, error)}`` where exactly one of the two
+    is None: the connect round trip in seconds, or why it failed.
+    """
+    probes = {}
+    pending = collections.deque(dict.fromkeys(targets))
+    selector = selectors.DefaultSelector()
+    deadlines = {}
+    try:
+        while pending or deadlines:
+            while pending and len(deadlines) < PREFLIGHT_MAX_INFLIGHT:
+                target = pending.popleft()
+                started = time.monotonic()
+                try:
+                    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                except OSError as ex:
+                    probes[target] = (None, str(ex))
+                    continue
+                sock.setblocking(False)
+                try:
+                    err = sock.connect_ex(target)
+                except OSError as ex:  # e.g. a hostname that does not resolve
+                    probes[target] = (None, str(ex))
+                    sock.close()
+                    continue
+                if err == 0:
+                    probes[target] = (time.monotonic() - started, None)
+                    sock.close()
+                elif err in _CONNECT_IN_PROGRESS:
+                    selector.register(sock, selectors.EVENT_WRITE, (target, started))
+                    deadlines[sock] = started + timeout
+                else:
+                    probes[target] = (None, os.strerror(err))
+                    sock.close()
+            if not deadlines:
+                continue
+            wait = min(deadlines.values()) - time.monotonic()
+            for key, _ in selector.select(max(0.0, wait)):
+                target, started = key.data
+                err = key.fileobj.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if err == 0:
+                    probes[target] = (time.monotonic() - started, None)
+                else:
+                    probes[target] = (None, os.strerror(err))
+                selector.unregister(key.fileobj)
+                key.fileobj.close()
+                del deadlines[key.fileobj]
+            now = time.monotonic()
+            for sock, deadline in list(deadlines.items()):
+                if now >= deadline:
+                    target, _ = selector.get_key(sock).data
+                    probes[target] = (None, f"no answer within {timeout:g}s")
+                    selector.unregister(sock)
+                    sock.close()
+                    del deadlines[sock]
+    finally:
+        for sock in deadlines:
+            sock.close()
+        selector.close()
+    return probes
+
+
+def save_preflight(logs_dir, probes, timeout):
+    """Write ``probes`` (see :func:`preflight`) to ``<logs_dir>/preflight.json``."""
+    data = {
+        "probed_at": now_iso(),
+        "timeout_s": timeout,
+        "hosts": {
+            host: {
+                "port": port,
+                "rtt_ms": None if rtt is None else round(rtt * 1000, 1),
+                "error": error,
+            }
+            for (host, port), (rtt, error) in probes.items()
+        },
+    }
+    path = os.path.join(logs_dir, PREFLIGHT_NAME)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+# ---------------------------------------------------------------------------
+# Run journal (--resume)
+# ---------------------------------------------------------------------------
+#
+# Every finished host (skipped ones included) appends one NDJSON line to
+# <logs-dir>/journal.ndjson with a single O_APPEND write followed by fsync, so
+# a crash or reboot leaves at worst a torn last line, which replay ignores.
+# ``host`` and ``status`` are written first: replay reads them with a prefix
+# regex and only falls back to a full json.loads for lines it cannot match,
+# so tens of thousands of entries replay without parsing their command lists.
+JOURNAL_NAME = "journal.ndjson"
+_JSON_STR = r'"(?:[^"\\]|\\.)*"'
+JOURNAL_HEAD_RE = re.compile(
+    r'\{"host": (?P<host>' + _JSON_STR + r'), "status": (?P<status>' + _JSON_STR + r')'
+)
+
+
+def _journal_str(token):
+    """Decode a JSON string token, skipping json.loads when it has no escapes."""
+    return json.loads(token) if "\\" in token else token[1:-1]
+
+
+class RunJournal:
+    """Append-only record of finished hosts in ``<logs_dir>/journal.ndjson``."""
+
+    def __init__(self, logs_dir):
+        self.path = os.path.join(logs_dir, JOURNAL_NAME)
+        self._lock = threading.Lock()
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def record(self, result, output_paths):
+        """Append ``result`` (a session_result) and its output file paths."""
+        entry = {
+            "host": result["host"],
+            "status": result["status"],
+            "device_type": result["device_type"],
+            "started_at": result["started_at"],
+            "ended_at": result["ended_at"],
+            "duration_s": round(result["duration_s"], 3),
+            "error": result["error"],
+            "outputs": output_paths,
+            "commands": [
+                {"command": cmd["command"], "status": cmd["status"]}
+                for cmd in result["commands"]
+            ],
+        }
+        line = (json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock:
+            os.write(self._fd, line)
+            os.fsync(self._fd)
+
+    def close(self):
+        with self._lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+
+    @staticmethod
+    def replay(logs_dir):
+        """Return ``{host: status}`` from the latest entry of each host.
+
+        A missing journal replays as empty; torn or foreign lines are skipped.
+        """
+        statuses = {}
+        try:
+            f = open(os.path.join(logs_dir, JOURNAL_NAME), "r", encoding="utf-8")
+        except FileNotFoundError:
+            return statuses
+        with f:
+            for line in f:
+                if not line.endswith("\n"):
+                    continue  # torn by a crash mid-write
+                m = JOURNAL_HEAD_RE.match(line)
+                try:
+                    if m:
+                        host = _journal_str(m.group("host"))
+                        status = _journal_str(m.group("status"))
+                    else:
+                        entry = json.loads(line)
+                        host, status = entry["host"], entry["status"]
+                except (ValueError, KeyError, TypeError):
+                    continue
+                statuses[host] = status
+        return statuses
+
+
+def _parse_output_formats(arg_value):
+    """Validate --output-format and return a list of unique format names."""
+    raw = [p.strip().lower() for p in arg_value.split(",") if p.strip()]
+    if not raw:
+        raise argparse.ArgumentTypeError("--output-format requires at least one format")
+    seen = []
+    for fmt in raw:
+        if fmt not in ALL_OUTPUT_FORMATS:
+            raise argparse.ArgumentTypeError(
+                f"unknown output format: {fmt!r}. "
+                f"Valid: {', '.join(ALL_OUTPUT_FORMATS)}"
+            )
+        if fmt not in seen:
+            seen.append(fmt)
+    return seen
+
+
+def _parse_name_list(arg_value):
+    """argparse ``type=`` for a comma-separated list of algorithm names."""
+    names = [name.strip() for name in arg_value.split(",") if name.strip()]
+    if not names:
+        raise argparse.ArgumentTypeError("expected one or more comma-separated names")
+    return names
+
+
+def _parse_max_workers(arg_value):
+    """Validate --max-workers: an integer or 'auto'."""
+    if arg_value.strip().lower() == MAX_WORKERS_AUTO:
+        return MAX_WORKERS_AUTO
+    try:
+        return int(arg_value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"--max-workers must be an integer or '{MAX_WORKERS_AUTO}' "
+            f"(got {arg_value!r})"
+        )
+
+
+def _build_output_paths(logs_dir, router_ip, timestamp, formats):
+    """Build a {format -> path} dict for one host run."""
+    ext_map = {
+        OUTPUT_FORMAT_TEXT: "txt",
+        OUTPUT_FORMAT_JSON: "json",
+        OUTPUT_FORMAT_CSV: "csv",
+    }
+    paths = {}
+    for fmt in formats:
+        ext = ext_map[fmt]
+        paths[fmt] = os.path.join(logs_dir, f"output_{router_ip}_{timestamp}.{ext}")
+    return paths
+
+
+def build_jobs(parsed_hosts, options, shared_password=None,
+               latency_profile=None, pipeline=None, session_pool=None,
+               cancel=None, host_budget=None, connector=None,
+               post_processor=None):
+    """Turn parsed hosts into ``connect_and_execute`` keyword-argument dicts.
+
+    Args:
+        parsed_hosts: iterable of ``(ip, username, password, device_type,
+            site)`` tuples as returned by :func:`parse_host_line` (the site
+            is ignored here).
+        options: object carrying the CLI settings by their argparse names
+            (``commands_file``, ``controller_commands``, ``edge_commands``,
+            ``port``, ``controller_port``, ``reject_unknown_hosts``,
+            ``password_prompt``, ``retries``, ``retry_delay``, ``logs_dir``,
+            ``output_format``) -- the parsed ``argparse.Namespace`` or an
+            equivalent object such as ``bulkshow.RunPlan``.
+        shared_password: password for hosts without one in the hosts file
+            (and for every host when ``options.password_prompt`` is set).
+        latency_profile: optional :class:`LatencyProfile` shared by all hosts.
+        pipeline: optional :class:`CommandPipeline` shared by all hosts.
+        session_pool: optional :class:`SessionPool` of warm shells.
+        cancel: optional run-wide :class:`CancelToken`.
+        host_budget: optional per-host time budget in seconds.
+        connector: optional :class:`SSHConnector` shared by all hosts.
+        post_processor: optional :class:`PostProcessor` shared by all hosts.
 
     Returns:
-        session_result: dict with the schema:
-            {
-              "host": str, "username": str, "port": int,
-              "device_type": str,
-              "started_at": iso, "ended_at": iso, "duration_s": float,
-              "status": one of SESSION_*,
-              "error": str | None,
-              "commands": [
-                  {"command": str, "started_at": iso,
-                   "duration_s": float, "exit_kind": str,
-                   "status": one of CMD_*, "output": str},
-                  ...
-              ],
-            }
+        list of job dicts accepted by the execution engines.
     """
-    # Imported lazily so that the pure-parser helpers in this module remain
-    # importable (and unit-testable) on systems without paramiko installed.
-    import paramiko
+    jobs = []
+    for host in parsed_hosts:
+        router_ip, username, password, device_type, _ = host
+        # Choose effective password:
+        #   --password-prompt -> shared overrides file
+        #   missing in file   -> shared
+        #   else              -> embedded password
+        if options.password_prompt or password is None:
+            effective_password = shared_password
+        else:
+            effective_password = password
+
+        # Controllers default to TCP/22; edges to --port (830).
+        if device_type == DEVICE_CONTROLLER:
+            effective_port = options.controller_port
+        else:
+            effective_port = options.port
+
+        # Resolve the command list this host should run from its type.
+        commands_file = resolve_commands_file(
+            device_type,
+            options.commands_file,
+            options.controller_commands,
+            options.edge_commands,
+        )
+
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        output_paths = _build_output_paths(
+            options.logs_dir, router_ip, timestamp, options.output_format
+        )
+        jobs.append(
+            dict(
+                router_ip=router_ip,
+                username=username,
+                password=effective_password,
+                commands_file=commands_file,
+                output_paths=output_paths,
+                allow_unknown_hosts=not options.reject_unknown_hosts,
+                port=effective_port,
+                retries=options.retries,
+                retry_delay=options.retry_delay,
+                device_type=device_type,
+                latency_profile=latency_profile,
+                pipeline=pipeline,
+                session_pool=session_pool,
+                cancel=cancel,
+                host_budget=host_budget,
+                connector=connector,
+                post_processor=post_processor,
+            )
+        )
+    return jobs
 
-    started_wall = now_iso()
-    started_mono = time.monotonic()
-    session_result = {
-        "host": router_ip,
-        "username": username,
-        "port": port,
-        "device_type": device_type,
-        "started_at": started_wall,
-        "ended_at": started_wall,  # updated in finally
-        "duration_s": 0.0,
-        "status": SESSION_OTHER_ERR,
-        "error": None,
-        "commands": [],
-    }
 
-    # Create an SSH client.
-    ssh = paramiko.SSHClient()
-    ssh.load_system_host_keys()
-    if allow_unknown_hosts:
-        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+def run_hosts(parsed_hosts, options, shared_password=None, max_workers=None,
+              engine=ENGINE_THREADS, latency_profile=None, pipeline=None,
+              session_pool=None, max_load=None, host_history=None,
+              cancel=None):
+    """Run every host on ``engine`` and log the start / timing / done lines.
+
+    Shared by a one-shot run and by each job of the --serve daemon. Arguments
+    are as for :func:`build_jobs`; ``max_workers`` defaults to
+    min(8, number of hosts), and :data:`MAX_WORKERS_AUTO` selects a
+    :class:`ConcurrencyController` (``max_load`` is its optional load-average
+    ceiling). ``host_history`` (a :class:`HostHistory`) orders the hosts
+    longest-expected-first and learns from this run. ``options.deadline``
+    and ``options.host_budget`` (seconds or None) bound the run and each
+    host; ``options.preflight`` probes every host first (see
+    :func:`preflight`, timeout ``options.preflight_timeout``);
+    ``options.circuit_breaker`` (0 = off) and
+    ``options.failure_domain_prefix`` configure the :class:`CircuitBreaker`,
+    and ``options.controller_workers``, ``options.edge_workers`` and
+    ``options.per_site_workers`` (None = no cap) the :class:`WorkerPools`;
+    ``options.connect_workers`` and ``options.ready_sessions`` size the
+    :data:`ENGINE_STAGED` connect stage, and ``options.ssh_auth``,
+    ``options.kex``, ``options.ciphers``, ``options.banner_timeout`` and
+    ``options.auth_timeout`` configure the run's :class:`SSHConnector`, and
+    ``options.post_process_workers`` (0 = in the I/O threads) sizes its
+    :class:`PostProcessor`; ``options.record`` (a directory or None) saves
+    every session's transcript, and ``options.replay`` (a directory or None)
+    replays them instead of connecting, at ``options.replay_speed`` (see
+    :class:`ReplayConnector`); ``cancel`` is a :class:`CancelToken` that
+    stops the run early (e.g. from a signal handler). Returns ``(succeeded,
+    failed)`` host counts; skipped and cut-short hosts count as failed.
+    Every finished host is appended to the :class:`RunJournal` in
+    ``options.logs_dir``.
+    """
+    os.makedirs(options.logs_dir, exist_ok=True)
+
+    # Bound concurrency. Default: min(8, hosts) keeps small jobs serial-ish
+    # while still benefiting from parallelism on big batches.
+    if max_workers is None:
+        if options.controller_workers and options.edge_workers:
+            # Both types capped: the caps, not the default, bound the run.
+            max_workers = options.controller_workers + options.edge_workers
+        else:
+            max_workers = 8
+        max_workers = min(max_workers, len(parsed_hosts))
+    if max_workers == MAX_WORKERS_AUTO:
+        max_workers = ConcurrencyController(
+            initial=min(AIMD_INITIAL, len(parsed_hosts)),
+            maximum=min(AIMD_MAX, len(parsed_hosts)),
+            max_load=max_load,
+        )
+        workers_label = (
+            f"{max_workers.maximum} concurrent worker(s) (adaptive, starting "
+            f"at {max_workers.limit})"
+        )
     else:
-        ssh.set_missing_host_key_policy(paramiko.RejectPolicy())
+        workers_label = f"{max_workers} concurrent worker(s)"
+    log_message(
+        f"[main] starting {len(parsed_hosts)} host(s) with up to "
+        f"{workers_label}; output formats: "
+        f"{','.join(options.output_format)}; engine: {engine}"
+    )
 
-    # Accumulated buffer during shell entry; useful for diagnostics and for
-    # extracting the device prompt. NEVER overwritten -- always appended.
-    auth_banner = []
+    run_started_mono = time.monotonic()
+    if options.deadline is not None:
+        cancel = CancelToken(
+            run_started_mono + options.deadline,
+            f"deadline {options.deadline:g}s reached",
+            cancel,
+        )
+    if session_pool is not None:
+        hits, misses = session_pool.hits, session_pool.misses
+    if options.replay:
+        connector = ReplayConnector(options.replay, options.replay_speed)
+        log_message(
+            f"[main] replaying transcripts from {options.replay} "
+            f"(speed {options.replay_speed:g})"
+        )
+    else:
+        connector = SSHConnector(
+            options.ssh_auth,
+            options.kex,
+            options.ciphers,
+            options.banner_timeout,
+            options.auth_timeout,
+            record=options.record,
+        )
+        if options.record:
+            os.makedirs(options.record, exist_ok=True)
+            log_message(f"[main] recording transcripts to {options.record}")
+    post_processor = None
+    if options.post_process_workers:
+        post_processor = PostProcessor(options.post_process_workers)
+        log_message(
+            f"[main] post-processing: {post_processor.workers} worker process(es)"
+        )
+    jobs = build_jobs(
+        parsed_hosts, options, shared_password, latency_profile, pipeline,
+        session_pool, cancel, options.host_budget, connector, post_processor,
+    )
+    output_paths = {job["router_ip"]: job["output_paths"] for job in jobs}
+    unreachable = []
+    rtts = None
+    if options.preflight:
+        probes = preflight(
+            [(job["router_ip"], job["port"]) for job in jobs],
+            options.preflight_timeout,
+        )
+        try:
+            save_preflight(options.logs_dir, probes, options.preflight_timeout)
+        except OSError as ex:
+            log_message(f"[main] warning: could not save preflight results: {ex}")
+        rtts = {host: rtt for (host, _), (rtt, _) in probes.items() if rtt is not None}
+        live = []
+        for job in jobs:
+            _, error = probes[(job["router_ip"], job["port"])]
+            if error is None:
+                live.append(job)
+            else:
+                unreachable.append(_unstarted_result(
+                    job, SESSION_CONNECT_ERR, f"connect error: preflight: {error}"
+                ))
+        jobs = live
+        median_rtt = (
+            f", median RTT {_percentile(list(rtts.values()), 50) * 1000:.1f} ms"
+            if rtts else ""
+        )
+        log_message(
+            f"[main] preflight: {len(live)} host(s) reachable, "
+            f"{len(unreachable)} unreachable in "
+            f"{time.monotonic() - run_started_mono:.2f}s{median_rtt}"
+        )
+    predicted = None
+    if host_history is not None:
+        seeded = host_history.seed_from_outputs(options.logs_dir)
+        if seeded:
+            log_message(f"[main] schedule: seeded {seeded} host(s) from earlier outputs")
+        file_order = [host_history.estimate(job["router_ip"]) for job in jobs]
+        jobs, estimates = host_history.order(jobs, rtts)
+        if None not in estimates:
+            # Predicted at the starting limit for --max-workers auto.
+            workers = _current_limit(max_workers)
+            fill = _percentile(estimates, 50)
+            predicted = (
+                predict_makespan(estimates, workers),
+                predict_makespan(
+                    [fill if e is None else e for e in file_order], workers
+                ),
+            )
 
     try:
-        # Phase 1: SSH transport with optional retry on transient failures.
-        # AuthenticationException is intentionally NOT retried.
-        attempt = 0
-        while True:
+        journal = RunJournal(options.logs_dir)
+    except OSError as ex:
+        journal = None
+        log_message(f"[main] warning: could not open the run journal: {ex}")
+
+    breaker = pools = domains = None
+    if options.circuit_breaker or options.per_site_workers:
+        domains = failure_domains(parsed_hosts, options.failure_domain_prefix)
+        if options.circuit_breaker:
+            breaker = CircuitBreaker(domains, options.circuit_breaker)
+    if options.controller_workers or options.edge_workers or options.per_site_workers:
+        pools = WorkerPools(
+            {
+                DEVICE_CONTROLLER: options.controller_workers,
+                DEVICE_EDGE: options.edge_workers,
+            },
+            options.per_site_workers,
+            domains,
+        )
+        log_message(
+            "[main] worker pools: "
+            f"controllers={options.controller_workers or 'shared'}, "
+            f"edges={options.edge_workers or 'shared'}, "
+            f"per site={options.per_site_workers or 'unlimited'}"
+        )
+    if engine == ENGINE_SELECTORS:
+        results = run_selectors_engine(jobs, max_workers, cancel, breaker, pools)
+    elif engine == ENGINE_STAGED:
+        results = run_staged_engine(
+            jobs, max_workers, cancel, breaker, pools,
+            options.connect_workers, options.ready_sessions,
+        )
+    else:
+        results = run_threaded_engine(jobs, max_workers, cancel, breaker, pools)
+    # Preflight failures lasted no time, so they teach the history nothing.
+    no_history = {id(result) for result in unreachable}
+    results = itertools.chain(unreachable, results)
+
+    # Wait for all hosts to complete; surface aggregate counts.
+    ok = 0
+    bad = 0
+    cut_short = collections.Counter()
+    retried = collections.Counter()
+    fast_failed = 0
+    for result in results:
+        if result and result.get("status") == SESSION_OK:
+            ok += 1
+        else:
+            bad += 1
+        if result and result["connect_attempts"] > 1:
+            retried["hosts"] += 1
+            retried["attempts"] += result["connect_attempts"] - 1
+            if result["connect_s"] is not None:
+                retried["connected"] += 1
+        if result and result["status"] in (SESSION_DEADLINE, SESSION_SKIPPED):
+            # Truncated durations would skew the history.
+            cut_short[result["status"]] += 1
+        elif result and result["status"] == SESSION_CIRCUIT_OPEN:
+            fast_failed += 1
+        elif result and host_history is not None and id(result) not in no_history:
+            host_history.record(result)
+        if result and journal is not None:
             try:
-                ssh.connect(
-                    router_ip,
-                    port=port,
-                    username=username,
-                    password=password,
-                    timeout=10,
-                )
-                break
-            except paramiko.AuthenticationException as ex:
-                session_result["status"] = SESSION_AUTH_SSH
-                session_result["error"] = f"auth error (ssh): {ex}"
-                log_message(f"[{router_ip}] {session_result['error']}")
-                return session_result
-            except (paramiko.SSHException, socket.timeout, OSError) as ex:
-                if attempt < retries:
-                    attempt += 1
-                    log_message(
-                        f"[{router_ip}] connect attempt {attempt} failed: "
-                        f"{ex}; retrying in {retry_delay:.1f}s "
-                        f"({attempt}/{retries})"
-                    )
-                    time.sleep(retry_delay)
-                    continue
-                session_result["status"] = SESSION_CONNECT_ERR
-                session_result["error"] = f"connect error: {ex}"
-                log_message(f"[{router_ip}] {session_result['error']}")
-                return session_result
-        log_message(f"[{router_ip}] connected")
+                journal.record(result, output_paths[result["host"]])
+            except OSError as ex:
+                log_message(f"[main] warning: could not write the run journal: {ex}")
+                journal.close()
+                journal = None
+    if journal is not None:
+        journal.close()
+    if post_processor is not None:
+        post_processor.close()
+    makespan = time.monotonic() - run_started_mono
+    if retried:
+        log_message(
+            f"[main] retries: {retried['attempts']} retry attempt(s) for "
+            f"{retried['hosts']} host(s); {retried['connected']} host(s) "
+            f"connected on a retry"
+        )
+    if breaker is not None and breaker.opened:
+        log_message(
+            f"[main] circuit breaker: {breaker.opened} failure domain(s) "
+            f"opened; {fast_failed} host(s) failed without connecting"
+        )
+    if cut_short:
+        reason = ""
+        if cancel is not None and cancel.is_set():
+            reason = f" ({cancel.reason})"
+        log_message(
+            f"[main] cut short{reason}: "
+            f"{cut_short[SESSION_DEADLINE]} host(s) stopped early, "
+            f"{cut_short[SESSION_SKIPPED]} skipped"
+        )
+    if host_history is not None:
+        if predicted is not None:
+            log_message(
+                f"[main] schedule: longest-first predicted makespan "
+                f"{predicted[0]:.1f}s (hosts-file order {predicted[1]:.1f}s), "
+                f"actual {makespan:.1f}s"
+            )
+        else:
+            log_message("[main] schedule: no host history yet; hosts-file order used")
+        try:
+            host_history.save()
+        except OSError as ex:
+            log_message(f"[main] warning: could not save host history: {ex}")
+    if latency_profile is not None:
+        log_message(latency_profile.finish_run(makespan))
+        try:
+            latency_profile.save()
+        except OSError as ex:
+            log_message(f"[main] warning: could not save latency profile: {ex}")
+    if session_pool is not None:
+        log_message(
+            f"[main] pool: reused={session_pool.hits - hits}, "
+            f"fresh={session_pool.misses - misses}, warm={len(session_pool)}"
+        )
+    log_message(f"[main] done: success={ok}, failed={bad}")
+    return ok, bad
 
-        # Phase 2: Open an interactive shell and settle on a usable command
-        # prompt. Edges and controllers differ here, so branch on the
-        # connection profile.
-        shell = ssh.invoke_shell()
 
-        if device_type == DEVICE_CONTROLLER:
-            # Controllers (vBond / vSmart) reached through vManage land us
-            # directly in the viptela CLI on the SSH transport: there is no
-            # "shell" sub-process and the password was already supplied during
-            # the SSH handshake (asked only once). Just wait for the CLI
-            # prompt to appear.
-            buf, kind = read_channel(
-                shell,
-                prompt_re=DEFAULT_PROMPT_RE,
-                expect_re=CONTROLLER_REAUTH_RE,
-                idle_timeout=1.0,
-                max_wait=10.0,
+# ---------------------------------------------------------------------------
+# Process shards (--shards)
+# ---------------------------------------------------------------------------
+#
+# One Python process tops out at a few hundred concurrent sessions: paramiko
+# spends its time in the interpreter (key exchange, packet framing), so more
+# threads only queue on the GIL. ``--shards N`` deals the hosts to N child
+# processes, each an ordinary :func:`run_hosts` with its own engine and
+# worker pool, while the parent coordinates:
+#
+# - child log lines come back over a pipe and are printed by the parent; a
+#   child's ``[main] X`` becomes ``[main] shard k/N: X`` and its own start /
+#   done lines are reworded, so the run still logs exactly one ``[main]
+#   starting`` and one ``[main] done: success=, failed=`` line;
+# - the first SIGINT / SIGTERM cancels every shard cooperatively (also when
+#   only the parent was signalled); a second one aborts;
+# - --host-history is read and saved by the parent only, and with it the
+#   hosts are dealt longest-first to the least-loaded shard. With
+#   --circuit-breaker or --per-site-workers a failure domain is never split,
+#   so those stay exact; the other worker limits apply per shard;
+# - shards append to the one run journal and each writes its preflight
+#   results to ``preflight.shardK.json``, merged into preflight.json.
+#
+# Messages child -> parent are ``("log", line)``, ``("history", hosts)`` and
+# ``("done", ok, bad)``; parent -> child is one cancel reason string.
+SHARD_PREFLIGHT_NAME = "preflight.shard{}.json"
+
+
+def split_shards(parsed_hosts, shards, domains=None, host_history=None):
+    """Deal ``parsed_hosts`` into at most ``shards`` non-empty lists.
+
+    Hosts are dealt in units, each to the shard with the least expected work
+    so far: one host per unit, or every host of a failure domain together
+    when ``domains`` (see :func:`failure_domains`) is given. A unit weighs
+    its hosts' ``host_history`` estimates (the median estimate for unknown
+    hosts), or its host count without history; heavier units are dealt
+    first. Each shard keeps the hosts-file order.
+    """
+    units = {}
+    for index, host in enumerate(parsed_hosts):
+        key = domains[host[0]] if domains is not None else index
+        units.setdefault(key, []).append(index)
+    estimates = [None] * len(parsed_hosts)
+    if host_history is not None:
+        estimates = [host_history.estimate(host[0]) for host in parsed_hosts]
+    known = [e for e in estimates if e is not None]
+    fill = _percentile(known, 50) if known else 1.0
+    weights = {
+        key: sum(fill if estimates[i] is None else estimates[i] for i in members)
+        for key, members in units.items()
+    }
+    loads = [(0.0, shard) for shard in range(min(shards, len(units)))]
+    assigned = [[] for _ in loads]
+    for key in sorted(units, key=lambda key: -weights[key]):
+        load, shard = heapq.heappop(loads)
+        assigned[shard].extend(units[key])
+        heapq.heappush(loads, (load + weights[key], shard))
+    return [[parsed_hosts[i] for i in sorted(members)] for members in assigned]
+
+
+def _shard_line(line, label):
+    """Rewrite one child log line for the parent's log (see above)."""
+    if not line.startswith("[main] "):
+        return line
+    rest = line[len("[main] "):]
+    if rest.startswith("starting "):
+        rest = rest[len("starting "):]
+    elif rest.startswith("done: "):
+        rest = rest[len("done: "):]
+    return f"[main] {label}: {rest}"
+
+
+class _ShardHistory(HostHistory):
+    """A shard's slice of the run's HostHistory; :meth:`save` reports back."""
+
+    def __init__(self, hosts, send):
+        super().__init__()
+        self._hosts = hosts
+        self._send = send
+
+    def save(self):
+        with self._lock:
+            self._send(("history", self._hosts))
+
+
+def _run_shard(hosts, options, shared_password, settings, history,
+               log_conn, control_conn):
+    """Child process body: one :func:`run_hosts` over ``hosts``."""
+    global PREFLIGHT_NAME
+    PREFLIGHT_NAME = SHARD_PREFLIGHT_NAME.format(settings["index"])
+    # The parent prints everything; this process only reports.
+    sys.stdout = open(os.devnull, "w")
+
+    def send(message):
+        with print_lock:
+            log_conn.send(message)
+
+    log_listeners[:] = [lambda line: log_conn.send(("log", line))]
+    cancel = CancelToken()
+    install_interrupt_handler(cancel)
+
+    def watch_parent():
+        try:
+            reason = control_conn.recv()
+        except (EOFError, OSError):
+            reason = "coordinator exited"
+        cancel.cancel(reason)
+
+    threading.Thread(target=watch_parent, name="shard-cancel", daemon=True).start()
+    if history is not None:
+        history = _ShardHistory(history, send)
+    pipeline = settings["pipeline"]
+    ok, bad = run_hosts(
+        hosts, options, shared_password, settings["max_workers"],
+        settings["engine"], None,
+        CommandPipeline(pipeline) if pipeline > 1 else None,
+        max_load=settings["max_load"], host_history=history, cancel=cancel,
+    )
+    send(("done", ok, bad))
+
+
+def _merge_shard_preflight(logs_dir, count):
+    """Merge the shards' preflight files into one ``preflight.json``."""
+    merged = None
+    for index in range(1, count + 1):
+        path = os.path.join(logs_dir, SHARD_PREFLIGHT_NAME.format(index))
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if merged is None:
+            merged = data
+        else:
+            merged["probed_at"] = min(merged["probed_at"], data["probed_at"])
+            merged["hosts"].update(data["hosts"])
+        os.remove(path)
+    if merged is not None:
+        path = os.path.join(logs_dir, PREFLIGHT_NAME)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(merged, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+
+def run_sharded(parsed_hosts, options, shared_password, shards,
+                max_workers=None, engine=ENGINE_THREADS, pipeline=None,
+                max_load=None, host_history=None, cancel=None):
+    """Run ``parsed_hosts`` across ``shards`` processes (see above).
+
+    ``max_workers``, ``engine``, ``pipeline`` and ``max_load`` apply to
+    each shard as in :func:`run_hosts`; ``host_history`` deals the hosts
+    (:func:`split_shards`) and learns from every shard; ``cancel`` stops
+    all shards. Returns ``(succeeded, failed)`` host counts over all
+    shards; the hosts of a shard that died without reporting count as
+    failed.
+    """
+    os.makedirs(options.logs_dir, exist_ok=True)
+    domains = None
+    if options.circuit_breaker or options.per_site_workers:
+        domains = failure_domains(parsed_hosts, options.failure_domain_prefix)
+    groups = split_shards(parsed_hosts, shards, domains, host_history)
+    log_message(
+        f"[main] starting {len(parsed_hosts)} host(s) in {len(groups)} shard "
+        f"process(es) ({'/'.join(str(len(g)) for g in groups)} host(s)); "
+        f"engine: {engine}"
+    )
+    # Fork where available: nothing is running yet, and the children need
+    # not re-import this script. Elsewhere (Windows) spawn re-imports it.
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context("fork" if "fork" in methods else None)
+    children = []
+    try:
+        for index, hosts in enumerate(groups, 1):
+            history = None
+            if host_history is not None:
+                history = host_history.samples(host[0] for host in hosts)
+            log_recv, log_send = context.Pipe(duplex=False)
+            control_recv, control_send = context.Pipe(duplex=False)
+            settings = {
+                "index": index,
+                "max_workers": max_workers,
+                "engine": engine,
+                "pipeline": pipeline.depth if pipeline is not None else 1,
+                "max_load": max_load,
+            }
+            process = context.Process(
+                target=_run_shard,
+                args=(hosts, options, shared_password, settings, history,
+                      log_send, control_recv),
+                name=f"shard-{index}",
             )
-            auth_banner.append(buf)
-            if kind == MATCH_EXPECT:
-                # The controller unexpectedly asked for a password again (or
-                # reported an auth failure). The controller profile assumes a
-                # single password was already supplied during the SSH
-                # handshake, so we deliberately do NOT resend it here: doing so
-                # could leak the password into command output and would mask the
-                # real problem. Fail clearly instead.
-                if AUTH_FAILURE_RE.search(buf):
-                    session_result["error"] = (
-                        "auth error (shell): controller rejected the password"
-                    )
-                else:
-                    session_result["error"] = (
-                        "auth error (shell): controller re-prompted for a "
-                        "password (single-password profile does not resend); "
-                        "aborting"
-                    )
-                session_result["status"] = SESSION_AUTH_SHELL
-                log_message(f"[{router_ip}] {session_result['error']}")
-                return session_result
-            if kind != MATCH_PROMPT:
-                # A long login banner may push the prompt past the window;
-                # warn but continue and rely on per-command max_wait.
-                log_message(
-                    f"[{router_ip}] warning: no CLI prompt after login "
-                    f"({kind}); proceeding anyway"
-                )
+            process.start()
+            log_send.close()
+            control_recv.close()
+            children.append({
+                "label": f"shard {index}/{len(groups)}",
+                "hosts": hosts,
+                "process": process,
+                "log": log_recv,
+                "control": control_send,
+                "done": None,
+            })
 
-            # Phase 3: Capture the device's prompt for accurate completion
-            # detection. Fall back to the default regex if extraction fails.
-            captured_prompt = extract_prompt("".join(auth_banner))
-            cmd_prompt_re = build_command_prompt_re(captured_prompt)
-            if captured_prompt:
-                log_message(f"[{router_ip}] prompt: {captured_prompt}")
-            else:
-                log_message(
-                    f"[{router_ip}] prompt: <not captured, using default regex>"
-                )
+        by_conn = {shard["log"]: shard for shard in children}
+        forwarded = False
+        while by_conn:
+            if not forwarded and cancel is not None and cancel.is_set():
+                forwarded = True
+                for shard in children:
+                    try:
+                        shard["control"].send(cancel.reason)
+                    except OSError:
+                        pass  # already finished
+            ready = multiprocessing.connection.wait(
+                list(by_conn), CANCEL_POLL_INTERVAL
+            )
+            for conn in ready:
+                shard = by_conn[conn]
+                try:
+                    message = conn.recv()
+                except (EOFError, OSError):
+                    del by_conn[conn]
+                    continue
+                if message[0] == "log":
+                    log_message(_shard_line(message[1], shard["label"]))
+                elif message[0] == "history":
+                    # Only the shard's own hosts: it may have seeded others.
+                    mine = {host[0] for host in shard["hosts"]}
+                    host_history.update(
+                        {h: d for h, d in message[1].items() if h in mine}
+                    )
+                elif message[0] == "done":
+                    shard["done"] = message[1:]
+    finally:
+        for shard in children:
+            if shard["process"].is_alive() and shard["done"] is None:
+                shard["process"].terminate()
+            shard["process"].join()
+            shard["log"].close()
+            shard["control"].close()
 
-            # Phase 4: Disable pagination in the viptela CLI (vBond / vSmart /
-            # vEdge). Sent automatically for every controller-profile host.
-            shell.send("paginate false\n")
-            _, page_kind = read_until_prompt(
-                shell,
-                prompt_re=cmd_prompt_re,
-                idle_timeout=1.0,
-                max_wait=5.0,
+    ok = bad = 0
+    for shard in children:
+        if shard["done"] is None:
+            log_message(
+                f"[main] {shard['label']}: exited with code "
+                f"{shard['process'].exitcode} before finishing; counting its "
+                f"{len(shard['hosts'])} host(s) as failed"
             )
-            if page_kind != MATCH_PROMPT:
-                log_message(
-                    f"[{router_ip}] warning: 'paginate false' did not "
-                    f"return a prompt ({page_kind}); first command output may "
-                    "include residual data"
-                )
+            bad += len(shard["hosts"])
         else:
-            # Edge profile: enter the device "shell" sub-process. Wait for
-            # either a re-auth password prompt or the device's command prompt
-            # -- whichever comes first.
-            shell.send("shell\n")
-            log_message(f"[{router_ip}] entered shell")
-
-            buf, kind = read_channel(
-                shell,
-                prompt_re=DEFAULT_PROMPT_RE,
-                expect_re=PASSWORD_PROMPT_RE,
-                idle_timeout=1.0,
-                max_wait=10.0,
+            ok += shard["done"][0]
+            bad += shard["done"][1]
+    if options.preflight:
+        try:
+            _merge_shard_preflight(options.logs_dir, len(children))
+        except OSError as ex:
+            log_message(f"[main] warning: could not save preflight results: {ex}")
+    if host_history is not None:
+        try:
+            host_history.save()
+        except OSError as ex:
+            log_message(f"[main] warning: could not save host history: {ex}")
+    log_message(f"[main] done: success={ok}, failed={bad}")
+    return ok, bad
+
+
+# ---------------------------------------------------------------------------
+# Session pool daemon (--serve / --server)
+# ---------------------------------------------------------------------------
+#
+# ``--serve SOCKET`` keeps a SessionPool alive between runs and accepts runs
+# over a local Unix socket; ``--server SOCKET`` makes an ordinary invocation
+# submit its run there instead of executing it (falling back to a local run
+# when no daemon answers). The wire format is one JSON object per line:
+#
+#   client -> daemon  {"hosts": [[ip, user, password|null, device_type
+#                                 (, site)], ...],
+#                      "password": shared password|null,
+#                      "options": {<SERVE_RUN_OPTIONS>}}
+#   daemon -> client  {"log": line} ...  then  {"done": {"success": n,
+#                      "failed": m}}  or  {"error": message}
+#
+# Runs are executed one at a time, so the streamed log is exactly the run's
+# own. The socket file is created mode 0600 because requests carry passwords.
+
+# Per-run settings a client forwards to the daemon (argparse dest names);
+# engine, concurrency, pipelining and the latency profile are the daemon's.
+SERVE_RUN_OPTIONS = (
+    "commands_file",
+    "controller_commands",
+    "edge_commands",
+    "port",
+    "controller_port",
+    "reject_unknown_hosts",
+    "password_prompt",
+    "retries",
+    "retry_delay",
+    "logs_dir",
+    "output_format",
+    "deadline",
+    "host_budget",
+    "preflight",
+    "preflight_timeout",
+    "circuit_breaker",
+    "failure_domain_prefix",
+    "controller_workers",
+    "edge_workers",
+    "per_site_workers",
+    "connect_workers",
+    "ready_sessions",
+    "ssh_auth",
+    "kex",
+    "ciphers",
+    "banner_timeout",
+    "auth_timeout",
+    "post_process_workers",
+    "record",
+    "replay",
+    "replay_speed",
+)
+# Option values that are paths; the client makes them absolute because the
+# daemon may run from a different working directory.
+SERVE_PATH_OPTIONS = ("commands_file", "controller_commands", "edge_commands", "logs_dir")
+# How often the daemon closes pooled shells idle for longer than the TTL.
+SERVE_REAP_INTERVAL = 60.0
+
+
+class _PoolRequestHandler(socketserver.StreamRequestHandler):
+    """One client connection of a :class:`PoolDaemon` (one run).
+
+    The run is cancelled like an interrupted local run once the client goes
+    away (Ctrl-C, or the web UI killing its process group): when its end of
+    the socket reaches EOF or a write to it fails.
+    """
+
+    def setup(self):
+        super().setup()
+        self.cancel = CancelToken()
+
+    def send(self, message):
+        try:
+            self.wfile.write(json.dumps(message).encode() + b"\n")
+            self.wfile.flush()
+        except OSError:
+            self.cancel.cancel("client disconnected")
+
+    def watch_client(self, finished):
+        """Cancel the run when the client closes the connection."""
+        with selectors.DefaultSelector() as selector:
+            selector.register(self.connection, selectors.EVENT_READ)
+            while not finished.is_set():
+                if not selector.select(CANCEL_POLL_INTERVAL):
+                    continue
+                try:
+                    data = self.connection.recv(4096)
+                except OSError:
+                    data = b""
+                if not data:
+                    self.cancel.cancel("client disconnected")
+                    return
+
+    def send_log(self, message):
+        self.send({"log": message})
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+            parsed_hosts = [tuple(host) for host in request["hosts"]]
+            options = argparse.Namespace(
+                **{name: request["options"][name] for name in SERVE_RUN_OPTIONS}
             )
-            auth_banner.append(buf)
+            shared_password = request.get("password")
+        except (ValueError, KeyError, TypeError) as ex:
+            self.send({"error": f"bad request: {ex}"})
+            return
+        if not parsed_hosts:
+            self.send({"error": "no hosts in request"})
+            return
+        finished = threading.Event()
+        watcher = threading.Thread(
+            target=self.watch_client, args=(finished,), name="serve-client",
+            daemon=True,
+        )
+        watcher.start()
+        try:
+            ok, bad = self.server.pool_daemon.run(
+                parsed_hosts, options, shared_password, self.send_log,
+                self.cancel,
+            )
+        finally:
+            finished.set()
+            watcher.join()
+        self.send({"done": {"success": ok, "failed": bad}})
 
-            if kind == MATCH_EXPECT:
-                # Re-authentication requested by the device.
-                shell.send(f"{password}\n")
-                buf, kind = read_channel(
-                    shell,
-                    prompt_re=DEFAULT_PROMPT_RE,
-                    expect_re=AUTH_FAILURE_RE,
-                    idle_timeout=1.0,
-                    max_wait=10.0,
-                )
-                auth_banner.append(buf)
-                if kind == MATCH_EXPECT:
-                    session_result["status"] = SESSION_AUTH_SHELL
-                    session_result["error"] = (
-                        "auth error (shell): device rejected the password"
-                    )
-                    log_message(f"[{router_ip}] {session_result['error']}")
-                    return session_result
-                if kind != MATCH_PROMPT:
-                    session_result["status"] = SESSION_SHELL_ERR
-                    session_result["error"] = (
-                        f"shell did not return a prompt after password "
-                        f"(got {kind}); aborting"
-                    )
-                    log_message(f"[{router_ip}] {session_result['error']}")
-                    return session_result
-            elif kind != MATCH_PROMPT:
-                # Neither a prompt nor a password request appeared in the
-                # initial window. Some platforms emit a long banner first;
-                # we log a warning but continue and rely on the per-command
-                # max_wait to recover.
-                log_message(
-                    f"[{router_ip}] warning: shell entry returned no prompt "
-                    f"({kind}); proceeding anyway"
-                )
 
-            # Phase 3: Capture the device's prompt for accurate completion
-            # detection. Fall back to the default regex if extraction fails.
-            captured_prompt = extract_prompt("".join(auth_banner))
-            cmd_prompt_re = build_command_prompt_re(captured_prompt)
-            if captured_prompt:
-                log_message(f"[{router_ip}] prompt: {captured_prompt}")
+class PoolDaemon:
+    """The --serve daemon: executes submitted runs against one SessionPool.
+
+    Binds ``socket_path`` (mode 0600) on construction, replacing a stale
+    socket file left by a killed daemon. :meth:`serve_forever` blocks until
+    :meth:`shutdown` is called from another thread or the process is
+    interrupted, then closes the pool and removes the socket.
+    """
+
+    def __init__(self, socket_path, session_pool, max_workers=None,
+                 engine=ENGINE_THREADS, latency_profile=None, pipeline=None,
+                 max_load=None, host_history=None):
+        self.socket_path = socket_path
+        self.session_pool = session_pool
+        self.max_workers = max_workers
+        self.max_load = max_load
+        self.host_history = host_history
+        self.engine = engine
+        self.latency_profile = latency_profile
+        self.pipeline = pipeline
+        self._run_lock = threading.Lock()
+        self._stop = threading.Event()
+        if os.path.exists(socket_path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(socket_path)
+            except OSError:
+                os.unlink(socket_path)
             else:
-                log_message(
-                    f"[{router_ip}] prompt: <not captured, using default regex>"
-                )
+                raise OSError(f"another daemon is already serving {socket_path}")
+            finally:
+                probe.close()
+        # Built here rather than at module level: UnixStreamServer does not
+        # exist on platforms without AF_UNIX, where the rest of this module
+        # must still import.
+        server_cls = type(
+            "_PoolServer",
+            (socketserver.ThreadingMixIn, socketserver.UnixStreamServer),
+            {"daemon_threads": True},
+        )
+        self._server = server_cls(socket_path, _PoolRequestHandler)
+        self._server.pool_daemon = self
+        os.chmod(socket_path, 0o600)
 
-            # Phase 4: Disable pagination on the IOS-XE edge with
-            # 'terminal length 0' (sent automatically for every edge-profile
-            # host). Wait for the captured prompt to ensure the shell is
-            # settled before user commands start.
-            shell.send("terminal length 0\n")
-            _, term_kind = read_until_prompt(
-                shell,
-                prompt_re=cmd_prompt_re,
-                idle_timeout=1.0,
-                max_wait=5.0,
-            )
-            if term_kind != MATCH_PROMPT:
-                log_message(
-                    f"[{router_ip}] warning: 'terminal length 0' did not "
-                    f"return a prompt ({term_kind}); first command output may "
-                    "include residual data"
-                )
+    def run(self, parsed_hosts, options, shared_password, log, cancel=None):
+        """Execute one submitted run, teeing its log lines to ``log``.
 
-        # Phase 5: Run the user's commands. Each command captures its own
-        # metadata (start time, duration, exit kind) so that downstream
-        # writers can render boundaries (Issue 9) and structured outputs
-        # (Issue 14). A missing/empty commands_file (e.g. a device type with
-        # no split list) leaves the session connected but command-free.
-        if not commands_file:
-            log_message(
-                f"[{router_ip}] no commands file for device type "
-                f"{device_type}; connected but running no commands"
-            )
-            session_result["status"] = SESSION_OK
-            return session_result
-        with open(commands_file, "r") as file:
-            for line in file:
-                command = line.strip()
-                if not command or command.startswith("#"):
-                    continue
-                log_message(f"[{router_ip}] running: {command}")
-                cmd_started_wall = now_iso()
-                cmd_started_mono = time.monotonic()
-                # Prefix Ctrl-U (line kill) so any keystroke the previous
-                # command's pager left echoed on the input line (e.g. "!" or
-                # "q") is cleared before this command is typed; otherwise it
-                # would prepend to and corrupt the command.
-                shell.send(f"\x15{command}\n")
-                # Prompt detection short-circuits short commands; max_wait
-                # is the safety upper bound for long commands like
-                # 'show tech-support'. read_until_prompt nudges the device
-                # with a newline if the prompt is slow to redraw, so a late
-                # prompt is confirmed instead of being misreported as idle.
-                command_output, cmd_kind = read_until_prompt(
-                    shell,
-                    prompt_re=cmd_prompt_re,
-                    idle_timeout=1.0,
-                    max_wait=120.0,
-                )
-                command_output = clean_command_output(command_output)
-                cmd_status = CMD_OK if cmd_kind == MATCH_PROMPT else CMD_TIMEOUT
-                session_result["commands"].append(
-                    {
-                        "command": command,
-                        "started_at": cmd_started_wall,
-                        "duration_s": time.monotonic() - cmd_started_mono,
-                        "exit_kind": cmd_kind,
-                        "status": cmd_status,
-                        "output": command_output,
-                    }
+        ``cancel`` (a :class:`CancelToken`) stops the run early, as for
+        :func:`run_hosts`.
+        """
+        with self._run_lock:
+            log_listeners.append(log)
+            try:
+                return run_hosts(
+                    parsed_hosts, options, shared_password, self.max_workers,
+                    self.engine, self.latency_profile, self.pipeline,
+                    self.session_pool, self.max_load, self.host_history,
+                    cancel,
                 )
-                if cmd_status == CMD_OK:
-                    log_message(f"[{router_ip}] done: {command}")
-                else:
-                    log_message(
-                        f"[{router_ip}] command timeout ({cmd_kind}): "
-                        f"{command}"
-                    )
+            finally:
+                log_listeners.remove(log)
 
-        session_result["status"] = SESSION_OK
-    except (paramiko.SSHException, socket.timeout, OSError) as ex:
-        session_result["status"] = SESSION_OTHER_ERR
-        session_result["error"] = str(ex)
-        log_message(f"[{router_ip}] error: {ex}")
-    finally:
+    def _reap(self):
+        while not self._stop.wait(SERVE_REAP_INTERVAL):
+            evicted = self.session_pool.evict_idle()
+            if evicted:
+                log_message(f"[serve] closed {evicted} idle pooled session(s)")
+
+    def serve_forever(self):
+        threading.Thread(target=self._reap, name="pool-reaper", daemon=True).start()
+        log_message(
+            f"[serve] listening on {self.socket_path} (pool size "
+            f"{self.session_pool.max_size}, idle ttl "
+            f"{self.session_pool.idle_ttl:.0f}s)"
+        )
         try:
-            ssh.close()
-        except Exception:
+            self._server.serve_forever()
+        except KeyboardInterrupt:
             pass
-        session_result["ended_at"] = now_iso()
-        session_result["duration_s"] = time.monotonic() - started_mono
-        try:
-            _write_outputs(session_result, output_paths)
-        except OSError as ex:
-            log_message(f"[{router_ip}] failed to write output: {ex}")
-    return session_result
+        finally:
+            self._stop.set()
+            self._server.server_close()
+            self.session_pool.close()
+            try:
+                os.unlink(self.socket_path)
+            except OSError:
+                pass
+            log_message("[serve] stopped")
 
-def _parse_output_formats(arg_value):
-    """Validate --output-format and return a list of unique format names."""
-    raw = [p.strip().lower() for p in arg_value.split(",") if p.strip()]
-    if not raw:
-        raise argparse.ArgumentTypeError("--output-format requires at least one format")
-    seen = []
-    for fmt in raw:
-        if fmt not in ALL_OUTPUT_FORMATS:
-            raise argparse.ArgumentTypeError(
-                f"unknown output format: {fmt!r}. "
-                f"Valid: {', '.join(ALL_OUTPUT_FORMATS)}"
-            )
-        if fmt not in seen:
-            seen.append(fmt)
-    return seen
+    def shutdown(self):
+        """Stop :meth:`serve_forever` (call from another thread)."""
+        self._server.shutdown()
 
 
-def _build_output_paths(logs_dir, router_ip, timestamp, formats):
-    """Build a {format -> path} dict for one host run."""
-    ext_map = {
-        OUTPUT_FORMAT_TEXT: "txt",
-        OUTPUT_FORMAT_JSON: "json",
-        OUTPUT_FORMAT_CSV: "csv",
+def submit_to_server(socket_path, parsed_hosts, options, shared_password=None):
+    """Run ``parsed_hosts`` on a --serve daemon, echoing its log to stdout.
+
+    Returns ``(succeeded, failed)`` host counts, or ``None`` if no daemon is
+    listening on ``socket_path``. Raises RuntimeError if the daemon rejects
+    the request or drops the connection mid-run.
+    """
+    request_options = {name: getattr(options, name) for name in SERVE_RUN_OPTIONS}
+    for name in SERVE_PATH_OPTIONS:
+        if request_options[name]:
+            request_options[name] = os.path.abspath(request_options[name])
+    request = {
+        "hosts": [list(host) for host in parsed_hosts],
+        "password": shared_password,
+        "options": request_options,
     }
-    paths = {}
-    for fmt in formats:
-        ext = ext_map[fmt]
-        paths[fmt] = os.path.join(logs_dir, f"output_{router_ip}_{timestamp}.{ext}")
-    return paths
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except OSError:
+        sock.close()
+        return None
+    with sock, sock.makefile("rwb") as stream:
+        stream.write(json.dumps(request).encode() + b"\n")
+        stream.flush()
+        for line in stream:
+            message = json.loads(line)
+            if "log" in message:
+                with print_lock:
+                    print(message["log"], flush=True)
+            elif "done" in message:
+                return message["done"]["success"], message["done"]["failed"]
+            elif "error" in message:
+                raise RuntimeError(message["error"])
+    raise RuntimeError("daemon closed the connection before the run finished")
 
 
 if __name__ == "__main__":
@@ -1072,6 +5904,37 @@ if __name__ == "__main__":
             "    python3 bulk-show.py hosts.txt commands.txt --output-format text,json,csv\n"
             "  Mix edges and controllers (vBond/vSmart) in one hosts file:\n"
             "    python3 bulk-show.py hosts.txt commands.txt\n"
+            "  Let concurrency adapt to connect errors / timeouts / vManage load:\n"
+            "    python3 bulk-show.py hosts.txt commands.txt --max-workers auto --max-load 8\n"
+            "  Spread 5000 hosts over 4 processes of 64 workers each:\n"
+            "    python3 bulk-show.py hosts.txt commands.txt --shards 4 --max-workers 64\n"
+            "  Drive 500 concurrent sessions from one event loop:\n"
+            "    python3 bulk-show.py hosts.txt commands.txt --engine selectors \\\n"
+            "        --max-workers 500\n"
+            "  Send up to 8 commands per round trip on high-latency links:\n"
+            "    python3 bulk-show.py hosts.txt commands.txt --pipeline 8\n"
+            "  Learn per-command timeouts across runs and report time saved:\n"
+            "    python3 bulk-show.py hosts.txt commands.txt --latency-profile latency.json\n"
+            "  Fail unreachable hosts in seconds instead of SSH timeouts:\n"
+            "    python3 bulk-show.py hosts.txt commands.txt --preflight --retries 2\n"
+            "  Protect controllers and WAN links in a mixed inventory:\n"
+            "    python3 bulk-show.py hosts.txt commands.txt --controller-workers 2 \\\n"
+            "        --edge-workers 64 --per-site-workers 4\n"
+            "  Stop hammering a site that went dark (hosts tagged site=...):\n"
+            "    python3 bulk-show.py hosts.txt commands.txt --circuit-breaker 3\n"
+            "  Re-run only the hosts an interrupted run did not finish:\n"
+            "    python3 bulk-show.py hosts.txt commands.txt --resume logs\n"
+            "  Give the run 10 minutes and any single host 2 minutes:\n"
+            "    python3 bulk-show.py hosts.txt commands.txt --deadline 600 --host-budget 120\n"
+            "  Start the historically slowest hosts first to shorten the tail:\n"
+            "    python3 bulk-show.py hosts.txt commands.txt --host-history hosts-history.json\n"
+            "  Capture the fleet's sessions, then replay them offline at 10x speed:\n"
+            "    python3 bulk-show.py hosts.txt commands.txt --record transcripts\n"
+            "    python3 bulk-show.py hosts.txt commands.txt --replay transcripts \\\n"
+            "        --replay-speed 10\n"
+            "  Keep logged-in shells warm between scheduled runs:\n"
+            "    python3 bulk-show.py --serve /tmp/bulk-show.sock &\n"
+            "    python3 bulk-show.py hosts.txt commands.txt --server /tmp/bulk-show.sock\n"
             "  Separate command lists per device type (controller vs edge):\n"
             "    python3 bulk-show.py hosts.txt commands.txt \\\n"
             "      --controller-commands ctrl.txt --edge-commands edge.txt\n"
@@ -1091,12 +5954,14 @@ if __name__ == "__main__":
     )
     parser.add_argument(
         "hosts_file",
+        nargs="?",
         help="File listing hosts. Each line: 'ip,username[,password]' with an "
              "optional device type ('controller'/'vsmart'/'vbond' or "
              "'type=controller'); defaults to edge.",
     )
     parser.add_argument(
         "commands_file",
+        nargs="?",
         help="Default/fallback file with the list of commands. Applied to any "
              "device type that does not have a more specific list via "
              "--controller-commands / --edge-commands.",
@@ -1158,10 +6023,121 @@ if __name__ == "__main__":
     )
     parser.add_argument(
         "--max-workers",
-        type=int,
+        type=_parse_max_workers,
         default=None,
         help="Maximum concurrent SSH sessions. Default: min(8, number of hosts). "
-             "Set higher to fan out faster, lower to reduce load on the network.",
+             "Set higher to fan out faster, lower to reduce load on the network. "
+             "'auto' starts at 8 and adapts (AIMD): +1 per healthy host, halved "
+             "on connect errors, command timeouts or rising connect latency, "
+             f"up to {AIMD_MAX}.",
+    )
+    parser.add_argument(
+        "--max-load",
+        type=float,
+        default=None,
+        metavar="LOAD",
+        help="With --max-workers auto, also back off while this machine's "
+             "1-minute load average is above LOAD (e.g. vManage's core count).",
+    )
+    parser.add_argument(
+        "--controller-workers",
+        type=int,
+        default=None,
+        metavar="N",
+        help="At most N controller sessions at once, within --max-workers. "
+             "Other hosts keep starting while controllers wait. With "
+             "--edge-workers too, --max-workers defaults to their sum.",
+    )
+    parser.add_argument(
+        "--edge-workers",
+        type=int,
+        default=None,
+        metavar="N",
+        help="At most N edge sessions at once, within --max-workers.",
+    )
+    parser.add_argument(
+        "--per-site-workers",
+        type=int,
+        default=None,
+        metavar="N",
+        help="At most N sessions at once per site (hosts-file site= token, "
+             "else the --failure-domain-prefix network), to spare thin WAN "
+             "links.",
+    )
+    parser.add_argument(
+        "--deadline",
+        type=float,
+        default=None,
+        metavar="SECONDS",
+        help="Stop the whole run after SECONDS: in-flight commands end with "
+             "exit kind 'deadline' (partial output kept), unsent commands "
+             "are recorded as skipped, hosts not yet started are recorded "
+             "with status 'skipped', and every output file is completed.",
+    )
+    parser.add_argument(
+        "--host-budget",
+        type=float,
+        default=None,
+        metavar="SECONDS",
+        help="Stop any single host after SECONDS (counted from its start), "
+             "the same way --deadline stops the run.",
+    )
+    parser.add_argument(
+        "--preflight",
+        action="store_true",
+        help="Before any SSH session, open a TCP connect to every host at "
+             "once. Hosts that refuse or do not answer within "
+             "--preflight-timeout fail immediately with connect_error instead "
+             "of holding a worker for the 10 s SSH connect timeout (and any "
+             "retries). RTTs are saved to LOGS_DIR/preflight.json.",
+    )
+    parser.add_argument(
+        "--preflight-timeout",
+        type=float,
+        default=PREFLIGHT_TIMEOUT,
+        metavar="SECONDS",
+        help=f"How long --preflight waits for each host (default: {PREFLIGHT_TIMEOUT}).",
+    )
+    parser.add_argument(
+        "--ssh-auth",
+        choices=ALL_SSH_AUTH,
+        default=SSH_AUTH_PASSWORD,
+        help="SSH authentication methods to try. 'password' (default) sends "
+             "only the password; 'any' first offers SSH agent and ~/.ssh "
+             "keys, as paramiko does by default (one round trip each, and "
+             "devices may answer 'too many authentication failures').",
+    )
+    parser.add_argument(
+        "--kex",
+        type=_parse_name_list,
+        default=None,
+        metavar="NAMES",
+        help="Comma-separated key-exchange algorithms to prefer, in order "
+             "(e.g. curve25519-sha256@libssh.org,ecdh-sha2-nistp256). Other "
+             "algorithms stay available after them. Needs paramiko >= 3.2.",
+    )
+    parser.add_argument(
+        "--ciphers",
+        type=_parse_name_list,
+        default=None,
+        metavar="NAMES",
+        help="Comma-separated ciphers to prefer, in order (e.g. "
+             "aes128-gcm@openssh.com,aes128-ctr). Needs paramiko >= 3.2.",
+    )
+    parser.add_argument(
+        "--banner-timeout",
+        type=float,
+        default=None,
+        metavar="SECONDS",
+        help="Seconds to wait for the SSH banner (default: paramiko's, 15).",
+    )
+    parser.add_argument(
+        "--auth-timeout",
+        type=float,
+        default=None,
+        metavar="SECONDS",
+        help="Seconds to wait for authentication (default: paramiko's, 30). "
+             "Both are capped at the 10 s connect timeout and --deadline.",
     )
     parser.add_argument(
         "--retries",
@@ -1174,7 +6150,27 @@ if __name__ == "__main__":
         "--retry-delay",
         type=float,
         default=5.0,
-        help="Seconds to sleep between connect attempts (default: 5.0).",
+        help="Seconds before the first connect retry (default: 5.0). Each "
+             "later retry doubles it, with +/-25%% jitter. Hosts waiting to "
+             "retry do not hold a worker.",
+    )
+    parser.add_argument(
+        "--circuit-breaker",
+        type=int,
+        default=0,
+        metavar="K",
+        help="After K consecutive connect failures in one failure domain "
+             "(the host's site= token, else its /24), send a single probe "
+             "host; if it fails too, the domain's remaining hosts fail "
+             "immediately with status circuit_open. Default: 0 (off).",
+    )
+    parser.add_argument(
+        "--failure-domain-prefix",
+        type=int,
+        default=FAILURE_DOMAIN_PREFIX,
+        metavar="BITS",
+        help="IPv4 prefix length grouping hosts without site= into failure "
+             f"domains for --circuit-breaker (default: {FAILURE_DOMAIN_PREFIX}).",
     )
     parser.add_argument(
         "--output-format",
@@ -1183,7 +6179,165 @@ if __name__ == "__main__":
         help="Comma-separated output formats per host: text, json, csv. "
              "Default: text. Multiple formats produce multiple files per host.",
     )
+    parser.add_argument(
+        "--engine",
+        choices=ALL_ENGINES,
+        default=ENGINE_THREADS,
+        help="Session engine. 'threads' (default) runs one worker thread per "
+             "in-flight host; 'selectors' drives every host's channel from a "
+             "single event loop so --max-workers can go into the hundreds "
+             "without one polling thread per session; 'staged' logs hosts in "
+             "on --connect-workers threads while --max-workers threads run "
+             "commands, overlapping handshakes with execution. Output files "
+             "are identical.",
+    )
+    parser.add_argument(
+        "--connect-workers",
+        type=int,
+        default=STAGED_CONNECT_WORKERS,
+        metavar="N",
+        help="--engine staged: threads connecting and logging in hosts "
+             f"(default: {STAGED_CONNECT_WORKERS}).",
+    )
+    parser.add_argument(
+        "--ready-sessions",
+        type=int,
+        default=STAGED_READY_SESSIONS,
+        metavar="N",
+        help="--engine staged: logged-in sessions allowed to wait for a free "
+             "--max-workers slot; open sessions stay within --max-workers + N "
+             f"(default: {STAGED_READY_SESSIONS}).",
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=1,
+        metavar="N",
+        help="Split the hosts across N worker processes, each running the "
+             "engine with its own --max-workers (and --controller-workers / "
+             "--edge-workers / --connect-workers), for runs too large for one "
+             "Python process. A site (--circuit-breaker / --per-site-workers) "
+             "is never split. Not with --serve or --latency-profile "
+             "(default: 1).",
+    )
+    parser.add_argument(
+        "--post-process-workers",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Clean and render command output (text / JSON / CSV) in N "
+             "helper processes instead of the threads reading the sessions, "
+             "so that CPU work does not hold up socket reads at high "
+             "--max-workers (default: 0, in-thread).",
+    )
+    parser.add_argument(
+        "--record",
+        default=None,
+        metavar="DIR",
+        help="Save each host's shell traffic (received bytes with their "
+             "arrival times, and everything sent, the password masked) to "
+             "DIR/transcript_<host>.ndjson.gz for --replay.",
+    )
+    parser.add_argument(
+        "--replay",
+        default=None,
+        metavar="DIR",
+        help="Play back the --record transcripts in DIR instead of connecting "
+             "to the hosts, e.g. to benchmark or debug a run offline. Not with "
+             "--record, --preflight, --engine selectors, --serve or --server.",
+    )
+    parser.add_argument(
+        "--replay-speed",
+        type=float,
+        default=1.0,
+        metavar="X",
+        help="--replay: divide the recorded delays by X; 0 replays each "
+             "response as soon as its command is sent (default: 1.0, the "
+             "recorded timing).",
+    )
+    parser.add_argument(
+        "--pipeline",
+        type=int,
+        default=1,
+        metavar="N",
+        help="Send up to N commands back to back per round trip and split the "
+             "combined output at the captured prompt (default: 1, i.e. "
+             "stop-and-wait). Commands that hit a pager or time out inside a "
+             "batch are re-run, and from then on always run, stop-and-wait; "
+             "the commands after them in the batch may already have run "
+             "and are run again, so only pipeline read-only commands.",
+    )
+    parser.add_argument(
+        "--latency-profile",
+        default=None,
+        metavar="PATH",
+        help="JSON file recording per-(device type, command) latencies. When "
+             "given, each command's idle/max-wait/nudge timeouts are derived "
+             "from its observed p99 on earlier runs (fixed defaults until "
+             f"{LATENCY_MIN_SAMPLES} samples exist), the file is updated at "
+             "the end of the run, and a timing report is logged.",
+    )
+    parser.add_argument(
+        "--latency-margin",
+        type=float,
+        default=LATENCY_MARGIN,
+        help="Safety multiplier applied to the observed p99 latencies when "
+             f"deriving timeouts (default: {LATENCY_MARGIN}).",
+    )
+    parser.add_argument(
+        "--resume",
+        default=None,
+        metavar="LOGS_DIR",
+        help="Continue an interrupted run: use LOGS_DIR as --logs-dir and "
+             "skip every host whose latest entry in LOGS_DIR/journal.ndjson "
+             "is 'success'. Failed, timed-out, skipped and never-started "
+             "hosts run again.",
+    )
+    parser.add_argument(
+        "--host-history",
+        default=None,
+        metavar="PATH",
+        help="JSON file of per-host session durations. When given, hosts are "
+             "started longest-expected-first (hosts without history at the "
+             "median estimate; hosts missing from the file are seeded from "
+             "output_*.json in --logs-dir), the file is updated after the "
+             "run, and predicted vs actual makespan is logged.",
+    )
+    parser.add_argument(
+        "--serve",
+        default=None,
+        metavar="SOCKET",
+        help="Run as a daemon on this Unix socket instead of running hosts. "
+             "Logged-in, prompt-settled shells are pooled between runs so "
+             "repeat collections skip the SSH handshake and shell login. "
+             "--engine, --max-workers, --pipeline and --latency-profile apply "
+             "to every run the daemon executes.",
+    )
+    parser.add_argument(
+        "--server",
+        default=None,
+        metavar="SOCKET",
+        help="Submit this run to the --serve daemon on SOCKET and stream its "
+             "log. Falls back to running locally when no daemon answers.",
+    )
+    parser.add_argument(
+        "--pool-size",
+        type=int,
+        default=POOL_MAX_SIZE,
+        help="--serve: maximum number of warm shells kept; the least recently "
+             f"used is closed beyond it (default: {POOL_MAX_SIZE}).",
+    )
+    parser.add_argument(
+        "--pool-idle-ttl",
+        type=float,
+        default=POOL_IDLE_TTL,
+        metavar="SECS",
+        help="--serve: close warm shells unused for this long "
+             f"(default: {POOL_IDLE_TTL:.0f}).",
+    )
     args = parser.parse_args()
+    if args.serve is None and (args.hosts_file is None or args.commands_file is None):
+        parser.error("hosts_file and commands_file are required (unless --serve)")
 
     # Validate numeric arguments early so misuse fails before any I/O.
     if args.port < 1 or args.port > 65535:
@@ -1199,7 +6353,7 @@ if __name__ == "__main__":
             file=sys.stderr,
         )
         sys.exit(2)
-    if args.max_workers is not None and args.max_workers < 1:
+    if args.max_workers not in (None, MAX_WORKERS_AUTO) and args.max_workers < 1:
         print(
             f"--max-workers must be >= 1 (got {args.max_workers})",
             file=sys.stderr,
@@ -1217,6 +6371,149 @@ if __name__ == "__main__":
             file=sys.stderr,
         )
         sys.exit(2)
+    for label, value in (
+        ("--deadline", args.deadline),
+        ("--host-budget", args.host_budget),
+        ("--preflight-timeout", args.preflight_timeout),
+        ("--banner-timeout", args.banner_timeout),
+        ("--auth-timeout", args.auth_timeout),
+    ):
+        if value is not None and value <= 0:
+            print(f"{label} must be > 0 (got {value})", file=sys.stderr)
+            sys.exit(2)
+    for label, value in (
+        ("--controller-workers", args.controller_workers),
+        ("--edge-workers", args.edge_workers),
+        ("--per-site-workers", args.per_site_workers),
+        ("--connect-workers", args.connect_workers),
+    ):
+        if value is not None and value < 1:
+            print(f"{label} must be >= 1 (got {value})", file=sys.stderr)
+            sys.exit(2)
+    if args.post_process_workers < 0:
+        print(
+            f"--post-process-workers must be >= 0 (got {args.post_process_workers})",
+            file=sys.stderr,
+        )
+        sys.exit(2)
+    if args.shards < 1:
+        print(f"--shards must be >= 1 (got {args.shards})", file=sys.stderr)
+        sys.exit(2)
+    if args.replay_speed < 0:
+        print(f"--replay-speed must be >= 0 (got {args.replay_speed})", file=sys.stderr)
+        sys.exit(2)
+    if args.replay and (
+        args.record or args.preflight or args.engine == ENGINE_SELECTORS
+        or args.serve or args.server
+    ):
+        print(
+            "--replay cannot be combined with --record, --preflight, "
+            "--engine selectors, --serve or --server",
+            file=sys.stderr,
+        )
+        sys.exit(2)
+    if args.record and (args.serve or args.server):
+        print("--record cannot be combined with --serve or --server", file=sys.stderr)
+        sys.exit(2)
+    if args.shards > 1 and (args.serve or args.latency_profile):
+        print(
+            "--shards cannot be combined with --serve or --latency-profile",
+            file=sys.stderr,
+        )
+        sys.exit(2)
+    if args.ready_sessions < 0:
+        print(
+            f"--ready-sessions must be >= 0 (got {args.ready_sessions})",
+            file=sys.stderr,
+        )
+        sys.exit(2)
+    if args.circuit_breaker < 0:
+        print(
+            f"--circuit-breaker must be >= 0 (got {args.circuit_breaker})",
+            file=sys.stderr,
+        )
+        sys.exit(2)
+    if not 0 <= args.failure_domain_prefix <= 32:
+        print(
+            "--failure-domain-prefix must be between 0 and 32 "
+            f"(got {args.failure_domain_prefix})",
+            file=sys.stderr,
+        )
+        sys.exit(2)
+    if args.pipeline < 1:
+        print(
+            f"--pipeline must be >= 1 (got {args.pipeline})",
+            file=sys.stderr,
+        )
+        sys.exit(2)
+    if args.latency_margin < 1.0:
+        print(
+            f"--latency-margin must be >= 1.0 (got {args.latency_margin})",
+            file=sys.stderr,
+        )
+        sys.exit(2)
+    if args.max_load is not None and args.max_load <= 0:
+        print(
+            f"--max-load must be > 0 (got {args.max_load})",
+            file=sys.stderr,
+        )
+        sys.exit(2)
+    if args.max_load is not None and not hasattr(os, "getloadavg"):
+        print(
+            "--max-load needs os.getloadavg(), which this platform does not "
+            "provide",
+            file=sys.stderr,
+        )
+        sys.exit(2)
+    if args.pool_size < 1:
+        print(
+            f"--pool-size must be >= 1 (got {args.pool_size})",
+            file=sys.stderr,
+        )
+        sys.exit(2)
+    if args.pool_idle_ttl <= 0:
+        print(
+            f"--pool-idle-ttl must be > 0 (got {args.pool_idle_ttl})",
+            file=sys.stderr,
+        )
+        sys.exit(2)
+    if (args.serve or args.server) and not hasattr(socket, "AF_UNIX"):
+        print(
+            "--serve / --server need Unix domain sockets, which this "
+            "platform does not provide",
+            file=sys.stderr,
+        )
+        sys.exit(2)
+
+    latency_profile = None
+    if args.latency_profile:
+        latency_profile = LatencyProfile.load(
+            args.latency_profile, args.latency_margin
+        )
+    pipeline = CommandPipeline(args.pipeline) if args.pipeline > 1 else None
+    host_history = None
+    if args.host_history:
+        host_history = HostHistory.load(args.host_history)
+
+    if args.serve:
+        # SIGTERM (e.g. from systemd) shuts down like Ctrl-C, closing the pool.
+        signal.signal(signal.SIGTERM, lambda _signum, _frame: sys.exit(0))
+        try:
+            daemon = PoolDaemon(
+                args.serve,
+                SessionPool(args.pool_size, args.pool_idle_ttl),
+                args.max_workers,
+                args.engine,
+                latency_profile,
+                pipeline,
+                args.max_load,
+                host_history,
+            )
+        except OSError as ex:
+            print(f"--serve: {ex}", file=sys.stderr)
+            sys.exit(1)
+        daemon.serve_forever()
+        sys.exit(0)
 
     # Validate the command files that were actually provided. The positional
     # commands_file is always required; the split files are optional and only
@@ -1246,10 +6543,11 @@ if __name__ == "__main__":
     #   "ip,user,password"               -> edge,       embedded (legacy)
     #   "ip,user[,password],controller"  -> controller  (bare keyword)
     #   "ip,user[,password],type=...."   -> explicit device type
+    #   any of the above + ",site=NAME"  -> failure domain for --circuit-breaker
     with open(args.hosts_file, "r") as hosts_file:
         host_lines = hosts_file.readlines()
 
-    # list of tuples: (router_ip, username, password_or_None, device_type)
+    # list of tuples: (router_ip, username, password_or_None, device_type, site)
     parsed_hosts = []
     needs_shared_password = False
 
@@ -1261,7 +6559,7 @@ if __name__ == "__main__":
             continue
         if parsed is None:
             continue
-        router_ip, username, password, device_type = parsed
+        router_ip, username, password = parsed[:3]
 
         if not is_valid_ip(router_ip):
             print(f"Invalid IP address: {router_ip}. Skipping this host.")
@@ -1270,12 +6568,28 @@ if __name__ == "__main__":
         if password is None:
             needs_shared_password = True
 
-        parsed_hosts.append((router_ip, username, password, device_type))
+        parsed_hosts.append(parsed)
 
     if not parsed_hosts:
         print("No valid hosts found. Aborting.", file=sys.stderr)
         sys.exit(1)
 
+    if args.resume:
+        args.logs_dir = args.resume
+        statuses = RunJournal.replay(args.resume)
+        remaining = [
+            host for host in parsed_hosts if statuses.get(host[0]) != SESSION_OK
+        ]
+        log_message(
+            f"[main] resume: {len(parsed_hosts) - len(remaining)} host(s) "
+            f"already succeeded in {args.resume}; {len(remaining)} to run"
+        )
+        if not remaining:
+            log_message("[main] done: success=0, failed=0")
+            sys.exit(0)
+        parsed_hosts = remaining
+        needs_shared_password = any(host[2] is None for host in parsed_hosts)
+
     # Decide whether to prompt for a shared password:
     #   - Explicit --password-prompt always prompts (and overrides any embedded pw).
     #   - If at least one row omitted the password, prompt once and reuse it.
@@ -1295,73 +6609,32 @@ if __name__ == "__main__":
             print("Empty password entered. Aborting.", file=sys.stderr)
             sys.exit(1)
 
-    logs_dir = args.logs_dir
-    os.makedirs(logs_dir, exist_ok=True)
-
-    # Bound concurrency. Default: min(8, hosts) keeps small jobs serial-ish
-    # while still benefiting from parallelism on big batches.
-    if args.max_workers is None:
-        max_workers = min(8, len(parsed_hosts))
-    else:
-        max_workers = args.max_workers
-    log_message(
-        f"[main] starting {len(parsed_hosts)} host(s) with up to "
-        f"{max_workers} concurrent worker(s); output formats: "
-        f"{','.join(args.output_format)}"
-    )
-
-    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = []
-        for router_ip, username, password, device_type in parsed_hosts:
-            # Choose effective password:
-            #   --password-prompt -> shared overrides file
-            #   missing in file   -> shared
-            #   else              -> embedded password
-            if args.password_prompt or password is None:
-                effective_password = shared_password
-            else:
-                effective_password = password
-
-            # Controllers default to TCP/22; edges to --port (830).
-            if device_type == DEVICE_CONTROLLER:
-                effective_port = args.controller_port
-            else:
-                effective_port = args.port
-
-            # Resolve the command list this host should run from its type.
-            commands_file = resolve_commands_file(
-                device_type,
-                args.commands_file,
-                args.controller_commands,
-                args.edge_commands,
+    if args.server:
+        try:
+            counts = submit_to_server(
+                args.server, parsed_hosts, args, shared_password
             )
+        except RuntimeError as ex:
+            print(f"--server: {ex}", file=sys.stderr)
+            sys.exit(1)
+        if counts is not None:
+            sys.exit(0)
+        log_message(
+            f"[main] no daemon listening on {args.server}; running locally"
+        )
 
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            output_paths = _build_output_paths(
-                logs_dir, router_ip, timestamp, args.output_format
-            )
-            future = executor.submit(
-                connect_and_execute,
-                router_ip,
-                username,
-                effective_password,
-                commands_file,
-                output_paths,
-                not args.reject_unknown_hosts,
-                effective_port,
-                args.retries,
-                args.retry_delay,
-                device_type,
-            )
-            futures.append(future)
-
-        # Wait for all futures to complete; surface aggregate counts.
-        ok = 0
-        bad = 0
-        for future in concurrent.futures.as_completed(futures):
-            result = future.result()
-            if result and result.get("status") == SESSION_OK:
-                ok += 1
-            else:
-                bad += 1
-        log_message(f"[main] done: success={ok}, failed={bad}")
+    # The first SIGINT / SIGTERM cancels the run cooperatively; a second
+    # one aborts immediately (see install_interrupt_handler).
+    cancel = CancelToken()
+    install_interrupt_handler(cancel)
+    if args.shards > 1:
+        run_sharded(
+            parsed_hosts, args, shared_password, args.shards, args.max_workers,
+            args.engine, pipeline, args.max_load, host_history, cancel,
+        )
+    else:
+        run_hosts(
+            parsed_hosts, args, shared_password, args.max_workers, args.engine,
+            latency_profile, pipeline, max_load=args.max_load,
+            host_history=host_history, cancel=cancel,
+        )
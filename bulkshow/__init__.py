@@ -0,0 +1,35 @@
+"""Importable API for ``bulk-show.py``.
+
+``bulk-show.py`` remains the single file shipped to vManage; this package
+loads it once (see :mod:`bulkshow._core`) and exposes its helpers under a
+normal module name, plus :class:`FleetRunner`, an ``async for`` API that
+streams per-host results as they complete.
+"""
+
+from ._core import core
+from .fleet import FleetRunner, RunPlan, parse_hosts
+
+parse_host_line = core.parse_host_line
+normalize_device_type = core.normalize_device_type
+resolve_commands_file = core.resolve_commands_file
+connect_and_execute = core.connect_and_execute
+build_jobs = core.build_jobs
+
+DEVICE_EDGE = core.DEVICE_EDGE
+DEVICE_CONTROLLER = core.DEVICE_CONTROLLER
+SESSION_OK = core.SESSION_OK
+
+__all__ = [
+    "DEVICE_CONTROLLER",
+    "DEVICE_EDGE",
+    "FleetRunner",
+    "RunPlan",
+    "SESSION_OK",
+    "build_jobs",
+    "connect_and_execute",
+    "core",
+    "normalize_device_type",
+    "parse_host_line",
+    "parse_hosts",
+    "resolve_commands_file",
+]
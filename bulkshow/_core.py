@@ -0,0 +1,38 @@
+"""Load ``bulk-show.py`` once as an importable module.
+
+``bulk-show.py`` stays a single self-contained script because
+``run_on_vmanage.py`` uploads exactly that one file to vManage. Its name has
+a hyphen, so it cannot be imported by name; this module loads it by path a
+single time and registers it in :data:`sys.modules` (as
+``bulkshow._bulk_show``) so every importer shares the same module object and
+its functions pickle by reference.
+"""
+
+from __future__ import annotations
+
+import importlib.util
+import sys
+from pathlib import Path
+
+BULK_SHOW_PATH = Path(__file__).resolve().parent.parent / "bulk-show.py"
+MODULE_NAME = "bulkshow._bulk_show"
+
+
+def _load():
+    existing = sys.modules.get(MODULE_NAME)
+    if existing is not None:
+        return existing
+    spec = importlib.util.spec_from_file_location(MODULE_NAME, BULK_SHOW_PATH)
+    if spec is None or spec.loader is None:  # pragma: no cover - broken checkout
+        raise ImportError(f"cannot load {BULK_SHOW_PATH}")
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[MODULE_NAME] = module
+    try:
+        spec.loader.exec_module(module)
+    except BaseException:
+        sys.modules.pop(MODULE_NAME, None)
+        raise
+    return module
+
+
+core = _load()
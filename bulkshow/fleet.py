@@ -0,0 +1,159 @@
+"""Async fleet API: run bulk-show against many hosts and stream results.
+
+:class:`FleetRunner` drives the same ``connect_and_execute`` the CLI uses, on
+a bounded thread pool, and yields each host's ``session_result`` dict as soon
+as that host finishes::
+
+    plan = RunPlan(commands_file="commands.txt", logs_dir="logs/run1")
+    runner = FleetRunner(max_concurrency=16)
+    async for result in runner.run(["10.0.0.1,admin", "10.0.0.2,admin"], plan,
+                                   password="..."):
+        print(result["host"], result["status"])
+
+Per-host output files are still written to ``plan.logs_dir`` exactly as the
+CLI would write them.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import concurrent.futures
+import functools
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Iterable, Optional, Sequence, Union
+
+from ._core import core
+
+# How often (seconds) a waiting run() re-checks its cancellation token.
+CANCEL_POLL_INTERVAL = 0.2
+
+HostEntry = Union[str, Sequence]
+
+
+@dataclass
+class RunPlan:
+    """What to run on each host.
+
+    Field names match ``bulk-show.py``'s argparse destinations so the plan can
+    be handed straight to ``build_jobs``.
+    """
+
+    commands_file: Optional[str] = None
+    controller_commands: Optional[str] = None
+    edge_commands: Optional[str] = None
+    logs_dir: str = "logs"
+    output_format: Sequence[str] = field(
+        default_factory=lambda: [core.OUTPUT_FORMAT_TEXT]
+    )
+    port: int = 830
+    controller_port: int = 22
+    reject_unknown_hosts: bool = False
+    password_prompt: bool = False
+    retries: int = 0
+    retry_delay: float = 5.0
+
+
+def parse_hosts(hosts: Iterable[HostEntry]) -> list[tuple]:
+    """Normalize hosts-file lines and/or parsed tuples into host tuples.
+
+    Strings are parsed with ``parse_host_line`` (blank and comment lines are
+    skipped); tuples must already be ``(ip, username, password, device_type)``,
+    optionally followed by the site, which is None when left out. Raises
+    :class:`ValueError` for a malformed line or an invalid IP address.
+    """
+    parsed = []
+    for entry in hosts:
+        if isinstance(entry, str):
+            try:
+                host = core.parse_host_line(entry)
+            except ValueError as exc:
+                raise ValueError(f"invalid host entry {entry.strip()!r}: {exc}") from exc
+            if host is None:
+                continue
+        else:
+            host = tuple(entry)
+            host += (None,) * (5 - len(host))
+        if not core.is_valid_ip(host[0]):
+            raise ValueError(f"invalid IP address: {host[0]!r}")
+        parsed.append(host)
+    return parsed
+
+
+class FleetRunner:
+    """Run bulk-show sessions concurrently and yield results as they finish.
+
+    Args:
+        max_concurrency: maximum number of hosts in flight at once.
+        cancel: optional cancellation token -- any object with ``is_set()``
+            such as :class:`threading.Event`, or a ``core.CancelToken``.
+            Once set, no further hosts are started: hosts in flight stop at
+            their next connect or read step and are yielded with status
+            ``deadline``; hosts never started are yielded with status
+            ``skipped``.
+    """
+
+    def __init__(self, max_concurrency: int = 8, cancel=None) -> None:
+        if max_concurrency < 1:
+            raise ValueError(f"max_concurrency must be >= 1 (got {max_concurrency})")
+        self.max_concurrency = max_concurrency
+        self.cancel = cancel if cancel is not None else threading.Event()
+
+    async def run(
+        self,
+        hosts: Iterable[HostEntry],
+        plan: RunPlan,
+        password: Optional[str] = None,
+    ) -> AsyncIterator[dict]:
+        """Yield each host's ``session_result`` as soon as it completes.
+
+        ``password`` is used for hosts without one (and for every host when
+        ``plan.password_prompt`` is set), mirroring the CLI's shared password.
+        """
+        # The sessions only understand a CancelToken; another kind of token
+        # is relayed to one by the loop below.
+        token = self.cancel
+        if not isinstance(token, core.CancelToken):
+            token = core.CancelToken()
+        jobs = core.build_jobs(
+            parse_hosts(hosts), plan, password, cancel=token,
+            connector=core.SSHConnector(),
+        )
+        if not jobs:
+            return
+        os.makedirs(plan.logs_dir, exist_ok=True)
+        loop = asyncio.get_running_loop()
+        executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=min(self.max_concurrency, len(jobs)),
+            thread_name_prefix="bulkshow",
+        )
+        queued = list(reversed(jobs))
+        in_flight: set[asyncio.Future] = set()
+        try:
+            while queued or in_flight:
+                if self.cancel.is_set():
+                    token.cancel("cancelled")
+                    while queued:
+                        yield core._skip_job(queued.pop(), token.reason)
+                while queued and len(in_flight) < self.max_concurrency:
+                    job = queued.pop()
+                    in_flight.add(
+                        loop.run_in_executor(
+                            executor,
+                            functools.partial(core.connect_and_execute, **job),
+                        )
+                    )
+                if not in_flight:
+                    break
+                done, in_flight = await asyncio.wait(
+                    in_flight,
+                    timeout=CANCEL_POLL_INTERVAL,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                for future in done:
+                    yield future.result()
+        finally:
+            # Hosts still in flight (consumer stopped early) finish on their
+            # own threads and still write their output files.
+            executor.shutdown(wait=False)
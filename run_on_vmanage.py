@@ -39,6 +39,18 @@ def log_errors_only(output):
         print("\n".join(lines), file=sys.stderr, flush=True)
 
 
+def max_workers_arg(value):
+    """--max-workers: an integer or 'auto' (validated here, not remotely)."""
+    if value.strip().lower() == "auto":
+        return "auto"
+    try:
+        return int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"must be an integer or 'auto' (got {value!r})"
+        )
+
+
 def parse_args():
     parser = argparse.ArgumentParser(
         description="Upload bulk-show.py + inputs to vManage and run remotely via SSH.",
@@ -140,16 +152,87 @@ def parse_args():
         "--retry-delay",
         type=float,
         default=5.0,
-        help="Forwarded to bulk-show.py --retry-delay: seconds between connect "
-             "attempts (default: 5.0).",
+        help="Forwarded to bulk-show.py --retry-delay: seconds before the first "
+             "connect retry, doubled for each later one (default: 5.0).",
     )
     parser.add_argument(
         "--max-workers",
-        type=int,
+        type=max_workers_arg,
         default=None,
         help="Forwarded to bulk-show.py --max-workers: max concurrent SSH "
-             "sessions (default: bulk-show.py's own default).",
+             "sessions, or 'auto' to adapt to errors and latency "
+             "(default: bulk-show.py's own default).",
+    )
+    parser.add_argument(
+        "--max-load",
+        type=float,
+        default=None,
+        help="Forwarded to bulk-show.py --max-load: with --max-workers auto, "
+             "back off while vManage's 1-minute load average exceeds this.",
+    )
+    parser.add_argument(
+        "--deadline",
+        type=float,
+        default=None,
+        help="Forwarded to bulk-show.py --deadline: stop the whole run after "
+             "this many seconds, keeping partial output and recording hosts "
+             "not yet started as skipped.",
+    )
+    parser.add_argument(
+        "--host-budget",
+        type=float,
+        default=None,
+        help="Forwarded to bulk-show.py --host-budget: stop any single host "
+             "after this many seconds.",
+    )
+    parser.add_argument(
+        "--preflight",
+        action="store_true",
+        help="Forwarded to bulk-show.py --preflight: fail hosts that do not "
+             "accept a TCP connection within seconds instead of waiting out "
+             "the SSH connect timeout.",
+    )
+    parser.add_argument(
+        "--circuit-breaker",
+        type=int,
+        default=0,
+        help="Forwarded to bulk-show.py --circuit-breaker: after this many "
+             "consecutive connect failures in a site (or /24), probe once and "
+             "fail the rest of it fast (default: 0, off).",
     )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=None,
+        help="Forwarded to bulk-show.py --shards: split the hosts across this "
+             "many worker processes on vManage.",
+    )
+    parser.add_argument(
+        "--record",
+        action="store_true",
+        help="Forwarded to bulk-show.py --record: save each host's session "
+             "transcript in the remote logs directory (downloaded with the "
+             "outputs) for offline --replay.",
+    )
+    parser.add_argument(
+        "--post-process-workers",
+        type=int,
+        default=None,
+        help="Forwarded to bulk-show.py --post-process-workers: clean and "
+             "render command output in this many helper processes.",
+    )
+    for flag, what in (
+        ("--controller-workers", "controller"),
+        ("--edge-workers", "edge"),
+        ("--per-site-workers", "per-site"),
+    ):
+        parser.add_argument(
+            flag,
+            type=int,
+            default=None,
+            help=f"Forwarded to bulk-show.py {flag}: cap on concurrent "
+                 f"{what} sessions.",
+        )
     parser.add_argument(
         "--controller-port",
         type=int,
@@ -377,6 +460,31 @@ def main():
         remote_cmd += f" --retry-delay {shlex.quote(str(args.retry_delay))}"
     if args.max_workers is not None:
         remote_cmd += f" --max-workers {shlex.quote(str(args.max_workers))}"
+    if args.max_load is not None:
+        remote_cmd += f" --max-load {shlex.quote(str(args.max_load))}"
+    if args.deadline is not None:
+        remote_cmd += f" --deadline {shlex.quote(str(args.deadline))}"
+    if args.host_budget is not None:
+        remote_cmd += f" --host-budget {shlex.quote(str(args.host_budget))}"
+    if args.preflight:
+        remote_cmd += " --preflight"
+    for flag, value in (
+        ("--controller-workers", args.controller_workers),
+        ("--edge-workers", args.edge_workers),
+        ("--per-site-workers", args.per_site_workers),
+    ):
+        if value is not None:
+            remote_cmd += f" {flag} {shlex.quote(str(value))}"
+    if args.post_process_workers is not None:
+        remote_cmd += (
+            f" --post-process-workers {shlex.quote(str(args.post_process_workers))}"
+        )
+    if args.shards is not None:
+        remote_cmd += f" --shards {shlex.quote(str(args.shards))}"
+    if args.record:
+        remote_cmd += f" --record {shlex.quote(remote_logs_dir)}"
+    if args.circuit_breaker:
+        remote_cmd += f" --circuit-breaker {shlex.quote(str(args.circuit_breaker))}"
     remote_cmd += f" --controller-port {shlex.quote(str(args.controller_port))}"
     if args.output_format:
         remote_cmd += f" --output-format {shlex.quote(args.output_format)}"
@@ -448,9 +556,10 @@ def main():
                         f"output_*.{{txt,json,csv}} -> {local_logs_dir}"
                     )
                 for entry in entries:
-                    if entry.startswith("output_") and entry.endswith(
-                        (".txt", ".json", ".csv")
-                    ):
+                    if (
+                        entry.startswith("output_")
+                        and entry.endswith((".txt", ".json", ".csv"))
+                    ) or (args.record and entry.startswith("transcript_")):
                         local_path = local_logs_dir / entry
                         sftp.get(f"{remote_source}/{entry}", str(local_path))
             finally:
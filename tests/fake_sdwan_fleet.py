@@ -0,0 +1,441 @@
+#!/usr/bin/env python3
+"""Simulated Cisco SD-WAN fleet for end-to-end runs of ``bulk-show.py``.
+
+A paramiko SSH server that answers on every loopback address. The address a
+connection arrives on names the simulated device: Linux routes all of
+127.0.0.0/8 to ``lo``, while other systems need an alias per address.
+Connections to any other address are closed at once. The port it arrives
+on sets its kind:
+
+edge (``--edge-port``, like :830)
+    IOS-XE SD-WAN. ``shell`` enters the device shell, asking for the
+    password again unless ``--no-reprompt`` is given. ``terminal length 0``
+    is accepted, and the prompt is ``cedge-<address>#``.
+controller (``--controller-port``, like :22)
+    viptela vSmart / vBond CLI. The prompt is
+    ``\\x1b[?7hvsmart-<address># ``, drawn right after login. Output is
+    paged (``--More--`` ... ``(END)``, driven by Space / ``!`` / ``q``) until
+    ``paginate false``.
+
+Commands listed in ``--pager-commands`` page on either kind even after
+pagination was turned off, like a config-mode ``show running-config``.
+Every other command is echoed and answered with ``--output-size`` bytes
+after ``--latency`` seconds. The prompt comes ``--prompt-delay`` seconds
+after the last line.
+
+``--fail-rate`` of the devices misbehave, each in one of the
+``--fail-modes``. They are picked by a hash of their address, so the same
+devices fail every run:
+
+``auth``        the SSH password is rejected.
+``shell-auth``  edges reject the password at the shell re-prompt;
+                controllers ask for a password again instead of showing
+                their CLI.
+``drop``        the connection closes in the middle of the first output.
+``hang``        the first command never returns.
+``refuse``      the connection is closed before the SSH banner.
+
+Run it on its own (Ctrl-C stops it)::
+
+    python tests/fake_sdwan_fleet.py --edge-port 8830 --controller-port 8822
+
+or use :class:`FleetServer` from Python. ``tests/test_bulk_show.py`` and
+``benchmarks/bench_fleet.py`` do that.
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import logging
+import multiprocessing
+import re
+import socket
+import threading
+import time
+
+import paramiko
+
+EDGE = "edge"
+CONTROLLER = "controller"
+FAIL_MODES = ("auth", "shell-auth", "drop", "hang", "refuse")
+CONTROLLER_PROMPT_PREFIX = b"\x1b[?7h"
+PAGER_ERASE = b"\r        \r"
+CHUNK = 32 * 1024
+LINE_END_RE = re.compile(rb"[\r\n]")
+
+
+class DeviceProfile:
+    """Behaviour shared by the simulated devices; see the module docstring
+    for what each setting does.
+    """
+
+    def __init__(
+        self,
+        password="admin",
+        latency=0.0,
+        output_size=4096,
+        prompt_delay=0.0,
+        reprompt=True,
+        page_lines=24,
+        pager_commands=("show running-config",),
+        fail_rate=0.0,
+        fail_modes=FAIL_MODES,
+        seed=0,
+    ):
+        self.password = password
+        self.latency = latency
+        self.output_size = output_size
+        self.prompt_delay = prompt_delay
+        self.reprompt = reprompt
+        self.page_lines = page_lines
+        self.pager_commands = tuple(pager_commands)
+        self.fail_rate = fail_rate
+        self.fail_modes = tuple(fail_modes)
+        self.seed = seed
+        self._bodies = {}
+
+    def failure(self, address):
+        """The failure mode of the device at ``address``, or None."""
+        if not self.fail_rate or not self.fail_modes:
+            return None
+        digest = hashlib.sha256(f"{self.seed}:{address}".encode()).digest()
+        if int.from_bytes(digest[:8], "big") / 2 ** 64 >= self.fail_rate:
+            return None
+        return self.fail_modes[digest[8] % len(self.fail_modes)]
+
+    def body(self, command):
+        """``output_size`` bytes of output lines for ``command``."""
+        body = self._bodies.get(command)
+        if body is None:
+            lines = []
+            size = 0
+            while size < self.output_size:
+                line = f"{command} {len(lines):07d}".ljust(78).encode() + b"\r\n"
+                lines.append(line)
+                size += len(line)
+            body = self._bodies[command] = lines
+        return body
+
+
+class _Closed(Exception):
+    """The client went away."""
+
+
+class _Server(paramiko.ServerInterface):
+    def __init__(self, profile, failure):
+        self.profile = profile
+        self.failure = failure
+        self.shell_requested = threading.Event()
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_auth_password(self, username, password):
+        if self.failure != "auth" and password == self.profile.password:
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_pty_request(self, *_args):
+        return True
+
+    def check_channel_shell_request(self, channel):
+        self.shell_requested.set()
+        return True
+
+
+class SimulatedDevice:
+    """One shell session on a simulated edge or controller."""
+
+    def __init__(self, channel, kind, address, profile, failure=None):
+        self.channel = channel
+        self.kind = kind
+        self.profile = profile
+        self.failure = failure
+        name = "cedge" if kind == EDGE else "vsmart"
+        self.hostname = f"{name}-{address.replace('.', '-')}"
+        self.paginate = kind == CONTROLLER
+        self._input = b""
+        self._commands = 0
+
+    def run(self):
+        try:
+            if self.kind == CONTROLLER and not self._controller_login():
+                return
+            while True:
+                self._command(self._read_line())
+        except (_Closed, EOFError, OSError):
+            pass
+        finally:
+            self.channel.close()
+
+    # -- I/O ---------------------------------------------------------------
+
+    def _send(self, data):
+        self.channel.sendall(data)
+
+    def _fill(self):
+        data = self.channel.recv(4096)
+        if not data:
+            raise _Closed()
+        self._input += data
+
+    def _read_line(self):
+        """The next typed line, after any Ctrl-U (line kill)."""
+        while True:
+            match = LINE_END_RE.search(self._input)
+            if match:
+                break
+            self._fill()
+        line = self._input[:match.start()]
+        self._input = self._input[match.end():]
+        if match.group() == b"\r" and self._input.startswith(b"\n"):
+            self._input = self._input[1:]
+        return line.rsplit(b"\x15", 1)[-1].decode(errors="replace")
+
+    def _read_key(self):
+        while not self._input:
+            self._fill()
+        key, self._input = self._input[:1], self._input[1:]
+        return key
+
+    def _prompt(self):
+        if self.profile.prompt_delay:
+            time.sleep(self.profile.prompt_delay)
+        if self.kind == CONTROLLER:
+            self._send(CONTROLLER_PROMPT_PREFIX + self.hostname.encode() + b"# ")
+        else:
+            self._send(self.hostname.encode() + b"#")
+
+    def _wait(self):
+        if self.profile.latency:
+            time.sleep(self.profile.latency)
+
+    # -- Device behaviour --------------------------------------------------
+
+    def _controller_login(self):
+        self._wait()
+        if self.failure == "shell-auth":
+            self._send(b"\r\nPassword: ")
+            while True:
+                self._read_line()
+        self._send(b"viptela 20.12.3\r\n\r\n")
+        self._prompt()
+        return True
+
+    def _edge_shell(self):
+        self._send(b"shell\r\n")
+        self._wait()
+        if self.profile.reprompt:
+            while True:
+                self._send(b"Password: ")
+                password = self._read_line()
+                self._wait()
+                if self.failure != "shell-auth" and password == self.profile.password:
+                    break
+                self._send(b"\r\n% Authentication failed\r\n")
+        self._send(b"\r\n")
+        self._prompt()
+
+    def _command(self, line):
+        command = line.strip()
+        if self.kind == EDGE and command == "shell":
+            self._edge_shell()
+            return
+        self._send(line.encode() + b"\r\n")
+        if command in ("terminal length 0", "paginate false"):
+            self.paginate = False
+        elif command == "exit":
+            raise _Closed()
+        elif command:
+            self._commands += 1
+            self._wait()
+            if self._commands == 1 and self.failure == "hang":
+                while True:
+                    self._read_line()
+            body = self.profile.body(command)
+            if self._commands == 1 and self.failure == "drop":
+                self._send(b"".join(body[:len(body) // 2 + 1]))
+                self.channel.get_transport().close()
+                raise _Closed()
+            if self.paginate or command in self.profile.pager_commands:
+                self._page(body)
+            else:
+                self._write(body)
+        self._prompt()
+
+    def _write(self, lines):
+        data = b"".join(lines)
+        for pos in range(0, len(data), CHUNK):
+            self._send(data[pos:pos + CHUNK])
+
+    def _page(self, lines):
+        step = max(1, self.profile.page_lines)
+        pos = 0
+        while pos < len(lines):
+            self._write(lines[pos:pos + step])
+            pos += step
+            if pos >= len(lines):
+                break
+            self._send(b"--More--")
+            key = self._read_key()
+            self._send(PAGER_ERASE)
+            if key == b"q":
+                self._send(b"\r")
+                return
+            if key == b"!":
+                self._write(lines[pos:])
+                break
+        self._send(b"(END)")
+        while self._read_key() != b"q":
+            pass
+        self._send(b"\r")
+
+
+class FleetServer:
+    """Serves simulated devices on an edge and a controller port.
+
+    Both ports listen on every address and ``0`` picks a free one (see
+    :attr:`edge_port` / :attr:`controller_port`); only loopback connections
+    are served. With ``processes`` > 1 that many forked processes accept the
+    connections: paramiko's server side is CPU-bound, and a single process
+    would limit a large run before bulk-show does. Stop it with
+    :meth:`close`.
+    """
+
+    def __init__(self, profile=None, edge_port=0, controller_port=0,
+                 processes=1, host_key=None):
+        self.profile = profile or DeviceProfile()
+        self.host_key = host_key or paramiko.ECDSAKey.generate()
+        self._listeners = {}
+        for kind, port in ((EDGE, edge_port), (CONTROLLER, controller_port)):
+            listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            listener.bind(("0.0.0.0", port))
+            listener.listen(1024)
+            self._listeners[kind] = listener
+        self.edge_port = self._listeners[EDGE].getsockname()[1]
+        self.controller_port = self._listeners[CONTROLLER].getsockname()[1]
+        self._children = []
+        if processes > 1:
+            context = multiprocessing.get_context("fork")
+            for _ in range(processes):
+                child = context.Process(target=self._serve_forever, daemon=True)
+                child.start()
+                self._children.append(child)
+        else:
+            self._start_accepting()
+
+    def _start_accepting(self):
+        threads = []
+        for kind, listener in self._listeners.items():
+            thread = threading.Thread(
+                target=self._accept_loop, args=(listener, kind), daemon=True
+            )
+            thread.start()
+            threads.append(thread)
+        return threads
+
+    def _serve_forever(self):
+        for thread in self._start_accepting():
+            thread.join()
+
+    def _accept_loop(self, listener, kind):
+        while True:
+            try:
+                sock, _ = listener.accept()
+            except OSError:
+                return
+            threading.Thread(
+                target=self._handle, args=(sock, kind), daemon=True
+            ).start()
+
+    def _handle(self, sock, kind):
+        address = sock.getsockname()[0]
+        failure = self.profile.failure(address)
+        if failure == "refuse" or not address.startswith("127."):
+            sock.close()
+            return
+        transport = paramiko.Transport(sock)
+        transport.add_server_key(self.host_key)
+        server = _Server(self.profile, failure)
+        try:
+            transport.start_server(server=server)
+            channel = transport.accept(30)
+            if channel is not None and server.shell_requested.wait(10):
+                SimulatedDevice(channel, kind, address, self.profile, failure).run()
+        except (paramiko.SSHException, EOFError, OSError):
+            pass
+        finally:
+            transport.close()
+
+    def close(self):
+        for child in self._children:
+            child.terminate()
+            child.join()
+        for listener in self._listeners.values():
+            listener.close()
+
+
+def _parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--edge-port", type=int, default=8830)
+    parser.add_argument("--controller-port", type=int, default=8822)
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--password", default="admin")
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--output-size", type=int, default=4096)
+    parser.add_argument("--prompt-delay", type=float, default=0.0)
+    parser.add_argument("--no-reprompt", action="store_true")
+    parser.add_argument("--page-lines", type=int, default=24)
+    parser.add_argument("--pager-commands", default="show running-config")
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--fail-modes", default=",".join(FAIL_MODES))
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args(argv)
+
+
+def profile_from_args(args):
+    """A :class:`DeviceProfile` from the options of :func:`_parse_args`."""
+    return DeviceProfile(
+        password=args.password,
+        latency=args.latency,
+        output_size=args.output_size,
+        prompt_delay=args.prompt_delay,
+        reprompt=not args.no_reprompt,
+        page_lines=args.page_lines,
+        pager_commands=[c for c in args.pager_commands.split(",") if c],
+        fail_rate=args.fail_rate,
+        fail_modes=[m for m in args.fail_modes.split(",") if m],
+        seed=args.seed,
+    )
+
+
+def main(argv=None):
+    args = _parse_args(argv)
+    logging.getLogger("paramiko").setLevel(logging.CRITICAL)
+    server = FleetServer(
+        profile_from_args(args), args.edge_port, args.controller_port,
+        args.processes,
+    )
+    print(
+        f"edges on :{server.edge_port}, controllers on :{server.controller_port} "
+        f"(any 127.x.y.z address), password {args.password!r}",
+        flush=True,
+    )
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+if __name__ == "__main__":
+    main()
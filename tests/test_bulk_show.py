@@ -7,13 +7,28 @@ parsing helpers without touching SSH.
 
 from __future__ import annotations
 
+import collections
+import concurrent.futures
+import concurrent.futures.process
 import contextlib
+import csv
+import functools
 import importlib.util
 import io
+import itertools
+import json
+import os
+import random
+import re
+import socket
 import sys
+import tempfile
+import threading
+import time
 import types
 import unittest
 from pathlib import Path
+from unittest import mock
 
 REPO_ROOT = Path(__file__).resolve().parent.parent
 BULK_SHOW_PATH = REPO_ROOT / "bulk-show.py"
@@ -23,6 +38,8 @@ def _load_bulk_show():
     spec = importlib.util.spec_from_file_location("bulk_show", BULK_SHOW_PATH)
     module = importlib.util.module_from_spec(spec)
     assert spec and spec.loader
+    # Registered so that its functions pickle by reference (PostProcessor).
+    sys.modules[spec.name] = module
     spec.loader.exec_module(module)
     return module
 
@@ -107,11 +124,27 @@ class FakeChannel:
         raise _socket.timeout()
 
 
+class _FakeTransport:
+    def __init__(self):
+        self.active = True
+
+    def is_active(self):
+        return self.active
+
+    def set_keepalive(self, _interval):
+        pass
+
+
 class _FakeSSHClient:
     """Minimal paramiko.SSHClient stand-in returning a preset shell channel."""
 
     def __init__(self, channel):
         self._channel = channel
+        self._transport = _FakeTransport()
+        self.closed = False
+
+    def get_transport(self):
+        return self._transport
 
     def load_system_host_keys(self):
         pass
@@ -126,14 +159,17 @@ class _FakeSSHClient:
         return self._channel
 
     def close(self):
-        pass
+        self.closed = True
+        self._transport.active = False
 
 
 def _make_fake_paramiko(channel):
     """Build a stub ``paramiko`` module exposing only what connect_and_execute
-    touches, wired to return ``channel`` from ``invoke_shell``."""
+    touches, wired to return ``channel`` from ``invoke_shell``. ``channel``
+    may also be a zero-argument factory returning a fresh channel per host."""
+    make_channel = channel if callable(channel) else (lambda: channel)
     return types.SimpleNamespace(
-        SSHClient=lambda: _FakeSSHClient(channel),
+        SSHClient=lambda: _FakeSSHClient(make_channel()),
         AutoAddPolicy=lambda: object(),
         RejectPolicy=lambda: object(),
         AuthenticationException=type("AuthenticationException", (Exception,), {}),
@@ -175,6 +211,87 @@ class ReadChannelControllerTests(unittest.TestCase):
         self.assertEqual(buf, "vsmart# ")
 
 
+class ChannelReaderTests(unittest.TestCase):
+    def test_escape_split_across_chunks_is_stripped(self) -> None:
+        reader = bulk_show.ChannelReader()
+        for piece in (b"banner\n\x1b", b"[?", b"7hvsmart# "):
+            reader.feed(piece)
+        self.assertEqual(reader.tail, "banner\nvsmart# ")
+        self.assertEqual(reader.getvalue(), "banner\nvsmart# ")
+
+    def test_matches_strip_ansi_of_whole_buffer(self) -> None:
+        raw = "row\x1b[0m1\n\x1b[1;32mrow2\x1b\n\x1b[?7hRT01# " * 50
+        data = raw.encode()
+        for size in (1, 2, 3, 7, 64):
+            reader = bulk_show.ChannelReader()
+            for i in range(0, len(data), size):
+                reader.feed(data[i:i + size])
+            self.assertEqual(reader.getvalue(), bulk_show.strip_ansi(raw), msg=size)
+
+    def test_multibyte_character_split_across_chunks(self) -> None:
+        # A Japanese interface description split mid-character must decode
+        # intact instead of producing replacement characters.
+        data = "description 東京本社\nRT01# ".encode()
+        reader = bulk_show.ChannelReader()
+        for i in range(len(data)):
+            reader.feed(data[i:i + 1])
+        self.assertEqual(reader.getvalue(), "description 東京本社\nRT01# ")
+
+    def test_tail_is_bounded(self) -> None:
+        reader = bulk_show.ChannelReader(tail_chars=16)
+        reader.feed(b"x" * 1000)
+        reader.feed(b"\nRT01# ")
+        self.assertEqual(len(reader.tail), 16)
+        self.assertTrue(reader.tail.endswith("\nRT01# "))
+        self.assertEqual(len(reader.getvalue()), 1007)
+
+    def test_spilled_output_is_returned_intact(self) -> None:
+        raw = "line\r\n 東京 --More-- \r        \r" * 40 + "RT01# "
+        reader = bulk_show.ChannelReader(spill_chars=64)
+        data = raw.encode()
+        for i in range(0, len(data), 50):
+            reader.feed(data[i:i + 50])
+        self.assertTrue(reader.capture.spilled)
+        self.assertEqual(reader.getvalue(), raw)
+
+    def test_capped_output_keeps_head_and_tail(self) -> None:
+        reader = bulk_show.ChannelReader(
+            spill_chars=16, max_chars=40, keep_tail_chars=12
+        )
+        body = "".join(f"{i:04d}東\n" for i in range(100))
+        reader.feed(body.encode())
+        reader.feed(b"RT01# ")
+        value = reader.getvalue()
+        dropped = (body + "RT01# ")[40:-12]
+        marker = bulk_show.CAPTURE_TRUNCATED_FMT.format(len(dropped.encode()))
+        self.assertEqual(value, body[:40] + marker + "0099東\nRT01# ")
+        self.assertEqual(reader.truncated_bytes, len(dropped.encode()))
+        self.assertEqual(reader.tail, (body + "RT01# ")[-bulk_show.READ_TAIL_CHARS:])
+
+
+class ChannelReadTests(unittest.TestCase):
+    def test_recv_size_grows_on_full_reads_and_resets(self) -> None:
+        op = bulk_show.ChannelRead(FakeChannel([]), now=0.0)
+        self.assertEqual(op.recv_size, bulk_show.READ_RECV_MIN)
+        for _ in range(20):
+            op.feed(b"x" * op.recv_size, 0.0)
+        self.assertEqual(op.recv_size, bulk_show.READ_RECV_MAX)
+        op.feed(b"RT01# ", 0.0)
+        self.assertEqual(op.recv_size, bulk_show.READ_RECV_MIN)
+
+    def test_capped_read_still_settles_on_prompt(self) -> None:
+        chunks = [b"x" * 4096] * 64 + [b"\nRT01# "]
+        op = bulk_show.ChannelRead(FakeChannel(chunks), now=0.0)
+        op.reader = bulk_show.ChannelReader(max_chars=1000, keep_tail_chars=100)
+        for chunk in chunks:
+            op.feed(chunk, 0.0)
+            result = op.check(0.0)
+        buf, kind = result
+        self.assertEqual(kind, bulk_show.MATCH_PROMPT)
+        self.assertTrue(buf.endswith("x\nRT01# "))
+        self.assertEqual(op.reader.truncated_bytes, 64 * 4096 + 7 - 1100)
+
+
 class ReadUntilPromptTests(unittest.TestCase):
     def test_late_prompt_recovered_by_nudge(self) -> None:
         # First read yields output that goes idle without a prompt; after the
@@ -235,6 +352,155 @@ class PagerHandlingTests(unittest.TestCase):
         self.assertIn("row2", cleaned)
 
 
+class OutputCleanerTests(unittest.TestCase):
+    PIECES = (
+        "-", "--", "- ", "--More--", "-- More --", " --More-- ", "(", "(E",
+        "(END)", "END)", "More", "\r", "\n", "\r\n", "\r\r\n", " ", "\t",
+        "row", "interface Gi1",
+    )
+
+    def _stream(self, raw, sizes):
+        cleaner = bulk_show.OutputCleaner()
+        out, pos = [], 0
+        for size in sizes:
+            out.append(cleaner.feed(raw[pos:pos + size]))
+            pos += size
+        out.append(cleaner.feed(raw[pos:]))
+        return "".join(out) + cleaner.finish()
+
+    def test_matches_clean_command_output_for_any_chunking(self) -> None:
+        rng = random.Random(22)
+        for _ in range(3000):
+            raw = "".join(rng.choice(self.PIECES) for _ in range(rng.randint(0, 40)))
+            sizes = [rng.randint(1, 8) for _ in range(len(raw))]
+            self.assertEqual(
+                self._stream(raw, sizes), bulk_show.clean_command_output(raw), msg=repr(raw)
+            )
+
+    def test_marker_split_across_chunks(self) -> None:
+        raw = "row1\n--More--\r        \rrow2\n(END)\rRT01(config)# "
+        for cut in range(len(raw) + 1):
+            self.assertEqual(
+                self._stream(raw, [cut]), bulk_show.clean_command_output(raw), msg=cut
+            )
+
+    def test_output_without_newlines_stays_bounded(self) -> None:
+        raw = "progress 50%\r" * 500_000 + "progress 100%\r\nRT01#"
+        cleaner = bulk_show.OutputCleaner()
+        reader = bulk_show.ChannelReader(
+            spill_chars=1000, max_chars=10_000, cleaner=cleaner
+        )
+        data = raw.encode()
+        for i in range(0, len(data), 4096):
+            reader.feed(data[i:i + 4096])
+            self.assertLessEqual(
+                cleaner._line_chars, bulk_show.CLEANER_LINE_CHARS + 4096
+            )
+        self.assertEqual(reader.getvalue(), bulk_show.clean_command_output(raw))
+
+    def test_long_line_is_released_into_the_budget(self) -> None:
+        cleaner = bulk_show.OutputCleaner()
+        reader = bulk_show.ChannelReader(
+            spill_chars=1000, max_chars=10_000, keep_tail_chars=100, cleaner=cleaner
+        )
+        for _ in range(100):
+            reader.feed(b"x" * 4096)
+        self.assertLessEqual(cleaner._line_chars, bulk_show.CLEANER_LINE_CHARS)
+        reader.feed(b"\r\nRT01#")
+        value = reader.getvalue()
+        self.assertEqual(
+            value,
+            "x" * 10_000
+            + bulk_show.CAPTURE_TRUNCATED_FMT.format(reader.truncated_bytes)
+            + "x" * 94 + "\nRT01#",
+        )
+        self.assertEqual(reader.truncated_bytes, 100 * 4096 - 10_000 - 94)
+
+    def test_read_until_prompt_cleans_across_nudge(self) -> None:
+        cmd_re = bulk_show.build_command_prompt_re("RT01#")
+        chunks = [b"row1\r\n--Mo", b"re--\r        \rrow2\n-", b"-More"]
+        reply = b"--\r\nRT01#"
+        raw = b"".join(chunks + [reply]).decode()
+        capture = bulk_show.OutputCapture(cleaner=bulk_show.OutputCleaner())
+        chan = FakeChannel(chunks)
+        # The output stops inside a pager marker; the nudge's reply completes
+        # it, so the cleaner must carry the partial marker across reads.
+        chan.send = lambda data: chan._chunks.append(reply) or len(data)
+        buf, kind = bulk_show.run_read_steps(
+            chan,
+            bulk_show.read_until_prompt_steps(
+                chan, cmd_re, idle_timeout=0.05, max_wait=1.0, nudge_wait=1.0,
+                capture=capture,
+            ),
+        )
+        self.assertEqual(kind, bulk_show.MATCH_PROMPT)
+        self.assertIs(buf, capture)
+        self.assertEqual(buf.getvalue(), bulk_show.clean_command_output(raw))
+
+
+class LatencyProfileTests(unittest.TestCase):
+    def _observe(self, profile, n, duration=2.0, gap=0.2, kind=None):
+        for _ in range(n):
+            profile.observe(
+                bulk_show.DEVICE_EDGE, "show version", duration, gap, 0.0,
+                kind or bulk_show.MATCH_PROMPT, False,
+            )
+
+    def test_fixed_defaults_until_enough_samples(self) -> None:
+        profile = bulk_show.LatencyProfile()
+        self._observe(profile, bulk_show.LATENCY_MIN_SAMPLES - 1)
+        limits = profile.timeouts(bulk_show.DEVICE_EDGE, "show version")
+        self.assertFalse(limits["adaptive"])
+        self.assertEqual(limits["max_wait"], bulk_show.DEFAULT_COMMAND_MAX_WAIT)
+
+    def test_waits_derived_from_p99(self) -> None:
+        profile = bulk_show.LatencyProfile(margin=2.0)
+        self._observe(profile, 10, duration=8.0, gap=3.0)
+        limits = profile.timeouts(bulk_show.DEVICE_EDGE, "show version")
+        self.assertTrue(limits["adaptive"])
+        # Slow prompt (3 s pause): idle grows so the prompt is not nudged.
+        self.assertEqual(limits["idle_timeout"], 6.0)
+        self.assertEqual(limits["max_wait"], 22.0)
+        self.assertEqual(limits["nudge_wait"], bulk_show.DEFAULT_NUDGE_WAIT)
+        # Other device types / commands keep the fixed defaults.
+        self.assertFalse(
+            profile.timeouts(bulk_show.DEVICE_CONTROLLER, "show version")["adaptive"]
+        )
+
+    def test_timeouts_are_not_learned_from(self) -> None:
+        profile = bulk_show.LatencyProfile()
+        self._observe(profile, 10, kind=bulk_show.MATCH_MAX_WAIT)
+        limits = profile.timeouts(bulk_show.DEVICE_EDGE, "show version")
+        self.assertFalse(limits["adaptive"])
+
+    def test_round_trip_and_saving_report(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "latency.json")
+            profile = bulk_show.LatencyProfile.load(path)
+            for _ in range(5):
+                profile.observe(
+                    bulk_show.DEVICE_EDGE, "show version", 1.0, 0.1, 4.0,
+                    bulk_show.MATCH_PROMPT, False,
+                )
+            with contextlib.redirect_stdout(io.StringIO()):
+                first = profile.finish_run(30.0)
+            self.assertNotIn("saved", first)
+            profile.save()
+
+            profile = bulk_show.LatencyProfile.load(path)
+            self.assertTrue(
+                profile.timeouts(bulk_show.DEVICE_EDGE, "show version")["adaptive"]
+            )
+            for _ in range(5):
+                profile.observe(
+                    bulk_show.DEVICE_EDGE, "show version", 1.0, 0.1, 0.5,
+                    bulk_show.MATCH_PROMPT, True,
+                )
+            report = profile.finish_run(12.0)
+        self.assertIn("5 with adaptive timeouts", report)
+        self.assertIn("saved 17.5s", report)
+
+
 class ParseHostLineTests(unittest.TestCase):
     def test_blank_and_comment_lines_return_none(self) -> None:
         self.assertIsNone(bulk_show.parse_host_line(""))
@@ -245,49 +511,59 @@ class ParseHostLineTests(unittest.TestCase):
     def test_two_column_edge_default(self) -> None:
         self.assertEqual(
             bulk_show.parse_host_line("2.1.1.1,admin"),
-            ("2.1.1.1", "admin", None, bulk_show.DEVICE_EDGE),
+            ("2.1.1.1", "admin", None, bulk_show.DEVICE_EDGE, None),
         )
 
     def test_three_column_edge_with_password(self) -> None:
         self.assertEqual(
             bulk_show.parse_host_line("2.1.1.1,admin,secret"),
-            ("2.1.1.1", "admin", "secret", bulk_show.DEVICE_EDGE),
+            ("2.1.1.1", "admin", "secret", bulk_show.DEVICE_EDGE, None),
         )
 
     def test_bare_keyword_controller_no_password(self) -> None:
         self.assertEqual(
             bulk_show.parse_host_line("2.1.1.1,admin,controller"),
-            ("2.1.1.1", "admin", None, bulk_show.DEVICE_CONTROLLER),
+            ("2.1.1.1", "admin", None, bulk_show.DEVICE_CONTROLLER, None),
         )
 
     def test_bare_keyword_controller_with_password(self) -> None:
         self.assertEqual(
             bulk_show.parse_host_line("2.1.1.1,admin,secret,vsmart"),
-            ("2.1.1.1", "admin", "secret", bulk_show.DEVICE_CONTROLLER),
+            ("2.1.1.1", "admin", "secret", bulk_show.DEVICE_CONTROLLER, None),
         )
 
+    def test_site_token_sets_failure_domain(self) -> None:
+        self.assertEqual(
+            bulk_show.parse_host_line("2.1.1.1,admin,site=dc1,secret,vsmart"),
+            ("2.1.1.1", "admin", "secret", bulk_show.DEVICE_CONTROLLER, "dc1"),
+        )
+        with self.assertRaises(ValueError):
+            bulk_show.parse_host_line("2.1.1.1,admin,site=dc1,site=dc2")
+        with self.assertRaises(ValueError):
+            bulk_show.parse_host_line("2.1.1.1,admin,site=")
+
     def test_explicit_type_token_no_password(self) -> None:
         self.assertEqual(
             bulk_show.parse_host_line("2.1.1.1,admin,type=controller"),
-            ("2.1.1.1", "admin", None, bulk_show.DEVICE_CONTROLLER),
+            ("2.1.1.1", "admin", None, bulk_show.DEVICE_CONTROLLER, None),
         )
 
     def test_explicit_type_token_with_password(self) -> None:
         self.assertEqual(
             bulk_show.parse_host_line("2.1.1.1,admin,secret,type=vbond"),
-            ("2.1.1.1", "admin", "secret", bulk_show.DEVICE_CONTROLLER),
+            ("2.1.1.1", "admin", "secret", bulk_show.DEVICE_CONTROLLER, None),
         )
 
     def test_explicit_type_edge_with_password(self) -> None:
         self.assertEqual(
             bulk_show.parse_host_line("2.1.1.1,admin,secret,type=edge"),
-            ("2.1.1.1", "admin", "secret", bulk_show.DEVICE_EDGE),
+            ("2.1.1.1", "admin", "secret", bulk_show.DEVICE_EDGE, None),
         )
 
     def test_whitespace_is_stripped(self) -> None:
         self.assertEqual(
             bulk_show.parse_host_line("  2.1.1.1 , admin , secret , controller "),
-            ("2.1.1.1", "admin", "secret", bulk_show.DEVICE_CONTROLLER),
+            ("2.1.1.1", "admin", "secret", bulk_show.DEVICE_CONTROLLER, None),
         )
 
     def test_missing_username_raises(self) -> None:
@@ -308,7 +584,7 @@ class ParseHostLineTests(unittest.TestCase):
         # as a device type (password left empty), but now warns about it.
         result, err = _parse_capture_stderr("4.1.1.1,admin,vmanage")
         self.assertEqual(
-            result, ("4.1.1.1", "admin", None, bulk_show.DEVICE_CONTROLLER)
+            result, ("4.1.1.1", "admin", None, bulk_show.DEVICE_CONTROLLER, None)
         )
         self.assertIn("vmanage", err)
         self.assertIn("device type", err)
@@ -316,7 +592,7 @@ class ParseHostLineTests(unittest.TestCase):
     def test_bare_keyword_edge_three_col_infers_type_and_warns(self) -> None:
         result, err = _parse_capture_stderr("4.1.1.1,admin,edge")
         self.assertEqual(
-            result, ("4.1.1.1", "admin", None, bulk_show.DEVICE_EDGE)
+            result, ("4.1.1.1", "admin", None, bulk_show.DEVICE_EDGE, None)
         )
         self.assertIn("edge", err)
 
@@ -325,7 +601,7 @@ class ParseHostLineTests(unittest.TestCase):
         # unambiguously a password, and no warning is emitted (4-column form).
         result, err = _parse_capture_stderr("4.1.1.1,admin,vmanage,type=edge")
         self.assertEqual(
-            result, ("4.1.1.1", "admin", "vmanage", bulk_show.DEVICE_EDGE)
+            result, ("4.1.1.1", "admin", "vmanage", bulk_show.DEVICE_EDGE, None)
         )
         self.assertEqual(err, "")
 
@@ -339,20 +615,20 @@ class ParseHostLineTests(unittest.TestCase):
         # pair is consistent and accepted.
         self.assertEqual(
             bulk_show.parse_host_line("2.1.1.1,admin,type=controller,type=vbond"),
-            ("2.1.1.1", "admin", None, bulk_show.DEVICE_CONTROLLER),
+            ("2.1.1.1", "admin", None, bulk_show.DEVICE_CONTROLLER, None),
         )
 
     # -- Finding 5: additional coverage ----------------------------------- --
     def test_empty_password_three_col_is_none(self) -> None:
         self.assertEqual(
             bulk_show.parse_host_line("2.1.1.1,admin,"),
-            ("2.1.1.1", "admin", None, bulk_show.DEVICE_EDGE),
+            ("2.1.1.1", "admin", None, bulk_show.DEVICE_EDGE, None),
         )
 
     def test_empty_password_with_controller_is_none(self) -> None:
         self.assertEqual(
             bulk_show.parse_host_line("2.1.1.1,admin,,controller"),
-            ("2.1.1.1", "admin", None, bulk_show.DEVICE_CONTROLLER),
+            ("2.1.1.1", "admin", None, bulk_show.DEVICE_CONTROLLER, None),
         )
 
     def test_empty_username_raises(self) -> None:
@@ -362,19 +638,19 @@ class ParseHostLineTests(unittest.TestCase):
     def test_unknown_trailing_keyword_is_password(self) -> None:
         self.assertEqual(
             bulk_show.parse_host_line("2.1.1.1,admin,notatype"),
-            ("2.1.1.1", "admin", "notatype", bulk_show.DEVICE_EDGE),
+            ("2.1.1.1", "admin", "notatype", bulk_show.DEVICE_EDGE, None),
         )
 
     def test_explicit_type_is_case_insensitive(self) -> None:
         self.assertEqual(
             bulk_show.parse_host_line("2.1.1.1,admin,TYPE=VSmart"),
-            ("2.1.1.1", "admin", None, bulk_show.DEVICE_CONTROLLER),
+            ("2.1.1.1", "admin", None, bulk_show.DEVICE_CONTROLLER, None),
         )
 
     def test_explicit_type_token_order_independent(self) -> None:
         self.assertEqual(
             bulk_show.parse_host_line("type=controller,2.1.1.1,admin"),
-            ("2.1.1.1", "admin", None, bulk_show.DEVICE_CONTROLLER),
+            ("2.1.1.1", "admin", None, bulk_show.DEVICE_CONTROLLER, None),
         )
 
 
@@ -419,6 +695,2007 @@ class ResolveCommandsFileTests(unittest.TestCase):
         )
 
 
+class ScriptedChannel:
+    """Fake edge shell that answers each ``send`` from a script.
+
+    Exposes a real file descriptor (a pipe that is readable while output is
+    queued) so it can be driven by both the threaded and selectors engines.
+    """
+
+    RESPONSES = {
+        "shell": b"\r\nPassword: ",
+        "pw": b"\r\nRT01#",
+        "terminal length 0": b"terminal length 0\r\nRT01#",
+        "show version": b"show version\r\nCisco IOS XE Software\r\nRT01#",
+        "show clock": b"show clock\r\n*10:00:00.000 UTC Mon Jan 1 2026\r\nRT01#",
+        "show run": b"show run\r\nhostname RT01\r\n--More--",
+        "!": b"\r        \r!\r\nend\r\n(END)",
+        "q": b"\rRT01#",
+    }
+
+    def __init__(self):
+        self._read_fd, self._write_fd = os.pipe()
+        self._chunks = []
+        self.eof_received = False
+        self.closed = False
+
+    def _push(self, data):
+        self._chunks.append(data)
+        os.write(self._write_fd, b"x")
+
+    def settimeout(self, _timeout):
+        pass
+
+    def fileno(self):
+        return self._read_fd
+
+    def send(self, data):
+        # Answer every line of a (possibly pipelined) send in order.
+        for line in data.replace("\x15", "").splitlines():
+            reply = self.RESPONSES.get(line.strip())
+            if reply is not None:
+                self._push(reply)
+        return len(data)
+
+    def recv_ready(self):
+        return bool(self._chunks)
+
+    def recv(self, _size):
+        if not self._chunks:
+            raise socket.timeout()
+        os.read(self._read_fd, 1)
+        return self._chunks.pop(0)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            os.close(self._read_fd)
+            os.close(self._write_fd)
+
+
+class WarmChannel(ScriptedChannel):
+    """ScriptedChannel that also redraws its prompt for an empty line."""
+
+    RESPONSES = dict(ScriptedChannel.RESPONSES, **{"": b"\r\nRT01#"})
+
+    def __init__(self):
+        super().__init__()
+        self.sent = []
+
+    def send(self, data):
+        self.sent.append(data)
+        return super().send(data)
+
+
+class SessionPoolTests(unittest.TestCase):
+    def _pooled(self, channel=None):
+        ssh = _FakeSSHClient(channel or WarmChannel())
+        shell = ssh.invoke_shell()
+        self.addCleanup(shell.close)
+        return bulk_show.PooledShell(ssh, shell, bulk_show.SettledShell("RT01#"))
+
+    def test_lru_eviction_closes_oldest(self) -> None:
+        pool = bulk_show.SessionPool(max_size=2)
+        shells = [self._pooled() for _ in range(3)]
+        for i, pooled in enumerate(shells):
+            pool.checkin(("10.0.0.%d" % i, 830, "admin", "edge"), pooled)
+        self.assertEqual(len(pool), 2)
+        self.assertTrue(shells[0].ssh.closed)
+        self.assertFalse(shells[2].ssh.closed)
+
+    def test_evict_idle(self) -> None:
+        pool = bulk_show.SessionPool(idle_ttl=60.0)
+        pooled = self._pooled()
+        pool.checkin("k", pooled)
+        self.assertEqual(pool.evict_idle(pooled.last_used + 30), 0)
+        self.assertEqual(pool.evict_idle(pooled.last_used + 61), 1)
+        self.assertTrue(pooled.ssh.closed)
+        self.assertEqual(len(pool), 0)
+
+    def test_checkout_health_checks_prompt(self) -> None:
+        pool = bulk_show.SessionPool()
+        pooled = self._pooled()
+        pool.checkin("k", pooled)
+        self.assertIs(pool.checkout("k"), pooled)
+        self.assertIsNone(pool.checkout("k"))
+        self.assertEqual((pool.hits, pool.misses), (1, 1))
+
+    def test_dead_shell_is_not_handed_out(self) -> None:
+        pool = bulk_show.SessionPool()
+        pooled = self._pooled()
+        pool.checkin("k", pooled)
+        pooled.ssh.get_transport().active = False
+        self.assertIsNone(pool.checkout("k"))
+        self.assertTrue(pooled.ssh.closed)
+
+
+class PooledSessionTests(unittest.TestCase):
+    """Repeat runs through a SessionPool skip the login phases."""
+
+    def setUp(self) -> None:
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        self.commands = os.path.join(self._tmp.name, "commands.txt")
+        with open(self.commands, "w") as f:
+            f.write("show version\n")
+        self.channels = []
+        self.pool = bulk_show.SessionPool()
+        self.addCleanup(self.pool.close)
+
+    def tearDown(self) -> None:
+        for chan in self.channels:
+            chan.close()
+
+    def _make_channel(self):
+        self.channels.append(WarmChannel())
+        return self.channels[-1]
+
+    def _job(self, run):
+        return dict(
+            router_ip="10.0.0.1",
+            username="admin",
+            password="pw",
+            commands_file=self.commands,
+            output_paths={
+                bulk_show.OUTPUT_FORMAT_TEXT: os.path.join(self._tmp.name, f"{run}.txt")
+            },
+            session_pool=self.pool,
+        )
+
+    def _assert_reused(self, results) -> None:
+        self.assertEqual([r["status"] for r in results], [bulk_show.SESSION_OK] * 2)
+        self.assertEqual(len(self.channels), 1)
+        self.assertEqual(
+            sum(1 for data in self.channels[0].sent if data == "shell\n"), 1
+        )
+        self.assertEqual((self.pool.hits, self.pool.misses), (1, 1))
+        with open(os.path.join(self._tmp.name, "second.txt"), encoding="utf-8") as f:
+            self.assertIn("Cisco IOS XE Software", f.read())
+
+    def test_threaded_reuses_warm_shell(self) -> None:
+        with _injected_paramiko(self._make_channel):
+            results = [
+                bulk_show.connect_and_execute(**self._job(run))
+                for run in ("first", "second")
+            ]
+        self._assert_reused(results)
+
+    def test_selectors_reuses_warm_shell(self) -> None:
+        with _injected_paramiko(self._make_channel):
+            results = [
+                next(bulk_show.run_selectors_engine([self._job(run)], 1))
+                for run in ("first", "second")
+            ]
+        self._assert_reused(results)
+
+    def test_failed_session_is_not_parked(self) -> None:
+        job = self._job("first")
+        job["commands_file"] = os.path.join(self._tmp.name, "missing.txt")
+        with _injected_paramiko(self._make_channel):
+            result = bulk_show.connect_and_execute(**job)
+        self.assertEqual(result["status"], bulk_show.SESSION_OTHER_ERR)
+        self.assertEqual(len(self.pool), 0)
+
+
+@unittest.skipUnless(hasattr(socket, "AF_UNIX"), "needs Unix domain sockets")
+class PoolDaemonTests(unittest.TestCase):
+    def _options(self, tmp, commands):
+        return types.SimpleNamespace(
+            commands_file=commands,
+            controller_commands=None,
+            edge_commands=None,
+            port=830,
+            controller_port=22,
+            reject_unknown_hosts=False,
+            password_prompt=False,
+            retries=0,
+            retry_delay=0.0,
+            logs_dir=os.path.join(tmp, "logs"),
+            output_format=["text"],
+            deadline=None,
+            host_budget=None,
+            preflight=False,
+            preflight_timeout=2.0,
+            circuit_breaker=0,
+            failure_domain_prefix=24,
+            controller_workers=None,
+            edge_workers=None,
+            per_site_workers=None,
+            connect_workers=4,
+            ready_sessions=2,
+            ssh_auth="password",
+            kex=None,
+            ciphers=None,
+            banner_timeout=None,
+            auth_timeout=None,
+            post_process_workers=0,
+            record=None,
+            replay=None,
+            replay_speed=1.0,
+        )
+
+    def test_runs_share_warm_shells(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            commands = os.path.join(tmp, "commands.txt")
+            with open(commands, "w") as f:
+                f.write("show version\n")
+            options = self._options(tmp, commands)
+            hosts = [("10.0.0.1", "admin", None, "edge", None), ("10.0.0.2", "admin", None, "edge", None)]
+            channels = []
+
+            def make_channel():
+                channels.append(WarmChannel())
+                return channels[-1]
+
+            sock_path = os.path.join(tmp, "daemon.sock")
+            with _injected_paramiko(make_channel), contextlib.redirect_stdout(
+                io.StringIO()
+            ) as log:
+                daemon = bulk_show.PoolDaemon(sock_path, bulk_show.SessionPool())
+                server = threading.Thread(target=daemon.serve_forever)
+                server.start()
+                try:
+                    first = bulk_show.submit_to_server(sock_path, hosts, options, "pw")
+                    second = bulk_show.submit_to_server(sock_path, hosts, options, "pw")
+                finally:
+                    daemon.shutdown()
+                    server.join()
+            for chan in channels:
+                chan.close()
+            self.assertEqual(first, (2, 0))
+            self.assertEqual(second, (2, 0))
+            self.assertEqual(len(channels), 2)
+            self.assertIn("[main] pool: reused=2, fresh=0, warm=2", log.getvalue())
+            self.assertFalse(os.path.exists(sock_path))
+            self.assertIsNone(
+                bulk_show.submit_to_server(sock_path, hosts, options, "pw")
+            )
+
+    def test_client_disconnect_cancels_the_run(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            commands = os.path.join(tmp, "commands.txt")
+            with open(commands, "w") as f:
+                f.write("show version\nshow hang\n")
+            options = self._options(tmp, commands)
+            request = {
+                "hosts": [["10.0.0.1", "admin", None, "edge", None]],
+                "password": "pw",
+                "options": {
+                    name: getattr(options, name)
+                    for name in bulk_show.SERVE_RUN_OPTIONS
+                },
+            }
+            sock_path = os.path.join(tmp, "daemon.sock")
+            outcome = []
+            ended = threading.Event()
+            with _injected_paramiko(HangingChannel), contextlib.redirect_stdout(
+                io.StringIO()
+            ):
+                daemon = bulk_show.PoolDaemon(sock_path, bulk_show.SessionPool())
+                run = daemon.run
+
+                def recorded_run(*args):
+                    outcome.append(run(*args))
+                    ended.set()
+                    return outcome[-1]
+
+                daemon.run = recorded_run
+                server = threading.Thread(target=daemon.serve_forever)
+                server.start()
+                try:
+                    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                    client.connect(sock_path)
+                    with client, client.makefile("rwb") as stream:
+                        stream.write(json.dumps(request).encode() + b"\n")
+                        stream.flush()
+                        for line in stream:
+                            if "running: show hang" in line.decode():
+                                break
+                    # The client is gone mid-command, as after a Ctrl-C.
+                    self.assertTrue(ended.wait(10), "daemon run kept going")
+                finally:
+                    daemon.shutdown()
+                    server.join()
+            self.assertEqual(outcome, [(0, 1)])
+
+
+class ConcurrencyControllerTests(unittest.TestCase):
+    def _result(self, status=bulk_show.SESSION_OK, connect_s=0.1, cmd_status="ok"):
+        return {
+            "host": "10.0.0.1",
+            "status": status,
+            "connect_s": connect_s,
+            "commands": [{"command": "show clock", "status": cmd_status}],
+        }
+
+    def _record(self, controller, *results):
+        with contextlib.redirect_stdout(io.StringIO()) as log:
+            for result in results:
+                controller.record(result)
+        return log.getvalue()
+
+    def test_additive_increase_up_to_maximum(self) -> None:
+        controller = bulk_show.ConcurrencyController(initial=2, maximum=4)
+        log = self._record(controller, *[self._result()] * 5)
+        self.assertEqual(controller.limit, 4)
+        self.assertIn("[main] concurrency: 2 -> 3 (healthy)", log)
+
+    def test_connect_error_halves_once_per_generation(self) -> None:
+        controller = bulk_show.ConcurrencyController(initial=16)
+        error = self._result(status=bulk_show.SESSION_CONNECT_ERR)
+        log = self._record(controller, error)
+        self.assertEqual(controller.limit, 8)
+        self.assertIn("16 -> 8 (connect_error on 10.0.0.1)", log)
+        # Hosts already running under the old limit do not back off again.
+        self._record(controller, *[error] * 15)
+        self.assertEqual(controller.limit, 8)
+        self._record(controller, error)
+        self.assertEqual(controller.limit, 4)
+
+    def test_command_timeout_and_auth_errors(self) -> None:
+        controller = bulk_show.ConcurrencyController(initial=8)
+        self._record(controller, self._result(status=bulk_show.SESSION_AUTH_SSH))
+        self.assertEqual(controller.limit, 8)
+        self._record(controller, self._result(cmd_status=bulk_show.CMD_TIMEOUT))
+        self.assertEqual(controller.limit, 4)
+
+    def test_connect_latency_above_baseline_backs_off(self) -> None:
+        controller = bulk_show.ConcurrencyController(initial=8, maximum=64)
+        self._record(controller, *[self._result(connect_s=0.5)] * 5)
+        self.assertEqual(controller.limit, 13)
+        log = self._record(controller, *[self._result(connect_s=6.0)] * 5)
+        self.assertIn("connect latency 6.0s > 2.0s", log)
+        self.assertEqual(controller.limit, 8)
+
+    @unittest.skipUnless(hasattr(os, "getloadavg"), "needs os.getloadavg")
+    def test_load_average_signal(self) -> None:
+        controller = bulk_show.ConcurrencyController(initial=8, max_load=4.0)
+        with mock.patch.object(bulk_show.os, "getloadavg", return_value=(6.5, 0, 0)):
+            log = self._record(controller, self._result())
+        self.assertEqual(controller.limit, 4)
+        self.assertIn("load average 6.50 > 4", log)
+
+    def test_threaded_engine_follows_controller(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            commands = os.path.join(tmp, "commands.txt")
+            with open(commands, "w") as f:
+                f.write("show version\n")
+            jobs = [
+                dict(
+                    router_ip=f"10.0.0.{i}",
+                    username="admin",
+                    password="pw",
+                    commands_file=commands,
+                    output_paths={},
+                )
+                for i in range(1, 5)
+            ]
+            channels = []
+
+            def make_channel():
+                channels.append(ScriptedChannel())
+                return channels[-1]
+
+            controller = bulk_show.ConcurrencyController(initial=1, maximum=4)
+            with _injected_paramiko(make_channel):
+                results = list(bulk_show.run_threaded_engine(jobs, controller))
+            for chan in channels:
+                chan.close()
+        self.assertEqual(len(results), 4)
+        self.assertEqual(controller.limit, 4)
+
+
+class HangingChannel(ScriptedChannel):
+    """ScriptedChannel whose "show hang" prints a line and never returns."""
+
+    RESPONSES = dict(
+        ScriptedChannel.RESPONSES, **{"show hang": b"show hang\r\npartial line\r\n"}
+    )
+
+
+class DeadlineTests(unittest.TestCase):
+    def test_cancel_token(self) -> None:
+        parent = bulk_show.CancelToken()
+        self.assertIs(bulk_show.CancelToken.for_host(parent), parent)
+        child = bulk_show.CancelToken.for_host(parent, budget=60)
+        self.assertFalse(child.is_set())
+        self.assertLessEqual(child.remaining(), 60)
+        parent.cancel("interrupted by SIGTERM")
+        self.assertTrue(child.is_set())
+        self.assertEqual(child.reason, "interrupted by SIGTERM")
+        expired = bulk_show.CancelToken(deadline=0.0, reason="deadline 5s reached")
+        self.assertTrue(expired.is_set())
+        self.assertEqual(expired.reason, "deadline 5s reached")
+        self.assertTrue(expired.wait(10))
+
+    def test_cancel_token_expires_walks_every_parent(self) -> None:
+        now = time.monotonic()
+        caller = bulk_show.CancelToken(deadline=now + 5)
+        run = bulk_show.CancelToken(deadline=now + 600, parent=caller)
+        host = bulk_show.CancelToken.for_host(run, budget=120)
+        self.assertEqual(host.expires(), now + 5)
+        self.assertLessEqual(host.remaining(), 5)
+        self.assertIsNone(bulk_show.CancelToken(parent=bulk_show.CancelToken()).expires())
+
+    def test_read_channel_stops_on_cancel(self) -> None:
+        cancel = bulk_show.CancelToken()
+        cancel.cancel("test")
+        buf, kind = bulk_show.read_channel(
+            FakeChannel([b"partial"]), max_wait=60, cancel=cancel
+        )
+        self.assertEqual(kind, bulk_show.MATCH_DEADLINE)
+
+    def _jobs(self, tmp, budget=None, cancel=None, hosts=1):
+        commands = os.path.join(tmp, "commands.txt")
+        with open(commands, "w") as f:
+            f.write("show version\nshow hang\nshow clock\n")
+        return [
+            dict(
+                router_ip=f"10.0.0.{i}",
+                username="admin",
+                password="pw",
+                commands_file=commands,
+                output_paths={
+                    bulk_show.OUTPUT_FORMAT_TEXT: os.path.join(tmp, f"out{i}.txt"),
+                    bulk_show.OUTPUT_FORMAT_JSON: os.path.join(tmp, f"out{i}.json"),
+                },
+                host_budget=budget,
+                cancel=cancel,
+            )
+            for i in range(1, hosts + 1)
+        ]
+
+    def test_host_budget_records_partial_and_skipped_commands(self) -> None:
+        for engine in (
+            bulk_show.run_threaded_engine,
+            bulk_show.run_selectors_engine,
+            bulk_show.run_staged_engine,
+        ):
+            with self.subTest(engine=engine.__name__), tempfile.TemporaryDirectory() as tmp:
+                channels = []
+
+                def make_channel():
+                    channels.append(HangingChannel())
+                    return channels[-1]
+
+                started = bulk_show.time.monotonic()
+                with _injected_paramiko(make_channel), contextlib.redirect_stdout(
+                    io.StringIO()
+                ):
+                    (result,) = list(engine(self._jobs(tmp, budget=1.0), 1))
+                for chan in channels:
+                    chan.close()
+                self.assertLess(bulk_show.time.monotonic() - started, 4.0)
+                self.assertEqual(result["status"], bulk_show.SESSION_DEADLINE)
+                self.assertIn("host budget 1s exceeded", result["error"])
+                with open(os.path.join(tmp, "out1.json"), encoding="utf-8") as f:
+                    commands = json.load(f)["commands"]
+                self.assertEqual(
+                    [(c["status"], c["exit_kind"]) for c in commands],
+                    [
+                        (bulk_show.CMD_OK, bulk_show.MATCH_PROMPT),
+                        (bulk_show.CMD_TIMEOUT, bulk_show.MATCH_DEADLINE),
+                        (bulk_show.CMD_SKIPPED, bulk_show.MATCH_DEADLINE),
+                    ],
+                )
+                self.assertIn("partial line", commands[1]["output"])
+                with open(os.path.join(tmp, "out1.txt"), encoding="utf-8") as f:
+                    text = f.read()
+                self.assertIn("!! command not run: show clock (exit=deadline)", text)
+                self.assertIn("status=deadline", text)
+
+    def test_pending_hosts_are_skipped(self) -> None:
+        cancel = bulk_show.CancelToken()
+        cancel.cancel("deadline 5s reached")
+        for engine in (
+            bulk_show.run_threaded_engine,
+            bulk_show.run_selectors_engine,
+            bulk_show.run_staged_engine,
+        ):
+            with self.subTest(engine=engine.__name__), tempfile.TemporaryDirectory() as tmp:
+                with contextlib.redirect_stdout(io.StringIO()) as log:
+                    results = list(
+                        engine(self._jobs(tmp, cancel=cancel, hosts=3), 2, cancel)
+                    )
+                self.assertEqual(
+                    [r["status"] for r in results], [bulk_show.SESSION_SKIPPED] * 3
+                )
+                self.assertIn("[10.0.0.3] skipped: deadline 5s reached", log.getvalue())
+                with open(os.path.join(tmp, "out3.txt"), encoding="utf-8") as f:
+                    self.assertIn("status=skipped", f.read())
+
+
+class SSHConnectorTests(unittest.TestCase):
+    def test_password_auth_disables_key_attempts(self) -> None:
+        seen = []
+
+        def connect(client, host, **kwargs):
+            seen.append(kwargs)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            commands = os.path.join(tmp, "commands.txt")
+            with open(commands, "w") as f:
+                f.write("show version\n")
+            for connector in (
+                None,
+                bulk_show.SSHConnector(bulk_show.SSH_AUTH_ANY, banner_timeout=30.0),
+            ):
+                chan = ScriptedChannel()
+                with _injected_paramiko(chan), mock.patch.object(
+                    _FakeSSHClient, "connect", autospec=True, side_effect=connect
+                ):
+                    bulk_show.connect_and_execute(
+                        "10.0.0.1", "admin", "pw", commands, {}, connector=connector
+                    )
+                chan.close()
+        self.assertFalse(seen[0]["look_for_keys"])
+        self.assertFalse(seen[0]["allow_agent"])
+        self.assertNotIn("look_for_keys", seen[1])
+        # Capped at the connect timeout.
+        self.assertEqual(seen[1]["banner_timeout"], bulk_show.SSH_CONNECT_TIMEOUT)
+
+    def test_prefer_keeps_other_algorithms(self) -> None:
+        self.assertEqual(
+            bulk_show._prefer(("a", "b", "c"), ["c", "unknown", "a"]), ("c", "a", "b")
+        )
+
+
+@unittest.skipUnless(
+    importlib.util.find_spec("paramiko"), "needs paramiko for real host keys"
+)
+class KnownHostsPolicyTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        import paramiko
+
+        cls.paramiko = paramiko
+        cls.key = paramiko.RSAKey.generate(1024)
+        cls.other = paramiko.RSAKey.generate(1024)
+
+    def _connector(self, tmp):
+        path = os.path.join(tmp, "known_hosts")
+        with open(path, "w") as f:
+            f.write(f"[10.0.0.1]:830 {self.key.get_name()} {self.key.get_base64()}\n")
+        return bulk_show.SSHConnector(known_hosts=path)
+
+    def test_known_hosts_parsed_once_and_checked(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            connector = self._connector(tmp)
+            policy = bulk_show._KnownHostsPolicy(connector, allow_unknown_hosts=False)
+            policy.missing_host_key(None, "[10.0.0.1]:830", self.key)
+            with self.assertRaises(self.paramiko.BadHostKeyException):
+                policy.missing_host_key(None, "[10.0.0.1]:830", self.other)
+            with self.assertRaises(self.paramiko.SSHException):
+                policy.missing_host_key(None, "[10.0.0.2]:830", self.key)
+            os.unlink(os.path.join(tmp, "known_hosts"))
+            # Still answered from the copy parsed on first use.
+            policy.missing_host_key(None, "[10.0.0.1]:830", self.key)
+
+    def test_unknown_host_remembered_when_allowed(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            connector = self._connector(tmp)
+            policy = bulk_show._KnownHostsPolicy(connector, allow_unknown_hosts=True)
+            policy.missing_host_key(None, "10.0.0.9", self.other)
+            with self.assertRaises(self.paramiko.BadHostKeyException):
+                policy.missing_host_key(None, "10.0.0.9", self.key)
+
+    def test_transport_factory_orders_algorithms(self) -> None:
+        connector = bulk_show.SSHConnector(
+            kex=["diffie-hellman-group14-sha256"], ciphers=["aes256-ctr"]
+        )
+        self.assertIn(
+            "transport_factory", connector.connect_kwargs(self.paramiko, 10)
+        )
+        left, right = socket.socketpair()
+        self.addCleanup(right.close)
+        transport = connector.transport(left)
+        self.addCleanup(transport.close)
+        options = transport.get_security_options()
+        self.assertEqual(options.kex[0], "diffie-hellman-group14-sha256")
+        self.assertEqual(options.ciphers[0], "aes256-ctr")
+        self.assertIn("aes128-ctr", options.ciphers)
+
+
+class TranscriptTests(unittest.TestCase):
+    _VOLATILE_RE = re.compile(r"(started|ended|duration)=\S+")
+
+    def _transcript(self, *events):
+        return bulk_show.Transcript({"version": 1, "host": "RT01"}, list(events))
+
+    def _session(self, tmp, name, **kwargs):
+        commands = os.path.join(tmp, "commands.txt")
+        with open(commands, "w") as f:
+            f.write("show version\nshow run\n")
+        paths = bulk_show._build_output_paths(
+            os.path.join(tmp, name), "10.0.0.1", "ts", [bulk_show.OUTPUT_FORMAT_TEXT]
+        )
+        os.makedirs(os.path.join(tmp, name))
+        result = bulk_show.connect_and_execute(
+            "10.0.0.1", "admin", "pw", commands, paths, **kwargs
+        )
+        with open(paths[bulk_show.OUTPUT_FORMAT_TEXT], encoding="utf-8") as f:
+            return result, self._VOLATILE_RE.sub("", f.read())
+
+    def test_replayed_session_writes_the_recorded_output(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            record = os.path.join(tmp, "transcripts")
+            os.makedirs(record)
+            chan = ScriptedChannel()
+            with _injected_paramiko(chan):
+                recorded, recorded_text = self._session(
+                    tmp, "live", connector=bulk_show.SSHConnector(record=record)
+                )
+            chan.close()
+            transcript = bulk_show.Transcript.load(
+                bulk_show.transcript_path(record, "10.0.0.1")
+            )
+            sends = [data for _, kind, data in transcript.events if kind == "s"]
+            self.assertIn(bulk_show.TRANSCRIPT_PASSWORD + b"\n", sends)
+            self.assertNotIn(b"pw\n", sends)
+            self.assertEqual(transcript.header["username"], "admin")
+
+            log = io.StringIO()
+            with _injected_paramiko(None), contextlib.redirect_stdout(log):
+                replayed, replayed_text = self._session(
+                    tmp, "replay", connector=bulk_show.ReplayConnector(record, speed=0)
+                )
+        self.assertEqual(recorded["status"], bulk_show.SESSION_OK)
+        self.assertEqual(replayed["status"], bulk_show.SESSION_OK)
+        self.assertEqual(replayed_text, recorded_text)
+        self.assertIn("hostname RT01", replayed_text)
+        self.assertNotIn("diverged", log.getvalue())
+
+    def test_response_waits_for_its_command(self) -> None:
+        chan = bulk_show.ReplayChannel(
+            self._transcript(
+                (0.0, "r", b"RT01#"),
+                (1.0, "s", b"show clock\n"),
+                (1.5, "r", b"show clock\r\n10:00\r\nRT01#"),
+            ),
+            speed=10,
+        )
+        buf, kind = bulk_show.read_channel(chan, idle_timeout=0.05, poll_interval=0.01)
+        self.assertEqual((buf, kind), ("RT01#", bulk_show.MATCH_PROMPT))
+        chan.settimeout(0.01)
+        with self.assertRaises(socket.timeout):
+            chan.recv(1024)
+        started = time.monotonic()
+        chan.send("show clock\n")
+        buf, kind = bulk_show.read_channel(chan, idle_timeout=0.5, poll_interval=0.01)
+        self.assertEqual(kind, bulk_show.MATCH_PROMPT)
+        self.assertIn("10:00", buf)
+        self.assertGreaterEqual(time.monotonic() - started, 0.04)
+
+    def test_divergent_send_is_ignored(self) -> None:
+        chan = bulk_show.ReplayChannel(
+            self._transcript((0.0, "s", b"show clock\n"), (0.1, "r", b"RT01#")),
+            speed=0,
+        )
+        chan.settimeout(0.01)
+        log = io.StringIO()
+        with contextlib.redirect_stdout(log):
+            chan.send("\n")
+        self.assertTrue(chan.diverged)
+        self.assertIn("[RT01] replay diverged", log.getvalue())
+        with self.assertRaises(socket.timeout):
+            chan.recv(1024)
+        chan.send("show clock\n")
+        self.assertEqual(chan.recv(2), b"RT")
+        self.assertEqual(chan.recv(1024), b"01#")
+
+    def test_host_without_transcript_fails_to_connect(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp, _injected_paramiko(None):
+            result, _ = self._session(
+                tmp, "replay", connector=bulk_show.ReplayConnector(tmp, speed=0)
+            )
+        self.assertEqual(result["status"], bulk_show.SESSION_CONNECT_ERR)
+
+
+@unittest.skipUnless(
+    importlib.util.find_spec("paramiko"), "needs paramiko for the simulated fleet"
+)
+class SimulatedFleetTests(unittest.TestCase):
+    """connect_and_execute over real SSH against tests/fake_sdwan_fleet.py."""
+
+    @classmethod
+    def setUpClass(cls):
+        spec = importlib.util.spec_from_file_location(
+            "fake_sdwan_fleet", REPO_ROOT / "tests" / "fake_sdwan_fleet.py"
+        )
+        cls.fleet = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(cls.fleet)
+
+    def _run(self, profile, host, device_type):
+        server = self.fleet.FleetServer(profile)
+        self.addCleanup(server.close)
+        port = server.edge_port
+        if device_type == bulk_show.DEVICE_CONTROLLER:
+            port = server.controller_port
+        with tempfile.TemporaryDirectory() as tmp:
+            commands = os.path.join(tmp, "commands.txt")
+            with open(commands, "w") as f:
+                f.write("show version\nshow running-config\n")
+            paths = bulk_show._build_output_paths(
+                tmp, host, "ts", [bulk_show.OUTPUT_FORMAT_TEXT]
+            )
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = bulk_show.connect_and_execute(
+                    host, "admin", "admin", commands, paths, port=port,
+                    device_type=device_type,
+                    connector=bulk_show.SSHConnector(
+                        known_hosts=os.path.join(tmp, "known_hosts")
+                    ),
+                )
+            with open(paths[bulk_show.OUTPUT_FORMAT_TEXT], encoding="utf-8") as f:
+                return result, f.read()
+
+    def test_edge_and_paged_controller(self) -> None:
+        profile = self.fleet.DeviceProfile(output_size=2000, page_lines=5)
+        for host, device_type, prompt in (
+            ("127.1.0.1", bulk_show.DEVICE_EDGE, "cedge-127-1-0-1#show"),
+            ("127.1.0.2", bulk_show.DEVICE_CONTROLLER, "vsmart-127-1-0-2# show"),
+        ):
+            result, text = self._run(profile, host, device_type)
+            self.assertEqual(result["status"], bulk_show.SESSION_OK, msg=text)
+            self.assertEqual(
+                [c["status"] for c in result["commands"]], [bulk_show.CMD_OK] * 2
+            )
+            self.assertIn(f"{prompt} running-config", text)
+            self.assertIn("show running-config 0000024", text)
+            self.assertNotIn("--More--", text)
+
+    def test_injected_failures(self) -> None:
+        for mode, device_type, status in (
+            ("auth", bulk_show.DEVICE_EDGE, bulk_show.SESSION_AUTH_SSH),
+            ("shell-auth", bulk_show.DEVICE_EDGE, bulk_show.SESSION_AUTH_SHELL),
+            ("shell-auth", bulk_show.DEVICE_CONTROLLER, bulk_show.SESSION_AUTH_SHELL),
+        ):
+            profile = self.fleet.DeviceProfile(fail_rate=1.0, fail_modes=[mode])
+            result, _ = self._run(profile, "127.1.0.3", device_type)
+            self.assertEqual(result["status"], status, msg=mode)
+
+
+class RetryQueueTests(unittest.TestCase):
+    def test_backoff_doubles_with_jitter(self) -> None:
+        for attempt, base in ((1, 10.0), (2, 20.0), (3, 40.0), (10, 300.0)):
+            delay = bulk_show.retry_backoff(10.0, attempt)
+            self.assertGreaterEqual(delay, base * (1 - bulk_show.RETRY_JITTER))
+            self.assertLessEqual(delay, base * (1 + bulk_show.RETRY_JITTER))
+
+    def test_offer_only_retries_connect_errors(self) -> None:
+        queue_ = bulk_show.RetryQueue()
+        job = {"router_ip": "10.0.0.1", "retries": 1, "retry_delay": 0.0}
+        result = bulk_show._new_session_result("10.0.0.1", "admin", 830, "edge")
+        result["connect_attempts"] = 1
+        result["status"] = bulk_show.SESSION_AUTH_SSH
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertFalse(queue_.offer(job, result))
+            result["status"] = bulk_show.SESSION_CONNECT_ERR
+            self.assertTrue(queue_.offer(job, result))
+            self.assertEqual(queue_.ready(bulk_show.time.monotonic()), [(job, result)])
+            result["connect_attempts"] = 2
+            self.assertFalse(queue_.offer(job, result))
+
+    def test_failing_host_does_not_hold_a_worker(self) -> None:
+        connects = collections.Counter()
+
+        def connect(client, host, **_kwargs):
+            connects[host] += 1
+            if host == "10.0.0.1" and connects[host] <= 2:
+                raise OSError("unreachable")
+
+        # One connect thread for the staged engine too: with several, the
+        # healthy hosts can settle, and so finish, in either order.
+        staged = functools.partial(bulk_show.run_staged_engine, connect_workers=1)
+        staged.__name__ = "run_staged_engine"
+        for engine in (
+            bulk_show.run_threaded_engine,
+            bulk_show.run_selectors_engine,
+            staged,
+        ):
+            connects.clear()
+            with self.subTest(engine=engine.__name__), tempfile.TemporaryDirectory() as tmp:
+                commands = os.path.join(tmp, "commands.txt")
+                with open(commands, "w") as f:
+                    f.write("show version\n")
+                jobs = [
+                    dict(
+                        router_ip=f"10.0.0.{i}",
+                        username="admin",
+                        password="pw",
+                        commands_file=commands,
+                        output_paths={},
+                        retries=3,
+                        retry_delay=0.3,
+                    )
+                    for i in (1, 2, 3)
+                ]
+                channels = []
+
+                def make_channel():
+                    channels.append(ScriptedChannel())
+                    return channels[-1]
+
+                with _injected_paramiko(make_channel), mock.patch.object(
+                    _FakeSSHClient, "connect", autospec=True, side_effect=connect
+                ):
+                    results = list(engine(jobs, 1))
+                for chan in channels:
+                    chan.close()
+                # With one worker, the healthy hosts finish while 10.0.0.1
+                # waits out its backoff.
+                self.assertEqual(
+                    [r["host"] for r in results], ["10.0.0.2", "10.0.0.3", "10.0.0.1"]
+                )
+                self.assertTrue(all(r["status"] == bulk_show.SESSION_OK for r in results))
+                self.assertEqual(results[2]["connect_attempts"], 3)
+                self.assertEqual(results[0]["connect_attempts"], 1)
+
+
+class CircuitBreakerTests(unittest.TestCase):
+    def _result(self, host, status, connected=False):
+        result = bulk_show._new_session_result(host, "admin", 830, "edge")
+        result["status"] = status
+        result["connect_s"] = 0.1 if connected else None
+        return result
+
+    def test_failure_domains_use_site_else_prefix(self) -> None:
+        domains = bulk_show.failure_domains(
+            [
+                ("10.1.1.5", "admin", None, "edge", None),
+                ("10.1.1.200", "admin", None, "edge", "dc1"),
+                ("10.1.2.5", "admin", None, "edge", None),
+            ],
+            24,
+        )
+        self.assertEqual(
+            domains,
+            {"10.1.1.5": "10.1.1.0/24", "10.1.1.200": "site=dc1", "10.1.2.5": "10.1.2.0/24"},
+        )
+
+    def test_probe_decides_for_held_hosts(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp, contextlib.redirect_stdout(io.StringIO()):
+            jobs = {
+                host: {"router_ip": host, "username": "admin", "output_paths": {
+                    "json": os.path.join(tmp, f"{host}.json"),
+                }}
+                for host in ("a", "b", "c", "d", "e")
+            }
+            breaker = bulk_show.CircuitBreaker({host: "dc1" for host in jobs}, 2)
+            for host in ("a", "b"):
+                self.assertTrue(breaker.admit((jobs[host], None)))
+                breaker.record(jobs[host], self._result(host, bulk_show.SESSION_CONNECT_ERR))
+            self.assertEqual(breaker.opened, 1)
+            # c is the probe; d waits on it.
+            self.assertTrue(breaker.admit((jobs["c"], None)))
+            self.assertFalse(breaker.admit((jobs["d"], None)))
+            self.assertEqual(
+                breaker.record(jobs["c"], self._result("c", bulk_show.SESSION_CONNECT_ERR)),
+                [],
+            )
+            self.assertFalse(breaker.admit((jobs["e"], None)))
+            failed = breaker.take_failed()
+            self.assertEqual([r["host"] for r in failed], ["d", "e"])
+            self.assertTrue(
+                all(r["status"] == bulk_show.SESSION_CIRCUIT_OPEN for r in failed)
+            )
+            with open(os.path.join(tmp, "d.json")) as f:
+                self.assertEqual(json.load(f)["status"], bulk_show.SESSION_CIRCUIT_OPEN)
+
+    def test_probe_success_releases_held_hosts(self) -> None:
+        breaker = bulk_show.CircuitBreaker({"a": "dc1", "b": "dc1", "c": "dc1"}, 1)
+        a, b, c = ({"router_ip": host} for host in "abc")
+        with contextlib.redirect_stdout(io.StringIO()):
+            breaker.record(a, self._result("a", bulk_show.SESSION_CONNECT_ERR))
+            self.assertTrue(breaker.admit((b, None)))
+            self.assertFalse(breaker.admit((c, None)))
+            released = breaker.record(b, self._result("b", bulk_show.SESSION_OK, True))
+        self.assertEqual(released, [(c, None)])
+        self.assertTrue(breaker.admit((c, None)))
+
+    def test_engines_fail_dead_domain_fast(self) -> None:
+        connects = collections.Counter()
+
+        def connect(client, host, **_kwargs):
+            connects[host] += 1
+            if host.startswith("10.9."):
+                raise OSError("unreachable")
+
+        hosts = [f"10.9.0.{i}" for i in range(1, 7)] + ["10.0.0.1"]
+        for engine, retries in itertools.product(
+            (
+                bulk_show.run_threaded_engine,
+                bulk_show.run_selectors_engine,
+                bulk_show.run_staged_engine,
+            ),
+            (0, 2),
+        ):
+            connects.clear()
+            with self.subTest(engine=engine.__name__, retries=retries), \
+                    tempfile.TemporaryDirectory() as tmp:
+                commands = os.path.join(tmp, "commands.txt")
+                with open(commands, "w") as f:
+                    f.write("show version\n")
+                jobs = [
+                    dict(
+                        router_ip=host,
+                        username="admin",
+                        password="pw",
+                        commands_file=commands,
+                        output_paths={},
+                        retries=retries,
+                        retry_delay=0.0,
+                    )
+                    for host in hosts
+                ]
+                breaker = bulk_show.CircuitBreaker(
+                    bulk_show.failure_domains(
+                        [(host, "admin", None, "edge", None) for host in hosts]
+                    ),
+                    2,
+                )
+                channels = []
+
+                def make_channel():
+                    channels.append(ScriptedChannel())
+                    return channels[-1]
+
+                with _injected_paramiko(make_channel), mock.patch.object(
+                    _FakeSSHClient, "connect", autospec=True, side_effect=connect
+                ):
+                    # One host at a time, so every failure is seen in order.
+                    staged = {"connect_workers": 1, "ready_sessions": 0}
+                    results = list(engine(
+                        jobs, 1, breaker=breaker,
+                        **(staged if engine is bulk_show.run_staged_engine else {}),
+                    ))
+                for chan in channels:
+                    chan.close()
+                statuses = collections.Counter(r["status"] for r in results)
+                # Two hosts failing (each after all its retries) open the
+                # breaker, the probe fails, and the other three dead hosts
+                # are never tried.
+                self.assertEqual(
+                    statuses,
+                    {
+                        bulk_show.SESSION_CONNECT_ERR: 3,
+                        bulk_show.SESSION_CIRCUIT_OPEN: 3,
+                        bulk_show.SESSION_OK: 1,
+                    },
+                )
+                self.assertEqual(sum(connects.values()), 3 * (1 + retries) + 1)
+
+
+class WorkerPoolsTests(unittest.TestCase):
+    def _job(self, host, device_type=bulk_show.DEVICE_EDGE):
+        return {"router_ip": host, "device_type": device_type}
+
+    def test_full_pool_is_skipped_not_blocking(self) -> None:
+        pools = bulk_show.WorkerPools(
+            {bulk_show.DEVICE_CONTROLLER: 1}, 2, {"e1": "dc1", "e2": "dc1", "e3": "dc1"}
+        )
+        pending = collections.deque(
+            (self._job(host, kind), None)
+            for host, kind in (
+                ("c1", bulk_show.DEVICE_CONTROLLER),
+                ("c2", bulk_show.DEVICE_CONTROLLER),
+                ("e1", bulk_show.DEVICE_EDGE),
+                ("e2", bulk_show.DEVICE_EDGE),
+                ("e3", bulk_show.DEVICE_EDGE),
+                ("e4", bulk_show.DEVICE_EDGE),
+            )
+        )
+        started = bulk_show._start_entries(
+            pending, 10, pools, bulk_show.CircuitBreaker()
+        )
+        self.assertEqual([job["router_ip"] for job, _ in started], ["c1", "e1", "e2", "e4"])
+        # Held-back hosts keep their order at the front.
+        self.assertEqual([job["router_ip"] for job, _ in pending], ["c2", "e3"])
+        pools.release(started[0][0])
+        started = bulk_show._start_entries(pending, 10, pools, bulk_show.CircuitBreaker())
+        self.assertEqual([job["router_ip"] for job, _ in started], ["c2"])
+
+    def test_threaded_engine_caps_controllers(self) -> None:
+        lock = threading.Lock()
+        running = collections.Counter()
+        peak = collections.Counter()
+
+        def attempt(job, previous):
+            kind = job["device_type"]
+            with lock:
+                running[kind] += 1
+                peak[kind] = max(peak[kind], running[kind])
+            bulk_show.time.sleep(0.02)
+            with lock:
+                running[kind] -= 1
+            result = bulk_show._new_session_result(job["router_ip"], "admin", 22, kind)
+            result["status"] = bulk_show.SESSION_OK
+            return result
+
+        jobs = [
+            self._job(f"10.0.0.{i}", bulk_show.DEVICE_CONTROLLER) for i in range(4)
+        ] + [self._job(f"10.0.1.{i}") for i in range(8)]
+        pools = bulk_show.WorkerPools({bulk_show.DEVICE_CONTROLLER: 1})
+        with mock.patch.object(bulk_show, "_attempt_job", side_effect=attempt):
+            results = list(bulk_show.run_threaded_engine(jobs, 4, pools=pools))
+        self.assertEqual(len(results), 12)
+        self.assertEqual(peak[bulk_show.DEVICE_CONTROLLER], 1)
+        # The edges used the slots the waiting controllers could not.
+        self.assertEqual(peak[bulk_show.DEVICE_EDGE], 3)
+
+
+class RunJournalTests(unittest.TestCase):
+    def _result(self, host, status):
+        result = bulk_show._new_session_result(host, "admin", 830, "edge")
+        result["status"] = status
+        result["commands"] = [{"command": "show version", "status": "ok"}]
+        return result
+
+    def test_replay_keeps_latest_status_per_host(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            journal = bulk_show.RunJournal(tmp)
+            journal.record(self._result("10.0.0.1", bulk_show.SESSION_CONNECT_ERR), {})
+            journal.record(self._result("10.0.0.2", bulk_show.SESSION_OK), {"text": "x"})
+            journal.record(self._result("10.0.0.1", bulk_show.SESSION_OK), {})
+            journal.close()
+            path = os.path.join(tmp, bulk_show.JOURNAL_NAME)
+            with open(path, "a", encoding="utf-8") as f:
+                # A hand-written line in another key order, then a torn one.
+                f.write('{"status": "skipped", "host": "10.0.0.3"}\n')
+                f.write('{"host": "10.0.0.2", "status": "error", "dev')
+            self.assertEqual(
+                bulk_show.RunJournal.replay(tmp),
+                {"10.0.0.1": "success", "10.0.0.2": "success", "10.0.0.3": "skipped"},
+            )
+            with open(path, encoding="utf-8") as f:
+                entry = json.loads(f.readlines()[1])
+            self.assertEqual(entry["outputs"], {"text": "x"})
+            self.assertEqual(entry["commands"], [{"command": "show version", "status": "ok"}])
+
+    def test_missing_journal_replays_empty(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            self.assertEqual(bulk_show.RunJournal.replay(tmp), {})
+
+    def test_run_hosts_journals_every_host(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            commands = os.path.join(tmp, "commands.txt")
+            with open(commands, "w") as f:
+                f.write("show version\n")
+            options = types.SimpleNamespace(
+                commands_file=commands,
+                controller_commands=None,
+                edge_commands=None,
+                port=830,
+                controller_port=22,
+                reject_unknown_hosts=False,
+                password_prompt=False,
+                retries=0,
+                retry_delay=0.0,
+                logs_dir=os.path.join(tmp, "logs"),
+                output_format=["text"],
+                deadline=None,
+                host_budget=None,
+                preflight=False,
+                preflight_timeout=2.0,
+                circuit_breaker=0,
+                failure_domain_prefix=24,
+                controller_workers=None,
+                edge_workers=None,
+                per_site_workers=None,
+                connect_workers=4,
+                ready_sessions=2,
+                ssh_auth="password",
+                kex=None,
+                ciphers=None,
+                banner_timeout=None,
+                auth_timeout=None,
+                post_process_workers=0,
+                record=None,
+                replay=None,
+                replay_speed=1.0,
+            )
+            hosts = [("10.0.0.1", "admin", None, "edge", None), ("10.0.0.2", "admin", None, "edge", None)]
+            channels = []
+
+            def make_channel():
+                channels.append(ScriptedChannel())
+                return channels[-1]
+
+            with _injected_paramiko(make_channel), contextlib.redirect_stdout(
+                io.StringIO()
+            ):
+                bulk_show.run_hosts(hosts, options, "pw")
+            for chan in channels:
+                chan.close()
+            self.assertEqual(
+                bulk_show.RunJournal.replay(options.logs_dir),
+                {"10.0.0.1": "success", "10.0.0.2": "success"},
+            )
+
+
+class HostHistoryTests(unittest.TestCase):
+    def _jobs(self, *hosts):
+        return [dict(router_ip=host) for host in hosts]
+
+    def test_predict_makespan(self) -> None:
+        self.assertEqual(bulk_show.predict_makespan([5, 1, 1, 1], 2), 5)
+        self.assertEqual(bulk_show.predict_makespan([1, 1, 1, 5], 2), 6)
+        self.assertEqual(bulk_show.predict_makespan([], 4), 0.0)
+
+    def test_order_longest_first_with_median_fill(self) -> None:
+        history = bulk_show.HostHistory()
+        for host, duration in (("a", 10.0), ("b", 2.0), ("c", 30.0)):
+            history.record({"host": host, "duration_s": duration})
+        jobs, estimates = history.order(self._jobs("a", "b", "new", "c"))
+        self.assertEqual([job["router_ip"] for job in jobs], ["c", "a", "new", "b"])
+        self.assertEqual(estimates, [30.0, 10.0, 10.0, 2.0])
+
+    def test_order_breaks_ties_by_preflight_rtt(self) -> None:
+        history = bulk_show.HostHistory()
+        for host in ("a", "b", "c"):
+            history.record({"host": host, "duration_s": 5.0})
+        jobs, _ = history.order(self._jobs("a", "b", "c"), {"b": 0.2, "c": 0.05})
+        self.assertEqual([job["router_ip"] for job in jobs], ["b", "c", "a"])
+
+    def test_no_history_keeps_hosts_file_order(self) -> None:
+        jobs, estimates = bulk_show.HostHistory().order(self._jobs("x", "y"))
+        self.assertEqual([job["router_ip"] for job in jobs], ["x", "y"])
+        self.assertEqual(estimates, [None, None])
+
+    def test_estimate_is_median_of_recent_samples(self) -> None:
+        history = bulk_show.HostHistory()
+        for duration in (100.0, 1.0, 2.0, 3.0, 4.0, 5.0):
+            history.record({"host": "a", "duration_s": duration})
+        # The 100s outlier has aged out of the last HOST_HISTORY_SAMPLES.
+        self.assertEqual(
+            history.estimate("a"),
+            bulk_show._percentile([1.0, 2.0, 3.0, 4.0, 5.0], 50),
+        )
+
+    def test_seed_from_outputs_uses_newest_json(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            for name, duration in (
+                ("output_10.0.0.1_20240101_000000.json", 5.0),
+                ("output_10.0.0.1_20240102_000000.json", 7.5),
+                ("output_10.0.0.2_20240101_000000.json", 1.0),
+            ):
+                with open(os.path.join(tmp, name), "w") as f:
+                    json.dump({"duration_s": duration}, f)
+            history = bulk_show.HostHistory()
+            history.record({"host": "10.0.0.2", "duration_s": 9.0})
+            self.assertEqual(history.seed_from_outputs(tmp), 1)
+        self.assertEqual(history.estimate("10.0.0.1"), 7.5)
+        self.assertEqual(history.estimate("10.0.0.2"), 9.0)
+
+    def test_save_and_load_round_trip(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "history.json")
+            history = bulk_show.HostHistory.load(path)
+            history.record({"host": "a", "duration_s": 4.25})
+            history.save()
+            self.assertEqual(bulk_show.HostHistory.load(path).estimate("a"), 4.25)
+
+
+class PreflightTests(unittest.TestCase):
+    def _closed_port(self):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            return sock.getsockname()[1]
+
+    def test_probe_reports_rtt_or_error(self) -> None:
+        listener = socket.socket()
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(8)
+        self.addCleanup(listener.close)
+        up = ("127.0.0.1", listener.getsockname()[1])
+        down = ("127.0.0.1", self._closed_port())
+        probes = bulk_show.preflight([up, down, up], timeout=2.0)
+        self.assertEqual(set(probes), {up, down})
+        rtt, error = probes[up]
+        self.assertIsNone(error)
+        self.assertGreaterEqual(rtt, 0.0)
+        rtt, error = probes[down]
+        self.assertIsNone(rtt)
+        self.assertTrue(error)
+
+    def test_run_hosts_fails_unreachable_hosts_without_ssh(self) -> None:
+        listener = socket.socket()
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(8)
+        self.addCleanup(listener.close)
+        with tempfile.TemporaryDirectory() as tmp:
+            commands = os.path.join(tmp, "commands.txt")
+            with open(commands, "w") as f:
+                f.write("show version\n")
+            options = types.SimpleNamespace(
+                commands_file=commands,
+                controller_commands=None,
+                edge_commands=None,
+                port=listener.getsockname()[1],
+                controller_port=22,
+                reject_unknown_hosts=False,
+                password_prompt=False,
+                retries=3,
+                retry_delay=30.0,
+                logs_dir=os.path.join(tmp, "logs"),
+                output_format=["json"],
+                deadline=None,
+                host_budget=None,
+                preflight=True,
+                preflight_timeout=2.0,
+                circuit_breaker=0,
+                failure_domain_prefix=24,
+                controller_workers=None,
+                edge_workers=None,
+                per_site_workers=None,
+                connect_workers=4,
+                ready_sessions=2,
+                ssh_auth="password",
+                kex=None,
+                ciphers=None,
+                banner_timeout=None,
+                auth_timeout=None,
+                post_process_workers=0,
+                record=None,
+                replay=None,
+                replay_speed=1.0,
+            )
+            hosts = [("127.0.0.1", "admin", None, "edge", None), ("127.0.0.2", "admin", None, "edge", None)]
+            closed_port = self._closed_port()
+            connected = []
+            channels = []
+
+            def make_channel():
+                channels.append(ScriptedChannel())
+                return channels[-1]
+
+            real_preflight = bulk_show.preflight
+
+            def probe(targets, timeout):
+                # 127.0.0.2 stands in for a dead router: aim it at a closed port.
+                probes = {}
+                for host, port in targets:
+                    target = (host, port if host == "127.0.0.1" else closed_port)
+                    probes[(host, port)] = real_preflight([target], timeout)[target]
+                return probes
+
+            log = io.StringIO()
+            with _injected_paramiko(make_channel), mock.patch.object(
+                bulk_show, "preflight", side_effect=probe
+            ):
+                with contextlib.redirect_stdout(log):
+                    bulk_show.run_hosts(hosts, options, "pw")
+            for chan in channels:
+                chan.close()
+            self.assertEqual(len(channels), 1)
+            self.assertIn("[main] preflight: 1 host(s) reachable, 1 unreachable", log.getvalue())
+            self.assertIn("[main] done: success=1, failed=1", log.getvalue())
+            self.assertEqual(
+                bulk_show.RunJournal.replay(options.logs_dir),
+                {"127.0.0.1": "success", "127.0.0.2": "connect_error"},
+            )
+            [dead] = [
+                name for name in os.listdir(options.logs_dir)
+                if name.startswith("output_127.0.0.2_")
+            ]
+            with open(os.path.join(options.logs_dir, dead)) as f:
+                self.assertIn("preflight", json.load(f)["error"])
+            with open(os.path.join(options.logs_dir, bulk_show.PREFLIGHT_NAME)) as f:
+                saved = json.load(f)["hosts"]
+            self.assertIsNone(saved["127.0.0.2"]["rtt_ms"])
+            self.assertIsNone(saved["127.0.0.1"]["error"])
+
+
+class ShardTests(unittest.TestCase):
+    HOSTS = [(f"10.0.{i // 2}.{i % 2 + 1}", "admin", None, "edge", None) for i in range(6)]
+
+    def _options(self, tmp):
+        commands = os.path.join(tmp, "commands.txt")
+        with open(commands, "w") as f:
+            f.write("show version\n")
+        return types.SimpleNamespace(
+            commands_file=commands,
+            controller_commands=None,
+            edge_commands=None,
+            port=830,
+            controller_port=22,
+            reject_unknown_hosts=False,
+            password_prompt=False,
+            retries=0,
+            retry_delay=0.0,
+            logs_dir=os.path.join(tmp, "logs"),
+            output_format=["text"],
+            deadline=None,
+            host_budget=None,
+            preflight=False,
+            preflight_timeout=2.0,
+            circuit_breaker=0,
+            failure_domain_prefix=24,
+            controller_workers=None,
+            edge_workers=None,
+            per_site_workers=None,
+            connect_workers=4,
+            ready_sessions=2,
+            ssh_auth="password",
+            kex=None,
+            ciphers=None,
+            banner_timeout=None,
+            auth_timeout=None,
+            post_process_workers=0,
+            record=None,
+            replay=None,
+            replay_speed=1.0,
+        )
+
+    def _ips(self, groups):
+        return [[host[0] for host in group] for group in groups]
+
+    def test_split_deals_evenly_in_hosts_file_order(self) -> None:
+        groups = bulk_show.split_shards(self.HOSTS, 4)
+        self.assertEqual(sorted(len(group) for group in groups), [1, 1, 2, 2])
+        for group in groups:
+            self.assertEqual(group, sorted(group, key=self.HOSTS.index))
+        self.assertEqual(len(bulk_show.split_shards(self.HOSTS[:2], 4)), 2)
+
+    def test_split_keeps_failure_domains_whole(self) -> None:
+        domains = bulk_show.failure_domains(self.HOSTS, 24)
+        groups = bulk_show.split_shards(self.HOSTS, 2, domains)
+        self.assertEqual(
+            self._ips(groups),
+            [["10.0.0.1", "10.0.0.2", "10.0.2.1", "10.0.2.2"],
+             ["10.0.1.1", "10.0.1.2"]],
+        )
+
+    def test_split_balances_expected_durations(self) -> None:
+        history = bulk_show.HostHistory()
+        for host, duration in (("10.0.0.1", 60.0), ("10.0.0.2", 10.0), ("10.0.1.1", 10.0)):
+            history.record({"host": host, "duration_s": duration})
+        groups = bulk_show.split_shards(self.HOSTS, 2, host_history=history)
+        # The 60s host alone balances the other five (10s each; the unknown
+        # hosts are estimated at the median).
+        self.assertEqual(
+            self._ips(groups),
+            [["10.0.0.1"], ["10.0.0.2", "10.0.1.1", "10.0.1.2", "10.0.2.1", "10.0.2.2"]],
+        )
+
+    def test_child_lines_never_look_like_the_run_summary(self) -> None:
+        label = "shard 2/3"
+        self.assertEqual(
+            bulk_show._shard_line("[main] starting 5 host(s) with up to 5", label),
+            "[main] shard 2/3: 5 host(s) with up to 5",
+        )
+        self.assertEqual(
+            bulk_show._shard_line("[main] done: success=4, failed=1", label),
+            "[main] shard 2/3: success=4, failed=1",
+        )
+        self.assertEqual(
+            bulk_show._shard_line("[10.0.0.1] connected", label), "[10.0.0.1] connected"
+        )
+
+    def test_run_sharded_reports_one_summary(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            options = self._options(tmp)
+            history = bulk_show.HostHistory(os.path.join(tmp, "history.json"))
+            with _injected_paramiko(lambda: ScriptedChannel()), contextlib.redirect_stdout(
+                io.StringIO()
+            ) as log:
+                counts = bulk_show.run_sharded(
+                    self.HOSTS, options, "pw", 3, host_history=history
+                )
+            lines = log.getvalue().splitlines()
+            self.assertEqual(counts, (6, 0))
+            self.assertEqual(
+                [line for line in lines if "starting" in line],
+                ["[main] starting 6 host(s) in 3 shard process(es) "
+                 "(2/2/2 host(s)); engine: threads"],
+            )
+            self.assertEqual(
+                [line for line in lines if line.startswith("[main] done:")],
+                ["[main] done: success=6, failed=0"],
+            )
+            self.assertIn("[main] shard 3/3: success=2, failed=0", lines)
+            self.assertEqual(
+                set(bulk_show.RunJournal.replay(options.logs_dir).values()), {"success"}
+            )
+            saved = bulk_show.HostHistory.load(history.path)
+            self.assertTrue(all(saved.estimate(host[0]) is not None for host in self.HOSTS))
+
+    def test_cancel_reaches_every_shard(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            options = self._options(tmp)
+            with open(options.commands_file, "w") as f:
+                f.write("show hang\n")
+            cancel = bulk_show.CancelToken()
+            cancel.cancel("interrupted by SIGTERM")
+            with _injected_paramiko(lambda: HangingChannel()), contextlib.redirect_stdout(
+                io.StringIO()
+            ) as log:
+                counts = bulk_show.run_sharded(
+                    self.HOSTS, options, "pw", 2, cancel=cancel
+                )
+            self.assertEqual(counts, (0, 6))
+            # Whether a host was started before the reason arrived is a race.
+            for label in ("shard 1/2", "shard 2/2"):
+                self.assertIn(
+                    f"[main] {label}: cut short (interrupted by SIGTERM): ",
+                    log.getvalue(),
+                )
+
+
+class EngineParityTests(unittest.TestCase):
+    """The selectors and staged engines must write the same files as the
+    threaded one."""
+
+    HOSTS = ("10.0.0.1", "10.0.0.2", "10.0.0.3")
+    _VOLATILE_RE = re.compile(r"(started|ended|duration)=\S+")
+
+    def _run(self, engine, tmp):
+        commands = os.path.join(tmp, "commands.txt")
+        with open(commands, "w") as f:
+            f.write("show version\nshow run\n")
+        out_dir = os.path.join(tmp, engine.__name__)
+        os.makedirs(out_dir)
+        jobs = [
+            dict(
+                router_ip=host,
+                username="admin",
+                password="pw",
+                commands_file=commands,
+                output_paths=bulk_show._build_output_paths(
+                    out_dir, host, "ts", bulk_show.ALL_OUTPUT_FORMATS
+                ),
+            )
+            for host in self.HOSTS
+        ]
+        channels = []
+
+        def make_channel():
+            channels.append(ScriptedChannel())
+            return channels[-1]
+
+        with _injected_paramiko(make_channel):
+            results = list(engine(jobs, 2))
+        for chan in channels:
+            chan.close()
+        return out_dir, results
+
+    def _normalized(self, path):
+        with open(path, encoding="utf-8") as f:
+            text = f.read()
+        if path.endswith(".json"):
+            data = json.loads(text)
+            for key in ("started_at", "ended_at", "duration_s", "connect_s"):
+                data.pop(key)
+            for cmd in data["commands"]:
+                cmd.pop("started_at")
+                cmd.pop("duration_s")
+            return data
+        if path.endswith(".csv"):
+            return [row.split(",")[2:3] + row.split(",")[5:] for row in text.splitlines()]
+        return self._VOLATILE_RE.sub("", text)
+
+    def test_outputs_identical(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            threads_dir, threads_results = self._run(bulk_show.run_threaded_engine, tmp)
+            sel_dir, sel_results = self._run(bulk_show.run_selectors_engine, tmp)
+            staged_dir, staged_results = self._run(bulk_show.run_staged_engine, tmp)
+            for results in (sel_results, staged_results):
+                self.assertEqual(
+                    [r["status"] for r in results], [bulk_show.SESSION_OK] * 3
+                )
+            self.assertEqual(len(threads_results), len(sel_results))
+            names = sorted(os.listdir(threads_dir))
+            self.assertEqual(names, sorted(os.listdir(sel_dir)))
+            self.assertEqual(names, sorted(os.listdir(staged_dir)))
+            self.assertEqual(len(names), 9)
+            for name in names:
+                expected = self._normalized(os.path.join(threads_dir, name))
+                for other in (sel_dir, staged_dir):
+                    self.assertEqual(
+                        expected,
+                        self._normalized(os.path.join(other, name)),
+                        msg=f"{other}: {name}",
+                    )
+            with open(os.path.join(sel_dir, "output_10.0.0.1_ts.txt")) as f:
+                text = f.read()
+            self.assertIn("Cisco IOS XE Software", text)
+            self.assertIn("hostname RT01", text)
+            self.assertNotIn("--More--", text)
+
+    def test_selectors_writes_output_off_the_loop_thread(self) -> None:
+        original = bulk_show.SessionOutput._record
+        threads = []
+
+        def record(self, cmd, capture, seq):
+            threads.append(threading.current_thread())
+            return original(self, cmd, capture, seq)
+
+        with tempfile.TemporaryDirectory() as tmp, mock.patch.object(
+            bulk_show.SessionOutput, "_record", record
+        ):
+            _, results = self._run(bulk_show.run_selectors_engine, tmp)
+        self.assertEqual(
+            [r["status"] for r in results], [bulk_show.SESSION_OK] * 3
+        )
+        self.assertEqual(len(threads), 6)
+        self.assertNotIn(threading.current_thread(), threads)
+
+    def test_selectors_survives_a_failing_output_write(self) -> None:
+        original = bulk_show.SessionOutput._record
+        failed = []
+
+        def record(self, cmd, capture, seq):
+            if not failed:
+                failed.append(cmd)
+                raise OSError("disk full")
+            return original(self, cmd, capture, seq)
+
+        outcome = []
+
+        def run(tmp):
+            outcome.append(self._run(bulk_show.run_selectors_engine, tmp)[1])
+
+        with tempfile.TemporaryDirectory() as tmp, mock.patch.object(
+            bulk_show.SessionOutput, "_record", record
+        ), mock.patch.object(bulk_show, "log_message") as log:
+            worker = threading.Thread(target=run, args=(tmp,), daemon=True)
+            worker.start()
+            worker.join(10)
+            self.assertFalse(worker.is_alive(), "selectors engine hung")
+        self.assertEqual(len(failed), 1)
+        self.assertEqual(len(outcome[0]), 3)
+        self.assertTrue(
+            any("error writing output" in c.args[0] for c in log.call_args_list)
+        )
+
+    def test_ordered_writer_runs_calls_in_order(self) -> None:
+        calls = []
+        with concurrent.futures.ThreadPoolExecutor(4) as pool:
+            writer = bulk_show._OrderedWriter(pool, "10.0.0.1")
+            for i in range(200):
+                writer.submit(calls.append, i)
+            done = threading.Event()
+            writer.submit(done.set)
+            self.assertTrue(done.wait(5))
+        self.assertEqual(calls, list(range(200)))
+
+
+class StagedEngineTests(unittest.TestCase):
+    def test_open_sessions_bounded_and_stages_logged(self) -> None:
+        lock = threading.Lock()
+        open_now = collections.Counter()
+
+        def connect(client, *_args, **_kwargs):
+            with lock:
+                open_now["now"] += 1
+                open_now["peak"] = max(open_now["peak"], open_now["now"])
+            bulk_show.time.sleep(0.02)
+
+        def close(client):
+            with lock:
+                open_now["now"] -= 1
+
+        with tempfile.TemporaryDirectory() as tmp:
+            commands = os.path.join(tmp, "commands.txt")
+            with open(commands, "w") as f:
+                f.write("show version\n")
+            jobs = [
+                dict(
+                    router_ip=f"10.0.0.{i}",
+                    username="admin",
+                    password="pw",
+                    commands_file=commands,
+                    output_paths={},
+                )
+                for i in range(1, 9)
+            ]
+            channels = []
+
+            def make_channel():
+                channels.append(ScriptedChannel())
+                return channels[-1]
+
+            log = io.StringIO()
+            with _injected_paramiko(make_channel), mock.patch.object(
+                _FakeSSHClient, "connect", autospec=True, side_effect=connect
+            ), mock.patch.object(
+                _FakeSSHClient, "close", autospec=True, side_effect=close
+            ):
+                with contextlib.redirect_stdout(log):
+                    results = list(bulk_show.run_staged_engine(
+                        jobs, 2, connect_workers=3, ready_sessions=1
+                    ))
+            for chan in channels:
+                chan.close()
+        self.assertEqual(
+            [r["status"] for r in results], [bulk_show.SESSION_OK] * 8
+        )
+        self.assertLessEqual(open_now["peak"], 3)
+        self.assertEqual(open_now["now"], 0)
+        self.assertIn("[main] stages: connect 8 session(s)", log.getvalue())
+        self.assertIn("ready queue depth max", log.getvalue())
+
+
+class SessionOutputTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        self.paths = bulk_show._build_output_paths(
+            self._tmp.name, "10.0.0.1", "ts", bulk_show.ALL_OUTPUT_FORMATS
+        )
+        self.result = bulk_show._new_session_result(
+            "10.0.0.1", "admin", 830, bulk_show.DEVICE_EDGE
+        )
+        self.output = bulk_show.SessionOutput(self.result, self.paths)
+
+    def _command(self, name, text, status=bulk_show.CMD_OK):
+        return {
+            "command": name,
+            "started_at": "2026-01-01T00:00:00",
+            "duration_s": 0.5,
+            "exit_kind": bulk_show.MATCH_PROMPT,
+            "status": status,
+            "output": text,
+        }
+
+    def _read(self, fmt):
+        with open(self.paths[fmt], encoding="utf-8") as f:
+            return f.read()
+
+    def test_commands_are_on_disk_before_end(self) -> None:
+        self.output.begin()
+        self.output.command(self._command("show clock", "show clock\n10:00\nRT01#"))
+        self.assertIn("10:00", self._read(bulk_show.OUTPUT_FORMAT_TEXT))
+        self.assertIn("10:00", self._read(bulk_show.OUTPUT_FORMAT_CSV))
+        self.assertIn("10:00", self._read(bulk_show.OUTPUT_FORMAT_JSON))
+        self.assertNotIn("output", self.result["commands"][0])
+        self.output.end()
+
+    def test_json_matches_session_result(self) -> None:
+        commands = [
+            self._command("show version", "show version\n東京\nRT01#"),
+            self._command("show tech", "partial", status=bulk_show.CMD_TIMEOUT),
+        ]
+        self.output.begin()
+        for cmd in commands:
+            self.output.command(dict(cmd))
+        self.result["status"] = bulk_show.SESSION_OK
+        self.output.end()
+        expected = dict(
+            self.result, commands=[dict(cmd, truncated_bytes=0) for cmd in commands]
+        )
+        self.assertEqual(json.loads(self._read(bulk_show.OUTPUT_FORMAT_JSON)), expected)
+        text = self._read(bulk_show.OUTPUT_FORMAT_TEXT)
+        self.assertIn("RT01#partial\n!! command did not return a prompt: show tech", text)
+
+    def test_empty_session_writes_error_row_and_note(self) -> None:
+        self.output.begin()
+        self.result["error"] = "Authentication failed"
+        self.output.end()
+        data = json.loads(self._read(bulk_show.OUTPUT_FORMAT_JSON))
+        self.assertEqual(data["commands"], [])
+        self.assertIn("!! Authentication failed", self._read(bulk_show.OUTPUT_FORMAT_TEXT))
+        rows = self._read(bulk_show.OUTPUT_FORMAT_CSV).splitlines()
+        self.assertEqual(len(rows), 2)
+        self.assertIn("Authentication failed", rows[1])
+
+    def test_unwritable_format_is_dropped(self) -> None:
+        self.paths[bulk_show.OUTPUT_FORMAT_CSV] = os.path.join(
+            self._tmp.name, "missing", "out.csv"
+        )
+        output = bulk_show.SessionOutput(self.result, self.paths)
+        with contextlib.redirect_stdout(io.StringIO()) as log:
+            output.begin()
+            output.command(self._command("show clock", "10:00"))
+            output.end()
+        self.assertIn("failed to write output", log.getvalue())
+        self.assertIn("10:00", self._read(bulk_show.OUTPUT_FORMAT_TEXT))
+
+    def _files(self, output_for):
+        """Write three commands, giving each output as ``output_for(text)``."""
+        texts = (
+            "show run\r\n" + 'description "東京" \r\n --More-- \r   \r' * 300,
+            "show clock\n10:00\nRT01#",
+            "",
+        )
+        self.result["commands"] = []
+        output = bulk_show.SessionOutput(self.result, self.paths)
+        output.begin()
+        for i, text in enumerate(texts):
+            output.command(self._command(f"show {i}", output_for(text)))
+        self.result["status"] = bulk_show.SESSION_OK
+        output.end()
+        return {fmt: self._read(fmt) for fmt in self.paths}
+
+    def test_spilled_capture_is_written_like_text(self) -> None:
+        expected = self._files(lambda text: text)
+        for cleaner in (None, bulk_show.OutputCleaner):
+            def output_for(text):
+                capture = bulk_show.OutputCapture(
+                    spill_chars=64, cleaner=cleaner and cleaner()
+                )
+                capture.write(text)
+                capture.finish()
+                return capture
+
+            self.assertEqual(self._files(output_for), expected, msg=cleaner)
+        rows = list(csv.DictReader(io.StringIO(expected[bulk_show.OUTPUT_FORMAT_CSV])))
+        self.assertEqual(rows[1]["output"], "show clock\n10:00\nRT01#")
+
+    def test_spilled_capture_is_read_in_blocks(self) -> None:
+        capture = bulk_show.OutputCapture(spill_chars=64)
+        capture.write("x" * 1000)
+        self.assertTrue(capture.spilled)
+        self.assertEqual([len(c) for c in capture.chunks(size=300)], [300, 300, 300, 100])
+        capture.close()
+
+    def test_truncated_bytes_come_from_the_capture(self) -> None:
+        marker = bulk_show.CAPTURE_TRUNCATED_FMT.format(5)
+        capture = bulk_show.OutputCapture(max_chars=10, keep_tail_chars=4)
+        capture.write("0123456789abcdefgh")
+        capture.finish()
+        self.output.begin()
+        self.output.command(self._command("show log", "device said" + marker))
+        self.output.command(self._command("show tech", capture))
+        self.output.end()
+        self.assertEqual(
+            [cmd["truncated_bytes"] for cmd in self.result["commands"]], [0, 4]
+        )
+        self.assertIn(
+            "0123456789" + bulk_show.CAPTURE_TRUNCATED_FMT.format(4) + "efgh",
+            self._read(bulk_show.OUTPUT_FORMAT_TEXT),
+        )
+
+
+class PostProcessorTests(unittest.TestCase):
+    RAW = "show int\r\nGi1 up\r\n --More-- \r          \rGi2 down\r\nRT01#"
+
+    def _write_session(self, tmp, post_processor, spill_chars=None):
+        paths = bulk_show._build_output_paths(
+            tmp, "10.0.0.1", "ts", bulk_show.ALL_OUTPUT_FORMATS
+        )
+        result = bulk_show._new_session_result(
+            "10.0.0.1", "admin", 830, bulk_show.DEVICE_EDGE
+        )
+        output = bulk_show.SessionOutput(result, paths, post_processor)
+        output.begin()
+        for i, status in enumerate((bulk_show.CMD_OK, bulk_show.CMD_TIMEOUT, bulk_show.CMD_OK)):
+            output.command({
+                "command": f"show int {i}",
+                "started_at": "2026-01-01T00:00:00",
+                "duration_s": 0.25,
+                "exit_kind": bulk_show.MATCH_PROMPT,
+                "status": status,
+                "output": self._output(post_processor, spill_chars),
+            })
+        result["status"] = bulk_show.SESSION_OK
+        output.end()
+        contents = {}
+        for fmt, path in paths.items():
+            with open(path, "rb") as f:
+                contents[fmt] = f.read()
+        return contents
+
+    def _output(self, post_processor, spill_chars):
+        if spill_chars is None:
+            return self.RAW
+        cleaner = bulk_show.OutputCleaner() if post_processor is None else None
+        capture = bulk_show.OutputCapture(spill_chars=spill_chars, cleaner=cleaner)
+        for i in range(0, len(self.RAW), 7):
+            capture.write(self.RAW[i:i + 7])
+        capture.finish()
+        self.assertTrue(capture.spilled)
+        return capture
+
+    def test_render_cleans_output(self) -> None:
+        rendered = bulk_show.render_command(
+            {"command": "show int", "started_at": "t", "duration_s": 0.1,
+             "exit_kind": bulk_show.MATCH_PROMPT, "status": bulk_show.CMD_OK,
+             "output": self.RAW},
+            (bulk_show.OUTPUT_FORMAT_TEXT,), 1, "10.0.0.1",
+        )
+        self.assertEqual(
+            rendered,
+            {bulk_show.OUTPUT_FORMAT_TEXT: bulk_show.clean_command_output(self.RAW)},
+        )
+
+    def test_cleaning_waits_for_the_pool(self) -> None:
+        result = bulk_show._new_session_result(
+            "10.0.0.1", "admin", 830, bulk_show.DEVICE_EDGE
+        )
+        self.assertTrue(bulk_show.SessionOutput(result, {}).capture().cleaned)
+        self.assertFalse(
+            bulk_show.SessionOutput(result, {}, object()).capture().cleaned
+        )
+
+    def test_pool_output_matches_inline(self) -> None:
+        post = bulk_show.PostProcessor(2)
+        self.addCleanup(post.close)
+        with tempfile.TemporaryDirectory() as inline_tmp, \
+                tempfile.TemporaryDirectory() as pool_tmp:
+            self.assertEqual(
+                self._write_session(pool_tmp, post),
+                self._write_session(inline_tmp, None),
+            )
+
+    def test_pool_renders_spilled_output_from_the_file(self) -> None:
+        post = bulk_show.PostProcessor(1)
+        self.addCleanup(post.close)
+        with tempfile.TemporaryDirectory() as inline_tmp, \
+                tempfile.TemporaryDirectory() as pool_tmp:
+            self.assertEqual(
+                self._write_session(pool_tmp, post, spill_chars=16),
+                self._write_session(inline_tmp, None),
+            )
+
+    def test_broken_pool_renders_inline(self) -> None:
+        class BrokenPool:
+            def submit(self, *args):
+                future = concurrent.futures.Future()
+                future.set_exception(concurrent.futures.process.BrokenProcessPool())
+                return future
+
+        for spill_chars in (None, 16):
+            with self.subTest(spill_chars=spill_chars), \
+                    tempfile.TemporaryDirectory() as inline_tmp, \
+                    tempfile.TemporaryDirectory() as pool_tmp:
+                self.assertEqual(
+                    self._write_session(pool_tmp, BrokenPool(), spill_chars),
+                    self._write_session(inline_tmp, None),
+                )
+
+
+class PipelineSplitTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.boundary_re = bulk_show.build_prompt_boundary_re("RT01#")
+
+    def test_prompt_followed_by_next_echo_ends_command(self) -> None:
+        buf = "show version\r\nIOS XE\r\nRT01#show clock\r\n10:00\r\nRT01#"
+        end = bulk_show.find_pipelined_command_end(buf, 0, self.boundary_re, "show clock")
+        self.assertEqual(buf[:end], "show version\r\nIOS XE\r\nRT01#")
+        last = bulk_show.find_pipelined_command_end(buf, end, self.boundary_re, None)
+        self.assertEqual(last, len(buf))
+
+    def test_prompt_like_output_line_is_skipped(self) -> None:
+        buf = "show history\r\nRT01#show run\r\nRT01#show clock\r\n"
+        end = bulk_show.find_pipelined_command_end(buf, 0, self.boundary_re, "show clock")
+        self.assertEqual(buf[end:], "show clock\r\n")
+
+    def test_partial_echo_at_tail_counts(self) -> None:
+        buf = "show version\r\nIOS XE\r\nRT01#sho"
+        end = bulk_show.find_pipelined_command_end(buf, 0, self.boundary_re, "show clock")
+        self.assertEqual(buf[end:], "sho")
+
+    def test_splitter_hands_long_output_to_the_capture(self) -> None:
+        result = bulk_show._new_session_result(
+            "10.0.0.1", "admin", 830, bulk_show.DEVICE_EDGE
+        )
+        splitter = bulk_show.BatchSplitter(
+            ["show run", "show clock"], self.boundary_re,
+            bulk_show.SessionOutput(result, {}), window_chars=1024,
+        )
+        body = "show run\r\n" + "RT01#show version\r\n interface Gi1\r\n" * 2000
+        stream = body + "RT01#show clock\r\n10:00\r\nRT01#"
+        for i in range(0, len(stream), 500):
+            splitter.write(stream[i:i + 500])
+            self.assertLess(len(splitter.unassigned()), 2048)
+        self.assertEqual(len(splitter.done), 1)
+        splitter.settle()
+        self.assertEqual(len(splitter.done), 2)
+        self.assertFalse(splitter.pager)
+        self.assertEqual(
+            splitter.done[0][0].getvalue(), bulk_show.clean_command_output(body + "RT01#")
+        )
+        self.assertEqual(splitter.done[1][0].getvalue(), "show clock\n10:00\nRT01#")
+
+    def test_next_batch_respects_serial_commands(self) -> None:
+        pipeline = bulk_show.CommandPipeline(3)
+        commands = ["a", "b", "c", "d", "e"]
+        pipeline.mark_serial(bulk_show.DEVICE_EDGE, "c")
+        self.assertEqual(pipeline.next_batch(bulk_show.DEVICE_EDGE, commands, 0), ["a", "b"])
+        self.assertEqual(pipeline.next_batch(bulk_show.DEVICE_EDGE, commands, 2), ["c"])
+        self.assertEqual(
+            pipeline.next_batch(bulk_show.DEVICE_EDGE, commands, 3), ["d", "e"]
+        )
+        self.assertEqual(
+            pipeline.next_batch(bulk_show.DEVICE_CONTROLLER, commands, 1),
+            ["b", "c", "d"],
+        )
+
+
+class PipelineSessionTests(unittest.TestCase):
+    def _run(self, commands, pipeline, latency_profile=None):
+        """Return the per-command entries of the session's JSON output."""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "commands.txt")
+            with open(path, "w") as f:
+                f.write("\n".join(commands) + "\n")
+            json_path = os.path.join(tmp, "out.json")
+            chan = ScriptedChannel()
+            try:
+                with _injected_paramiko(chan):
+                    result = bulk_show.connect_and_execute(
+                        "10.0.0.1", "admin", "pw", path,
+                        {bulk_show.OUTPUT_FORMAT_JSON: json_path},
+                        pipeline=pipeline,
+                        latency_profile=latency_profile,
+                    )
+            finally:
+                chan.close()
+            self.assertEqual(result["status"], bulk_show.SESSION_OK)
+            with open(json_path, encoding="utf-8") as f:
+                return json.load(f)["commands"]
+
+    def test_pipelined_results_match_stop_and_wait(self) -> None:
+        commands = ["show version", "show clock", "show version"]
+        serial = self._run(commands, None)
+        piped = self._run(commands, bulk_show.CommandPipeline(3))
+        for field in ("command", "exit_kind", "status", "output"):
+            self.assertEqual(
+                [c[field] for c in piped], [c[field] for c in serial], msg=field
+            )
+
+    def test_pipelined_commands_feed_the_latency_profile(self) -> None:
+        profile = bulk_show.LatencyProfile()
+        self._run(["show version", "show clock"], bulk_show.CommandPipeline(2), profile)
+        report = profile.finish_run(1.0)
+        self.assertIn("2 command(s)", report)
+        for command in ("show version", "show clock"):
+            self.assertEqual(
+                len(profile._commands[bulk_show.DEVICE_EDGE][command]["latency"]), 1
+            )
+
+    def test_pager_falls_back_to_stop_and_wait(self) -> None:
+        pipeline = bulk_show.CommandPipeline(3)
+        commands = self._run(["show version", "show run", "show clock"], pipeline)
+        self.assertEqual(
+            [c["command"] for c in commands], ["show version", "show run", "show clock"]
+        )
+        self.assertTrue(all(c["status"] == bulk_show.CMD_OK for c in commands))
+        run_output = commands[1]["output"]
+        self.assertIn("hostname RT01", run_output)
+        self.assertNotIn("--More--", run_output)
+        self.assertIn("UTC", commands[2]["output"])
+        self.assertTrue(pipeline.needs_serial(bulk_show.DEVICE_EDGE, "show run"))
+
+    def test_drain_waits_as_long_as_the_outstanding_commands(self) -> None:
+        batch = ["show version", "show run", "show clock"]
+        waits = {"show version": 2.0, "show run": 30.0, "show clock": 4.0}
+
+        class Profile:
+            def timeouts(self, device_type, command):
+                return {
+                    "idle_timeout": waits[command] / 10,
+                    "max_wait": waits[command],
+                    "nudge_wait": 1.0,
+                    "adaptive": True,
+                }
+
+            def observe(self, *args):
+                pass
+
+        sent = []
+        output = bulk_show.SessionOutput({"commands": []}, {})
+        steps = bulk_show.pipelined_batch_steps(
+            types.SimpleNamespace(send=sent.append), "10.0.0.1", batch,
+            "RT01#", bulk_show.build_command_prompt_re("RT01#"),
+            bulk_show.DEVICE_EDGE, output, bulk_show.CommandPipeline(3),
+            Profile(),
+        )
+        read = next(steps)
+        read["capture"].write(
+            "show version\r\nCisco IOS XE Software\r\nRT01#show run\r\n"
+            "hostname RT01\r\n --More-- "
+        )
+        drain = steps.send((read["capture"], bulk_show.MATCH_IDLE))
+        self.assertIsNone(drain["prompt_re"])
+        self.assertEqual(drain["idle_timeout"], 3.0)
+        self.assertEqual(drain["max_wait"], 34.0)
+        with self.assertRaises(StopIteration) as stop:
+            steps.send(("", bulk_show.MATCH_IDLE))
+        self.assertEqual(stop.exception.value, 1)
+
+
 class ControllerConnectTests(unittest.TestCase):
     """Finding 2: a controller that re-prompts for a password must fail loudly
     instead of silently succeeding with show commands sent into the prompt."""
@@ -0,0 +1,119 @@
+"""Tests for the importable :mod:`bulkshow` fleet API.
+
+SSH is replaced by the scripted fake channel from ``test_bulk_show`` so the
+real ``connect_and_execute`` runs end to end without a network.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+import bulkshow
+from tests.test_bulk_show import HangingChannel, ScriptedChannel, _injected_paramiko
+
+
+class ParseHostsTests(unittest.TestCase):
+    def test_lines_and_tuples(self) -> None:
+        hosts = bulkshow.parse_hosts(
+            [
+                "# comment",
+                "10.0.0.1,admin",
+                ("10.0.0.2", "admin", "pw", bulkshow.DEVICE_CONTROLLER),
+            ]
+        )
+        self.assertEqual(
+            hosts,
+            [
+                ("10.0.0.1", "admin", None, bulkshow.DEVICE_EDGE, None),
+                ("10.0.0.2", "admin", "pw", bulkshow.DEVICE_CONTROLLER, None),
+            ],
+        )
+
+    def test_invalid_ip_raises(self) -> None:
+        with self.assertRaises(ValueError):
+            bulkshow.parse_hosts(["not-an-ip,admin"])
+
+
+class FleetRunnerTests(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        self.commands = os.path.join(self._tmp.name, "commands.txt")
+        with open(self.commands, "w") as f:
+            f.write("show version\n")
+        self.plan = bulkshow.RunPlan(
+            commands_file=self.commands,
+            logs_dir=os.path.join(self._tmp.name, "logs"),
+            output_format=["text", "json"],
+        )
+        self.channels: list[ScriptedChannel] = []
+
+    def tearDown(self) -> None:
+        for chan in self.channels:
+            chan.close()
+
+    def _make_channel(self) -> ScriptedChannel:
+        self.channels.append(ScriptedChannel())
+        return self.channels[-1]
+
+    async def test_streams_every_host(self) -> None:
+        hosts = [f"10.0.0.{i},admin" for i in range(1, 6)]
+        runner = bulkshow.FleetRunner(max_concurrency=2)
+        with _injected_paramiko(self._make_channel):
+            results = [r async for r in runner.run(hosts, self.plan, password="pw")]
+        self.assertEqual(
+            sorted(r["host"] for r in results), [f"10.0.0.{i}" for i in range(1, 6)]
+        )
+        self.assertTrue(all(r["status"] == bulkshow.SESSION_OK for r in results))
+        names = os.listdir(self.plan.logs_dir)
+        self.assertEqual(len(names), 10)
+        text_log = os.path.join(self.plan.logs_dir, sorted(names)[-1])
+        with open(text_log, encoding="utf-8") as f:
+            self.assertIn("Cisco IOS XE Software", f.read())
+
+    async def test_cancel_stops_starting_new_hosts(self) -> None:
+        cancel = threading.Event()
+        runner = bulkshow.FleetRunner(max_concurrency=1, cancel=cancel)
+        hosts = [f"10.0.0.{i},admin" for i in range(1, 6)]
+        seen = []
+        with _injected_paramiko(self._make_channel):
+            async for result in runner.run(hosts, self.plan, password="pw"):
+                seen.append((result["host"], result["status"]))
+                cancel.set()
+        self.assertEqual(
+            seen,
+            [("10.0.0.1", bulkshow.SESSION_OK)]
+            + [(f"10.0.0.{i}", bulkshow.core.SESSION_SKIPPED) for i in range(2, 6)],
+        )
+
+    async def test_cancel_interrupts_hosts_in_flight(self) -> None:
+        with open(self.commands, "w") as f:
+            f.write("show hang\n")
+        cancel = threading.Event()
+        runner = bulkshow.FleetRunner(max_concurrency=2, cancel=cancel)
+
+        def make_channel():
+            self.channels.append(HangingChannel())
+            return self.channels[-1]
+
+        asyncio.get_running_loop().call_later(0.5, cancel.set)
+        started = time.monotonic()
+        with _injected_paramiko(make_channel):
+            results = [
+                r async for r in runner.run(
+                    ["10.0.0.1,admin", "10.0.0.2,admin"], self.plan, password="pw"
+                )
+            ]
+        self.assertLess(time.monotonic() - started, 10)
+        self.assertEqual(
+            [r["status"] for r in results], [bulkshow.core.SESSION_DEADLINE] * 2
+        )
+
+
+if __name__ == "__main__":  # pragma: no cover
+    unittest.main()
@@ -1090,15 +1090,21 @@ def _build_argv(
 def _load_parse_host_line(bulk_script: Path):
     """Return ``bulk-show.py``'s canonical ``parse_host_line`` or ``None``.
 
-    The script is loaded by path (its name has a hyphen, so it is not a normal
-    importable module). ``paramiko`` is lazy-imported inside
-    ``connect_and_execute``, so importing the module here does not require SSH
-    dependencies. Returns ``None`` if the script cannot be loaded or does not
-    expose ``parse_host_line`` (e.g. the fake script used by the smoke test),
-    in which case the caller falls back to leaving host lines untouched.
+    The repository's own script is reached through the :mod:`bulkshow`
+    package, which loads it once per process. Any other script is loaded by
+    path (its name has a hyphen, so it is not a normal importable module).
+    ``paramiko`` is lazy-imported inside ``connect_and_execute``, so importing
+    the module here does not require SSH dependencies. Returns ``None`` if the
+    script cannot be loaded or does not expose ``parse_host_line`` (e.g. the
+    fake script used by the smoke test), in which case the caller falls back
+    to leaving host lines untouched.
     """
 
     try:
+        if Path(bulk_script).resolve() == BULK_SCRIPT.resolve():
+            import bulkshow
+
+            return bulkshow.parse_host_line
         spec = importlib.util.spec_from_file_location(
             "_bulk_show_for_runner", bulk_script
         )
@@ -1139,10 +1145,11 @@ def _inject_host_passwords(hosts_text: str, password: str, bulk_script: Path) ->
         if parsed is None:
             out_lines.append(raw)
             continue
-        ip, user, pw, device_type = parsed
+        ip, user, pw, device_type, site = parsed
         if pw is None:
             pw = password
-        out_lines.append(f"{ip},{user},{pw},type={device_type}")
+        site = f",site={site}" if site else ""
+        out_lines.append(f"{ip},{user},{pw},type={device_type}{site}")
 
     result = "\n".join(out_lines)
     if hosts_text.endswith("\n"):